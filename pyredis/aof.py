@@ -0,0 +1,405 @@
+import os, mmap, threading, time, logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from itertools import islice
+from pyredis.protocol import RespParser, ProtocolError, encode_command
+from pyredis.client import Client
+from pyredis.commands import lookup_command
+from pyredis import rdb
+from pyredis.quicklist import QuickList
+from pyredis.hashes import Hash
+from pyredis.sets import Set
+from pyredis.sortedsets import SortedSet, format_score
+from pyredis.encoding import string_bytes
+
+APPENDFSYNC_ALWAYS = "always"
+APPENDFSYNC_EVERYSEC = "everysec"
+APPENDFSYNC_NO = "no"
+APPENDFSYNC_POLICIES = (APPENDFSYNC_ALWAYS, APPENDFSYNC_EVERYSEC, APPENDFSYNC_NO)
+
+AUTO_AOF_REWRITE_PERCENTAGE = 100 # Rewrite once the file has doubled since the last rewrite...
+AUTO_AOF_REWRITE_MIN_SIZE = 64 * 1024 * 1024 # ...and is at least this big
+AOF_REWRITE_ITEMS_PER_CMD = 64 # Elements per RPUSH when rewriting large collections
+AOF_LOAD_PROGRESS_INTERVAL = 1.0 # Seconds between progress reports while loading
+
+logger = logging.getLogger(__name__)
+
+
+class AOFWriter:
+    """
+        Append-only file writer with group commit.
+
+        The file stays open for the life of the server. Commands fed by any client are appended to
+        an in-memory buffer; in the asyncio server the buffer is written with a single write() once
+        per event loop iteration however many clients fed it, while the threaded server calls
+        `commit` after each batch of commands. Durability follows the `appendfsync` policy:
+
+        always   - fsync after every write; clients wait for it before their replies are sent
+        everysec - a background thread fsyncs once a second if anything was written
+        no       - leave flushing to the operating system
+
+        The file is compacted by `start_rewrite`, either on BGREWRITEAOF or automatically once it
+        has grown by `auto_rewrite_percentage` since the last rewrite and is larger than
+        `auto_rewrite_min_size`. A background thread writes the smallest set of commands that
+        recreates a snapshot of the keyspace to a temporary file. Commands fed in the meantime keep
+        going to the old file and are also collected in a rewrite buffer, which is appended to the
+        new file before it atomically replaces the old one. With `use_rdb_preamble` the snapshot
+        is written in the binary snapshot format instead of as commands, so the new file is a
+        snapshot followed by an AOF tail.
+    """
+
+    def __init__(self, filename, appendfsync=APPENDFSYNC_EVERYSEC,
+                 auto_rewrite_percentage=AUTO_AOF_REWRITE_PERCENTAGE,
+                 auto_rewrite_min_size=AUTO_AOF_REWRITE_MIN_SIZE, use_rdb_preamble=False):
+        if appendfsync not in APPENDFSYNC_POLICIES:
+            raise ValueError(f"appendfsync must be one of {', '.join(APPENDFSYNC_POLICIES)}")
+        self.filename = filename
+        self.appendfsync = appendfsync
+        self._fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.size = os.fstat(self._fd).st_size
+        self.base_size = self.size # Size right after the last rewrite, the baseline for auto rewrites
+        self.auto_rewrite_percentage = auto_rewrite_percentage
+        self.auto_rewrite_min_size = auto_rewrite_min_size
+        self.use_rdb_preamble = use_rdb_preamble
+        self.rewrites = 0
+        self.last_rewrite_ok = True
+        self._rewrite_buffer = None # Commands fed since the running rewrite took its snapshot
+        self._buffer = bytearray()
+        self._lock = threading.Lock() # Keeps buffer swaps and writes in order across threads
+        self._fsync_lock = threading.Lock() # Held across an fsync, so its descriptor isn't closed under it
+        self._loop = None
+        self._flush_scheduled = False
+        self.offset = 0 # Bytes fed since the writer was opened, the position `synced` waits for
+        self._synced_offset = 0 # Position the last completed fsync covers
+        self._sync_waiters = [] # (position, future) pairs waiting for an fsync to cover the position
+        self._unsynced = False
+        self._closed = False
+        self._fsync_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="aof-fsync")
+        self.last_fsync = time.time()
+
+        if appendfsync == APPENDFSYNC_EVERYSEC:
+            threading.Thread(target=self._fsync_every_second, name="aof-everysec", daemon=True).start()
+
+    def bind_loop(self, loop):
+        """Flush once per iteration of `loop` instead of waiting for `commit` calls."""
+        self._loop = loop
+
+    def feed(self, args):
+        """Queue an executed write command."""
+        self._append(encode_command(args))
+
+    def feed_all(self, commands):
+        """Queue several executed write commands, which reach the file together."""
+        self._append(b"".join(map(encode_command, commands)))
+
+    def flush(self):
+        """Write everything queued so far with one write() call."""
+        with self._lock:
+            if not self._buffer:
+                return
+            data = memoryview(bytes(self._buffer))
+            self._buffer.clear()
+            while data:
+                written = os.write(self._fd, data)
+                data = data[written:]
+                self.size += written
+            self._unsynced = True
+
+    def fsync(self):
+        with self._fsync_lock:
+            with self._lock:
+                fd = self._fd
+            os.fsync(fd)
+        self._unsynced = False
+        self.last_fsync = time.time()
+
+    def commit(self):
+        """Flush queued commands and fsync them if the policy asks for it. Used by the threaded server."""
+        self.flush()
+        if self.appendfsync == APPENDFSYNC_ALWAYS:
+            self.fsync()
+
+    def synced(self, offset=None):
+        """
+            Return a future that resolves once everything fed up to `offset` (by default,
+            everything fed so far) is on disk. Only meaningful with appendfsync always in the
+            asyncio server; every client that writes during the same loop iteration shares one
+            fsync. The future is already done if an fsync has covered `offset`.
+        """
+        if offset is None:
+            offset = self.offset
+        future = self._loop.create_future()
+        if offset <= self._synced_offset:
+            future.set_result(None)
+        else:
+            self._sync_waiters.append((offset, future))
+        return future
+
+    @property
+    def rewrite_in_progress(self):
+        return self._rewrite_buffer is not None
+
+    def rewrite_due(self):
+        """Whether the file has grown enough since the last rewrite to compact it again."""
+        if self._rewrite_buffer is not None or not self.auto_rewrite_percentage:
+            return False
+        if self.size < self.auto_rewrite_min_size:
+            return False
+        growth = (self.size - self.base_size) * 100 // max(self.base_size, 1)
+        return growth >= self.auto_rewrite_percentage
+
+    def start_rewrite(self, db):
+        """
+            Start rewriting the file from a snapshot of `db` on a background thread. Must be called
+            from the thread that executes commands, so no write slips in between the snapshot and
+            the start of the rewrite buffer. Returns False if a rewrite is already running.
+        """
+        with self._lock:
+            if self._rewrite_buffer is not None:
+                return False
+            self._rewrite_buffer = bytearray()
+        snapshot = db.snapshot()
+        threading.Thread(target=self._rewrite, args=(snapshot,), name="aof-rewrite", daemon=True).start()
+        return True
+
+    def close(self):
+        if self._closed:
+            return
+        self.flush()
+        self.fsync()
+        self._closed = True
+        self._fsync_executor.shutdown()
+        with self._fsync_lock:
+            os.close(self._fd)
+
+    def _append(self, data):
+        with self._lock:
+            self._buffer += data
+            self.offset += len(data)
+            if self._rewrite_buffer is not None:
+                self._rewrite_buffer += data
+        if self._loop is not None and not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._loop.call_soon(self._flush_on_loop)
+
+    def _flush_on_loop(self):
+        self._flush_scheduled = False
+        offset = self.offset # Read first: whatever is fed after this may not be written yet
+        self.flush()
+        if self.appendfsync == APPENDFSYNC_ALWAYS:
+            fsync = self._loop.run_in_executor(self._fsync_executor, self.fsync)
+            fsync.add_done_callback(lambda done: self._synced_up_to(offset, done.exception()))
+        else:
+            self._synced_up_to(offset, None)
+
+    def _synced_up_to(self, offset, error):
+        # Fsyncs run one at a time in feed order, so `offset` only grows from one call to the next
+        if error is None:
+            self._synced_offset = offset
+        waiting = []
+        for position, future in self._sync_waiters:
+            if position > offset:
+                waiting.append((position, future))
+            elif not future.done():
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+        self._sync_waiters = waiting
+
+    def _rewrite(self, snapshot):
+        temp_filename = os.path.join(os.path.dirname(self.filename), f"temp-rewriteaof-{os.getpid()}.aof")
+        try:
+            with open(temp_filename, "wb") as file:
+                if self.use_rdb_preamble:
+                    rdb.dump(snapshot.items(), file)
+                else:
+                    for key, value, deadline in snapshot.items():
+                        for args in rewrite_commands(key, value, deadline):
+                            file.write(encode_command(args))
+                snapshot.release()
+
+                # Catch up with the writes made meanwhile while clients are still being served
+                while True:
+                    with self._lock:
+                        pending = bytes(self._rewrite_buffer)
+                        self._rewrite_buffer.clear()
+                    file.write(pending)
+                    if len(pending) < 64 * 1024:
+                        break
+                file.flush()
+                os.fsync(file.fileno())
+
+            fd = os.open(temp_filename, os.O_WRONLY | os.O_APPEND)
+            with self._lock:
+                # No command can be fed until the new file is in place
+                data = memoryview(bytes(self._rewrite_buffer))
+                while data:
+                    data = data[os.write(fd, data):]
+                os.fsync(fd)
+                os.replace(temp_filename, self.filename)
+                old_fd, self._fd = self._fd, fd
+                # Whatever is still queued reached the new file through the rewrite buffer
+                self._buffer.clear()
+                self.size = self.base_size = os.fstat(fd).st_size
+                self._rewrite_buffer = None
+                self.rewrites += 1
+                self.last_rewrite_ok = True
+            with self._fsync_lock: # Wait for an fsync still running on the old file
+                os.close(old_fd)
+            logger.info("Background AOF rewrite finished, new size %d bytes", self.size)
+        except Exception:
+            logger.exception("Background AOF rewrite failed")
+            with self._lock:
+                self._rewrite_buffer = None
+                self.last_rewrite_ok = False
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+        finally:
+            snapshot.release()
+
+    def _fsync_every_second(self):
+        while not self._closed:
+            time.sleep(1)
+            if self._unsynced and not self._closed:
+                try:
+                    self.fsync()
+                except OSError: # The descriptor was closed on shutdown
+                    pass
+
+
+def _rewrite_string(key, value, deadline):
+    value = string_bytes(value)
+    if deadline is None:
+        yield [b"SET", key, value]
+    else:
+        yield [b"SET", key, value, b"PXAT", b"%d" % deadline]
+
+def _rewrite_list(key, value, deadline):
+    for i in range(0, len(value), AOF_REWRITE_ITEMS_PER_CMD):
+        yield [b"RPUSH", key, *value.range(i, i + AOF_REWRITE_ITEMS_PER_CMD)]
+    if deadline is not None:
+        yield [b"PEXPIREAT", key, b"%d" % deadline]
+
+def _rewrite_hash(key, value, deadline):
+    items = iter(value.items())
+    while True:
+        chunk = [item for pair in islice(items, AOF_REWRITE_ITEMS_PER_CMD) for item in pair]
+        if not chunk:
+            break
+        yield [b"HSET", key, *chunk]
+    if deadline is not None:
+        yield [b"PEXPIREAT", key, b"%d" % deadline]
+
+def _rewrite_set(key, value, deadline):
+    members = value.members()
+    while True:
+        chunk = list(islice(members, AOF_REWRITE_ITEMS_PER_CMD))
+        if not chunk:
+            break
+        yield [b"SADD", key, *chunk]
+    if deadline is not None:
+        yield [b"PEXPIREAT", key, b"%d" % deadline]
+
+def _rewrite_sorted_set(key, value, deadline):
+    for i in range(0, len(value), AOF_REWRITE_ITEMS_PER_CMD):
+        pairs = value.range(i, i + AOF_REWRITE_ITEMS_PER_CMD)
+        yield [b"ZADD", key, *(item for member, score in pairs for item in (format_score(score), member))]
+    if deadline is not None:
+        yield [b"PEXPIREAT", key, b"%d" % deadline]
+
+# Value type -> generator of the commands that recreate a key holding it
+REWRITERS = {
+    bytes: _rewrite_string,
+    int: _rewrite_string,
+    QuickList: _rewrite_list,
+    Hash: _rewrite_hash,
+    Set: _rewrite_set,
+    SortedSet: _rewrite_sorted_set,
+}
+
+def rewrite_commands(key, value, deadline):
+    """Yield the fewest commands that recreate `key` with `value` and its absolute `deadline`."""
+    return REWRITERS[type(value)](key, value, deadline)
+
+
+class AOFLoadError(Exception):
+    """Raised when the AOF contains something other than a truncated final command."""
+
+
+@dataclass
+class AOFLoadResult:
+    commands: int = 0 # Commands applied from the RESP part of the file
+    preamble_keys: int = 0 # Keys loaded from an RDB preamble
+    bytes: int = 0 # Bytes of the file that were loaded
+    truncated: int = 0 # Bytes of a torn final command that were dropped
+    seconds: float = 0.0
+
+
+def load_aof(db, filename, truncate=True, progress_interval=AOF_LOAD_PROGRESS_INTERVAL):
+    """
+        Rebuild `db` from the AOF at `filename`.
+
+        The file is memory-mapped and parsed in place, so it is never read into memory as a whole
+        or copied while parsing. Commands are applied straight to the keyspace by their handlers:
+        no locks, no stats and nothing is fed back to the AOF (attach the writer afterwards).
+        Progress is logged every `progress_interval` seconds. The commands of a MULTI ... EXEC block
+        are applied together once the EXEC is read. If the file ends in the middle of a command or
+        of a transaction, as after a crash during a write, the torn part is dropped and with
+        `truncate` the file is cut back to the last complete command or transaction.
+    """
+    result = AOFLoadResult()
+    start = last_report = time.perf_counter()
+    with open(filename, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            return result
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            offset = 0
+            if buffer[:len(rdb.MAGIC)] == rdb.MAGIC:
+                result.preamble_keys, offset = rdb.load(buffer, db)
+
+            client = Client(db)
+            parser = RespParser(buffer, offset)
+            commands = 0
+            transaction = None # Commands read since a MULTI, applied once its EXEC is read
+            try:
+                for args in parser:
+                    command = lookup_command(args[0])
+                    if command is None or not command.check_arity(len(args)):
+                        name = args[0].decode(errors="replace")
+                        raise AOFLoadError(f"Invalid command '{name}' in AOF at offset {offset}")
+                    if command.name == "multi":
+                        transaction = []
+                        continue
+                    if command.name == "exec" and transaction is not None:
+                        for queued, queued_args in transaction:
+                            queued.handler(client, queued_args)
+                        commands += len(transaction)
+                        transaction = None
+                    elif transaction is not None:
+                        transaction.append((command, args))
+                        continue
+                    else:
+                        command.handler(client, args)
+                        commands += 1
+                    offset = parser.offset
+                    if commands % 4096 == 0 and time.perf_counter() - last_report >= progress_interval:
+                        last_report = time.perf_counter()
+                        elapsed = last_report - start
+                        logger.info("Loading AOF: %d%%, %d commands, %.1f MB/s",
+                                    offset * 100 // size, commands, offset / elapsed / 1e6)
+            except ProtocolError as e:
+                raise AOFLoadError(f"Bad AOF format at offset {offset}: {e}") from None
+
+    result.commands = commands
+    result.bytes = offset
+    result.truncated = size - offset
+    result.seconds = time.perf_counter() - start
+    if result.truncated:
+        logger.warning("AOF ends with a torn command or an unfinished transaction; dropping the last %d bytes",
+                       result.truncated)
+        if truncate:
+            os.truncate(filename, offset)
+    logger.info("AOF loaded: %d commands, %d bytes in %.3f seconds", commands, offset, result.seconds)
+    return result
@@ -0,0 +1,287 @@
+"""
+    Load generator modeled on redis-benchmark: `python -m pyredis.benchmark`.
+
+    Each of `--clients` connections sends batches of `--pipeline` commands and waits for their
+    replies before sending the next batch, until `--requests` commands have been answered in all.
+    The latency of a command is the time from the write of its batch to the arrival of its reply,
+    as redis-benchmark measures it. Keys are drawn at random from `--keyspace` keys, values are
+    `--data-size` bytes.
+
+    By default every test in `--tests` runs on its own, one after the other; `--mix` runs a single
+    test drawing each command from weighted choices instead, e.g. `--mix get=8,set=2`. Each test
+    reports its throughput, latency percentiles and a latency histogram, as text or (with
+    `--json`) as JSON, so that runs can be compared by a script.
+
+    `--server asyncio` or `--server threads` starts a fresh in-memory server of that kind in a
+    child process and benchmarks it, so both front ends can be measured the same way; otherwise
+    the server at `--host` and `--port` is used.
+"""
+import argparse, asyncio, json, math, multiprocessing, os, random, socket, sys, time
+from dataclasses import dataclass
+from pyredis.protocol import encode_command, reply_end
+from pyredis.db import Database
+from pyredis import server, server_using_multithreading
+
+READ_CHUNK_SIZE = 64 * 1024
+MGET_KEYS = 10 # Keys per MGET, as in redis-benchmark's MSET test
+LRANGE_LENGTH = 100 # Elements LRANGE asks for, and pushed to the list before an LRANGE test
+SERVER_START_TIMEOUT = 10.0 # Seconds to wait for a server started with --server
+# Upper bounds of the histogram buckets, in milliseconds: 1-2-5 steps from 10us to 10s
+HISTOGRAM_BOUNDS_MS = [mantissa * 10.0 ** exponent for exponent in range(-2, 5) for mantissa in (1, 2, 5)][:-2]
+
+
+def _key(rng, config, prefix=b"key:"):
+    return b"%s%012d" % (prefix, rng.randrange(config.keyspace))
+
+# Test name -> function returning one encoded command
+COMMANDS = {
+    "set": lambda rng, config: encode_command([b"SET", _key(rng, config), config.value]),
+    "get": lambda rng, config: encode_command([b"GET", _key(rng, config)]),
+    "incr": lambda rng, config: encode_command([b"INCR", _key(rng, config, b"counter:")]),
+    "lpush": lambda rng, config: encode_command([b"LPUSH", b"mylist", config.value]),
+    "lrange": lambda rng, config: encode_command([b"LRANGE", b"mylist", b"0", b"%d" % (LRANGE_LENGTH - 1)]),
+    "mget": lambda rng, config: encode_command([b"MGET", *(_key(rng, config) for _ in range(MGET_KEYS))]),
+}
+
+
+@dataclass
+class Config:
+    host: str = "127.0.0.1"
+    port: int = server.PORT
+    clients: int = 50
+    requests: int = 100000
+    pipeline: int = 1
+    keyspace: int = 10000
+    data_size: int = 3
+    seed: int = None
+
+    @property
+    def value(self):
+        return b"x" * self.data_size
+
+
+def percentile(latencies, fraction):
+    """The value below which `fraction` of the sorted `latencies` fall (nearest rank)."""
+    if not latencies:
+        return 0.0
+    return latencies[min(len(latencies) - 1, max(0, math.ceil(fraction * len(latencies)) - 1))]
+
+def histogram(latencies):
+    """Count the sorted `latencies` (in milliseconds) per HISTOGRAM_BOUNDS_MS bucket, skipping empty buckets."""
+    counts = []
+    start = 0
+    for bound in HISTOGRAM_BOUNDS_MS + [math.inf]:
+        end = start
+        while end < len(latencies) and latencies[end] <= bound:
+            end += 1
+        if end > start:
+            counts.append([bound, end - start])
+        start = end
+    return counts
+
+
+class _Run:
+    """What the clients of one test share: the requests left to send and what was measured."""
+
+    def __init__(self, config, mix):
+        self.config = config
+        self.names = list(mix)
+        self.weights = list(mix.values())
+        self.remaining = config.requests
+        self.latencies = [] # Seconds, one per reply
+        self.errors = 0
+
+    async def client(self, rng):
+        config = self.config
+        reader, writer = await asyncio.open_connection(config.host, config.port)
+        buffer = bytearray()
+        try:
+            while self.remaining > 0:
+                count = min(config.pipeline, self.remaining)
+                self.remaining -= count
+                names = rng.choices(self.names, self.weights, k=count)
+                payload = b"".join(COMMANDS[name](rng, config) for name in names)
+                sent = time.perf_counter()
+                writer.write(payload)
+                received = 0
+                while received < count:
+                    data = await reader.read(READ_CHUNK_SIZE)
+                    if not data:
+                        raise ConnectionError("server closed the connection")
+                    now = time.perf_counter()
+                    buffer += data
+                    offset = 0
+                    while received < count:
+                        end = reply_end(buffer, offset)
+                        if end == -1:
+                            break
+                        if buffer[offset] == 45: # b"-"
+                            self.errors += 1
+                        self.latencies.append(now - sent)
+                        received += 1
+                        offset = end
+                    del buffer[:offset]
+        finally:
+            writer.close()
+
+
+async def run_test(config, mix, name=None):
+    """
+        Run one test with `config`, drawing commands from `mix` (test name -> weight), and return
+        its results as a dict ready for JSON.
+    """
+    if "lrange" in mix: # Give LRANGE a full list to read
+        _, writer = await asyncio.open_connection(config.host, config.port)
+        writer.write(encode_command([b"RPUSH", b"mylist", *[config.value] * LRANGE_LENGTH]))
+        await writer.drain()
+        writer.close()
+    run = _Run(config, mix)
+    rng = random.Random(config.seed)
+    start = time.perf_counter()
+    await asyncio.gather(*(run.client(random.Random(rng.random())) for _ in range(config.clients)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency * 1000 for latency in run.latencies)
+    return {
+        "test": name or ",".join(f"{test}={weight:g}" for test, weight in mix.items()),
+        "requests": len(latencies),
+        "errors": run.errors,
+        "clients": config.clients,
+        "pipeline": config.pipeline,
+        "keyspace": config.keyspace,
+        "data_size": config.data_size,
+        "seconds": elapsed,
+        "ops_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "min": latencies[0] if latencies else 0.0,
+            "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+            "p50": percentile(latencies, 0.5),
+            "p99": percentile(latencies, 0.99),
+            "p99.9": percentile(latencies, 0.999),
+            "max": latencies[-1] if latencies else 0.0,
+        },
+        "histogram_ms": histogram(latencies),
+    }
+
+def format_result(result):
+    """Describe a result of `run_test` the way redis-benchmark does."""
+    latency = result["latency_ms"]
+    lines = [
+        f"====== {result['test'].upper()} ======",
+        f"  {result['requests']} requests completed in {result['seconds']:.2f} seconds",
+        f"  {result['clients']} parallel clients, pipeline {result['pipeline']}, "
+        f"{result['data_size']} bytes payload, {result['keyspace']} keys",
+        f"  {result['errors']} errors" if result["errors"] else None,
+        f"  throughput: {result['ops_per_sec']:.2f} requests per second",
+        f"  latency (ms): min {latency['min']:.3f}, p50 {latency['p50']:.3f}, p99 {latency['p99']:.3f}, "
+        f"p99.9 {latency['p99.9']:.3f}, max {latency['max']:.3f}",
+        "  latency distribution:",
+    ]
+    seen = 0
+    for bound, count in result["histogram_ms"]:
+        seen += count
+        lines.append(f"    {seen * 100 / result['requests']:6.2f}% <= {bound:g} ms")
+    return "\n".join(line for line in lines if line is not None)
+
+
+async def _serve_using_asyncio(db, port):
+    await asyncio.gather(server.start_server_using_asyncio(db, port), server.expiry_scheduler(db))
+
+def _serve(kind, port):
+    # Child process: a fresh in-memory server of the given kind
+    sys.stdout = open(os.devnull, "w") # Keep "Server listening" out of the benchmark's output
+    db = Database()
+    if kind == "asyncio":
+        asyncio.run(_serve_using_asyncio(db, port))
+    else:
+        server_using_multithreading.start_server_using_multiThreading(db, port)
+
+def spawn_server(kind):
+    """Start an asyncio or threads server in a child process and return the process and its port."""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    process = multiprocessing.Process(target=_serve, args=(kind, port), daemon=True)
+    process.start()
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process, port
+        except OSError:
+            if time.monotonic() > deadline or not process.is_alive():
+                process.terminate()
+                raise RuntimeError(f"{kind} server didn't start")
+            time.sleep(0.05)
+
+
+def _parse_mix(text):
+    mix = {}
+    for entry in text.split(","):
+        name, _, weight = entry.partition("=")
+        name = name.strip().lower()
+        if name not in COMMANDS:
+            raise argparse.ArgumentTypeError(f"unknown command {name!r}, choose from {', '.join(COMMANDS)}")
+        try:
+            mix[name] = float(weight) if weight else 1.0
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"bad weight {weight!r}") from None
+    return mix
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pyredis.benchmark", description="pyredis load generator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=server.PORT)
+    parser.add_argument("--server", choices=("asyncio", "threads"),
+                        help="benchmark a fresh in-memory server of this kind, started in a child process")
+    parser.add_argument("-c", "--clients", type=int, default=50, help="parallel connections")
+    parser.add_argument("-n", "--requests", type=int, default=100000, help="requests per test")
+    parser.add_argument("-P", "--pipeline", type=int, default=1, help="commands sent per round trip")
+    parser.add_argument("-r", "--keyspace", type=int, default=10000, help="distinct keys to draw from")
+    parser.add_argument("-d", "--data-size", type=int, default=3, help="bytes per value")
+    parser.add_argument("-t", "--tests", default=",".join(COMMANDS),
+                        help=f"comma-separated tests to run one after the other ({','.join(COMMANDS)})")
+    parser.add_argument("--mix", type=_parse_mix,
+                        help="run one test mixing weighted commands instead, e.g. get=8,set=2")
+    parser.add_argument("--seed", type=int, help="seed the key and command choices")
+    parser.add_argument("--json", metavar="FILE", help="write the results as JSON to FILE ('-' for stdout)")
+    options = parser.parse_args(argv)
+    if min(options.clients, options.requests, options.pipeline, options.keyspace) < 1 or options.data_size < 0:
+        parser.error("clients, requests, pipeline and keyspace must be positive")
+    try:
+        tests = [{name: 1.0} for name in _parse_mix(options.tests)] if options.mix is None else [options.mix]
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    process = None
+    if options.server is not None:
+        process, options.port = spawn_server(options.server)
+        options.host = "127.0.0.1"
+    config = Config(options.host, options.port, options.clients, options.requests, options.pipeline,
+                    options.keyspace, options.data_size, options.seed)
+    to_stdout = options.json == "-"
+    try:
+        async def run_all():
+            results = []
+            for mix in tests:
+                result = await run_test(config, mix, name=next(iter(mix)) if len(mix) == 1 else None)
+                if not to_stdout:
+                    print(format_result(result) + "\n", flush=True)
+                results.append(result)
+            return results
+        results = asyncio.run(run_all())
+    finally:
+        if process is not None:
+            process.terminate()
+
+    if options.json is not None:
+        report = {"server": options.server or f"{options.host}:{options.port}", "results": results}
+        if to_stdout:
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            with open(options.json, "w") as file:
+                json.dump(report, file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import math
+from collections import deque
+from pyredis.protocol import Error, NULL_ARRAY
+
+TIMEOUT_REPLY = NULL_ARRAY # Sent to a blocked client whose timeout expired
+TIMEOUT_NOT_FLOAT_ERROR = Error("ERR timeout is not a float or out of range").encode()
+TIMEOUT_NEGATIVE_ERROR = Error("ERR timeout is negative").encode()
+
+
+class Waiter:
+    """
+        A client blocked by BLPOP, BRPOP, BLMOVE, BZPOPMIN or BZPOPMAX.
+
+        `serve(key)` tries to complete the command from `key` and returns the encoded reply and the
+        command to propagate in its place, or None if the key still has nothing to offer. Once
+        served, `reply` holds the reply and `on_ready` is called; the front end sets `on_ready` to
+        whatever wakes the blocked connection (resolving a future, notifying a condition).
+    """
+
+    __slots__ = ("keys", "serve", "timeout", "reply", "on_ready")
+
+    def __init__(self, keys, serve, timeout):
+        self.keys = keys
+        self.serve = serve
+        self.timeout = timeout # Seconds, None to block forever
+        self.reply = None
+        self.on_ready = None
+
+
+def parse_timeout(arg):
+    """Parse a blocking timeout in seconds into (timeout, error). A timeout of 0 blocks forever."""
+    try:
+        timeout = float(arg)
+    except ValueError:
+        return None, TIMEOUT_NOT_FLOAT_ERROR
+    if not math.isfinite(timeout):
+        return None, TIMEOUT_NOT_FLOAT_ERROR
+    if timeout < 0:
+        return None, TIMEOUT_NEGATIVE_ERROR
+    return timeout or None, None
+
+def block(client, keys, serve, timeout):
+    """
+        Nothing to serve yet: queue `client` on `keys` and return None, the reply of a command that
+        blocks. The front end waits for the waiter to be served.
+    """
+    waiter = Waiter(list(dict.fromkeys(keys)), serve, timeout)
+    client.db.blocked.block(waiter)
+    client.waiter = waiter
+    return None
+
+
+class BlockedClients:
+    """
+        FIFO queues of the clients blocked on each key.
+
+        Commands that add elements to a key with waiters mark it ready with `signal`. After each
+        command `execute` calls `serve`, which hands the new elements to the oldest waiters
+        straight away, so blocked clients never poll the keyspace.
+    """
+
+    def __init__(self):
+        self.queues = {} # Key -> deque of waiters, oldest first
+        self.ready = [] # Keys that received elements since the last `serve`
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def block(self, waiter):
+        for key in waiter.keys:
+            self.queues.setdefault(key, deque()).append(waiter)
+        self.count += 1
+
+    def unblock(self, waiter):
+        """Remove `waiter` from every queue it is in, e.g. when it times out."""
+        for key in waiter.keys:
+            queue = self.queues.get(key)
+            if queue is None:
+                continue
+            try:
+                queue.remove(waiter)
+            except ValueError:
+                continue
+            if not queue:
+                del self.queues[key]
+        self.count -= 1
+
+    def signal(self, key):
+        """Mark `key` as having new elements if anyone is blocked on it."""
+        if key in self.queues and key not in self.ready:
+            self.ready.append(key)
+
+    def serve(self, db):
+        """Serve the waiters of every ready key, oldest first, while the keys have elements."""
+        while self.ready:
+            ready, self.ready = self.ready, []
+            for key in ready:
+                queue = self.queues.get(key)
+                while queue:
+                    waiter = queue[0]
+                    served = waiter.serve(key)
+                    if served is None:
+                        break
+                    self.unblock(waiter)
+                    waiter.reply, propagate_args = served
+                    if propagate_args is not None:
+                        db.propagate(propagate_args)
+                    waiter.on_ready()
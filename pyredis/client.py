@@ -0,0 +1,18 @@
+class Client:
+    """
+        Per-connection state. Command handlers receive the client as their first argument and
+        reach the keyspace through `client.db`.
+    """
+
+    def __init__(self, db, addr=None):
+        self.db = db
+        self.addr = addr
+        self.propagate_args = None # Set by a handler to log a different command than it received
+        self.waiter = None # Set by a blocking command that found nothing and has to wait
+        self.on_block = None # Set by the front end to flush earlier replies before waiting
+        self.transport = None # Set by the asyncio front end, pub/sub messages are written to it
+        self.subscriber = None # pubsub.Subscriber while the client has subscriptions
+        self.transaction = None # transactions.Transaction between MULTI and EXEC
+        self.watching = None # Key -> (version, whether it existed) for each WATCHed key
+        self.asking = False # Set by ASKING, lets the next command use a slot being imported
+        self.in_exec = False # Set while EXEC runs the queued commands, which must not yield
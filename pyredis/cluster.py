@@ -0,0 +1,195 @@
+"""
+    Cluster mode: the keyspace split over several servers by hash slot.
+
+    Every key belongs to one of the SLOTS hash slots (keyindex.key_slot, which honours {hashtags})
+    and every slot to one node. A node answers a command for a slot it doesn't serve with
+    `-MOVED <slot> <host>:<port>`, naming the node that does, so clients learn the slot map (also
+    given by CLUSTER SLOTS) and send each command straight to the right node. The keys of one
+    command must share a slot.
+
+    There is no cluster bus: a node learns about another with CLUSTER MEET, which asks it for its
+    id, and the slot map is set on every node by the administrator with CLUSTER ADDSLOTS and
+    CLUSTER SETSLOT, the way redis-cli's --cluster tools drive Redis. A slot moves between nodes
+    while both keep serving it:
+
+        1. CLUSTER SETSLOT <slot> IMPORTING <source-id> on the target,
+        2. CLUSTER SETSLOT <slot> MIGRATING <target-id> on the source,
+        3. CLUSTER GETKEYSINSLOT and MIGRATE ... KEYS on the source, a batch of keys at a time,
+        4. CLUSTER SETSLOT <slot> NODE <target-id> on every node.
+
+    Meanwhile the source serves the keys it still has and answers `-ASK <slot> <host>:<port>` for
+    the others; the client then sends ASKING and the command to the target, which accepts it for a
+    slot it is importing. MIGRATE sends a whole batch as pipelined RESTORE-ASKING commands in one
+    write, and the keys of a batch on its way are answered with -TRYAGAIN until the target has
+    them, so no write to them can be lost.
+"""
+import asyncio, os
+from pyredis.protocol import Error, OK, encode_command, reply_end
+from pyredis.keyindex import SLOTS, key_slot
+
+CLUSTER_BUS_PORT_OFFSET = 10000 # Reported in CLUSTER NODES, as Redis does; there is no bus
+CLUSTER_LINK_TIMEOUT = 5.0 # Seconds CLUSTER MEET waits for the other node
+READ_CHUNK_SIZE = 64 * 1024
+
+CROSSSLOT_ERROR = Error("CROSSSLOT Keys in request don't hash to the same slot").encode()
+TRYAGAIN_ERROR = Error("TRYAGAIN Multiple keys request during rehashing of slot").encode()
+CLUSTERDOWN_ERROR = Error("CLUSTERDOWN Hash slot not served").encode()
+IOERR_ERROR = Error("IOERR error or timeout reading to target instance").encode()
+
+
+def _new_id():
+    return os.urandom(20).hex()
+
+
+class Node:
+    """A member of the cluster, as known to this node."""
+
+    __slots__ = ("id", "host", "port")
+
+    def __init__(self, node_id, host, port):
+        self.id = node_id
+        self.host = host
+        self.port = port
+
+    @property
+    def address(self):
+        return f"{self.host}:{self.port}"
+
+
+class Cluster:
+    """
+        A node's view of the cluster: the known nodes, the owner of every slot, and the slots being
+        moved to (`migrating`) or from (`importing`) another node.
+    """
+
+    def __init__(self, host, port):
+        self.myself = Node(_new_id(), host, port)
+        self.nodes = {self.myself.id: self.myself} # Id -> Node
+        self.slots = [None] * SLOTS # Slot -> Node serving it
+        self.migrating = {} # Slot -> Node it is being moved to
+        self.importing = {} # Slot -> Node it is being moved from
+        self.in_flight = set() # Keys sent by a MIGRATE that hasn't heard back yet
+        self._links = {} # (host, port) -> (reader, writer, lock), MIGRATE's connections
+
+    def add_node(self, node_id, host, port):
+        node = self.nodes.get(node_id)
+        if node is None:
+            node = self.nodes[node_id] = Node(node_id, host, port)
+        else:
+            node.host, node.port = host, port
+        return node
+
+    def redirect(self, client, command, args):
+        """Return the error sending a command to the node that serves its keys, or None to run it here."""
+        asking, client.asking = client.asking, False # ASKING only covers the next command
+        if not command.first_key:
+            return None
+        keys = command.get_keys(args)
+        if not keys:
+            return None
+        slot = key_slot(keys[0])
+        for key in keys[1:]:
+            if key_slot(key) != slot:
+                return CROSSSLOT_ERROR
+
+        owner = self.slots[slot]
+        if owner is self.myself:
+            target = self.migrating.get(slot)
+            if target is None:
+                return None
+            if not self.in_flight.isdisjoint(keys):
+                return TRYAGAIN_ERROR
+            missing = sum(client.db.peek(key) is None for key in keys)
+            if not missing:
+                return None
+            if missing < len(keys):
+                return TRYAGAIN_ERROR # Split between the two nodes for now
+            return Error(f"ASK {slot} {target.address}").encode()
+        if slot in self.importing and (asking or command.asking):
+            if len(keys) > 1 and any(client.db.peek(key) is None for key in keys):
+                return TRYAGAIN_ERROR
+            return None
+        if owner is None:
+            return CLUSTERDOWN_ERROR
+        return Error(f"MOVED {slot} {owner.address}").encode()
+
+    def slot_ranges(self):
+        """Yield (first slot, last slot, node) for every run of consecutive slots with the same node."""
+        start = 0
+        slots = self.slots
+        for slot in range(1, SLOTS + 1):
+            if slot == SLOTS or slots[slot] is not slots[start]:
+                if slots[start] is not None:
+                    yield start, slot - 1, slots[start]
+                start = slot
+
+    async def meet(self, host, port):
+        """Learn the id of the node at `host`:`port` and add it. Returns the reply to CLUSTER MEET."""
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), CLUSTER_LINK_TIMEOUT)
+            try:
+                writer.write(encode_command([b"CLUSTER", b"MYID"]))
+                reply, = await asyncio.wait_for(read_replies(reader, 1), CLUSTER_LINK_TIMEOUT)
+            finally:
+                writer.close()
+        except (OSError, EOFError, asyncio.TimeoutError) as e:
+            return Error(f"ERR can't reach {host}:{port}: {e or 'timeout'}").encode()
+        if reply[:1] != b"$":
+            return Error(f"ERR {host}:{port} replied {reply.strip().decode(errors='replace')}").encode()
+        self.add_node(reply.split(b"\r\n")[1].decode(), host, port)
+        return OK
+
+    async def migrate(self, db, host, port, keys, payload, timeout, copy):
+        """
+            Send `payload`, one RESTORE-ASKING command per key of `keys`, to the node at
+            `host`:`port`, then delete the keys it took unless `copy` is set. The keys are in
+            `in_flight` until then. Returns the reply to MIGRATE.
+        """
+        try:
+            replies = await asyncio.wait_for(self._send(host, port, payload, len(keys)), timeout)
+        except (OSError, EOFError, asyncio.TimeoutError):
+            link = self._links.pop((host, port), None)
+            if link is not None:
+                link[1].close()
+            return IOERR_ERROR
+        finally:
+            self.in_flight.difference_update(keys)
+
+        moved = [key for key, reply in zip(keys, replies) if reply == OK]
+        if moved and not copy:
+            for key in moved:
+                db.delete(key)
+            db.propagate([b"DEL", *moved])
+        for reply in replies:
+            if reply[:1] == b"-":
+                return Error(f"ERR Target instance replied with error: {reply[1:-2].decode(errors='replace')}").encode()
+        return OK
+
+    async def _send(self, host, port, payload, count):
+        # One connection per target, kept for the next batch; a batch waits for the previous one
+        link = self._links.get((host, port))
+        if link is None:
+            reader, writer = await asyncio.open_connection(host, port)
+            link = self._links.setdefault((host, port), (reader, writer, asyncio.Lock()))
+        reader, writer, lock = link
+        async with lock:
+            writer.write(payload)
+            return await read_replies(reader, count)
+
+
+async def read_replies(reader, count):
+    """Read `count` encoded replies from `reader` and return them as raw bytes."""
+    buffer = bytearray()
+    replies = []
+    offset = 0
+    while len(replies) < count:
+        end = reply_end(buffer, offset) if offset < len(buffer) else -1
+        if end == -1:
+            data = await reader.read(READ_CHUNK_SIZE)
+            if not data:
+                raise EOFError("connection closed")
+            buffer += data
+            continue
+        replies.append(bytes(buffer[offset:end]))
+        offset = end
+    return replies
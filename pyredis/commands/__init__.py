@@ -0,0 +1,164 @@
+"""
+    Command registry shared by the asyncio and multithreading servers.
+
+    Every command is described once by a `Command` entry: the handler, its arity, its flags and
+    where its keys sit in the argument list. Front ends call `execute`, which does one dict lookup,
+    checks the arity and runs the handler. Whether a command is written to the AOF is decided here
+    from its flags, so the handlers only deal with the keyspace. Arguments reach the handlers as
+    the bytes that were received, and keys and string values are stored as bytes.
+"""
+import time
+from pyredis.protocol import Error, QUEUED
+from pyredis.eviction import OOM_ERROR
+from pyredis.replication import READONLY_ERROR
+
+# Command flags, reported by COMMAND INFO
+WRITE = "write"         # May modify the keyspace
+READONLY = "readonly"   # Never modifies the keyspace
+FAST = "fast"           # O(1) or O(log N)
+DENYOOM = "denyoom"     # May grow memory usage
+ADMIN = "admin"         # Server administration
+LOADING = "loading"     # Allowed while the dataset is loading
+STALE = "stale"         # Allowed on a replica with stale data
+BLOCKING = "blocking"   # May block the client until a key is ready
+PUBSUB = "pubsub"       # Publish/subscribe, allowed to a client in pub/sub mode
+ASKING = "asking"       # Accepted for a slot being imported without a preceding ASKING (cluster mode)
+
+WRONGTYPE_ERROR = Error("WRONGTYPE Operation against a key holding the wrong kind of value").encode()
+NOT_INTEGER_ERROR = Error("ERR value is not an integer or out of range").encode()
+SYNTAX_ERROR = Error("ERR syntax error").encode()
+INCR_OVERFLOW_ERROR = Error("ERR increment or decrement would overflow").encode()
+NOT_POSITIVE_ERROR = Error("ERR value is out of range, must be positive").encode()
+
+# Commands that run straight away between MULTI and EXEC rather than being queued
+UNQUEUED_COMMANDS = frozenset(("exec", "discard", "multi", "watch"))
+# The only commands a client with subscriptions may send
+SUBSCRIBED_COMMANDS = frozenset(("subscribe", "unsubscribe", "psubscribe", "punsubscribe", "ping"))
+
+class Command:
+    """
+        A registered command.
+
+        `arity` follows the Redis convention: a positive number is the exact argument count
+        (including the command name), a negative number is the minimum count. `first_key`,
+        `last_key` and `step` locate the keys in the argument list; `last_key` of -1 means the
+        last argument.
+    """
+    __slots__ = ("name", "handler", "arity", "flags", "first_key", "last_key", "step",
+                 "write", "readonly", "denyoom", "asking", "calls", "usec")
+
+    def __init__(self, name, handler, arity, flags, first_key=0, last_key=0, step=0):
+        self.name = name
+        self.handler = handler
+        self.arity = arity
+        self.flags = tuple(flags)
+        self.first_key = first_key
+        self.last_key = last_key
+        self.step = step
+        self.write = WRITE in self.flags
+        self.readonly = READONLY in self.flags
+        self.denyoom = DENYOOM in self.flags
+        self.asking = ASKING in self.flags
+        self.calls = 0
+        self.usec = 0
+
+    def check_arity(self, argc):
+        if self.arity > 0:
+            return argc == self.arity
+        return argc >= -self.arity
+
+    def get_keys(self, args):
+        """Return the key arguments of a call to this command."""
+        if not self.first_key:
+            return []
+        last = self.last_key if self.last_key >= 0 else len(args) + self.last_key
+        return args[self.first_key:last + 1:self.step]
+
+
+COMMANDS = {}
+COMMAND_TABLE = {} # Command name as received (b"get", b"GET") -> Command, saves a lower() per call
+
+def command(name, arity, flags=(), first_key=0, last_key=0, step=0):
+    """Decorator that registers a handler under `name`."""
+    def register(handler):
+        cmd = Command(name.lower(), handler, arity, flags, first_key, last_key, step)
+        COMMANDS[cmd.name] = cmd
+        COMMAND_TABLE[cmd.name.encode()] = COMMAND_TABLE[cmd.name.upper().encode()] = cmd
+        return handler
+    return register
+
+def lookup_command(name):
+    """Find a command by its name, given as str or bytes in any case."""
+    if type(name) is not str:
+        return COMMAND_TABLE.get(name) or COMMAND_TABLE.get(name.lower())
+    return COMMANDS.get(name.lower())
+
+def execute(client, args):
+    """
+        Run one command for `client` and return the encoded reply, or None if a blocking command
+        has to wait; `client.waiter` then describes what it waits for.
+
+        Between MULTI and EXEC commands are checked and queued instead (see transactions): a
+        command refused here makes the EXEC fail.
+    """
+    command = COMMAND_TABLE.get(args[0]) or COMMAND_TABLE.get(args[0].lower())
+    if command is None:
+        return refuse(client, Error(f"ERR unknown command '{args[0].decode(errors='replace')}'").encode())
+    if not command.check_arity(len(args)):
+        return refuse(client, Error(f"ERR wrong number of arguments for '{command.name}' command").encode())
+    if client.subscriber is not None and command.name not in SUBSCRIBED_COMMANDS:
+        return Error(f"ERR Can't execute '{command.name}': only (P)SUBSCRIBE / (P)UNSUBSCRIBE / PING "
+                     "are allowed in this context").encode()
+
+    db = client.db
+    if db.cluster is not None:
+        error = db.cluster.redirect(client, command, args)
+        if error is not None:
+            return refuse(client, error)
+    if command.write and db.replication.primary is not None and client is not db.replication.primary.client:
+        return refuse(client, READONLY_ERROR) # Only the primary writes to a replica
+    if command.denyoom and db.evictor is not None and not db.evictor.make_room(db):
+        return refuse(client, OOM_ERROR)
+    if client.transaction is not None and command.name not in UNQUEUED_COMMANDS:
+        client.transaction.commands.append((command, args))
+        return QUEUED
+    return call(client, command, args)
+
+def call(client, command, args, log=None):
+    """
+        Run a command that has been checked and return its reply (None if it has to wait).
+
+        Write commands that actually changed the keyspace are propagated to the AOF, or appended
+        to `log` when given (EXEC propagates the whole transaction at once, and serves blocked
+        clients after it). Handlers whose effect depends on the clock (relative TTLs) set
+        `client.propagate_args` to an equivalent absolute form, which is logged instead of the
+        original arguments.
+    """
+    db = client.db
+    tally = db.tally()
+    changes = tally.changes # Per thread: with striped locks other commands run at the same time
+    client.propagate_args = None
+    start = time.perf_counter_ns()
+    reply = command.handler(client, args)
+    command.usec += (time.perf_counter_ns() - start) // 1000
+    command.calls += 1
+    db.stats["total_commands_processed"] += 1
+
+    if command.write and tally.changes != changes:
+        if log is None:
+            db.propagate(client.propagate_args or args)
+        else:
+            log.append(client.propagate_args or args)
+    if db.blocked.ready and log is None:
+        db.blocked.serve(db) # Hand new elements to blocked clients
+    return reply
+
+def refuse(client, error):
+    """Return the error reply of a command refused before running; between MULTI and EXEC it dooms the EXEC."""
+    if client.transaction is not None:
+        client.transaction.failed = True
+    return error
+
+
+# Handler modules register themselves on import
+from pyredis.commands import server, keys, strings, lists, hashes, sets, sortedsets, pubsub, transactions, replication, cluster  # noqa: E402,F401
@@ -0,0 +1,246 @@
+from pyredis.protocol import Error, OK, BulkString, encode_array, encode_bulk, encode_command, encode_integer
+from pyredis.commands import command, NOT_INTEGER_ERROR, SYNTAX_ERROR, WRITE, ADMIN, STALE, FAST
+from pyredis.cluster import CLUSTER_BUS_PORT_OFFSET
+from pyredis.keyindex import SLOTS, key_slot
+from pyredis.rdb import dump_value
+
+CLUSTER_DISABLED_ERROR = Error("ERR This instance has cluster support disabled").encode()
+INVALID_SLOT_ERROR = Error("ERR Invalid or out of range slot").encode()
+IN_TRANSACTION_ERROR = Error("ERR command not allowed in a transaction").encode()
+NOKEY = b"+NOKEY\r\n"
+
+
+def _parse_slot(arg):
+    # The slot number in `arg`, or None if it isn't one
+    try:
+        slot = int(arg)
+    except ValueError:
+        return None
+    return slot if 0 <= slot < SLOTS else None
+
+def _unknown_node(node_id):
+    return Error(f"ERR I don't know about node {node_id.decode(errors='replace')}").encode()
+
+def _myid(client, cluster, args):
+    return encode_bulk(cluster.myself.id.encode())
+
+def _meet(client, cluster, args):
+    if len(args) != 4:
+        return SYNTAX_ERROR
+    try:
+        port = int(args[3])
+    except ValueError:
+        return NOT_INTEGER_ERROR
+    if client.in_exec:
+        return IN_TRANSACTION_ERROR
+    return cluster.meet(args[2].decode(), port)
+
+def _addslots(client, cluster, args, ranges=False):
+    # ADDSLOTS slot ... or ADDSLOTSRANGE first last ...
+    if len(args) < 3 or ranges and len(args) % 2:
+        return SYNTAX_ERROR
+    bounds = [_parse_slot(arg) for arg in args[2:]]
+    if None in bounds:
+        return INVALID_SLOT_ERROR
+    slots = [slot for first, last in zip(bounds[::2], bounds[1::2]) for slot in range(first, last + 1)] \
+        if ranges else bounds
+    for slot in slots:
+        if cluster.slots[slot] is not None:
+            return Error(f"ERR Slot {slot} is already busy").encode()
+    for slot in slots:
+        cluster.slots[slot] = cluster.myself
+    return OK
+
+def _addslotsrange(client, cluster, args):
+    return _addslots(client, cluster, args, ranges=True)
+
+def _delslots(client, cluster, args):
+    slots = [_parse_slot(arg) for arg in args[2:]]
+    if not slots:
+        return SYNTAX_ERROR
+    if None in slots:
+        return INVALID_SLOT_ERROR
+    for slot in slots:
+        cluster.slots[slot] = None
+        cluster.migrating.pop(slot, None)
+        cluster.importing.pop(slot, None)
+    return OK
+
+def _setslot(client, cluster, args):
+    """SETSLOT slot IMPORTING source-id | MIGRATING target-id | NODE id | STABLE"""
+    if len(args) < 4:
+        return SYNTAX_ERROR
+    slot = _parse_slot(args[2])
+    if slot is None:
+        return INVALID_SLOT_ERROR
+    action = args[3].upper()
+    if action == b"STABLE" and len(args) == 4:
+        cluster.migrating.pop(slot, None)
+        cluster.importing.pop(slot, None)
+        return OK
+    if len(args) != 5 or action not in (b"IMPORTING", b"MIGRATING", b"NODE"):
+        return SYNTAX_ERROR
+    node = cluster.nodes.get(args[4].decode(errors="replace"))
+    if node is None:
+        return _unknown_node(args[4])
+    myself = cluster.myself
+    if action == b"IMPORTING":
+        if cluster.slots[slot] is myself:
+            return Error(f"ERR I'm already the owner of hash slot {slot}").encode()
+        cluster.importing[slot] = node
+    elif action == b"MIGRATING":
+        if cluster.slots[slot] is not myself:
+            return Error(f"ERR I'm not the owner of hash slot {slot}").encode()
+        cluster.migrating[slot] = node
+    else:
+        if cluster.slots[slot] is myself and node is not myself and client.db.slots.count(slot):
+            return Error(f"ERR Can't assign hashslot {slot} to a different node while I still hold keys "
+                         "for this hash slot.").encode()
+        cluster.slots[slot] = node
+        cluster.migrating.pop(slot, None)
+        cluster.importing.pop(slot, None)
+    return OK
+
+def _slots(client, cluster, args):
+    ranges = list(cluster.slot_ranges())
+    entries = [
+        b"*3\r\n" + encode_integer(first) + encode_integer(last) + b"*3\r\n" + encode_bulk(node.host.encode())
+        + encode_integer(node.port) + encode_bulk(node.id.encode())
+        for first, last, node in ranges
+    ]
+    return b"*%d\r\n" % len(entries) + b"".join(entries)
+
+def _nodes(client, cluster, args):
+    served = {node_id: [] for node_id in cluster.nodes}
+    for first, last, node in cluster.slot_ranges():
+        served[node.id].append(str(first) if first == last else f"{first}-{last}")
+    for slot, node in cluster.migrating.items():
+        served[cluster.myself.id].append(f"[{slot}->-{node.id}]")
+    for slot, node in cluster.importing.items():
+        served[cluster.myself.id].append(f"[{slot}-<-{node.id}]")
+    lines = []
+    for node in cluster.nodes.values():
+        flags = "myself,master" if node is cluster.myself else "master"
+        lines.append(" ".join([node.id, f"{node.address}@{node.port + CLUSTER_BUS_PORT_OFFSET}", flags,
+                               "-", "0", "0", "0", "connected", *served[node.id]]) + "\n")
+    return BulkString("".join(lines)).encode()
+
+def _info(client, cluster, args):
+    assigned = sum(node is not None for node in cluster.slots)
+    sizes = {node for node in cluster.slots if node is not None}
+    return BulkString(
+        f"cluster_state:{'ok' if assigned == SLOTS else 'fail'}\r\n"
+        f"cluster_slots_assigned:{assigned}\r\n"
+        f"cluster_slots_ok:{assigned}\r\n"
+        f"cluster_known_nodes:{len(cluster.nodes)}\r\n"
+        f"cluster_size:{len(sizes)}\r\n").encode()
+
+def _keyslot(client, cluster, args):
+    if len(args) != 3:
+        return SYNTAX_ERROR
+    return encode_integer(key_slot(args[2]))
+
+def _countkeysinslot(client, cluster, args):
+    if len(args) != 3:
+        return SYNTAX_ERROR
+    slot = _parse_slot(args[2])
+    if slot is None:
+        return INVALID_SLOT_ERROR
+    return encode_integer(client.db.slots.count(slot))
+
+def _getkeysinslot(client, cluster, args):
+    if len(args) != 4:
+        return SYNTAX_ERROR
+    slot = _parse_slot(args[2])
+    if slot is None:
+        return INVALID_SLOT_ERROR
+    try:
+        count = int(args[3])
+    except ValueError:
+        return NOT_INTEGER_ERROR
+    if count < 0:
+        return Error("ERR Invalid number of keys").encode()
+    db = client.db
+    keys = [key for key in db.slots.keys(slot) if db.peek(key) is not None][:count]
+    return encode_array(keys, len(keys))
+
+# CLUSTER subcommand -> handler(client, cluster, args)
+SUBCOMMANDS = {
+    b"myid": _myid,
+    b"meet": _meet,
+    b"addslots": _addslots,
+    b"addslotsrange": _addslotsrange,
+    b"delslots": _delslots,
+    b"setslot": _setslot,
+    b"slots": _slots,
+    b"nodes": _nodes,
+    b"info": _info,
+    b"keyslot": _keyslot,
+    b"countkeysinslot": _countkeysinslot,
+    b"getkeysinslot": _getkeysinslot,
+}
+
+@command("CLUSTER", -2, (ADMIN, STALE))
+def cluster(client, args):
+    cluster = client.db.cluster
+    if cluster is None:
+        return CLUSTER_DISABLED_ERROR
+    handler = SUBCOMMANDS.get(args[1].lower())
+    if handler is None:
+        return Error(f"ERR unknown subcommand '{args[1].decode(errors='replace')}'").encode()
+    return handler(client, cluster, args)
+
+@command("ASKING", 1, (FAST,))
+def asking(client, args):
+    if client.db.cluster is None:
+        return CLUSTER_DISABLED_ERROR
+    client.asking = True
+    return OK
+
+@command("MIGRATE", -6, (WRITE,))
+def migrate(client, args):
+    """
+        MIGRATE host port key|"" destination-db timeout [COPY] [REPLACE] [KEYS key ...]. The keys
+        are serialized right away and sent in one write; the reply comes once the target has
+        answered for all of them (see cluster.Cluster.migrate).
+    """
+    cluster = client.db.cluster
+    if cluster is None:
+        return CLUSTER_DISABLED_ERROR
+    try:
+        port, destination_db, timeout = int(args[2]), int(args[4]), int(args[5])
+    except ValueError:
+        return NOT_INTEGER_ERROR
+    if destination_db != 0:
+        return Error("ERR Target database must be 0 in cluster mode").encode()
+    copy = replace = False
+    keys = [args[3]]
+    for i in range(6, len(args)):
+        option = args[i].upper()
+        if option == b"COPY":
+            copy = True
+        elif option == b"REPLACE":
+            replace = True
+        elif option == b"KEYS" and not args[3]:
+            keys = args[i + 1:]
+            break
+        else:
+            return SYNTAX_ERROR
+    if client.in_exec:
+        return IN_TRANSACTION_ERROR
+
+    db = client.db
+    sending = []
+    commands = []
+    for key in dict.fromkeys(keys):
+        value = db.peek(key) # No lazy expiry: a change here would log the MIGRATE itself
+        if value is None or key in cluster.in_flight:
+            continue
+        deadline = db.get_expire(key)
+        sending.append(key)
+        commands.append(encode_command([b"RESTORE-ASKING", key, b"%d" % (deadline or 0), dump_value(value),
+                                        *((b"REPLACE",) if replace else ()), b"ABSTTL"]))
+    if not sending:
+        return NOKEY
+    cluster.in_flight.update(sending)
+    return cluster.migrate(db, args[1].decode(), port, sending, b"".join(commands), timeout / 1000 or None, copy)
@@ -0,0 +1,137 @@
+from pyredis.protocol import Error, NULL_BULK, EMPTY_ARRAY, encode_array, encode_bulk, encode_integer
+from pyredis.commands import (command, WRONGTYPE_ERROR, NOT_INTEGER_ERROR, INCR_OVERFLOW_ERROR, WRITE, READONLY,
+                              FAST, DENYOOM)
+from pyredis.commands.scanning import parse_scan, encode_scan
+from pyredis.encoding import LONG_MIN, LONG_MAX, encode_string
+from pyredis.hashes import Hash
+
+HASH_NOT_INTEGER_ERROR = Error("ERR hash value is not an integer").encode()
+
+
+def _lookup_or_create(db, key):
+    # The hash at `key` for a write, created empty if missing; None if the key holds another type
+    fields = db.lookup_write(key)
+    if fields is None:
+        fields = Hash()
+        db.set_value(key, fields)
+    elif type(fields) is not Hash:
+        return None
+    return fields
+
+@command("HSET", -4, (WRITE, DENYOOM, FAST), 1, 1, 1)
+def hset(client, args):
+    if len(args) % 2:
+        return Error("ERR wrong number of arguments for 'hset' command").encode()
+    db = client.db
+    key = args[1]
+    fields = _lookup_or_create(db, key)
+    if fields is None:
+        return WRONGTYPE_ERROR
+    added = 0
+    for i in range(2, len(args), 2):
+        added += fields.set(args[i], args[i + 1])
+    db.modified(key)
+    return encode_integer(added)
+
+@command("HGET", 3, (READONLY, FAST), 1, 1, 1)
+def hget(client, args):
+    fields = client.db.lookup(args[1])
+    if fields is None:
+        return NULL_BULK
+    if type(fields) is not Hash:
+        return WRONGTYPE_ERROR
+    value = fields.get(args[2])
+    return NULL_BULK if value is None else encode_bulk(value)
+
+@command("HMGET", -3, (READONLY, FAST), 1, 1, 1)
+def hmget(client, args):
+    fields = client.db.lookup(args[1])
+    if fields is not None and type(fields) is not Hash:
+        return WRONGTYPE_ERROR
+    parts = [b"*%d\r\n" % (len(args) - 2)]
+    for field in args[2:]:
+        value = None if fields is None else fields.get(field)
+        parts.append(NULL_BULK if value is None else encode_bulk(value))
+    return b"".join(parts)
+
+@command("HDEL", -3, (WRITE, FAST), 1, 1, 1)
+def hdel(client, args):
+    db = client.db
+    key = args[1]
+    fields = db.lookup_write(key)
+    if fields is None:
+        return encode_integer(0)
+    if type(fields) is not Hash:
+        return WRONGTYPE_ERROR
+    deleted = 0
+    for field in args[2:]:
+        deleted += fields.delete(field)
+    if not fields:
+        db.delete(key)
+    elif deleted:
+        db.modified(key)
+    return encode_integer(deleted)
+
+@command("HINCRBY", 4, (WRITE, DENYOOM, FAST), 1, 1, 1)
+def hincrby(client, args):
+    try:
+        increment = int(args[3])
+    except ValueError:
+        return NOT_INTEGER_ERROR
+    db = client.db
+    key = args[1]
+    fields = db.lookup_write(key)
+    if fields is not None and type(fields) is not Hash:
+        return WRONGTYPE_ERROR
+    value = None if fields is None else fields.get(args[2])
+    if value is None:
+        value = 0
+    else:
+        value = encode_string(value) # An int if the value spells one canonically
+        if type(value) is not int:
+            return HASH_NOT_INTEGER_ERROR
+    value += increment
+    if not LONG_MIN <= value <= LONG_MAX:
+        return INCR_OVERFLOW_ERROR
+
+    if fields is None:
+        fields = Hash()
+        db.set_value(key, fields)
+    fields.set(args[2], b"%d" % value)
+    db.modified(key)
+    return encode_integer(value)
+
+@command("HGETALL", 2, (READONLY,), 1, 1, 1)
+def hgetall(client, args):
+    fields = client.db.lookup(args[1])
+    if fields is None:
+        return EMPTY_ARRAY
+    if type(fields) is not Hash:
+        return WRONGTYPE_ERROR
+    return encode_array((item for pair in fields.items() for item in pair), 2 * len(fields))
+
+@command("HLEN", 2, (READONLY, FAST), 1, 1, 1)
+def hlen(client, args):
+    fields = client.db.lookup(args[1])
+    if fields is None:
+        return encode_integer(0)
+    if type(fields) is not Hash:
+        return WRONGTYPE_ERROR
+    return encode_integer(len(fields))
+
+@command("HSCAN", -3, (READONLY,), 1, 1, 1)
+def hscan(client, args):
+    """HSCAN key cursor [MATCH pattern] [COUNT count]"""
+    options, error = parse_scan(args, 2)
+    if error is not None:
+        return error
+    cursor, match, count, _ = options
+    fields = client.db.lookup(args[1])
+    if fields is None:
+        return encode_scan(0, [])
+    if type(fields) is not Hash:
+        return WRONGTYPE_ERROR
+    cursor, items = fields.scan(cursor, count)
+    if match is not None:
+        items = [(field, value) for field, value in items if match(field)]
+    return encode_scan(cursor, [item for pair in items for item in pair])
@@ -0,0 +1,260 @@
+import asyncio
+from pyredis.protocol import Error, OK, NULL_BULK, encode_array, encode_bulk, encode_integer
+from pyredis.commands import command, NOT_INTEGER_ERROR, SYNTAX_ERROR, WRITE, READONLY, FAST, DENYOOM, ASKING
+from pyredis.commands.scanning import parse_scan, encode_scan
+from pyredis.db import TYPE_NAMES
+from pyredis.expiry import now_ms
+from pyredis.encoding import object_encoding
+from pyredis.pattern import compile_pattern, literal_prefix
+from pyredis.rdb import RDBError, dump_value, load_value
+
+KEYS_BATCH = 1000 # Keys KEYS collects between turns of the event loop
+
+BUSYKEY_ERROR = Error("BUSYKEY Target key name already exists.").encode()
+BAD_PAYLOAD_ERROR = Error("ERR DUMP payload version or checksum are wrong").encode()
+
+
+@command("DEL", -2, (WRITE,), 1, -1, 1)
+def delete(client, args):
+    db = client.db
+    delete_count = 0
+    for key in args[1:]:
+        if db.delete(key):
+            delete_count += 1
+    return encode_integer(delete_count)
+
+@command("EXISTS", -2, (READONLY, FAST), 1, -1, 1)
+def exists(client, args):
+    db = client.db
+    exists_count = 0
+    for key in args[1:]:
+        if db.lookup(key) is not None:
+            exists_count += 1
+    return encode_integer(exists_count)
+
+def _expire_generic(client, args, multiplier, relative):
+    """Shared implementation of EXPIRE, PEXPIRE, EXPIREAT and PEXPIREAT."""
+    key = args[1]
+    try:
+        when = int(args[2]) * multiplier
+    except ValueError:
+        return NOT_INTEGER_ERROR
+    if relative:
+        when += now_ms()
+
+    flags = {flag.upper() for flag in args[3:]}
+    for flag in flags:
+        if flag not in (b"NX", b"XX", b"GT", b"LT"):
+            return Error(f"ERR Unsupported option {flag.decode(errors='replace')}").encode()
+    if b"NX" in flags and len(flags) > 1:
+        return Error("ERR NX and XX, GT or LT options at the same time are not compatible").encode()
+    if b"GT" in flags and b"LT" in flags:
+        return Error("ERR GT and LT options at the same time are not compatible").encode()
+
+    db = client.db
+    if db.lookup(key) is None:
+        return encode_integer(0)
+
+    current = db.get_expire(key)
+    if (b"NX" in flags and current is not None) or (b"XX" in flags and current is None):
+        return encode_integer(0)
+    # A key without a TTL counts as an infinite TTL for GT and LT
+    if b"GT" in flags and (current is None or when <= current):
+        return encode_integer(0)
+    if b"LT" in flags and current is not None and when >= current:
+        return encode_integer(0)
+
+    if when <= now_ms():
+        # A deadline in the past deletes the key straight away
+        db.delete(key)
+        client.propagate_args = [b"DEL", key]
+    else:
+        db.set_expire(key, when)
+        client.propagate_args = [b"PEXPIREAT", key, b"%d" % when]
+    return encode_integer(1)
+
+@command("EXPIRE", -3, (WRITE, FAST), 1, 1, 1)
+def expire(client, args):
+    return _expire_generic(client, args, 1000, relative=True)
+
+@command("PEXPIRE", -3, (WRITE, FAST), 1, 1, 1)
+def pexpire(client, args):
+    return _expire_generic(client, args, 1, relative=True)
+
+@command("EXPIREAT", -3, (WRITE, FAST), 1, 1, 1)
+def expireat(client, args):
+    return _expire_generic(client, args, 1000, relative=False)
+
+@command("PEXPIREAT", -3, (WRITE, FAST), 1, 1, 1)
+def pexpireat(client, args):
+    return _expire_generic(client, args, 1, relative=False)
+
+def _ttl_generic(client, key, divisor):
+    db = client.db
+    if db.lookup(key) is None:
+        return encode_integer(-2)
+    when = db.get_expire(key)
+    if when is None:
+        return encode_integer(-1)
+    remaining = max(0, when - now_ms())
+    return encode_integer((remaining + divisor // 2) // divisor)
+
+@command("TTL", 2, (READONLY, FAST), 1, 1, 1)
+def ttl(client, args):
+    return _ttl_generic(client, args[1], 1000)
+
+@command("PTTL", 2, (READONLY, FAST), 1, 1, 1)
+def pttl(client, args):
+    return _ttl_generic(client, args[1], 1)
+
+@command("PERSIST", 2, (WRITE, FAST), 1, 1, 1)
+def persist(client, args):
+    db = client.db
+    if db.lookup(args[1]) is None:
+        return encode_integer(0)
+    return encode_integer(1 if db.persist(args[1]) else 0)
+
+@command("OBJECT", -3, (READONLY,), 2, 2, 1)
+def object_(client, args):
+    subcommand = args[1].upper()
+    if subcommand != b"ENCODING" or len(args) != 3:
+        return Error(f"ERR unknown subcommand or wrong number of arguments for '{args[1].decode(errors='replace')}'").encode()
+    value = client.db.lookup(args[2])
+    if value is None:
+        return NULL_BULK
+    return encode_bulk(object_encoding(value).encode())
+
+@command("DUMP", 2, (READONLY,), 1, 1, 1)
+def dump(client, args):
+    value = client.db.lookup(args[1])
+    if value is None:
+        return NULL_BULK
+    return encode_bulk(dump_value(value))
+
+@command("RESTORE", -4, (WRITE, DENYOOM), 1, 1, 1)
+def restore(client, args):
+    """
+        RESTORE key ttl serialized-value [REPLACE] [ABSTTL]. Logged with an absolute TTL, so
+        replaying it is deterministic.
+    """
+    options = {option.upper() for option in args[4:]}
+    if not options <= {b"REPLACE", b"ABSTTL"}:
+        return SYNTAX_ERROR
+    try:
+        ttl = int(args[2])
+    except ValueError:
+        return NOT_INTEGER_ERROR
+    if ttl < 0:
+        return Error("ERR Invalid TTL value, must be >= 0").encode()
+    db = client.db
+    key = args[1]
+    if b"REPLACE" not in options and db.lookup(key) is not None:
+        return BUSYKEY_ERROR
+    try:
+        value = load_value(args[3])
+    except RDBError:
+        return BAD_PAYLOAD_ERROR
+
+    deadline = None
+    if ttl:
+        deadline = ttl if b"ABSTTL" in options else now_ms() + ttl
+        if deadline <= now_ms():
+            db.delete(key) # Already expired: REPLACE removes the old value, like Redis
+            client.propagate_args = [b"DEL", key]
+            return OK
+    db.set_value(key, value)
+    db.modified(key)
+    if deadline is not None:
+        db.set_expire(key, deadline)
+    client.propagate_args = [b"RESTORE", key, b"%d" % (deadline or 0), args[3], b"REPLACE", b"ABSTTL"]
+    return OK
+
+@command("RESTORE-ASKING", -4, (WRITE, DENYOOM, ASKING), 1, 1, 1)
+def restore_asking(client, args):
+    """RESTORE sent by MIGRATE, accepted by a node importing the key's slot."""
+    return restore(client, args)
+
+@command("TYPE", 2, (READONLY, FAST), 1, 1, 1)
+def type_(client, args):
+    value = client.db.lookup(args[1])
+    return b"+%s\r\n" % (b"none" if value is None else TYPE_NAMES[type(value)].encode())
+
+@command("DBSIZE", 1, (READONLY, FAST))
+def dbsize(client, args):
+    return encode_integer(len(client.db.store))
+
+def _live_keys(db, keys, match, kind=None):
+    # The keys among `keys` that match and have not expired, holding a `kind` value if given
+    if match is not None:
+        keys = filter(match, keys)
+    peek = db.peek
+    if kind is None:
+        return [key for key in keys if peek(key) is not None]
+    return [key for key in keys if TYPE_NAMES.get(type(peek(key))) == kind]
+
+@command("SCAN", -2, (READONLY,))
+def scan(client, args):
+    """
+        SCAN cursor [MATCH pattern] [COUNT count] [TYPE type]. The cursor is the next hash slot to
+        visit, so a key present during a whole iteration is returned exactly once.
+    """
+    options, error = parse_scan(args, 1, with_type=True)
+    if error is not None:
+        return error
+    cursor, match, count, kind = options
+    db = client.db
+    cursor, keys = db.slots.scan(cursor, count)
+    return encode_scan(cursor, _live_keys(db, keys, match, kind))
+
+@command("KEYS", 2, (READONLY,))
+def keys_(client, args):
+    """
+        KEYS pattern. With a prefix index, a pattern starting with a literal prefix only visits the
+        keys that share it. On the event loop a keyspace larger than KEYS_BATCH is collected a batch
+        at a time, serving other clients in between (except within EXEC): the reply then holds
+        every key that was present throughout, like a full SCAN, rather than a point-in-time view.
+    """
+    db = client.db
+    pattern = args[1]
+    match = compile_pattern(pattern)
+    prefix = literal_prefix(pattern)
+    if db.prefix_index is not None and prefix:
+        batches = _prefixed_batches(db.prefix_index, prefix)
+    else:
+        batches = _slot_batches(db.slots)
+    if len(db.store) <= KEYS_BATCH or client.in_exec or not _on_event_loop():
+        found = [key for batch in batches for key in _live_keys(db, batch, match)]
+        return encode_array(found, len(found))
+    return _collect_keys(db, batches, match)
+
+async def _collect_keys(db, batches, match):
+    found = []
+    for batch in batches:
+        found += _live_keys(db, batch, match)
+        await asyncio.sleep(0)
+    return encode_array(found, len(found))
+
+def _slot_batches(slots):
+    cursor = 0
+    while True:
+        cursor, keys = slots.scan(cursor, KEYS_BATCH)
+        yield keys
+        if not cursor:
+            return
+
+def _prefixed_batches(index, prefix):
+    after = None
+    while True:
+        keys = index.range(prefix, after, KEYS_BATCH)
+        yield keys
+        if len(keys) < KEYS_BATCH:
+            return
+        after = keys[-1]
+
+def _on_event_loop():
+    # Whether the command runs on an asyncio event loop it could yield to, rather than on a thread
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
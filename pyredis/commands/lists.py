@@ -0,0 +1,279 @@
+from pyredis.protocol import (Error, OK, NULL_BULK, NULL_ARRAY, EMPTY_ARRAY, encode_array, encode_bulk,
+                              encode_integer)
+from pyredis.commands import (command, WRONGTYPE_ERROR, NOT_INTEGER_ERROR, SYNTAX_ERROR, NOT_POSITIVE_ERROR,
+                              WRITE, READONLY, FAST, DENYOOM, BLOCKING)
+from pyredis.blocking import block, parse_timeout
+from pyredis.quicklist import QuickList
+
+NO_SUCH_KEY_ERROR = Error("ERR no such key").encode()
+INDEX_OUT_OF_RANGE_ERROR = Error("ERR index out of range").encode()
+
+
+def _range_bounds(start, end, length):
+    """Translate an inclusive LRANGE/LTRIM style range into clamped slice bounds."""
+    if start < 0:
+        start = max(0, start + length)
+    if end < 0:
+        end += length
+    return start, min(end, length - 1) + 1
+
+def _push(client, args, left):
+    db = client.db
+    key = args[1]
+    values = db.lookup_write(key)
+    if values is None:
+        values = QuickList() # Create a new list
+        db.set_value(key, values)
+    elif type(values) is not QuickList:
+        return WRONGTYPE_ERROR
+
+    if left:
+        values.extendleft(args[2:]) # Each value is pushed to the head in turn
+    else:
+        values.extend(args[2:])
+    db.modified(key)
+    db.blocked.signal(key)
+    return encode_integer(len(values))
+
+@command("LPUSH", -3, (WRITE, DENYOOM, FAST), 1, 1, 1)
+def lpush(client, args):
+    return _push(client, args, left=True)
+
+@command("RPUSH", -3, (WRITE, DENYOOM, FAST), 1, 1, 1)
+def rpush(client, args):
+    return _push(client, args, left=False)
+
+def _pop(client, args, left):
+    if len(args) > 3:
+        return Error(f"ERR wrong number of arguments for '{args[0].decode().lower()}' command").encode()
+    count = None
+    if len(args) == 3:
+        try:
+            count = int(args[2])
+        except ValueError:
+            return NOT_INTEGER_ERROR
+        if count < 0:
+            return NOT_POSITIVE_ERROR
+
+    db = client.db
+    key = args[1]
+    values = db.lookup_write(key)
+    if values is None:
+        return NULL_BULK if count is None else NULL_ARRAY
+    if type(values) is not QuickList:
+        return WRONGTYPE_ERROR
+    if count == 0:
+        return EMPTY_ARRAY
+
+    if count is None:
+        return encode_bulk(_pop_element(db, key, values, left))
+    count = min(count, len(values))
+    return encode_array([_pop_element(db, key, values, left) for _ in range(count)], count)
+
+def _pop_element(db, key, values, left):
+    """Pop one element from the non-empty list `values` stored at `key`, removing the key once empty."""
+    value = values.popleft() if left else values.pop()
+    if values:
+        db.modified(key)
+    else:
+        db.delete(key)
+    return value
+
+@command("LPOP", -2, (WRITE, FAST), 1, 1, 1)
+def lpop(client, args):
+    return _pop(client, args, left=True)
+
+@command("RPOP", -2, (WRITE, FAST), 1, 1, 1)
+def rpop(client, args):
+    return _pop(client, args, left=False)
+
+def _blocking_pop(client, args, left):
+    timeout, error = parse_timeout(args[-1])
+    if error is not None:
+        return error
+
+    db = client.db
+    pop_command = b"LPOP" if left else b"RPOP"
+    keys = args[1:-1]
+    for key in keys:
+        values = db.lookup_write(key)
+        if values is None:
+            continue
+        if type(values) is not QuickList:
+            return WRONGTYPE_ERROR
+        client.propagate_args = [pop_command, key]
+        return encode_array((key, _pop_element(db, key, values, left)), 2)
+
+    def serve(key):
+        values = db.lookup_write(key)
+        if type(values) is not QuickList:
+            return None
+        return encode_array((key, _pop_element(db, key, values, left)), 2), [pop_command, key]
+    return block(client, keys, serve, timeout)
+
+@command("BLPOP", -3, (WRITE, BLOCKING), 1, -2, 1)
+def blpop(client, args):
+    return _blocking_pop(client, args, left=True)
+
+@command("BRPOP", -3, (WRITE, BLOCKING), 1, -2, 1)
+def brpop(client, args):
+    return _blocking_pop(client, args, left=False)
+
+def _parse_sides(args):
+    # Return whether LMOVE pops from the left and pushes to the left, or None on a syntax error
+    sides = (args[0].upper(), args[1].upper())
+    if not all(side in (b"LEFT", b"RIGHT") for side in sides):
+        return None
+    return sides[0] == b"LEFT", sides[1] == b"LEFT"
+
+def _move(db, source, destination, from_left, to_left):
+    """Move one element between lists; return the encoded reply, or None if `source` is empty."""
+    values = db.lookup_write(source)
+    if values is None:
+        return None
+    if type(values) is not QuickList:
+        return WRONGTYPE_ERROR
+    target = db.lookup_write(destination)
+    if target is not None and type(target) is not QuickList:
+        return WRONGTYPE_ERROR
+
+    value = values.popleft() if from_left else values.pop()
+    if target is None:
+        target = QuickList()
+        db.set_value(destination, target)
+    if to_left:
+        target.appendleft(value)
+    else:
+        target.append(value)
+    if values:
+        db.modified(source)
+    else:
+        db.delete(source)
+    db.modified(destination)
+    db.blocked.signal(destination)
+    return encode_bulk(value)
+
+@command("LMOVE", 5, (WRITE, DENYOOM), 1, 2, 1)
+def lmove(client, args):
+    sides = _parse_sides(args[3:5])
+    if sides is None:
+        return SYNTAX_ERROR
+    reply = _move(client.db, args[1], args[2], *sides)
+    return NULL_BULK if reply is None else reply
+
+@command("BLMOVE", 6, (WRITE, DENYOOM, BLOCKING), 1, 2, 1)
+def blmove(client, args):
+    sides = _parse_sides(args[3:5])
+    if sides is None:
+        return SYNTAX_ERROR
+    timeout, error = parse_timeout(args[5])
+    if error is not None:
+        return error
+
+    db = client.db
+    propagate_args = [b"LMOVE", *args[1:5]]
+    reply = _move(db, args[1], args[2], *sides)
+    if reply is not None:
+        client.propagate_args = propagate_args
+        return reply
+
+    def serve(key):
+        reply = _move(db, args[1], args[2], *sides)
+        if reply is None:
+            return None
+        return reply, None if reply is WRONGTYPE_ERROR else propagate_args
+    return block(client, [args[1]], serve, timeout)
+
+@command("LLEN", 2, (READONLY, FAST), 1, 1, 1)
+def llen(client, args):
+    values = client.db.lookup(args[1])
+    if values is None:
+        return encode_integer(0)
+    if type(values) is not QuickList:
+        return WRONGTYPE_ERROR
+    return encode_integer(len(values))
+
+@command("LINDEX", 3, (READONLY,), 1, 1, 1)
+def lindex(client, args):
+    try:
+        index = int(args[2])
+    except ValueError:
+        return NOT_INTEGER_ERROR
+
+    values = client.db.lookup(args[1])
+    if values is None:
+        return NULL_BULK
+    if type(values) is not QuickList:
+        return WRONGTYPE_ERROR
+    try:
+        return encode_bulk(values[index])
+    except IndexError:
+        return NULL_BULK
+
+@command("LSET", 4, (WRITE, DENYOOM), 1, 1, 1)
+def lset(client, args):
+    try:
+        index = int(args[2])
+    except ValueError:
+        return NOT_INTEGER_ERROR
+
+    db = client.db
+    values = db.lookup_write(args[1])
+    if values is None:
+        return NO_SUCH_KEY_ERROR
+    if type(values) is not QuickList:
+        return WRONGTYPE_ERROR
+    try:
+        values[index] = args[3]
+    except IndexError:
+        return INDEX_OUT_OF_RANGE_ERROR
+    db.modified(args[1])
+    return OK
+
+@command("LTRIM", 4, (WRITE,), 1, 1, 1)
+def ltrim(client, args):
+    try:
+        start_index = int(args[2])
+        end_index = int(args[3])
+    except ValueError:
+        return NOT_INTEGER_ERROR
+
+    db = client.db
+    key = args[1]
+    values = db.lookup_write(key)
+    if values is None:
+        return OK
+    if type(values) is not QuickList:
+        return WRONGTYPE_ERROR
+
+    length = len(values)
+    start, stop = _range_bounds(start_index, end_index, length)
+    if start == 0 and stop >= length:
+        return OK # Nothing to trim
+    values.trim(start, stop)
+    if values:
+        db.modified(key)
+    else:
+        db.delete(key)
+    return OK
+
+@command("LRANGE", 4, (READONLY,), 1, 1, 1)
+def lrange(client, args):
+    try:
+        start_index = int(args[2])
+        end_index = int(args[3])
+    except ValueError:
+        return NOT_INTEGER_ERROR
+
+    values = client.db.lookup(args[1])
+    if values is None:
+        return EMPTY_ARRAY
+    if type(values) is not QuickList:
+        return WRONGTYPE_ERROR
+
+    # Translate negative indices and clamp the range to the list, then encode the elements
+    # straight from the nodes that hold them
+    start, stop = _range_bounds(start_index, end_index, len(values))
+    if start >= stop:
+        return EMPTY_ARRAY
+    return encode_array(values.range(start, stop), stop - start)
@@ -0,0 +1,80 @@
+from pyredis.protocol import Error, NULL_BULK, encode_array, encode_bulk, encode_integer
+from pyredis.commands import command, SYNTAX_ERROR, PUBSUB, LOADING, STALE, FAST
+from pyredis.pattern import compile_pattern
+from pyredis.pubsub import Subscriber
+
+PUBSUB_UNSUPPORTED_ERROR = Error("ERR pub/sub is only supported by the asyncio server").encode()
+
+
+def _confirm(kind, name, client):
+    # One `subscribe`-style reply: the kind, the channel or pattern, and the subscriptions left
+    count = 0 if client.subscriber is None else len(client.subscriber)
+    return b"*3\r\n" + encode_bulk(kind) + (NULL_BULK if name is None else encode_bulk(name)) + encode_integer(count)
+
+def _subscribe(client, args, kind, add):
+    if client.transport is None:
+        return PUBSUB_UNSUPPORTED_ERROR
+    if client.subscriber is None:
+        client.subscriber = Subscriber(client.transport)
+    replies = []
+    for name in args[1:]:
+        add(client.subscriber, name)
+        replies.append(_confirm(kind, name, client))
+    return b"".join(replies)
+
+def _unsubscribe(client, args, kind, subscriptions, remove):
+    subscriber = client.subscriber
+    names = args[1:]
+    if not names and subscriber is not None:
+        names = list(subscriptions(subscriber)) # Everything
+    if not names:
+        return _confirm(kind, None, client)
+    replies = []
+    for name in names:
+        if subscriber is not None:
+            remove(subscriber, name)
+            if not subscriber:
+                client.subscriber = None # Back to normal mode
+        replies.append(_confirm(kind, name, client))
+    return b"".join(replies)
+
+@command("SUBSCRIBE", -2, (PUBSUB, LOADING, STALE))
+def subscribe(client, args):
+    return _subscribe(client, args, b"subscribe", client.db.pubsub.subscribe)
+
+@command("PSUBSCRIBE", -2, (PUBSUB, LOADING, STALE))
+def psubscribe(client, args):
+    return _subscribe(client, args, b"psubscribe", client.db.pubsub.psubscribe)
+
+@command("UNSUBSCRIBE", -1, (PUBSUB, LOADING, STALE))
+def unsubscribe(client, args):
+    return _unsubscribe(client, args, b"unsubscribe", lambda subscriber: subscriber.channels,
+                        client.db.pubsub.unsubscribe)
+
+@command("PUNSUBSCRIBE", -1, (PUBSUB, LOADING, STALE))
+def punsubscribe(client, args):
+    return _unsubscribe(client, args, b"punsubscribe", lambda subscriber: subscriber.patterns,
+                        client.db.pubsub.punsubscribe)
+
+@command("PUBLISH", 3, (PUBSUB, LOADING, STALE, FAST))
+def publish(client, args):
+    return encode_integer(client.db.pubsub.publish(args[1], args[2]))
+
+@command("PUBSUB", -2, (PUBSUB, LOADING, STALE))
+def pubsub(client, args):
+    """PUBSUB CHANNELS [pattern] | NUMSUB [channel ...] | NUMPAT"""
+    pubsub = client.db.pubsub
+    subcommand = args[1].upper()
+    if subcommand == b"CHANNELS" and len(args) <= 3:
+        channels = list(pubsub.channels)
+        if len(args) == 3:
+            channels = list(filter(compile_pattern(args[2]), channels))
+        return encode_array(channels, len(channels))
+    if subcommand == b"NUMSUB":
+        channels = args[2:]
+        counts = [element for channel in channels
+                  for element in (encode_bulk(channel), encode_integer(pubsub.numsub(channel)))]
+        return b"*%d\r\n" % len(counts) + b"".join(counts)
+    if subcommand == b"NUMPAT" and len(args) == 2:
+        return encode_integer(len(pubsub.patterns))
+    return SYNTAX_ERROR
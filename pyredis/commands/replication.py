@@ -0,0 +1,63 @@
+from pyredis.protocol import Error, OK
+from pyredis.commands import command, NOT_INTEGER_ERROR, SYNTAX_ERROR, ADMIN, LOADING, STALE
+
+REPLICATION_UNSUPPORTED_ERROR = Error("ERR replication is only supported by the asyncio server").encode()
+CHAINED_REPLICATION_ERROR = Error("ERR a replica can't have replicas of its own").encode()
+
+
+@command("REPLICAOF", 3, (ADMIN, STALE))
+def replicaof(client, args):
+    """REPLICAOF host port | NO ONE"""
+    replication = client.db.replication
+    if args[1].upper() == b"NO" and args[2].upper() == b"ONE":
+        replication.stop_replicating()
+        return OK
+    try:
+        port = int(args[2])
+    except ValueError:
+        return NOT_INTEGER_ERROR
+    if client.transport is None:
+        return REPLICATION_UNSUPPORTED_ERROR
+    replication.replicate(args[1].decode(), port)
+    return OK
+
+@command("SLAVEOF", 3, (ADMIN, STALE))
+def slaveof(client, args):
+    return replicaof(client, args)
+
+@command("PSYNC", 3, (ADMIN, LOADING, STALE))
+def psync(client, args):
+    """PSYNC replid offset. The answer and the stream are written straight to the replica's transport."""
+    if client.transport is None:
+        return REPLICATION_UNSUPPORTED_ERROR
+    replication = client.db.replication
+    if replication.primary is not None:
+        return CHAINED_REPLICATION_ERROR
+    try:
+        offset = int(args[2])
+    except ValueError:
+        return NOT_INTEGER_ERROR
+    replication.sync(client, args[1], offset)
+    return b""
+
+@command("REPLCONF", -1, (ADMIN, LOADING, STALE))
+def replconf(client, args):
+    """REPLCONF listening-port port | ACK offset | option value ... Unknown options are accepted."""
+    if len(args) % 2 == 0:
+        return SYNTAX_ERROR
+    replication = client.db.replication
+    for i in range(1, len(args), 2):
+        option = args[i].lower()
+        if option not in (b"ack", b"listening-port"):
+            continue
+        try:
+            value = int(args[i + 1])
+        except ValueError:
+            return NOT_INTEGER_ERROR
+        if option == b"ack":
+            replication.acknowledge(client, value)
+            return b"" # Acknowledgments get no reply
+        if client.transport is None:
+            return REPLICATION_UNSUPPORTED_ERROR
+        replication.replica(client).port = value
+    return OK
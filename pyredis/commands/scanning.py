@@ -0,0 +1,55 @@
+"""
+    Arguments and replies shared by SCAN, HSCAN, SSCAN and ZSCAN.
+
+    SCAN's cursor is the next hash slot to visit (see keyindex), the cursor of the others the next
+    bucket of the container's ScanIndex (see scanindex). A container in a compact encoding is small
+    and returned whole, as Redis does.
+"""
+from pyredis.protocol import Error, encode_array, encode_bulk
+from pyredis.commands import NOT_INTEGER_ERROR, SYNTAX_ERROR
+from pyredis.pattern import compile_pattern
+
+INVALID_CURSOR_ERROR = Error("ERR invalid cursor").encode()
+
+SCAN_DEFAULT_COUNT = 10
+
+
+def parse_scan(args, cursor_index, with_type=False):
+    """
+        Parse `cursor [MATCH pattern] [COUNT count]` (and `[TYPE type]` if `with_type`) starting at
+        `args[cursor_index]`. Returns (cursor, match, count, type) and None, or None and the error
+        reply; `match` is a matching function, or None to match everything.
+    """
+    try:
+        cursor = int(args[cursor_index])
+    except ValueError:
+        return None, INVALID_CURSOR_ERROR
+    if cursor < 0:
+        return None, INVALID_CURSOR_ERROR
+    match = kind = None
+    count = SCAN_DEFAULT_COUNT
+    i = cursor_index + 1
+    while i < len(args):
+        option = args[i].upper()
+        if i + 1 >= len(args):
+            return None, SYNTAX_ERROR
+        if option == b"MATCH":
+            if args[i + 1] != b"*":
+                match = compile_pattern(args[i + 1])
+        elif option == b"COUNT":
+            try:
+                count = int(args[i + 1])
+            except ValueError:
+                return None, NOT_INTEGER_ERROR
+            if count < 1:
+                return None, SYNTAX_ERROR
+        elif option == b"TYPE" and with_type:
+            kind = args[i + 1].decode(errors="replace").lower()
+        else:
+            return None, SYNTAX_ERROR
+        i += 2
+    return (cursor, match, count, kind), None
+
+def encode_scan(cursor, elements):
+    """Encode a SCAN reply: the next cursor and a flat list of bytes elements."""
+    return b"*2\r\n" + encode_bulk(b"%d" % cursor) + encode_array(elements, len(elements))
@@ -0,0 +1,234 @@
+import time
+from pyredis import __version__
+from pyredis.protocol import Array, BulkString, Integer, SimpleString, Error, OK, PONG, NULL_BULK, encode_bulk, encode_integer
+from pyredis.eviction import NOEVICTION
+from pyredis.db import TYPE_NAMES, memory_usage
+from pyredis.replication import REPL_BACKLOG_SIZE
+from pyredis.commands import COMMANDS, command, lookup_command, SYNTAX_ERROR, READONLY, FAST, LOADING, STALE, ADMIN
+
+
+@command("PING", -1, (FAST, STALE))
+def ping(client, args):
+    if client.subscriber is not None: # In pub/sub mode the reply has to look like a message
+        return b"*2\r\n$4\r\npong\r\n" + encode_bulk(args[1] if len(args) > 1 else b"")
+    if len(args) > 1:
+        return SimpleString(args[1]).encode()
+    return PONG
+
+@command("ECHO", -2, (FAST,))
+def echo(client, args):
+    return encode_bulk(b" ".join(args[1:]))
+
+@command("INFO", -1, (LOADING, STALE))
+def info(client, args):
+    sections = [section.decode(errors="replace").lower() for section in args[1:]]
+    if "all" in sections or "everything" in sections:
+        sections = list(INFO_SECTIONS)
+    return BulkString("".join(INFO_SECTIONS[section](client) for section in sections if section in INFO_SECTIONS)).encode()
+
+def _info_server(client):
+    return f"# Server\nredis_version:{__version__}\n"
+
+def _info_clients(client):
+    return f"# Clients\nblocked_clients:{len(client.db.blocked)}\n"
+
+def _human_bytes(size):
+    # 1.50M, like Redis' *_human fields
+    for unit in ("B", "K", "M", "G"):
+        if size < 1024 or unit == "G":
+            return f"{size}{unit}" if unit == "B" else f"{size:.2f}{unit}"
+        size /= 1024
+
+def _info_memory(client):
+    db = client.db
+    evictor = db.evictor
+    used_memory = db.used_memory
+    by_type = dict.fromkeys(TYPE_NAMES.values(), 0)
+    for kind, size in db.memory_by_type().items():
+        by_type[TYPE_NAMES[kind]] += size
+    return (f"# Memory\nused_memory:{used_memory}\n"
+            f"used_memory_human:{_human_bytes(used_memory)}\n"
+            + "".join(f"used_memory_{name}:{size}\n" for name, size in by_type.items()) +
+            f"maxmemory:{0 if evictor is None else evictor.maxmemory}\n"
+            f"maxmemory_policy:{NOEVICTION if evictor is None else evictor.policy}\n")
+
+def _info_persistence(client):
+    db = client.db
+    lines = ["# Persistence"]
+    if db.rdb is not None:
+        lines += [
+            f"rdb_changes_since_last_save:{db.dirty - db.rdb.dirty_at_last_save}",
+            f"rdb_bgsave_in_progress:{int(db.rdb.bgsave_in_progress)}",
+            f"rdb_last_save_time:{db.rdb.last_save}",
+            f"rdb_last_bgsave_status:{'ok' if db.rdb.last_bgsave_ok else 'err'}",
+        ]
+    aof = db.aof
+    if aof is None:
+        lines.append("aof_enabled:0")
+    else:
+        lines += [
+            "aof_enabled:1",
+            f"aof_fsync_policy:{aof.appendfsync}",
+            f"aof_current_size:{aof.size}",
+            f"aof_base_size:{aof.base_size}",
+            f"aof_last_fsync:{int(aof.last_fsync)}",
+            f"aof_rewrite_in_progress:{int(aof.rewrite_in_progress)}",
+            f"aof_rewrites:{aof.rewrites}",
+            f"aof_last_bgrewrite_status:{'ok' if aof.last_rewrite_ok else 'err'}",
+        ]
+    return "\n".join(lines) + "\n"
+
+def _info_stats(client):
+    pubsub = client.db.pubsub
+    lines = [f"{name}:{value}" for name, value in client.db.stats.items()]
+    lines += [
+        f"pubsub_channels:{len(pubsub.channels)}",
+        f"pubsub_patterns:{len(pubsub.patterns)}",
+        f"client_output_buffer_limit_disconnections:{pubsub.disconnections}",
+    ]
+    return "# Stats\n" + "\n".join(lines) + "\n"
+
+def _info_replication(client):
+    replication = client.db.replication
+    primary = replication.primary
+    now = time.monotonic()
+    if primary is None:
+        replicas = [replica for replica in replication.replicas.values() if replica.state != "handshake"]
+        lines = ["role:master", f"connected_slaves:{len(replicas)}"]
+        lines += [
+            f"slave{i}:ip={replica.addr[0] if replica.addr else ''},port={replica.port},state={replica.state},"
+            f"offset={replica.ack_offset},lag={int(now - replica.ack_time)}"
+            for i, replica in enumerate(replicas)
+        ]
+    else:
+        lines = [
+            "role:slave",
+            f"master_host:{primary.host}",
+            f"master_port:{primary.port}",
+            f"master_link_status:{'up' if primary.up else 'down'}",
+            f"master_last_io_seconds_ago:{int(now - primary.last_io)}",
+            f"master_sync_in_progress:{int(primary.syncing)}",
+            f"slave_repl_offset:{replication.offset}",
+            "slave_read_only:1",
+        ]
+    backlog = replication.backlog
+    lines += [
+        f"master_replid:{replication.replid.decode()}",
+        f"master_repl_offset:{replication.offset}",
+        f"repl_backlog_active:{int(backlog is not None)}",
+        f"repl_backlog_size:{REPL_BACKLOG_SIZE if backlog is None else backlog.size}",
+        f"repl_backlog_first_byte_offset:{0 if backlog is None else backlog.first_offset}",
+        f"repl_backlog_histlen:{0 if backlog is None else backlog.length}",
+    ]
+    return "# Replication\n" + "\n".join(lines) + "\n"
+
+def _info_commandstats(client):
+    lines = [
+        f"cmdstat_{cmd.name}:calls={cmd.calls},usec={cmd.usec},usec_per_call={cmd.usec / cmd.calls:.2f}"
+        for cmd in COMMANDS.values() if cmd.calls
+    ]
+    return "# Commandstats\n" + "".join(line + "\n" for line in lines)
+
+def _info_cluster(client):
+    return f"# Cluster\ncluster_enabled:{int(client.db.cluster is not None)}\n"
+
+def _info_keyspace(client):
+    db = client.db
+    return "# Keyspace\n" + (f"db0:keys={len(db)},expires={len(db.expires)}\n" if len(db) else "")
+
+INFO_SECTIONS = {
+    "server": _info_server,
+    "clients": _info_clients,
+    "memory": _info_memory,
+    "persistence": _info_persistence,
+    "stats": _info_stats,
+    "replication": _info_replication,
+    "commandstats": _info_commandstats,
+    "cluster": _info_cluster,
+    "keyspace": _info_keyspace,
+}
+
+def _command_entry(cmd):
+    return Array([
+        BulkString(cmd.name),
+        Integer(cmd.arity),
+        Array([SimpleString(flag) for flag in cmd.flags]),
+        Integer(cmd.first_key),
+        Integer(cmd.last_key),
+        Integer(cmd.step),
+    ])
+
+@command("COMMAND", -1, (LOADING, STALE))
+def command_(client, args):
+    if len(args) == 1:
+        return Array([_command_entry(cmd) for cmd in COMMANDS.values()]).encode()
+
+    subcommand = args[1].upper()
+    if subcommand == b"COUNT":
+        return Integer(len(COMMANDS)).encode()
+    elif subcommand == b"INFO":
+        entries = []
+        for name in args[2:]:
+            cmd = lookup_command(name)
+            entries.append(Array(None) if cmd is None else _command_entry(cmd))
+        return Array(entries).encode()
+    elif subcommand == b"DOCS":
+        return Array([]).encode()
+    elif subcommand == b"GETKEYS":
+        cmd = lookup_command(args[2]) if len(args) > 2 else None
+        if cmd is None:
+            return Error("ERR Invalid command specified").encode()
+        if not cmd.check_arity(len(args) - 2):
+            return Error("ERR Invalid number of arguments specified for command").encode()
+        keys = cmd.get_keys(args[2:])
+        if not keys:
+            return Error("ERR The command has no key arguments").encode()
+        return Array([BulkString(key) for key in keys]).encode()
+    return SYNTAX_ERROR
+
+@command("BGREWRITEAOF", 1, (ADMIN,))
+def bgrewriteaof(client, args):
+    db = client.db
+    if db.aof is None:
+        return Error("ERR AOF is disabled").encode()
+    if not db.aof.start_rewrite(db):
+        return Error("ERR Background append only file rewriting already in progress").encode()
+    return SimpleString("Background append only file rewriting started").encode()
+
+@command("SAVE", 1, (ADMIN,))
+def save(client, args):
+    db = client.db
+    if db.rdb is None:
+        return Error("ERR snapshotting is disabled").encode()
+    if db.rdb.bgsave_in_progress:
+        return Error("ERR Background save already in progress").encode()
+    db.rdb.save(db)
+    return OK
+
+@command("BGSAVE", -1, (ADMIN,))
+def bgsave(client, args):
+    db = client.db
+    if db.rdb is None:
+        return Error("ERR snapshotting is disabled").encode()
+    if not db.rdb.bgsave(db):
+        return Error("ERR Background save already in progress").encode()
+    return SimpleString("Background saving started").encode()
+
+@command("LASTSAVE", 1, (FAST, LOADING, STALE))
+def lastsave(client, args):
+    if client.db.rdb is None:
+        return Integer(0).encode()
+    return Integer(client.db.rdb.last_save).encode()
+
+@command("MEMORY", -3, (READONLY,), 2, 2, 1)
+def memory(client, args):
+    subcommand = args[1].upper()
+    if subcommand != b"USAGE":
+        return Error(f"ERR unknown subcommand '{args[1].decode(errors='replace')}'").encode()
+    # SAMPLES is accepted for compatibility: the size of a value is tracked, never sampled
+    if len(args) not in (3, 5) or (len(args) == 5 and args[3].upper() != b"SAMPLES"):
+        return SYNTAX_ERROR
+    value = client.db.lookup(args[2])
+    if value is None:
+        return NULL_BULK
+    return encode_integer(memory_usage(args[2], value))
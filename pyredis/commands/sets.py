@@ -0,0 +1,196 @@
+from pyredis.protocol import NULL_BULK, EMPTY_ARRAY, encode_array, encode_bulk, encode_integer
+from pyredis.commands import (command, WRONGTYPE_ERROR, NOT_INTEGER_ERROR, SYNTAX_ERROR, NOT_POSITIVE_ERROR,
+                              WRITE, READONLY, FAST, DENYOOM)
+from pyredis.commands.scanning import parse_scan, encode_scan
+from pyredis.encoding import string_bytes
+from pyredis.sets import Set, intersection, union, difference
+
+
+def _lookup_set(db, key, write=False):
+    # The set at `key` and None, or None and the reply for a missing key or wrong type
+    members = db.lookup_write(key) if write else db.lookup(key)
+    if members is None:
+        return None, None
+    if type(members) is not Set:
+        return None, WRONGTYPE_ERROR
+    return members, None
+
+def _lookup_sets(db, keys):
+    # The sets at `keys`, skipping missing ones, and None; or None and WRONGTYPE_ERROR
+    found = []
+    for key in keys:
+        members, error = _lookup_set(db, key)
+        if error is not None:
+            return None, error
+        if members is not None:
+            found.append(members)
+    return found, None
+
+def _encode_values(values):
+    values = list(values)
+    return encode_array(map(string_bytes, values), len(values))
+
+@command("SADD", -3, (WRITE, DENYOOM, FAST), 1, 1, 1)
+def sadd(client, args):
+    db = client.db
+    key = args[1]
+    members, error = _lookup_set(db, key, write=True)
+    if error is not None:
+        return error
+    if members is None:
+        members = Set()
+        db.set_value(key, members)
+    added = 0
+    for member in args[2:]:
+        added += members.add(member)
+    if added:
+        db.modified(key)
+    return encode_integer(added)
+
+@command("SREM", -3, (WRITE, FAST), 1, 1, 1)
+def srem(client, args):
+    db = client.db
+    key = args[1]
+    members, error = _lookup_set(db, key, write=True)
+    if members is None:
+        return error or encode_integer(0)
+    removed = 0
+    for member in args[2:]:
+        removed += members.remove(member)
+    if not members:
+        db.delete(key)
+    elif removed:
+        db.modified(key)
+    return encode_integer(removed)
+
+@command("SISMEMBER", 3, (READONLY, FAST), 1, 1, 1)
+def sismember(client, args):
+    members, error = _lookup_set(client.db, args[1])
+    if members is None:
+        return error or encode_integer(0)
+    return encode_integer(args[2] in members)
+
+@command("SCARD", 2, (READONLY, FAST), 1, 1, 1)
+def scard(client, args):
+    members, error = _lookup_set(client.db, args[1])
+    if members is None:
+        return error or encode_integer(0)
+    return encode_integer(len(members))
+
+@command("SMEMBERS", 2, (READONLY,), 1, 1, 1)
+def smembers(client, args):
+    members, error = _lookup_set(client.db, args[1])
+    if members is None:
+        return error or EMPTY_ARRAY
+    return encode_array(members.members(), len(members))
+
+@command("SINTER", -2, (READONLY,), 1, -1, 1)
+def sinter(client, args):
+    db = client.db
+    sets, error = _lookup_sets(db, args[1:])
+    if error is not None:
+        return error
+    if len(sets) < len(args) - 1: # A missing key is an empty set
+        return EMPTY_ARRAY
+    return _encode_values(intersection(sets))
+
+@command("SINTERSTORE", -3, (WRITE, DENYOOM), 1, -1, 1)
+def sinterstore(client, args):
+    db = client.db
+    sets, error = _lookup_sets(db, args[2:])
+    if error is not None:
+        return error
+    values = list(intersection(sets)) if len(sets) == len(args) - 2 else []
+    key = args[1]
+    if not values:
+        db.delete(key)
+        return encode_integer(0)
+    db.set_value(key, Set.from_values(values))
+    db.modified(key)
+    return encode_integer(len(values))
+
+@command("SUNION", -2, (READONLY,), 1, -1, 1)
+def sunion(client, args):
+    sets, error = _lookup_sets(client.db, args[1:])
+    if error is not None:
+        return error
+    return _encode_values(union(sets))
+
+@command("SDIFF", -2, (READONLY,), 1, -1, 1)
+def sdiff(client, args):
+    db = client.db
+    first, error = _lookup_set(db, args[1])
+    if first is None:
+        if error is not None:
+            return error
+        first = Set()
+    others, error = _lookup_sets(db, args[2:])
+    if error is not None:
+        return error
+    return _encode_values(difference(first, others))
+
+@command("SRANDMEMBER", -2, (READONLY,), 1, 1, 1)
+def srandmember(client, args):
+    if len(args) > 3:
+        return SYNTAX_ERROR
+    count = None
+    if len(args) == 3:
+        try:
+            count = int(args[2])
+        except ValueError:
+            return NOT_INTEGER_ERROR
+    members, error = _lookup_set(client.db, args[1])
+    if members is None:
+        return error or (NULL_BULK if count is None else EMPTY_ARRAY)
+    if count is None:
+        return encode_bulk(string_bytes(members.random_value()))
+    return _encode_values(members.random_values(count))
+
+@command("SPOP", -2, (WRITE, FAST), 1, 1, 1)
+def spop(client, args):
+    """SPOP key [count]. Logged as the SREM of the members popped, so replaying it is deterministic."""
+    if len(args) > 3:
+        return SYNTAX_ERROR
+    count = None
+    if len(args) == 3:
+        try:
+            count = int(args[2])
+        except ValueError:
+            return NOT_INTEGER_ERROR
+        if count < 0:
+            return NOT_POSITIVE_ERROR
+    db = client.db
+    key = args[1]
+    members, error = _lookup_set(db, key, write=True)
+    if members is None:
+        return error or (NULL_BULK if count is None else EMPTY_ARRAY)
+    if count == 0:
+        return EMPTY_ARRAY
+
+    popped = [members.random_value()] if count is None else members.random_values(count)
+    for value in popped:
+        members.remove_value(value)
+    popped = [string_bytes(value) for value in popped]
+    client.propagate_args = [b"SREM", key, *popped]
+    if not members:
+        db.delete(key)
+    else:
+        db.modified(key)
+    if count is None:
+        return encode_bulk(popped[0])
+    return encode_array(popped, len(popped))
+
+@command("SSCAN", -3, (READONLY,), 1, 1, 1)
+def sscan(client, args):
+    """SSCAN key cursor [MATCH pattern] [COUNT count]"""
+    options, error = parse_scan(args, 2)
+    if error is not None:
+        return error
+    cursor, match, count, _ = options
+    members, error = _lookup_set(client.db, args[1])
+    if members is None:
+        return error or encode_scan(0, [])
+    cursor, page = members.scan(cursor, count)
+    if match is not None:
+        page = [member for member in page if match(member)]
+    return encode_scan(cursor, page)
@@ -0,0 +1,398 @@
+import math
+from pyredis.protocol import Error, NULL_BULK, EMPTY_ARRAY, encode_array, encode_bulk, encode_integer
+from pyredis.commands import (command, WRONGTYPE_ERROR, NOT_INTEGER_ERROR, SYNTAX_ERROR, NOT_POSITIVE_ERROR,
+                              WRITE, READONLY, FAST, DENYOOM, BLOCKING)
+from pyredis.commands.scanning import parse_scan, encode_scan
+from pyredis.blocking import block, parse_timeout
+from pyredis.sortedsets import SortedSet, format_score
+
+NOT_FLOAT_ERROR = Error("ERR value is not a valid float").encode()
+NAN_ERROR = Error("ERR resulting score is not a number (NaN)").encode()
+MIN_MAX_NOT_FLOAT_ERROR = Error("ERR min or max is not a float").encode()
+MIN_MAX_NOT_STRING_ERROR = Error("ERR min or max not valid string range item").encode()
+
+_LEX_MIN = object() # The - and + lex bounds
+_LEX_MAX = object()
+
+
+def _parse_score(arg):
+    # A score as a float, or None if it isn't one. NaN is not a valid score.
+    try:
+        score = float(arg)
+    except ValueError:
+        return None
+    return None if math.isnan(score) else score
+
+def _parse_score_bound(arg):
+    # ZRANGEBYSCORE bound: 1.5 (inclusive), (1.5 (exclusive), -inf, +inf. Returns (score, exclusive).
+    exclusive = arg[:1] == b"("
+    score = _parse_score(arg[1:] if exclusive else arg)
+    return (None, False) if score is None else (score, exclusive)
+
+def _parse_lex_bound(arg):
+    # BYLEX bound: [a (inclusive), (a (exclusive), - or +. Returns (member, exclusive) with
+    # _LEX_MIN or _LEX_MAX as the member for - and +, or None if invalid.
+    if arg == b"-":
+        return _LEX_MIN, False
+    if arg == b"+":
+        return _LEX_MAX, False
+    if arg[:1] in (b"[", b"("):
+        return arg[1:], arg[:1] == b"("
+    return None
+
+def _score_ranks(zset, low, high):
+    # Ranks [start, stop) of the members whose scores lie within the (score, exclusive) bounds
+    start = zset.count(low[0], inclusive=low[1])
+    stop = zset.count(high[0], inclusive=not high[1])
+    return start, max(start, stop)
+
+def _lex_ranks(zset, low, high):
+    # Ranks [start, stop) of the members within the lex bounds. Like Redis, this assumes every
+    # member has the same score.
+    if not zset:
+        return 0, 0
+    score = next(zset.range(0, 1))[1]
+    start, stop = _lex_rank(zset, score, low, False), _lex_rank(zset, score, high, True)
+    return start, max(start, stop)
+
+def _lex_rank(zset, score, bound, upper):
+    # The rank a lex bound starts at, or ends before if it is the `upper` one
+    member, exclusive = bound
+    if member is _LEX_MIN:
+        return 0
+    if member is _LEX_MAX:
+        return len(zset)
+    return zset.count(score, member, inclusive=exclusive != upper)
+
+def _encode_members(pairs, with_scores):
+    # Reply with the members, each followed by its score if `with_scores`
+    if with_scores:
+        pairs = list(pairs)
+        return encode_array((item for member, score in pairs for item in (member, format_score(score))),
+                            2 * len(pairs))
+    members = [member for member, _ in pairs]
+    return encode_array(members, len(members))
+
+def _lookup_zset(db, key, write=False):
+    # The sorted set at `key` and None, or None and the reply for a missing key or wrong type
+    zset = db.lookup_write(key) if write else db.lookup(key)
+    if zset is None:
+        return None, None
+    if type(zset) is not SortedSet:
+        return None, WRONGTYPE_ERROR
+    return zset, None
+
+@command("ZADD", -4, (WRITE, DENYOOM, FAST), 1, 1, 1)
+def zadd(client, args):
+    flags = set()
+    i = 2
+    while i < len(args) and args[i].upper() in (b"NX", b"XX", b"GT", b"LT", b"CH", b"INCR"):
+        flags.add(args[i].upper())
+        i += 1
+    if (len(args) - i) % 2 or i == len(args):
+        return SYNTAX_ERROR
+    if b"NX" in flags and b"XX" in flags:
+        return Error("ERR XX and NX options at the same time are not compatible").encode()
+    if len(flags & {b"NX", b"GT", b"LT"}) > 1:
+        return Error("ERR GT, LT, and/or NX options at the same time are not compatible").encode()
+    incr = b"INCR" in flags
+    if incr and len(args) - i > 2:
+        return Error("ERR INCR option supports a single increment-element pair").encode()
+    pairs = []
+    for j in range(i, len(args), 2):
+        score = _parse_score(args[j])
+        if score is None:
+            return NOT_FLOAT_ERROR
+        pairs.append((score, args[j + 1]))
+
+    reply = _zadd(client.db, args[1], pairs, flags)
+    if not incr or type(reply) is not float:
+        return reply
+    return encode_bulk(format_score(reply))
+
+def _zadd(db, key, pairs, flags):
+    """
+        Add or update members the way ZADD does with `flags`. Returns the encoded reply, or the new
+        score (None if the update was refused) with INCR.
+    """
+    zset, error = _lookup_zset(db, key, write=True)
+    if error is not None:
+        return error
+    incr = b"INCR" in flags
+    added = updated = 0
+    result = None
+    for score, member in pairs:
+        current = None if zset is None else zset.score(member)
+        if current is None:
+            if b"XX" in flags:
+                continue
+            if zset is None:
+                zset = SortedSet()
+                db.set_value(key, zset)
+            zset.add(member, score)
+            added += 1
+        else:
+            if b"NX" in flags:
+                continue
+            if incr:
+                score += current
+                if math.isnan(score):
+                    return NAN_ERROR
+            if (b"GT" in flags and score <= current) or (b"LT" in flags and score >= current):
+                continue
+            if score != current:
+                zset.add(member, score)
+                updated += 1
+        result = score
+    if added or updated:
+        db.modified(key)
+    if added:
+        db.blocked.signal(key)
+    if incr:
+        return NULL_BULK if result is None else result
+    return encode_integer(added + updated if b"CH" in flags else added)
+
+@command("ZINCRBY", 4, (WRITE, DENYOOM, FAST), 1, 1, 1)
+def zincrby(client, args):
+    increment = _parse_score(args[2])
+    if increment is None:
+        return NOT_FLOAT_ERROR
+    reply = _zadd(client.db, args[1], [(increment, args[3])], {b"INCR"})
+    return encode_bulk(format_score(reply)) if type(reply) is float else reply
+
+@command("ZSCORE", 3, (READONLY, FAST), 1, 1, 1)
+def zscore(client, args):
+    zset, error = _lookup_zset(client.db, args[1])
+    if zset is None:
+        return error or NULL_BULK
+    score = zset.score(args[2])
+    return NULL_BULK if score is None else encode_bulk(format_score(score))
+
+@command("ZCARD", 2, (READONLY, FAST), 1, 1, 1)
+def zcard(client, args):
+    zset, error = _lookup_zset(client.db, args[1])
+    if zset is None:
+        return error or encode_integer(0)
+    return encode_integer(len(zset))
+
+def _rank(client, args, reverse):
+    zset, error = _lookup_zset(client.db, args[1])
+    if zset is None:
+        return error or NULL_BULK
+    rank = zset.rank(args[2])
+    if rank is None:
+        return NULL_BULK
+    return encode_integer(len(zset) - 1 - rank if reverse else rank)
+
+@command("ZRANK", 3, (READONLY, FAST), 1, 1, 1)
+def zrank(client, args):
+    return _rank(client, args, reverse=False)
+
+@command("ZREVRANK", 3, (READONLY, FAST), 1, 1, 1)
+def zrevrank(client, args):
+    return _rank(client, args, reverse=True)
+
+def _range_generic(client, key, low, high, by, reverse, limit, with_scores):
+    """
+        Shared implementation of ZRANGE and ZRANGEBYSCORE. `by` is None (ranks), b"BYSCORE" or
+        b"BYLEX"; `low` and `high` are the raw bounds, already swapped for REV on scores and lex.
+    """
+    if by is None:
+        try:
+            start, end = int(low), int(high)
+        except ValueError:
+            return NOT_INTEGER_ERROR
+    elif by == b"BYSCORE":
+        low, high = _parse_score_bound(low), _parse_score_bound(high)
+        if low[0] is None or high[0] is None:
+            return MIN_MAX_NOT_FLOAT_ERROR
+    else:
+        low, high = _parse_lex_bound(low), _parse_lex_bound(high)
+        if low is None or high is None:
+            return MIN_MAX_NOT_STRING_ERROR
+
+    zset, error = _lookup_zset(client.db, key)
+    if zset is None:
+        return error or EMPTY_ARRAY
+    length = len(zset)
+    if by is None:
+        # Ranks count from the end with REV: turn them into ascending ranks
+        if start < 0:
+            start = max(0, start + length)
+        if end < 0:
+            end += length
+        end = min(end, length - 1)
+        if start > end:
+            return EMPTY_ARRAY
+        if reverse:
+            start, end = length - 1 - end, length - 1 - start
+        start, stop = start, end + 1
+    elif by == b"BYSCORE":
+        start, stop = _score_ranks(zset, low, high)
+    else:
+        start, stop = _lex_ranks(zset, low, high)
+
+    if limit is not None:
+        offset, count = limit
+        if offset < 0:
+            return EMPTY_ARRAY
+        if reverse:
+            stop = max(start, stop - offset)
+            if count >= 0:
+                start = max(start, stop - count)
+        else:
+            start = min(stop, start + offset)
+            if count >= 0:
+                stop = min(stop, start + count)
+    return _encode_members(zset.range(start, stop, reverse), with_scores)
+
+def _parse_range_options(args, allow_by):
+    """Parse [BYSCORE|BYLEX] [REV] [LIMIT offset count] [WITHSCORES] into a dict, or an error reply."""
+    options = {"by": None, "reverse": False, "limit": None, "with_scores": False}
+    i = 0
+    while i < len(args):
+        option = args[i].upper()
+        if option in (b"BYSCORE", b"BYLEX") and allow_by:
+            options["by"] = option
+        elif option == b"REV" and allow_by:
+            options["reverse"] = True
+        elif option == b"WITHSCORES":
+            options["with_scores"] = True
+        elif option == b"LIMIT" and i + 2 < len(args):
+            try:
+                options["limit"] = (int(args[i + 1]), int(args[i + 2]))
+            except ValueError:
+                return NOT_INTEGER_ERROR
+            i += 2
+        else:
+            return SYNTAX_ERROR
+        i += 1
+    return options
+
+@command("ZRANGE", -4, (READONLY,), 1, 1, 1)
+def zrange(client, args):
+    options = _parse_range_options(args[4:], allow_by=True)
+    if type(options) is bytes:
+        return options
+    if options["limit"] is not None and options["by"] is None:
+        return Error("ERR syntax error, LIMIT is only supported in combination with either BYSCORE or BYLEX").encode()
+    if options["with_scores"] and options["by"] == b"BYLEX":
+        return Error("ERR syntax error, WITHSCORES not supported in combination with BYLEX").encode()
+    low, high = args[2], args[3]
+    if options["reverse"] and options["by"] is not None:
+        low, high = high, low # ZRANGE key max min BYSCORE REV
+    return _range_generic(client, args[1], low, high, **options)
+
+@command("ZRANGEBYSCORE", -4, (READONLY,), 1, 1, 1)
+def zrangebyscore(client, args):
+    options = _parse_range_options(args[4:], allow_by=False)
+    if type(options) is bytes:
+        return options
+    options["by"] = b"BYSCORE"
+    return _range_generic(client, args[1], args[2], args[3], **options)
+
+@command("ZREM", -3, (WRITE, FAST), 1, 1, 1)
+def zrem(client, args):
+    db = client.db
+    key = args[1]
+    zset, error = _lookup_zset(db, key, write=True)
+    if zset is None:
+        return error or encode_integer(0)
+    removed = 0
+    for member in args[2:]:
+        removed += zset.remove(member)
+    if not zset:
+        db.delete(key)
+    elif removed:
+        db.modified(key)
+    return encode_integer(removed)
+
+def _pop_members(db, key, zset, count, reverse):
+    """Pop up to `count` members with the lowest (highest if `reverse`) scores, removing the key once empty."""
+    count = min(count, len(zset))
+    popped = list(zset.range(len(zset) - count, len(zset), True) if reverse else zset.range(0, count))
+    for member, _ in popped:
+        zset.remove(member)
+    if not zset:
+        db.delete(key)
+    elif popped:
+        db.modified(key)
+    return popped
+
+def _pop(client, args, reverse):
+    if len(args) > 3:
+        return Error(f"ERR wrong number of arguments for '{args[0].decode().lower()}' command").encode()
+    count = 1
+    if len(args) == 3:
+        try:
+            count = int(args[2])
+        except ValueError:
+            return NOT_INTEGER_ERROR
+        if count < 0:
+            return NOT_POSITIVE_ERROR
+    db = client.db
+    zset, error = _lookup_zset(db, args[1], write=True)
+    if zset is None:
+        return error or EMPTY_ARRAY
+    return _encode_members(_pop_members(db, args[1], zset, count, reverse), with_scores=True)
+
+@command("ZPOPMIN", -2, (WRITE, FAST), 1, 1, 1)
+def zpopmin(client, args):
+    return _pop(client, args, reverse=False)
+
+@command("ZPOPMAX", -2, (WRITE, FAST), 1, 1, 1)
+def zpopmax(client, args):
+    return _pop(client, args, reverse=True)
+
+def _blocking_pop(client, args, reverse):
+    timeout, error = parse_timeout(args[-1])
+    if error is not None:
+        return error
+
+    db = client.db
+    pop_command = b"ZPOPMAX" if reverse else b"ZPOPMIN"
+
+    def pop_from(key):
+        # The reply for a pop from `key`, or None if it holds no sorted set
+        zset, wrong_type = _lookup_zset(db, key, write=True)
+        if zset is None:
+            return wrong_type
+        (member, score), = _pop_members(db, key, zset, 1, reverse)
+        return encode_array((key, member, format_score(score)), 3)
+
+    for key in args[1:-1]:
+        reply = pop_from(key)
+        if reply is not None:
+            if reply is not WRONGTYPE_ERROR:
+                client.propagate_args = [pop_command, key]
+            return reply
+
+    def serve(key):
+        reply = pop_from(key)
+        if reply is None or reply is WRONGTYPE_ERROR:
+            return None # Wait for a sorted set
+        return reply, [pop_command, key]
+    return block(client, args[1:-1], serve, timeout)
+
+@command("BZPOPMIN", -3, (WRITE, BLOCKING), 1, -2, 1)
+def bzpopmin(client, args):
+    return _blocking_pop(client, args, reverse=False)
+
+@command("BZPOPMAX", -3, (WRITE, BLOCKING), 1, -2, 1)
+def bzpopmax(client, args):
+    return _blocking_pop(client, args, reverse=True)
+
+@command("ZSCAN", -3, (READONLY,), 1, 1, 1)
+def zscan(client, args):
+    """ZSCAN key cursor [MATCH pattern] [COUNT count]"""
+    options, error = parse_scan(args, 2)
+    if error is not None:
+        return error
+    cursor, match, count, _ = options
+    zset, error = _lookup_zset(client.db, args[1])
+    if zset is None:
+        return error or encode_scan(0, [])
+    cursor, pairs = zset.scan(cursor, count)
+    if match is not None:
+        pairs = [(member, score) for member, score in pairs if match(member)]
+    return encode_scan(cursor, [item for member, score in pairs for item in (member, format_score(score))])
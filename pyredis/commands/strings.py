@@ -0,0 +1,157 @@
+from pyredis.protocol import Error, OK, NULL_BULK, encode_bulk, encode_integer
+from pyredis.commands import (command, WRONGTYPE_ERROR, NOT_INTEGER_ERROR, SYNTAX_ERROR, INCR_OVERFLOW_ERROR,
+                              WRITE, READONLY, FAST, DENYOOM)
+from pyredis.expiry import now_ms
+from pyredis.encoding import LONG_MIN, LONG_MAX, STRING_TYPES, encode_string, shared_integer, string_bytes
+
+
+@command("SET", -3, (WRITE, DENYOOM), 1, 1, 1)
+def set_(client, args):
+    """SET key value [NX | XX] [GET] [EX seconds | PX ms | EXAT timestamp | PXAT ms-timestamp | KEEPTTL]"""
+    key, value = args[1], args[2]
+    expiry_time = None
+    flags = set()
+
+    # Optional expiry: EX/PX are relative (seconds/milliseconds), EXAT/PXAT are Unix timestamps
+    i = 3
+    while i < len(args):
+        option = args[i].upper()
+        if option in SET_FLAGS:
+            flags.add(option)
+            i += 1
+            continue
+        if option not in EXPIRY_UNITS or expiry_time is not None or i + 1 >= len(args):
+            return SYNTAX_ERROR
+        try:
+            amount = int(args[i + 1])
+        except ValueError:
+            return NOT_INTEGER_ERROR
+        if amount <= 0:
+            return Error("ERR invalid expire time in 'set' command").encode()
+        multiplier, relative = EXPIRY_UNITS[option]
+        expiry_time = amount * multiplier + (now_ms() if relative else 0)
+        i += 2
+    if b"NX" in flags and b"XX" in flags or b"KEEPTTL" in flags and expiry_time is not None:
+        return SYNTAX_ERROR
+
+    db = client.db
+    reply = OK
+    if flags:
+        old = db.lookup(key)
+        if b"GET" in flags:
+            if old is not None and type(old) not in STRING_TYPES:
+                return WRONGTYPE_ERROR
+            reply = NULL_BULK if old is None else encode_bulk(string_bytes(old))
+        if b"NX" in flags and old is not None or b"XX" in flags and old is None:
+            return NULL_BULK if reply is OK else reply
+    keep_ttl = b"KEEPTTL" in flags
+    db.set_value(key, encode_string(value), keep_ttl) # Overwrite the value if the key already exists
+    if expiry_time is not None:
+        db.set_expire(key, expiry_time)
+        client.propagate_args = [b"SET", key, value, b"PXAT", b"%d" % expiry_time]
+    elif flags:
+        # NX/XX/GET held and mean nothing more when replayed
+        client.propagate_args = [b"SET", key, value, b"KEEPTTL"] if keep_ttl else [b"SET", key, value]
+    return reply
+
+SET_FLAGS = frozenset((b"NX", b"XX", b"GET", b"KEEPTTL"))
+
+# Option -> (milliseconds per unit, relative to now)
+EXPIRY_UNITS = {
+    b"EX": (1000, True),
+    b"PX": (1, True),
+    b"EXAT": (1000, False),
+    b"PXAT": (1, False),
+}
+
+@command("GET", 2, (READONLY, FAST), 1, 1, 1)
+def get(client, args):
+    value = client.db.lookup(args[1])
+    if value is None:
+        return NULL_BULK # RESP null bulk string for missing keys
+    if type(value) is bytes:
+        return encode_bulk(value)
+    if type(value) is int:
+        return encode_bulk(b"%d" % value)
+    return WRONGTYPE_ERROR
+
+@command("GETSET", 3, (WRITE, DENYOOM, FAST), 1, 1, 1)
+def getset(client, args):
+    db = client.db
+    key = args[1]
+    old = db.lookup(key)
+    if old is not None and type(old) not in STRING_TYPES:
+        return WRONGTYPE_ERROR
+    db.set_value(key, encode_string(args[2]))
+    return NULL_BULK if old is None else encode_bulk(string_bytes(old))
+
+@command("SETNX", 3, (WRITE, DENYOOM, FAST), 1, 1, 1)
+def setnx(client, args):
+    db = client.db
+    if db.lookup(args[1]) is not None:
+        return encode_integer(0)
+    db.set_value(args[1], encode_string(args[2]))
+    return encode_integer(1)
+
+@command("MGET", -2, (READONLY, FAST), 1, -1, 1)
+def mget(client, args):
+    """Values of many keys, nil for missing keys and keys that don't hold a string."""
+    lookup = client.db.lookup
+    parts = [b"*%d\r\n" % (len(args) - 1)]
+    append = parts.append
+    for key in args[1:]:
+        value = lookup(key)
+        kind = type(value)
+        if kind is bytes:
+            append(encode_bulk(value))
+        elif kind is int:
+            append(encode_bulk(b"%d" % value))
+        else:
+            append(NULL_BULK)
+    return b"".join(parts)
+
+def _set_many(db, args):
+    set_value = db.set_value
+    for i in range(1, len(args), 2):
+        set_value(args[i], encode_string(args[i + 1]))
+
+@command("MSET", -3, (WRITE, DENYOOM), 1, -1, 2)
+def mset(client, args):
+    if len(args) % 2 == 0:
+        return Error("ERR wrong number of arguments for 'mset' command").encode()
+    _set_many(client.db, args)
+    return OK
+
+@command("MSETNX", -3, (WRITE, DENYOOM), 1, -1, 2)
+def msetnx(client, args):
+    """Set all the keys, or none if any of them exists."""
+    if len(args) % 2 == 0:
+        return Error("ERR wrong number of arguments for 'msetnx' command").encode()
+    db = client.db
+    for i in range(1, len(args), 2):
+        if db.lookup(args[i]) is not None:
+            return encode_integer(0)
+    _set_many(db, args)
+    return encode_integer(1)
+
+def _incr_by(client, key, increment):
+    db = client.db
+    value = db.lookup(key)
+    if value is None:
+        value = 0
+    elif type(value) is not int: # Strings that are integers are stored as ints
+        return WRONGTYPE_ERROR if type(value) is not bytes else NOT_INTEGER_ERROR
+
+    value += increment
+    if not LONG_MIN <= value <= LONG_MAX:
+        return INCR_OVERFLOW_ERROR
+    db.set_value(key, shared_integer(value), keep_ttl=True)
+    return encode_integer(value)
+
+@command("INCR", 2, (WRITE, DENYOOM, FAST), 1, 1, 1)
+def incr(client, args):
+    return _incr_by(client, args[1], 1)
+
+@command("DECR", 2, (WRITE, DENYOOM, FAST), 1, 1, 1)
+def decr(client, args):
+    return _incr_by(client, args[1], -1)
@@ -0,0 +1,76 @@
+from pyredis.protocol import Error, OK, NULL_ARRAY
+from pyredis.commands import command, call, refuse, FAST, LOADING, STALE
+from pyredis.blocking import TIMEOUT_REPLY
+from pyredis.transactions import Transaction, watch as watch_key, unwatch as unwatch_keys, watched_keys_changed
+
+NESTED_MULTI_ERROR = Error("ERR MULTI calls can not be nested").encode()
+EXEC_WITHOUT_MULTI_ERROR = Error("ERR EXEC without MULTI").encode()
+DISCARD_WITHOUT_MULTI_ERROR = Error("ERR DISCARD without MULTI").encode()
+EXECABORT_ERROR = Error("EXECABORT Transaction discarded because of previous errors.").encode()
+WATCH_IN_MULTI_ERROR = Error("ERR WATCH inside MULTI is not allowed").encode()
+
+
+@command("MULTI", 1, (FAST, LOADING, STALE))
+def multi(client, args):
+    if client.transaction is not None:
+        return refuse(client, NESTED_MULTI_ERROR)
+    client.transaction = Transaction()
+    return OK
+
+@command("DISCARD", 1, (LOADING, STALE))
+def discard(client, args):
+    if client.transaction is None:
+        return DISCARD_WITHOUT_MULTI_ERROR
+    client.transaction = None
+    unwatch_keys(client)
+    return OK
+
+@command("EXEC", 1, (LOADING, STALE))
+def exec_(client, args):
+    """
+        Run the queued commands back to back and reply with an array of their replies, or a null
+        array if a watched key changed. A blocking command doesn't wait: it times out at once. The
+        writes are propagated together, and blocked clients are only served once they all ran.
+    """
+    transaction, client.transaction = client.transaction, None
+    if transaction is None:
+        return EXEC_WITHOUT_MULTI_ERROR
+    changed = watched_keys_changed(client)
+    unwatch_keys(client)
+    if transaction.failed:
+        return EXECABORT_ERROR
+    if changed:
+        return NULL_ARRAY
+
+    db = client.db
+    log = []
+    replies = []
+    client.in_exec = True
+    try:
+        for queued, queued_args in transaction.commands:
+            reply = call(client, queued, queued_args, log)
+            if reply is None:
+                waiter, client.waiter = client.waiter, None
+                db.blocked.unblock(waiter)
+                reply = TIMEOUT_REPLY
+            replies.append(reply)
+    finally:
+        client.in_exec = False
+        if log:
+            db.propagate_transaction(log)
+    if db.blocked.ready:
+        db.blocked.serve(db)
+    return b"*%d\r\n" % len(replies) + b"".join(replies)
+
+@command("WATCH", -2, (FAST, LOADING, STALE), 1, -1, 1)
+def watch(client, args):
+    if client.transaction is not None:
+        return refuse(client, WATCH_IN_MULTI_ERROR)
+    for key in args[1:]:
+        watch_key(client, key)
+    return OK
+
+@command("UNWATCH", 1, (LOADING, STALE))
+def unwatch(client, args):
+    unwatch_keys(client)
+    return OK
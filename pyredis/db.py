@@ -0,0 +1,398 @@
+import sys, time, threading
+from collections import defaultdict
+from pyredis.expiry import ExpiryIndex, now_ms
+from pyredis.blocking import BlockedClients
+from pyredis.keyindex import SlotIndex
+from pyredis.pubsub import PubSub
+from pyredis.replication import Replication
+from pyredis.protocol import encode_command
+from pyredis.encoding import STRING_TYPES, string_memory
+from pyredis.quicklist import QuickList
+from pyredis.hashes import Hash
+from pyredis.sets import Set
+from pyredis.sortedsets import SortedSet
+
+# Python type of a stored value -> Redis type name
+TYPE_NAMES = {
+    bytes: "string",
+    int: "string",
+    QuickList: "list",
+    Hash: "hash",
+    Set: "set",
+    SortedSet: "zset",
+}
+
+_KEY_HEADER = sys.getsizeof(b"") + 32 # A key's bytes object and its entry in the keyspace dict
+
+
+def memory_usage(key, value):
+    """Estimated number of bytes taken up by `key` and its value."""
+    if type(value) in STRING_TYPES:
+        return _KEY_HEADER + len(key) + string_memory(value)
+    return _KEY_HEADER + len(key) + value.memory_usage()
+
+def _accounted(value):
+    # Bytes of a stored value included in `Database.used_memory`
+    if type(value) in STRING_TYPES:
+        return string_memory(value)
+    return value.accounted
+
+
+class _Tally:
+    __slots__ = ("changes", "memory")
+
+    def __init__(self):
+        self.changes = 0 # Changes made, lets `execute` tell whether its command wrote
+        self.memory = defaultdict(int) # Python type of the values -> net bytes added to the keyspace
+
+class _SharedTally:
+    # Commands run one at a time: a single set of counters
+    def __init__(self, tallies):
+        self.tally = _Tally()
+        tallies.append(self.tally)
+
+class _ThreadTally(threading.local):
+    """
+        Counters kept by each thread for itself. Commands holding different lock stripes run at the
+        same time, and a shared counter would lose updates.
+    """
+
+    def __init__(self, tallies):
+        self.tally = _Tally()
+        tallies.append(self.tally)
+
+class Database:
+    """
+        The keyspace shared by every client.
+
+        `store` maps a key to its value: bytes or an int for strings (see `encoding`), a QuickList
+        for lists. Keys with a TTL also have an absolute deadline (in milliseconds) in the
+        `expires` index. Handlers read keys through `lookup`, which removes an expired key lazily
+        when it is touched; `active_expire` removes the ones nobody touches.
+
+        Handlers that modify a value in place (pushing to a list) must fetch it with `lookup_write`,
+        which gives the keyspace a private copy first if a background snapshot still refers to it.
+        Every change is counted with `modified`, which handlers call after changing a value in
+        place.
+
+        Every key is also filed under its hash slot in `slots`, which gives SCAN a cursor that
+        survives changes to the keyspace (see keyindex), and in `prefix_index` if one is attached.
+
+        `used_memory` estimates the size of the dataset. Strings are counted when stored; lists and
+        the other containers keep their own size up to date, and `modified` adds the difference
+        since it last counted them (their `accounted` size).
+    """
+
+    def __init__(self, store=None):
+        self.store = {} if store is None else store
+        self.expires = ExpiryIndex()
+        self.aof = None # AOFWriter, attached once the dataset has been loaded
+        self.rdb = None # RDB, enables SAVE and BGSAVE
+        self.blocked = BlockedClients() # Clients waiting in BLPOP, BRPOP and BLMOVE
+        self.pubsub = PubSub()
+        self.watched = {} # Key -> [version, clients watching it], for WATCH (see `watch`)
+        self.replication = Replication(self)
+        self.cluster = None # Cluster in cluster mode, see cluster
+        self.router = None # ShardRouter when this process serves one shard of a --workers N server
+        self.locks = None # StripedLock when commands run on several threads, see `use_lock_striping`
+        self.evictor = None # Evictor when maxmemory is set
+        self.slots = SlotIndex()
+        self.prefix_index = None # PrefixIndex when --prefix-index is set
+        self.dirty = 0 # Changes since startup, bumped by every handler that modifies the keyspace
+        self._tallies = []
+        self._local = _SharedTally(self._tallies)
+        self._snapshots = () # Snapshots being written in the background, replaced rather than mutated
+        self._snapshots_lock = threading.Lock() # Snapshots are released from background threads
+        self.stats = {
+            "total_commands_processed": 0,
+            "expired_keys": 0,
+            "evicted_keys": 0,
+            "eviction_usec": 0,
+        }
+        for key in self.store:
+            self.slots.add(key)
+
+    def use_lock_striping(self, locks):
+        """
+            Let commands run on several threads at once, each holding the stripes of `locks` that
+            guard its keys (see server_using_multithreading).
+        """
+        self.locks = locks
+        self._local = _ThreadTally(self._tallies)
+
+    @property
+    def used_memory(self):
+        """Estimated bytes taken up by the keys and values."""
+        return sum(sum(tally.memory.values()) for tally in self._tallies)
+
+    def memory_by_type(self):
+        """Return the estimated bytes taken up by the keys holding each Python type of value."""
+        totals = defaultdict(int)
+        for tally in self._tallies:
+            for kind, size in list(tally.memory.items()):
+                totals[kind] += size
+        return totals
+
+    def tally(self):
+        """Return the counters of the calling thread."""
+        return self._local.tally
+
+    def modified(self, key):
+        """Count a change to `key`, made by a handler or by one of the methods below."""
+        if self.watched:
+            self._touch(key)
+        self.dirty += 1
+        tally = self._local.tally
+        tally.changes += 1
+        value = self.store.get(key)
+        if value is not None and type(value) not in STRING_TYPES:
+            usage = value.memory_usage()
+            tally.memory[type(value)] += usage - value.accounted
+            value.accounted = usage
+
+    def propagate(self, args):
+        """Record an executed write command in the AOF and send it to the replicas."""
+        if self.replication.backlog is not None:
+            self.replication.feed(encode_command(args))
+        aof = self.aof
+        if aof is not None:
+            aof.feed(args)
+            # With striped locks the rewrite has to wait for the other threads, see
+            # server_using_multithreading
+            if self.locks is None and aof.rewrite_due():
+                aof.start_rewrite(self)
+
+    def propagate_transaction(self, commands):
+        """Record the write commands run by an EXEC as one MULTI ... EXEC entry in the AOF and the replication stream."""
+        if len(commands) == 1:
+            self.propagate(commands[0])
+            return
+        commands = [[b"MULTI"], *commands, [b"EXEC"]]
+        if self.replication.backlog is not None:
+            self.replication.feed(b"".join(map(encode_command, commands)))
+        aof = self.aof
+        if aof is not None:
+            aof.feed_all(commands)
+            # With striped locks the rewrite has to wait for the other threads, see
+            # server_using_multithreading
+            if self.locks is None and aof.rewrite_due():
+                aof.start_rewrite(self)
+
+    def lookup(self, key):
+        """Return the value stored at `key`, or None if it is missing or expired."""
+        value = self.store.get(key)
+        if value is not None and self.expires:
+            when = self.expires.get(key)
+            if when is not None and now_ms() > when:
+                self._expire(key)
+                return None
+        if value is not None and self.evictor is not None:
+            self.evictor.touch(key)
+        return value
+
+    def peek(self, key):
+        """
+            Like `lookup`, for enumerating keys: an expired key is skipped but left for expiry to
+            remove, and the access doesn't count for eviction.
+        """
+        value = self.store.get(key)
+        if value is not None and self.expires:
+            when = self.expires.get(key)
+            if when is not None and now_ms() > when:
+                return None
+        return value
+
+    def lookup_write(self, key):
+        """Like `lookup`, for handlers that are about to modify the returned value in place."""
+        value = self.lookup(key)
+        if value is not None and self._snapshots and type(value) not in STRING_TYPES:
+            for snapshot in self._snapshots:
+                if snapshot.store.get(key) is value:
+                    value = self.store[key] = value.copy()
+                    break
+        return value
+
+    def set_value(self, key, value, keep_ttl=False):
+        """Store `value` at `key`. Any TTL is dropped unless `keep_ttl` is set."""
+        store = self.store
+        old = store.get(key)
+        store[key] = value
+        if not keep_ttl and self.expires:
+            self.expires.remove(key)
+        tally = self._local.tally
+        if type(old) is bytes and type(value) is bytes:
+            # Fast path for a string overwriting a string: only its length changes
+            if self.watched:
+                self._touch(key)
+            tally.memory[bytes] += len(value) - len(old)
+            tally.changes += 1
+            self.dirty += 1
+            return
+        if old is not None:
+            self._forget(key, old)
+        else:
+            self._key_added(key)
+        self._count(key, value)
+        self.modified(key)
+
+    def restore(self, key, value, deadline=None):
+        """Add a key read from a snapshot. It counts towards `used_memory` but not as a change."""
+        old = self.store.get(key)
+        self.store[key] = value
+        if old is not None:
+            self._forget(key, old)
+        else:
+            self._key_added(key)
+        self._count(key, value)
+        if deadline is not None:
+            self.expires.set(key, deadline)
+
+    def delete(self, key):
+        """Delete `key`, returning True if it existed."""
+        if self.lookup(key) is None:
+            return False
+        self._forget(key, self.store.pop(key))
+        self._key_removed(key)
+        self.expires.remove(key)
+        self.modified(key)
+        return True
+
+    def flush(self):
+        """Delete every key, as a replica does before loading its primary's snapshot."""
+        for key in list(self.store):
+            self.delete(key)
+
+    def get_expire(self, key):
+        """Return the deadline of `key` in milliseconds, or None if it has no TTL."""
+        return self.expires.get(key)
+
+    def set_expire(self, key, when):
+        """Give an existing key an absolute deadline in milliseconds."""
+        self.expires.set(key, when)
+        self.modified(key)
+
+    def persist(self, key):
+        """Remove the TTL of `key`, returning True if it had one."""
+        if self.expires.remove(key):
+            self.modified(key)
+            return True
+        return False
+
+    def active_expire(self, time_budget):
+        """
+            Delete keys whose deadline has passed, earliest first, for at most `time_budget`
+            seconds. Returns the number of keys removed and whether due keys are left over.
+        """
+        start = time.perf_counter()
+        expired = 0
+        for key in self.expires.pop_due(now_ms()):
+            value = self.store.pop(key, None)
+            if value is not None:
+                self._forget(key, value)
+                self._key_removed(key)
+            expired += 1
+            if expired % 32 == 0 and time.perf_counter() - start > time_budget:
+                self.stats["expired_keys"] += expired
+                return expired, True
+        self.stats["expired_keys"] += expired
+        return expired, False
+
+    def snapshot(self):
+        """
+            Take a point-in-time view of the keyspace for background persistence. The keyspace dict
+            is copied shallowly; values shared with the snapshot are copied on their next in-place
+            write (see `lookup_write`). Call `release` on the snapshot when done with it.
+        """
+        snapshot = Snapshot(self)
+        with self._snapshots_lock:
+            self._snapshots += (snapshot,)
+        return snapshot
+
+    def _expire(self, key):
+        self._forget(key, self.store.pop(key))
+        self._key_removed(key)
+        self.expires.remove(key)
+        self.stats["expired_keys"] += 1
+
+    def _key_added(self, key):
+        self.slots.add(key)
+        if self.prefix_index is not None:
+            self.prefix_index.add(key)
+
+    def watch(self, key):
+        """Start watching `key` and return its version, which any change to the key bumps."""
+        entry = self.watched.get(key)
+        if entry is None:
+            entry = self.watched[key] = [0, 0]
+        entry[1] += 1
+        return entry[0]
+
+    def unwatch(self, key):
+        entry = self.watched[key]
+        entry[1] -= 1
+        if not entry[1]:
+            del self.watched[key]
+
+    def version(self, key):
+        """Version of a watched key."""
+        return self.watched[key][0]
+
+    def _touch(self, key):
+        # Bump the version of `key` if it is watched
+        entry = self.watched.get(key)
+        if entry is not None:
+            entry[0] += 1
+
+    def _key_removed(self, key):
+        if self.watched:
+            self._touch(key) # Expired or evicted keys count as changed too
+        self.slots.remove(key)
+        if self.prefix_index is not None:
+            self.prefix_index.remove(key)
+
+    def _count(self, key, value):
+        # Start counting a key that has just been stored
+        if type(value) in STRING_TYPES:
+            size = string_memory(value)
+        else:
+            size = value.accounted = value.memory_usage()
+        self._local.tally.memory[type(value)] += _KEY_HEADER + len(key) + size
+        if self.evictor is not None:
+            self.evictor.added(key)
+
+    def _forget(self, key, value):
+        # Stop counting a key that has been removed from the store or overwritten
+        self._local.tally.memory[type(value)] -= _KEY_HEADER + len(key) + _accounted(value)
+        if self.evictor is not None:
+            self.evictor.removed(key)
+
+    def __len__(self):
+        return len(self.store)
+
+
+class Snapshot:
+    """A point-in-time copy of the keyspace, safe to read from a background thread."""
+
+    def __init__(self, db):
+        self.db = db
+        self.store = db.store.copy()
+        self.deadlines = db.expires.deadlines.copy()
+        self.taken_at = now_ms()
+
+    def __len__(self):
+        return len(self.store)
+
+    def items(self):
+        """Yield (key, value, deadline) for every key that had not expired when the snapshot was taken."""
+        deadlines = self.deadlines
+        taken_at = self.taken_at
+        for key, value in self.store.items():
+            when = deadlines.get(key)
+            if when is not None and when < taken_at:
+                continue
+            yield key, value, when
+
+    def release(self):
+        db = self.db
+        with db._snapshots_lock:
+            db._snapshots = tuple(snapshot for snapshot in db._snapshots if snapshot is not self)
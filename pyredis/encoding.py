@@ -0,0 +1,63 @@
+"""
+    Encodings of stored values, as reported by OBJECT ENCODING, and their estimated sizes.
+
+    A string value that is the canonical decimal form of a 64-bit integer is stored as an int
+    ("int"); any other string is stored as the bytes received. A bytes object keeps its data in
+    the same allocation as its header, which is what Redis' "embstr" encoding is for, so short and
+    long strings only differ in name: "embstr" up to EMBSTR_SIZE_LIMIT bytes, "raw" beyond.
+
+    Integers below SHARED_INTEGERS are shared like the replies in `protocol`: every key holding 42
+    points to the same object, so such a value costs nothing beyond its slot in the keyspace.
+    Containers report their encoding themselves (`encoding` attribute).
+"""
+import sys
+from pyredis.protocol import SHARED_INTEGERS
+
+EMBSTR_SIZE_LIMIT = 44
+LONG_MIN = -(1 << 63)
+LONG_MAX = (1 << 63) - 1
+
+STRING_TYPES = (bytes, int) # Python types a string value may be stored as
+
+_SHARED_INTEGERS = tuple(range(SHARED_INTEGERS))
+_BYTES_HEADER = sys.getsizeof(b"")
+
+
+def shared_integer(value):
+    """Return the shared object for a small integer, or `value` itself."""
+    if 0 <= value < SHARED_INTEGERS:
+        return _SHARED_INTEGERS[value]
+    return value
+
+def encode_string(value):
+    """Return how to store the string `value`: as an int if it spells one canonically, else as is."""
+    if not 0 < len(value) <= 20:
+        return value
+    digits = value[1:] if value[0] == 45 else value # b"-"
+    if not digits.isdigit() or (digits[0] == 48 and len(value) > 1): # No leading zeros, no "-0"
+        return value
+    number = int(value)
+    if not LONG_MIN <= number <= LONG_MAX:
+        return value
+    return shared_integer(number)
+
+def string_bytes(value):
+    """Return a stored string value as bytes."""
+    return value if type(value) is bytes else b"%d" % value
+
+def string_memory(value):
+    """Estimated bytes a stored string value takes up, besides its key."""
+    if type(value) is bytes:
+        return _BYTES_HEADER + len(value)
+    if 0 <= value < SHARED_INTEGERS:
+        return 0
+    return sys.getsizeof(value)
+
+def object_encoding(value):
+    """Return the name of the encoding of a stored value."""
+    kind = type(value)
+    if kind is int:
+        return "int"
+    if kind is bytes:
+        return "embstr" if len(value) <= EMBSTR_SIZE_LIMIT else "raw"
+    return value.encoding
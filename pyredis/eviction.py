@@ -0,0 +1,209 @@
+"""
+    maxmemory: evicting keys once the dataset outgrows a limit.
+
+    The size of the dataset is the estimate kept in `Database.used_memory`. Before a command that
+    may grow it (flagged DENYOOM) runs while the estimate is over the limit, `Evictor.make_room`
+    deletes keys chosen by the policy, or refuses the command with an OOM error under noeviction.
+
+    Like Redis, the LRU and LFU policies are approximated: every key has a 32-bit access clock (LRU)
+    or logarithmic counter (LFU) in a compact array, and eviction picks the best candidates from a
+    few randomly sampled keys, kept in a small pool across rounds. Nothing is reordered on access,
+    so reads stay O(1). volatile-lru samples only the keys with a TTL, from the expiry index, and
+    volatile-ttl evicts the keys closest to expiring, straight from that index.
+"""
+import random, threading, time
+from array import array
+from bisect import insort
+from pyredis.protocol import Error
+
+NOEVICTION = "noeviction"
+ALLKEYS_LRU = "allkeys-lru"
+ALLKEYS_LFU = "allkeys-lfu"
+VOLATILE_LRU = "volatile-lru"
+VOLATILE_TTL = "volatile-ttl"
+MAXMEMORY_POLICIES = (NOEVICTION, ALLKEYS_LRU, ALLKEYS_LFU, VOLATILE_LRU, VOLATILE_TTL)
+
+MAXMEMORY_SAMPLES = 5 # Keys sampled per eviction round
+EVICTION_POOL_SIZE = 16 # Best candidates remembered between rounds
+LFU_INIT_VAL = 5 # Counter of a new key, so it isn't evicted before it had a chance to be used
+LFU_LOG_FACTOR = 10 # Higher values make the counter saturate after more accesses
+LFU_DECAY_TIME = 1 # Minutes for the counter to lose one point
+
+OOM_ERROR = Error("OOM command not allowed when used memory > 'maxmemory'.").encode()
+
+_CLOCK_MASK = 0xFFFFFFFF
+_MINUTES_MASK = 0xFFFF
+
+_UNITS = {"": 1, "b": 1, "k": 1000, "kb": 1024, "m": 1000 ** 2, "mb": 1024 ** 2, "g": 1000 ** 3, "gb": 1024 ** 3}
+
+def parse_memory(text):
+    """Parse a memory size the way redis.conf spells it: 1048576, 100mb, 2gb..."""
+    text = text.strip().lower()
+    digits = text.rstrip("kmgb")
+    unit = text[len(digits):]
+    if not digits.isdigit() or unit not in _UNITS:
+        raise ValueError(f"invalid memory size: {text!r}")
+    return int(digits) * _UNITS[unit]
+
+def _lru_clock():
+    return (time.monotonic_ns() >> 20) & _CLOCK_MASK # Roughly milliseconds
+
+def _lfu_minutes():
+    return int(time.monotonic() // 60) & _MINUTES_MASK
+
+
+class Evictor:
+    """
+        Enforces `maxmemory` on a Database with one of MAXMEMORY_POLICIES.
+
+        For the LRU and LFU policies the keys are kept in a table (`_keys` and `_clocks`, indexed by
+        the position in `_positions`) that supports O(1) insertion, removal and random sampling. An
+        LFU entry packs the minute of its last decay (16 bits) above a logarithmic access counter
+        (8 bits), as Redis does.
+    """
+
+    def __init__(self, maxmemory, policy=NOEVICTION, samples=MAXMEMORY_SAMPLES):
+        if policy not in MAXMEMORY_POLICIES:
+            raise ValueError(f"unknown maxmemory policy: {policy!r}")
+        self.maxmemory = maxmemory
+        self.policy = policy
+        self.samples = samples
+        self.tracks_access = policy in (ALLKEYS_LRU, ALLKEYS_LFU, VOLATILE_LRU)
+        self._lfu = policy == ALLKEYS_LFU
+        self._volatile = policy == VOLATILE_LRU
+        self._positions = {} # Key -> index in _keys and _clocks
+        self._keys = []
+        self._clocks = array("I")
+        self._pool = [] # (score, key) of the best candidates, best last
+        self._lock = threading.Lock() # Commands on different lock stripes update the table together
+
+    def attach(self, db):
+        """Start enforcing the limit on `db`, tracking the keys it already holds."""
+        for key in db.store:
+            self.added(key)
+        db.evictor = self
+
+    def added(self, key):
+        if not self.tracks_access:
+            return
+        with self._lock:
+            self._positions[key] = len(self._keys)
+            self._keys.append(key)
+            self._clocks.append((_lfu_minutes() << 8 | LFU_INIT_VAL) if self._lfu else _lru_clock())
+
+    def removed(self, key):
+        if not self.tracks_access:
+            return
+        with self._lock:
+            position = self._positions.pop(key, None)
+            if position is None:
+                return
+            # Move the last entry into the hole
+            last_key = self._keys.pop()
+            last_clock = self._clocks.pop()
+            if position < len(self._keys):
+                self._keys[position] = last_key
+                self._clocks[position] = last_clock
+                self._positions[last_key] = position
+
+    def touch(self, key):
+        """Record an access to `key`."""
+        if not self.tracks_access:
+            return
+        with self._lock:
+            position = self._positions.get(key)
+            if position is None:
+                return
+            if self._lfu:
+                self._clocks[position] = self._lfu_increment(self._clocks[position])
+            else:
+                self._clocks[position] = _lru_clock()
+
+    def _lfu_increment(self, entry):
+        minutes = _lfu_minutes()
+        counter = self._lfu_decayed(entry, minutes)
+        if counter < 255:
+            base = counter - LFU_INIT_VAL
+            if base <= 0 or random.random() * (base * LFU_LOG_FACTOR + 1) < 1.0:
+                counter += 1
+        return minutes << 8 | counter
+
+    def _lfu_decayed(self, entry, minutes):
+        elapsed = (minutes - (entry >> 8)) & _MINUTES_MASK
+        counter = entry & 0xFF
+        return counter if not elapsed else max(counter - elapsed // LFU_DECAY_TIME, 0)
+
+    def over_limit(self, db):
+        return db.used_memory > self.maxmemory
+
+    def make_room(self, db):
+        """
+            Called before a command that may grow the dataset: evict keys until the dataset fits in
+            `maxmemory` again. Returns False if it doesn't fit and nothing more can be evicted.
+        """
+        if db.used_memory <= self.maxmemory:
+            return True
+        if self.policy == NOEVICTION:
+            return False
+        start = time.perf_counter_ns()
+        evicted = 0
+        fits = True
+        while db.used_memory > self.maxmemory:
+            key = self._candidate(db)
+            if key is None:
+                fits = False
+                break
+            db.delete(key)
+            db.propagate([b"DEL", key])
+            evicted += 1
+        db.stats["evicted_keys"] += evicted
+        db.stats["eviction_usec"] += (time.perf_counter_ns() - start) // 1000
+        return fits
+
+    def _candidate(self, db):
+        # The next key to evict, or None if there is none
+        if self.policy == VOLATILE_TTL:
+            return db.expires.earliest()
+        if self._volatile and not db.expires:
+            return None
+        pool = self._pool
+        for _ in range(EVICTION_POOL_SIZE): # Samples may all hit stale keys, sample again
+            self._fill_pool(db)
+            while pool:
+                _, key = pool.pop()
+                if key in db.store and (not self._volatile or key in db.expires):
+                    return key
+        # Unlucky sampling under volatile-lru: fall back on any key with a TTL rather than refuse
+        return db.expires.earliest() if self._volatile else None
+
+    def _fill_pool(self, db):
+        # Score a few random keys and keep the best candidates seen so far
+        pool = self._pool
+        sampled = db.expires.sample(self.samples) if self._volatile else None
+        with self._lock:
+            keys = self._keys
+            if not keys:
+                return
+            now = _lfu_minutes() if self._lfu else _lru_clock()
+            for i in range(self.samples):
+                if sampled is None:
+                    position = random.randrange(len(keys))
+                    key = keys[position]
+                elif i < len(sampled):
+                    key = sampled[i]
+                    position = self._positions.get(key)
+                    if position is None:
+                        continue
+                else:
+                    break
+                if self._lfu:
+                    score = 255 - self._lfu_decayed(self._clocks[position], now)
+                else:
+                    score = (now - self._clocks[position]) & _CLOCK_MASK # Idle time
+                if any(candidate == key for _, candidate in pool):
+                    continue
+                if len(pool) == EVICTION_POOL_SIZE:
+                    if score <= pool[0][0]:
+                        continue
+                    del pool[0]
+                insort(pool, (score, key))
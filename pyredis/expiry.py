@@ -0,0 +1,85 @@
+import heapq, random, threading, time
+
+
+def now_ms():
+    """Current Unix time in milliseconds, the unit every expiry deadline is stored in."""
+    return time.time_ns() // 1_000_000
+
+
+class ExpiryIndex:
+    """
+        Deadlines for the keys that have a TTL.
+
+        `deadlines` maps a key to its absolute expiry time in milliseconds and is the source of
+        truth. A min-heap of (deadline, key) pairs orders the same keys by deadline so that active
+        expiry only touches keys that are actually due. Changing or removing a deadline leaves the
+        old heap entry behind; stale entries are skipped when popped, and the heap is rebuilt from
+        `deadlines` once they outnumber the live ones.
+
+        Commands holding different lock stripes may set deadlines at the same time, so pushes to the
+        heap are serialised; popping only happens while every stripe is held.
+    """
+
+    def __init__(self):
+        self.deadlines = {}
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, key):
+        return key in self.deadlines
+
+    def get(self, key):
+        return self.deadlines.get(key)
+
+    def set(self, key, when):
+        with self._lock:
+            self.deadlines[key] = when
+            heapq.heappush(self._heap, (when, key))
+            if len(self._heap) > 2 * len(self.deadlines) + 64:
+                self._rebuild()
+
+    def remove(self, key):
+        """Forget the deadline of `key`, returning True if it had one."""
+        return self.deadlines.pop(key, None) is not None
+
+    def clear(self):
+        self.deadlines.clear()
+        self._heap.clear()
+
+    def earliest(self):
+        """Return the key with the earliest deadline, or None if no key has one."""
+        heap = self._heap
+        deadlines = self.deadlines
+        while heap:
+            when, key = heap[0]
+            if deadlines.get(key) == when:
+                return key
+            heapq.heappop(heap)
+        return None
+
+    def sample(self, count):
+        """Return up to `count` keys with a deadline, picked at random from the heap in O(count)."""
+        deadlines = self.deadlines
+        with self._lock:
+            heap = self._heap
+            if not heap:
+                return []
+            picks = [heap[random.randrange(len(heap))] for _ in range(count)]
+        return [key for when, key in picks if deadlines.get(key) == when] # Skip stale entries
+
+    def pop_due(self, now):
+        """Yield and forget the keys whose deadline is before `now`, earliest first."""
+        heap = self._heap
+        deadlines = self.deadlines
+        while heap and heap[0][0] < now:
+            when, key = heapq.heappop(heap)
+            if deadlines.get(key) == when:
+                del deadlines[key]
+                yield key
+
+    def _rebuild(self):
+        self._heap = [(when, key) for key, when in self.deadlines.items()]
+        heapq.heapify(self._heap)
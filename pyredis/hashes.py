@@ -0,0 +1,176 @@
+import sys
+from pyredis.scanindex import ScanIndex
+
+HASH_MAX_LISTPACK_ENTRIES = 128 # Most fields a hash keeps in the compact encoding...
+HASH_MAX_LISTPACK_VALUE = 64 # ...as long as no field or value is longer than this
+
+# Estimated footprint of the parts of a hash, see `memory_usage`
+_HASH_HEADER = 64 # The Hash object
+_STRING_HEADER = sys.getsizeof(b"") # A field's or value's bytes object
+
+
+class Hash:
+    """
+        The hash type, in one of two encodings:
+
+        listpack  - a flat Python list [field, value, field, value, ...]. Looking a field up is a
+                    linear scan, done by `list.index` in C, which beats hashing for a few dozen
+                    fields and saves the dict's table.
+        hashtable - a dict, once the hash has more than HASH_MAX_LISTPACK_ENTRIES fields or holds a
+                    field or value longer than HASH_MAX_LISTPACK_VALUE bytes. A hash never goes back
+                    to the listpack encoding, like in Redis.
+
+        Fields and values are bytes. The total length of the fields and values is kept up to date,
+        so `memory_usage` is O(1). `accounted` is the footprint the keyspace last counted for the
+        hash (see `Database.modified`). HSCAN walks a hashtable through a ScanIndex, built on the
+        first scan.
+    """
+
+    __slots__ = ("_entries", "_bytes", "_scan", "accounted")
+
+    def __init__(self, pairs=()):
+        self._entries = []
+        self._bytes = 0
+        self._scan = None # ScanIndex of a hashtable's fields, once it has been scanned
+        self.accounted = 0
+        for field, value in pairs:
+            self.set(field, value)
+
+    @property
+    def encoding(self):
+        return "listpack" if type(self._entries) is list else "hashtable"
+
+    def __len__(self):
+        entries = self._entries
+        return len(entries) // 2 if type(entries) is list else len(entries)
+
+    def __contains__(self, field):
+        entries = self._entries
+        if type(entries) is list:
+            return _find(entries, field) >= 0
+        return field in entries
+
+    def __eq__(self, other):
+        if isinstance(other, Hash):
+            return len(self) == len(other) and all(other.get(field) == value for field, value in self.items())
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Hash({dict(self.items())!r})"
+
+    def copy(self):
+        clone = Hash()
+        clone._entries = self._entries.copy()
+        clone._bytes = self._bytes
+        clone.accounted = self.accounted
+        return clone
+
+    def memory_usage(self):
+        """Estimated number of bytes the hash takes up."""
+        entries = self._entries
+        strings = len(entries) if type(entries) is list else 2 * len(entries)
+        return _HASH_HEADER + sys.getsizeof(entries) + strings * _STRING_HEADER + self._bytes
+
+    def get(self, field):
+        """Return the value of `field`, or None if there is no such field."""
+        entries = self._entries
+        if type(entries) is list:
+            position = _find(entries, field)
+            return entries[position + 1] if position >= 0 else None
+        return entries.get(field)
+
+    def set(self, field, value):
+        """Set `field` to `value`, returning True if the field is new."""
+        entries = self._entries
+        if type(entries) is list:
+            position = _find(entries, field)
+            if position >= 0:
+                old = entries[position + 1]
+                if len(value) > HASH_MAX_LISTPACK_VALUE:
+                    entries = self._convert()
+                else:
+                    entries[position + 1] = value
+                    self._bytes += len(value) - len(old)
+                    return False
+            elif (len(entries) >= 2 * HASH_MAX_LISTPACK_ENTRIES or len(field) > HASH_MAX_LISTPACK_VALUE
+                    or len(value) > HASH_MAX_LISTPACK_VALUE):
+                entries = self._convert()
+            else:
+                entries += (field, value)
+                self._bytes += len(field) + len(value)
+                return True
+
+        old = entries.get(field)
+        entries[field] = value
+        if old is None:
+            self._bytes += len(field) + len(value)
+            if self._scan is not None:
+                self._scan.add(field)
+            return True
+        self._bytes += len(value) - len(old)
+        return False
+
+    def delete(self, field):
+        """Remove `field`, returning True if it existed."""
+        entries = self._entries
+        if type(entries) is list:
+            position = _find(entries, field)
+            if position < 0:
+                return False
+            value = entries[position + 1]
+            del entries[position:position + 2]
+        else:
+            value = entries.pop(field, None)
+            if value is None:
+                return False
+            if self._scan is not None:
+                self._scan.remove(field)
+        self._bytes -= len(field) + len(value)
+        return True
+
+    def items(self):
+        """Iterate over (field, value) pairs, in insertion order."""
+        entries = self._entries
+        if type(entries) is list:
+            return zip(entries[::2], entries[1::2])
+        return entries.items()
+
+    def scan(self, cursor, count):
+        """
+            Return the cursor to continue from (0 once done) and about `count` (field, value) pairs
+            from `cursor` on. A listpack is small and returned whole.
+        """
+        entries = self._entries
+        if type(entries) is list:
+            return 0, list(self.items())
+        if self._scan is None:
+            self._scan = ScanIndex(entries)
+        cursor, found = self._scan.scan(cursor, count)
+        return cursor, [(field, entries[field]) for field in found]
+
+    def fields(self):
+        entries = self._entries
+        return entries[::2] if type(entries) is list else entries.keys()
+
+    def values(self):
+        entries = self._entries
+        return entries[1::2] if type(entries) is list else entries.values()
+
+    def _convert(self):
+        # Switch to the hashtable encoding
+        entries = self._entries
+        self._entries = dict(zip(entries[::2], entries[1::2]))
+        return self._entries
+
+
+def _find(entries, field):
+    # Position of `field` in a listpack, or -1. Values may be equal to the field, so skip those.
+    position = 0
+    try:
+        while True:
+            position = entries.index(field, position)
+            if not position & 1:
+                return position
+            position += 1
+    except ValueError:
+        return -1
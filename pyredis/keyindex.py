@@ -0,0 +1,157 @@
+"""
+    Indexes over the keys of the keyspace, kept up to date by `Database` as keys come and go.
+
+    A Python dict can't be iterated while it changes and doesn't expose its buckets, so SCAN can't
+    walk the keyspace dict itself the way Redis walks its hash table. Instead every key is filed
+    under its hash slot (`SlotIndex`), the CRC16 slot Redis Cluster uses: a key never changes
+    slot, so a cursor naming the next slot to visit stays valid whatever is added or removed in
+    between. `PrefixIndex` optionally keeps the keys sorted too, so KEYS with a pattern that starts
+    with a literal prefix only visits the keys sharing it.
+"""
+import threading
+from binascii import crc_hqx
+from bisect import bisect_left, bisect_right, insort
+
+SLOTS = 16384
+PREFIX_INDEX_CHUNK = 512 # Keys per sorted chunk of a PrefixIndex; chunks split at twice this
+
+
+def key_slot(key):
+    """Hash slot of `key`: CRC16 (XMODEM) of the key, or of its {hashtag} if it has a non-empty one."""
+    start = key.find(b"{")
+    if start >= 0:
+        end = key.find(b"}", start + 1)
+        if end > start + 1:
+            key = key[start + 1:end]
+    return crc_hqx(key, 0) & (SLOTS - 1)
+
+
+class SlotIndex:
+    """
+        The keys of each hash slot. A slot's set is created when it first gets a key and kept once
+        empty. Adding and removing a key is a single set operation, atomic on its own, so only
+        creating a slot's set takes the lock; `scan` and `keys` run with the whole keyspace locked
+        (they are keyless commands, see server_using_multithreading) and see no concurrent change.
+    """
+
+    def __init__(self):
+        self._slots = [None] * SLOTS
+        self._lock = threading.Lock() # Commands on different lock stripes may create the same slot
+
+    def add(self, key):
+        slot = key_slot(key)
+        keys = self._slots[slot]
+        if keys is None:
+            with self._lock:
+                keys = self._slots[slot]
+                if keys is None:
+                    keys = self._slots[slot] = set()
+        keys.add(key)
+
+    def remove(self, key):
+        keys = self._slots[key_slot(key)]
+        if keys is not None:
+            keys.discard(key)
+
+    def count(self, slot):
+        """Number of keys in `slot`."""
+        keys = self._slots[slot]
+        return 0 if keys is None else len(keys)
+
+    def keys(self, slot):
+        """Return a list of the keys in `slot`."""
+        keys = self._slots[slot]
+        return [] if keys is None else list(keys)
+
+    def scan(self, cursor, count):
+        """
+            Return the keys of the slots from `cursor` on, stopping after the slot that brings them
+            to at least `count`, and the cursor to continue from: 0 once every slot has been
+            visited. Each slot is returned whole, so a key that is in the index during a whole
+            iteration is returned exactly once.
+        """
+        found = []
+        slots = self._slots
+        while len(found) < count and cursor < SLOTS:
+            keys = slots[cursor]
+            if keys:
+                found += keys
+            cursor += 1
+        return (0 if cursor >= SLOTS else cursor), found
+
+
+class PrefixIndex:
+    """
+        All the keys in sorted order, for `--prefix-index`. The keys are split into sorted chunks of
+        up to 2 * PREFIX_INDEX_CHUNK, with the last key of each chunk in `_maxes`, so adding or
+        removing a key bisects twice and moves at most one chunk's worth of pointers, instead of
+        shifting a list as long as the keyspace.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._maxes = []
+        self._lock = threading.Lock()
+
+    def attach(self, db):
+        """Start indexing the keys of `db`, with those it already holds."""
+        for key in db.store:
+            self.add(key)
+        db.prefix_index = self
+
+    def __len__(self):
+        return sum(map(len, self._chunks))
+
+    def add(self, key):
+        with self._lock:
+            chunks, maxes = self._chunks, self._maxes
+            if not chunks:
+                chunks.append([key])
+                maxes.append(key)
+                return
+            i = min(bisect_left(maxes, key), len(maxes) - 1)
+            chunk = chunks[i]
+            insort(chunk, key)
+            maxes[i] = chunk[-1]
+            if len(chunk) > 2 * PREFIX_INDEX_CHUNK:
+                chunks[i:i + 1] = chunk[:PREFIX_INDEX_CHUNK], chunk[PREFIX_INDEX_CHUNK:]
+                maxes[i:i + 1] = chunk[PREFIX_INDEX_CHUNK - 1], chunk[-1]
+
+    def remove(self, key):
+        with self._lock:
+            chunks, maxes = self._chunks, self._maxes
+            i = bisect_left(maxes, key)
+            if i == len(maxes):
+                return
+            chunk = chunks[i]
+            j = bisect_left(chunk, key)
+            if j == len(chunk) or chunk[j] != key:
+                return
+            del chunk[j]
+            if chunk:
+                maxes[i] = chunk[-1]
+            else:
+                del chunks[i], maxes[i]
+
+    def range(self, prefix, after=None, count=None):
+        """
+            Return up to `count` (all if None) keys starting with `prefix` in ascending order,
+            beginning after the key `after` if given. Resuming from the last key returned keeps its
+            place however the index changed in between.
+        """
+        if after is not None and after >= prefix:
+            start, locate = after, bisect_right
+        else:
+            start, locate = prefix, bisect_left
+        found = []
+        with self._lock:
+            chunks = self._chunks
+            i = bisect_left(self._maxes, start)
+            j = locate(chunks[i], start) if i < len(chunks) else 0
+            while i < len(chunks):
+                for key in chunks[i][j:]:
+                    if not key.startswith(prefix) or len(found) == count:
+                        return found
+                    found.append(key)
+                i, j = i + 1, 0
+        return found
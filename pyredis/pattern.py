@@ -0,0 +1,88 @@
+"""
+    Glob-style patterns, as used by KEYS, SCAN and friends:
+
+        *        any run of bytes          ?        any single byte
+        [abc]    one of the listed bytes   [^abc]   any byte but those listed
+        [a-z]    a byte in the range       \\x       the byte x itself
+
+    A pattern is translated into a compiled regular expression once, so matching many keys costs
+    one C call each.
+"""
+import re
+from functools import lru_cache
+
+_SPECIAL = frozenset(b"*?[\\")
+
+
+@lru_cache(maxsize=256)
+def compile_pattern(pattern):
+    """Return a function telling whether a bytes string matches the glob `pattern`."""
+    if pattern == b"*":
+        return lambda string: True
+    if not _SPECIAL.intersection(pattern):
+        return pattern.__eq__
+    return re.compile(_translate(pattern), re.DOTALL).fullmatch
+
+def literal_prefix(pattern):
+    """Return the bytes every string matching the glob `pattern` starts with (maybe b"")."""
+    prefix = bytearray()
+    i, length = 0, len(pattern)
+    while i < length:
+        byte = pattern[i]
+        if byte == 92 and i + 1 < length: # b"\\"
+            prefix.append(pattern[i + 1])
+            i += 2
+        elif byte in _SPECIAL:
+            break
+        else:
+            prefix.append(byte)
+            i += 1
+    return bytes(prefix)
+
+def _translate(pattern):
+    parts = []
+    i, length = 0, len(pattern)
+    while i < length:
+        byte = pattern[i]
+        i += 1
+        if byte == 42: # b"*"
+            if not parts or parts[-1] != b".*": # Runs of * match like one
+                parts.append(b".*")
+        elif byte == 63: # b"?"
+            parts.append(b".")
+        elif byte == 92 and i < length: # b"\\"
+            parts.append(re.escape(pattern[i:i + 1]))
+            i += 1
+        elif byte == 91: # b"["
+            i = _translate_class(pattern, i, parts)
+        else:
+            parts.append(re.escape(bytes((byte,))))
+    return b"".join(parts)
+
+def _translate_class(pattern, i, parts):
+    # Translate a [...] class starting after the "[", returning where the pattern continues
+    length = len(pattern)
+    negate = i < length and pattern[i] == 94 # b"^"
+    if negate:
+        i += 1
+    members = []
+    while i < length and pattern[i] != 93: # b"]"
+        byte = pattern[i]
+        if byte == 92 and i + 1 < length: # b"\\"
+            i += 1
+            byte = pattern[i]
+        if i + 2 < length and pattern[i + 1] == 45 and pattern[i + 2] != 93: # b"-", a range
+            low, high = sorted((byte, pattern[i + 2]))
+            members.append(re.escape(bytes((low,))) + b"-" + re.escape(bytes((high,))))
+            i += 3
+        else:
+            members.append(re.escape(bytes((byte,))))
+            i += 1
+    # An unterminated class runs to the end of the pattern, like in Redis
+    if members:
+        parts.append(b"[" + (b"^" if negate else b"") + b"".join(members) + b"]")
+    elif negate:
+        parts.append(b".")
+    else:
+        parts.append(b"(?!)") # [] matches nothing
+    return i + 1
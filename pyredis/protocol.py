@@ -1,13 +1,42 @@
 from dataclasses import dataclass
 from typing import List, Union
 
+# Replies shared by every command instead of being encoded per call
+OK = b"+OK\r\n"
+PONG = b"+PONG\r\n"
+QUEUED = b"+QUEUED\r\n"
+NULL_BULK = b"$-1\r\n"
+NULL_ARRAY = b"*-1\r\n"
+EMPTY_ARRAY = b"*0\r\n"
+SHARED_INTEGERS = 10000 # Integer replies below this are pre-encoded
+BULK_HEADER_CACHE = 1024 # Bulk string headers for lengths below this are pre-encoded
+
+_INTEGER_REPLIES = [b":%d\r\n" % i for i in range(SHARED_INTEGERS)]
+_BULK_HEADERS = [b"$%d\r\n" % i for i in range(BULK_HEADER_CACHE)]
+
+
+def encode_integer(value):
+    """Encode an integer reply, using the shared encoding for small non-negative values."""
+    if 0 <= value < SHARED_INTEGERS:
+        return _INTEGER_REPLIES[value]
+    return b":%d\r\n" % value
+
+def encode_bulk(data):
+    """Encode bytes as a bulk string reply, straight from the buffer they are stored in."""
+    length = len(data)
+    if length < BULK_HEADER_CACHE:
+        return _BULK_HEADERS[length] + data + b"\r\n"
+    return b"".join((b"$%d\r\n" % length, data, b"\r\n")) # Copy a large value only once
 
 @dataclass
 class SimpleString:
-    data: str
+    data: Union[str, bytes]
 
     def encode(self):
-        return f"+{self.data}\r\n".encode()
+        data = self.data
+        if type(data) is str:
+            data = data.encode()
+        return b"+" + data + b"\r\n"
 
 @dataclass
 class Error:
@@ -18,76 +47,281 @@ class Error:
 
 @dataclass
 class BulkString:
-    data: str
+    data: Union[str, bytes, None]
     
     def encode(self):
-        if self.data is None: # Null Bulk String
-            return b"$-1\r\n"
-        else:
-            # Non-null Bulk String
-            encoded_data = self.data.encode()
-            length = len(encoded_data)
-            return f"${length}\r\n".encode() + encoded_data + b"\r\n"
+        data = self.data
+        if data is None: # Null Bulk String
+            return NULL_BULK
+        if type(data) is str:
+            data = data.encode()
+        return encode_bulk(data)
 
 @dataclass
 class Integer:
     data: int
     
     def encode(self):
-        return f":{self.data}\r\n".encode()
+        return encode_integer(self.data)
 
 @dataclass
 class Array:
     elements: List[Union[SimpleString, Error, BulkString, Integer]]
     
     def encode(self):
-        parts = [f"*{len(self.elements)}\r\n".encode()]
+        if self.elements is None: # Null Array
+            return NULL_ARRAY
+        parts = [b"*%d\r\n" % len(self.elements)]
         for element in self.elements:
             parts.append(element.encode())
         return b"".join(parts)
 
+def encode_command(args):
+    """Encode a command as a RESP array of bulk strings, the form used for requests and the AOF."""
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        parts.append(encode_bulk(arg.encode() if type(arg) is str else arg))
+    return b"".join(parts)
+
+def encode_array(values, count):
+    """Encode `count` bytes values from the iterable `values` as an array of bulk strings."""
+    parts = [b"*%d\r\n" % count]
+    parts += map(encode_bulk, values)
+    return b"".join(parts)
+
+def reply_end(buffer, offset=0):
+    """
+        Return the offset just past the encoded reply starting at `offset`, or -1 if the buffer
+        does not hold all of it yet. Nothing is decoded, so replies can be passed on as raw bytes.
+    """
+    pending = 1 # Values still to skip, nested array elements included
+    while pending:
+        end = buffer.find(b"\r\n", offset)
+        if end == -1:
+            return -1
+        kind = buffer[offset]
+        if kind == 36: # b"$"
+            length = int(buffer[offset + 1:end])
+            offset = end + 2 if length < 0 else end + length + 4
+            if offset > len(buffer):
+                return -1
+        elif kind == 42: # b"*"
+            count = int(buffer[offset + 1:end])
+            offset = end + 2
+            if count > 0:
+                pending += count
+        else:
+            offset = end + 2
+        pending -= 1
+    return offset
+
+def split_array(reply):
+    """Split an encoded array reply into the raw encodings of its elements."""
+    offset = reply.find(b"\r\n") + 2
+    elements = []
+    for _ in range(int(reply[1:offset - 2])):
+        end = reply_end(reply, offset)
+        elements.append(reply[offset:end])
+        offset = end
+    return elements
+
 def parse_frame(buffer):
-    end = buffer.find(b"\r\n")
+    return _parse_frame_at(buffer, 0)
+
+def _parse_frame_at(buffer, offset):
+    """Parse one frame starting at `offset`, returning the frame and the offset just past it.
+    Nested elements are parsed in place, so the buffer is never sliced per element."""
+    if offset >= len(buffer):
+        return None, 0
+
+    end = buffer.find(b"\r\n", offset)
     if end == -1:
         return None, 0
 
-    match chr(buffer[0]):
+    match chr(buffer[offset]):
         case '+':
             # SimpleString
-            return SimpleString(data=buffer[1:end].decode('ascii')), end + 2
+            return SimpleString(data=buffer[offset + 1:end].decode('ascii')), end + 2
 
         case '-':
             # Error
-            return Error(message=buffer[1:end].decode('ascii')), end + 2
+            return Error(message=buffer[offset + 1:end].decode('ascii')), end + 2
 
         case '$':
             # BulkString
-            expected_length = int(buffer[1:end].decode('ascii'))
-            size = end + expected_length + 2 + 2
+            expected_length = int(buffer[offset + 1:end])
+            size = end + 2 + expected_length + 2
 
             if len(buffer) >= size:
-                message = buffer[end + 2:end + 2 + expected_length].decode('ascii')
-                return BulkString(data=message), size
+                return BulkString(data=bytes(buffer[end + 2:end + 2 + expected_length])), size
 
         case ':':
             # Integer
-            return Integer(data=int(buffer[1:end].decode('ascii'))), end + 2
-        
+            return Integer(data=int(buffer[offset + 1:end])), end + 2
+
         case '*':
             # Array
-            num_elements = int(buffer[1:end].decode('ascii'))
+            num_elements = int(buffer[offset + 1:end])
             if num_elements == -1: # Null array
                 return Array(elements=None), end + 2
-            
+
             elements = []
             cursor = end + 2
             for _ in range(num_elements):
-                element, consumed = parse_frame(buffer[cursor:])
+                element, cursor = _parse_frame_at(buffer, cursor)
                 if element is None:
                     return None, 0
                 elements.append(element)
-                cursor += consumed
 
             return Array(elements=elements), cursor
 
-    return None, 0
\ No newline at end of file
+    return None, 0
+
+
+class ProtocolError(Exception):
+    """Raised when a client sends bytes that can never form a valid request."""
+
+
+# Limits mirror the ones Redis applies to client requests
+MAX_INLINE_SIZE = 64 * 1024
+MAX_MULTIBULK_LENGTH = 1024 * 1024
+MAX_BULK_LENGTH = 512 * 1024 * 1024
+
+class RespParser:
+    """
+        Incremental parser for client requests.
+
+        Bytes are appended to a single bytearray with `feed` and consumed by advancing a read
+        offset, so a command is never copied more than once (into its argument bytes). When a
+        command is only partially received, the parser remembers how far it got - the arguments
+        already read and the length of the pending bulk string - and resumes from there on the
+        next `feed` instead of re-scanning the frame.
+
+        Each complete command is produced as a flat list of argument bytes, e.g.
+        [b"SET", b"key", b"value"]. Inline commands ("PING\\r\\n") are accepted as well.
+
+        The parser can also read straight out of an existing buffer such as an mmap, starting at
+        `offset`, without copying it; `feed` can't be used in that mode.
+    """
+
+    def __init__(self, buffer=None, offset=0):
+        self._fixed = buffer is not None
+        self._buffer = buffer if self._fixed else bytearray()
+        self._pos = offset
+        self._args = None      # Arguments collected for the multibulk in progress
+        self._remaining = 0    # Arguments still expected for the multibulk in progress
+        self._bulk_len = -1    # Length of the bulk string being waited for, -1 if none
+
+    def feed(self, data):
+        """Append data received from the network."""
+        if self._fixed:
+            raise TypeError("Can't feed a parser that reads from a fixed buffer")
+        self._buffer += data
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        command = self.get_command()
+        if command is None:
+            raise StopIteration
+        return command
+
+    @property
+    def pending(self):
+        """Number of buffered bytes that have not been consumed yet."""
+        return len(self._buffer) - self._pos
+
+    @property
+    def offset(self):
+        """
+            Read offset in the buffer. Right after a command is returned this is where the next one
+            starts; with a fixed buffer it is an absolute position.
+        """
+        return self._pos
+
+    def get_command(self):
+        """Return the next complete command, or None if more data is needed."""
+        buffer = self._buffer
+        while self._args is None:
+            if self._pos >= len(buffer):
+                self._compact()
+                return None
+            if buffer[self._pos] != 42: # b"*"
+                command = self._parse_inline()
+                if command is None:
+                    self._compact()
+                    return None
+                if command:
+                    return command
+                continue # Blank lines are ignored
+
+            end = buffer.find(b"\r\n", self._pos)
+            if end == -1:
+                if len(buffer) - self._pos > MAX_INLINE_SIZE:
+                    raise ProtocolError("Protocol error: too big mbulk count string")
+                self._compact()
+                return None
+            try:
+                count = int(buffer[self._pos + 1:end])
+            except ValueError:
+                raise ProtocolError("Protocol error: invalid multibulk length") from None
+            if count > MAX_MULTIBULK_LENGTH:
+                raise ProtocolError("Protocol error: invalid multibulk length")
+            self._pos = end + 2
+            if count > 0: # Empty or null arrays are skipped, like Redis does
+                self._args = []
+                self._remaining = count
+
+        # Work on locals in the bulk loop, this is the hot path when loading an AOF
+        args, pos, remaining, bulk_len = self._args, self._pos, self._remaining, self._bulk_len
+        size = len(buffer)
+        while remaining:
+            if bulk_len == -1:
+                end = buffer.find(b"\r\n", pos)
+                if end == -1:
+                    self._pos, self._remaining, self._bulk_len = pos, remaining, -1
+                    if size - pos > MAX_INLINE_SIZE:
+                        raise ProtocolError("Protocol error: too big bulk count string")
+                    self._compact()
+                    return None
+                if buffer[pos] != 36: # b"$"
+                    self._pos = pos
+                    raise ProtocolError(f"Protocol error: expected '$', got '{chr(buffer[pos])}'")
+                try:
+                    bulk_len = int(buffer[pos + 1:end])
+                except ValueError:
+                    raise ProtocolError("Protocol error: invalid bulk length") from None
+                if bulk_len < 0 or bulk_len > MAX_BULK_LENGTH:
+                    raise ProtocolError("Protocol error: invalid bulk length")
+                pos = end + 2
+
+            end = pos + bulk_len
+            if size < end + 2:
+                self._pos, self._remaining, self._bulk_len = pos, remaining, bulk_len
+                self._compact()
+                return None
+            args.append(bytes(buffer[pos:end]))
+            pos = end + 2
+            bulk_len = -1
+            remaining -= 1
+
+        self._pos, self._remaining, self._bulk_len = pos, 0, -1
+        self._args = None
+        return args
+
+    def _parse_inline(self):
+        end = self._buffer.find(b"\n", self._pos)
+        if end == -1:
+            if len(self._buffer) - self._pos > MAX_INLINE_SIZE:
+                raise ProtocolError("Protocol error: too big inline request")
+            return None
+        line = self._buffer[self._pos:end]
+        self._pos = end + 1
+        return [bytes(arg) for arg in line.split()]
+
+    def _compact(self):
+        # Drop consumed bytes; deleting a bytearray prefix is O(1) amortised in CPython
+        if self._pos and not self._fixed:
+            del self._buffer[:self._pos]
+            self._pos = 0
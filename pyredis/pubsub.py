@@ -0,0 +1,167 @@
+"""
+    Publish/subscribe: channels and glob-style channel patterns.
+
+    A published message is encoded once per channel (and once per matching pattern, since a
+    pmessage names the pattern) and the same bytes object is written to every subscriber's
+    transport, so fanning out to 10k subscribers costs 10k `write` calls and no encoding. Writes
+    never wait: a subscriber that doesn't read its messages has them pile up in its transport
+    buffer, and is disconnected once that buffer passes the output buffer limits, like Redis'
+    `client-output-buffer-limit pubsub`.
+
+    Patterns are compiled once (see pattern.compile_pattern), and the patterns matching a channel
+    are remembered until the set of patterns changes, so publishing to the same channels again
+    doesn't match every pattern anew.
+"""
+import time
+from pyredis.protocol import encode_bulk
+from pyredis.pattern import compile_pattern
+
+PUBSUB_OUTPUT_BUFFER_HARD_LIMIT = 32 * 1024 * 1024 # Bytes: disconnect right away past this...
+PUBSUB_OUTPUT_BUFFER_SOFT_LIMIT = 8 * 1024 * 1024 # ...or after staying past this...
+PUBSUB_OUTPUT_BUFFER_SOFT_SECONDS = 60 # ...for this long
+PATTERN_MATCH_CACHE = 1024 # Channels whose matching patterns are remembered
+
+_MESSAGE = b"*3\r\n$7\r\nmessage\r\n"
+_PMESSAGE = b"*4\r\n$8\r\npmessage\r\n"
+
+
+class Subscriber:
+    """
+        The subscriptions of a client in pub/sub mode, and the transport its messages are written
+        to. `soft_limit_since` is when its output buffer went past the soft limit, None while it
+        is under it.
+    """
+
+    __slots__ = ("transport", "channels", "patterns", "soft_limit_since")
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.channels = set()
+        self.patterns = set()
+        self.soft_limit_since = None
+
+    def __len__(self):
+        return len(self.channels) + len(self.patterns)
+
+    def over_limit(self):
+        """Whether the messages waiting in the output buffer are over the limits."""
+        size = self.transport.get_write_buffer_size()
+        if size <= PUBSUB_OUTPUT_BUFFER_SOFT_LIMIT:
+            self.soft_limit_since = None
+            return False
+        if size > PUBSUB_OUTPUT_BUFFER_HARD_LIMIT:
+            return True
+        now = time.monotonic()
+        if self.soft_limit_since is None:
+            self.soft_limit_since = now
+        return now - self.soft_limit_since >= PUBSUB_OUTPUT_BUFFER_SOFT_SECONDS
+
+
+class PubSub:
+    """
+        The subscribers of each channel and pattern. Subscribers are kept in dicts used as ordered
+        sets, so they receive messages in the order they subscribed.
+    """
+
+    def __init__(self):
+        self.channels = {} # Channel -> {Subscriber: None}
+        self.patterns = {} # Pattern -> (matching function, {Subscriber: None})
+        self.disconnections = 0 # Subscribers dropped for going over the output buffer limits
+        self._matches = {} # Channel -> the patterns matching it, see `_matching`
+
+    def subscribe(self, subscriber, channel):
+        """Subscribe to `channel`, returning False if already subscribed."""
+        if channel in subscriber.channels:
+            return False
+        subscriber.channels.add(channel)
+        self.channels.setdefault(channel, {})[subscriber] = None
+        return True
+
+    def unsubscribe(self, subscriber, channel):
+        """Unsubscribe from `channel`, returning False if not subscribed."""
+        if channel not in subscriber.channels:
+            return False
+        subscriber.channels.discard(channel)
+        subscribers = self.channels[channel]
+        del subscribers[subscriber]
+        if not subscribers:
+            del self.channels[channel]
+        return True
+
+    def psubscribe(self, subscriber, pattern):
+        """Subscribe to the channels matching `pattern`, returning False if already subscribed."""
+        if pattern in subscriber.patterns:
+            return False
+        subscriber.patterns.add(pattern)
+        entry = self.patterns.get(pattern)
+        if entry is None:
+            entry = self.patterns[pattern] = (compile_pattern(pattern), {})
+            self._matches.clear()
+        entry[1][subscriber] = None
+        return True
+
+    def punsubscribe(self, subscriber, pattern):
+        """Unsubscribe from `pattern`, returning False if not subscribed."""
+        if pattern not in subscriber.patterns:
+            return False
+        subscriber.patterns.discard(pattern)
+        subscribers = self.patterns[pattern][1]
+        del subscribers[subscriber]
+        if not subscribers:
+            del self.patterns[pattern]
+            self._matches.clear()
+        return True
+
+    def disconnect(self, subscriber):
+        """Drop every subscription of `subscriber`."""
+        for channel in list(subscriber.channels):
+            self.unsubscribe(subscriber, channel)
+        for pattern in list(subscriber.patterns):
+            self.punsubscribe(subscriber, pattern)
+
+    def numsub(self, channel):
+        subscribers = self.channels.get(channel)
+        return 0 if subscribers is None else len(subscribers)
+
+    def publish(self, channel, message):
+        """Send `message` to the subscribers of `channel` and of the patterns matching it."""
+        receivers = 0
+        subscribers = self.channels.get(channel)
+        if subscribers:
+            receivers += self._deliver(subscribers, _MESSAGE + encode_bulk(channel) + encode_bulk(message))
+        if self.patterns:
+            tail = encode_bulk(channel) + encode_bulk(message)
+            for pattern in self._matching(channel):
+                entry = self.patterns.get(pattern)
+                if entry is not None: # Its last subscriber may have been dropped just now
+                    receivers += self._deliver(entry[1], _PMESSAGE + encode_bulk(pattern) + tail)
+        return receivers
+
+    def _deliver(self, subscribers, data):
+        # Write `data` to each subscriber and drop those whose buffer went over the limits
+        dropped = None
+        for subscriber in subscribers:
+            transport = subscriber.transport
+            transport.write(data)
+            if (transport.get_write_buffer_size() > PUBSUB_OUTPUT_BUFFER_SOFT_LIMIT
+                    or subscriber.soft_limit_since is not None) and subscriber.over_limit():
+                if dropped is None:
+                    dropped = []
+                dropped.append(subscriber)
+        count = len(subscribers)
+        if dropped is not None:
+            for subscriber in dropped:
+                self.disconnect(subscriber)
+                subscriber.transport.abort()
+            self.disconnections += len(dropped)
+        return count
+
+    def _matching(self, channel):
+        # The patterns matching `channel`, remembered until a pattern is added or removed
+        matches = self._matches.get(channel)
+        if matches is None:
+            if len(self._matches) >= PATTERN_MATCH_CACHE:
+                self._matches.clear()
+            matches = self._matches[channel] = [
+                pattern for pattern, (match, _) in self.patterns.items() if match(channel)]
+        return matches
@@ -0,0 +1,189 @@
+import sys
+from collections import deque
+
+QUICKLIST_NODE_SIZE = 128 # Most elements kept in one node
+
+# Estimated footprint of the parts of a list, see `memory_usage`
+_LIST_HEADER = sys.getsizeof(deque()) + 64
+_NODE_HEADER = sys.getsizeof([]) + 8 * QUICKLIST_NODE_SIZE
+_ELEMENT_HEADER = sys.getsizeof(b"") + 8 # The bytes object and its slot in the node
+
+
+class QuickList:
+    """
+        The list type: a deque of small nodes, each a Python list of at most
+        QUICKLIST_NODE_SIZE elements.
+
+        Pushing and popping at either end only touches the end node, so LPUSH, RPUSH, LPOP and RPOP
+        are O(1) however long the list gets, and no operation ever copies the whole list. Access by
+        index walks nodes rather than elements, starting from the nearer end.
+
+        The total length of the elements is kept up to date, so `memory_usage` is O(1).
+        `accounted` is the footprint the keyspace last counted for the list (see
+        `Database.modified`).
+    """
+
+    __slots__ = ("_nodes", "_len", "_bytes", "accounted")
+    encoding = "quicklist"
+
+    def __init__(self, values=()):
+        self._nodes = deque()
+        self._len = 0
+        self._bytes = 0
+        self.accounted = 0
+        self.extend(values)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for node in self._nodes:
+            yield from node
+
+    def __eq__(self, other):
+        if isinstance(other, QuickList):
+            return self._len == other._len and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return f"QuickList({list(self)!r})"
+
+    def copy(self):
+        clone = QuickList()
+        clone._nodes = deque(node.copy() for node in self._nodes)
+        clone._len = self._len
+        clone._bytes = self._bytes
+        clone.accounted = self.accounted
+        return clone
+
+    def memory_usage(self):
+        """Estimated number of bytes the list takes up."""
+        return (_LIST_HEADER + len(self._nodes) * _NODE_HEADER + self._len * _ELEMENT_HEADER
+                + self._bytes)
+
+    def append(self, value):
+        nodes = self._nodes
+        if not nodes or len(nodes[-1]) >= QUICKLIST_NODE_SIZE:
+            nodes.append([value])
+        else:
+            nodes[-1].append(value)
+        self._len += 1
+        self._bytes += len(value)
+
+    def appendleft(self, value):
+        nodes = self._nodes
+        if not nodes or len(nodes[0]) >= QUICKLIST_NODE_SIZE:
+            nodes.appendleft([value])
+        else:
+            nodes[0].insert(0, value)
+        self._len += 1
+        self._bytes += len(value)
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def extendleft(self, values):
+        """Push each of `values` to the head in turn, like LPUSH does."""
+        for value in values:
+            self.appendleft(value)
+
+    def pop(self):
+        """Remove and return the last element. The list must not be empty."""
+        nodes = self._nodes
+        value = nodes[-1].pop()
+        if not nodes[-1]:
+            nodes.pop()
+        self._len -= 1
+        self._bytes -= len(value)
+        return value
+
+    def popleft(self):
+        """Remove and return the first element. The list must not be empty."""
+        nodes = self._nodes
+        value = nodes[0].pop(0)
+        if not nodes[0]:
+            nodes.popleft()
+        self._len -= 1
+        self._bytes -= len(value)
+        return value
+
+    def _locate_node(self, index):
+        # Return the position of the node holding a normalised `index` and the offset within it
+        nodes = self._nodes
+        if index < self._len // 2:
+            for node_index, node in enumerate(nodes):
+                if index < len(node):
+                    return node_index, index
+                index -= len(node)
+        else:
+            index = self._len - index
+            for node_index, node in enumerate(reversed(nodes), 1):
+                if index <= len(node):
+                    return len(nodes) - node_index, len(node) - index
+                index -= len(node)
+        raise IndexError("list index out of range")
+
+    def _normalise(self, index):
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("list index out of range")
+        return index
+
+    def __getitem__(self, index):
+        node_index, position = self._locate_node(self._normalise(index))
+        return self._nodes[node_index][position]
+
+    def __setitem__(self, index, value):
+        node_index, position = self._locate_node(self._normalise(index))
+        node = self._nodes[node_index]
+        self._bytes += len(value) - len(node[position])
+        node[position] = value
+
+    def range(self, start, stop):
+        """Yield the elements from `start` up to, not including, `stop` without copying the list."""
+        start = max(start, 0)
+        stop = min(stop, self._len)
+        if start >= stop:
+            return
+        remaining = stop - start
+        nodes = self._nodes
+        node_index, start = self._locate_node(start)
+        while True:
+            node = nodes[node_index]
+            chunk = node[start:start + remaining] if start or remaining < len(node) else node
+            yield from chunk
+            remaining -= len(chunk)
+            if not remaining:
+                return
+            node_index += 1
+            start = 0
+
+    def trim(self, start, stop):
+        """Keep only the elements from `start` up to, not including, `stop`."""
+        start = max(start, 0)
+        stop = min(stop, self._len)
+        if start >= stop:
+            self._nodes.clear()
+            self._len = self._bytes = 0
+            return
+        nodes = self._nodes
+        # Drop whole nodes from both ends, then cut into the end nodes
+        dropped = []
+        drop_tail = self._len - stop
+        while drop_tail and len(nodes[-1]) <= drop_tail:
+            dropped.append(nodes.pop())
+            drop_tail -= len(dropped[-1])
+        if drop_tail:
+            dropped.append(nodes[-1][-drop_tail:])
+            del nodes[-1][-drop_tail:]
+        drop_head = start
+        while drop_head and len(nodes[0]) <= drop_head:
+            dropped.append(nodes.popleft())
+            drop_head -= len(dropped[-1])
+        if drop_head:
+            dropped.append(nodes[0][:drop_head])
+            del nodes[0][:drop_head]
+        self._len = stop - start
+        self._bytes -= sum(len(value) for node in dropped for value in node)
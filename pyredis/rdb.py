@@ -0,0 +1,373 @@
+"""
+    Binary snapshot format.
+
+    A file is the magic header, a sequence of key records and an EOF marker followed by a checksum:
+
+        "PYREDIS" <version: 4 ascii digits>
+        [EXPIRETIME_MS <deadline: uint64 little-endian>] <type tag> <key> <value>   (repeated)
+        EOF <crc32 of everything before it: uint32 little-endian>
+
+    Strings are length-prefixed. A length takes one byte below 64, two bytes below 16384 and five
+    bytes otherwise (the top two bits of the first byte say which). String values stored as ints
+    that fit in 8, 16 or 32 bits are written as ENCODING_INT8/16/32 (top two bits set) and the
+    integer in little-endian instead, as Redis does. Lists are an element count followed by that
+    many strings, hashes a field count followed by that many field and value strings, sets a member
+    count followed by the members, integer members encoded like integer strings. Sorted sets
+    are a member count followed by each member string and its score (a little-endian double), in
+    ascending order. Deadlines are absolute Unix times in milliseconds, so a snapshot can be loaded
+    at any later time without extending TTLs.
+"""
+import io, os, struct, threading, time, zlib, logging
+from pyredis.expiry import now_ms
+from pyredis.quicklist import QuickList
+from pyredis.hashes import Hash
+from pyredis.sets import Set
+from pyredis.sortedsets import SortedSet
+from pyredis.encoding import encode_string, shared_integer
+
+MAGIC = b"PYREDIS"
+VERSION = b"0002" # 0002 added the integer encodings of strings
+HEADER = MAGIC + VERSION
+READABLE_VERSIONS = (b"0001", VERSION)
+
+# Opcodes and type tags
+OPCODE_EXPIRETIME_MS = 0xFC
+OPCODE_EOF = 0xFF
+TYPE_STRING = 0
+TYPE_LIST = 1
+TYPE_HASH = 2
+TYPE_ZSET = 3
+TYPE_SET = 4
+
+# Special string encodings: first byte, struct format
+ENCODING_INT8 = 0xC0
+ENCODING_INT16 = 0xC1
+ENCODING_INT32 = 0xC2
+_INT_FORMATS = {ENCODING_INT8: "<b", ENCODING_INT16: "<h", ENCODING_INT32: "<i"}
+
+WRITE_CHUNK_SIZE = 64 * 1024
+READ_CHUNK_SIZE = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class RDBError(Exception):
+    """Raised when a snapshot file is truncated, corrupt or of an unknown version."""
+
+
+def _encode_length(length):
+    if length < 0x40:
+        return bytes((length,))
+    if length < 0x4000:
+        return bytes((0x40 | (length >> 8), length & 0xFF))
+    return b"\x80" + struct.pack(">I", length)
+
+def _encode_string(value):
+    return _encode_length(len(value)) + value
+
+def _encode_integer(value):
+    if -0x80 <= value < 0x80:
+        return struct.pack("<Bb", ENCODING_INT8, value)
+    if -0x8000 <= value < 0x8000:
+        return struct.pack("<Bh", ENCODING_INT16, value)
+    if -0x80000000 <= value < 0x80000000:
+        return struct.pack("<Bi", ENCODING_INT32, value)
+    return _encode_string(b"%d" % value)
+
+def _encode_list(value):
+    return _encode_length(len(value)) + b"".join(_encode_string(element) for element in value)
+
+def _encode_hash(value):
+    return _encode_length(len(value)) + b"".join(
+        _encode_string(field) + _encode_string(item) for field, item in value.items())
+
+def _encode_set(value):
+    return _encode_length(len(value)) + b"".join(
+        _encode_integer(member) if type(member) is int else _encode_string(member) for member in value.values())
+
+def _encode_sorted_set(value):
+    return _encode_length(len(value)) + b"".join(
+        _encode_string(member) + struct.pack("<d", score) for member, score in value.items())
+
+# Value type -> (type tag, encoder)
+ENCODERS = {
+    bytes: (TYPE_STRING, _encode_string),
+    int: (TYPE_STRING, _encode_integer),
+    QuickList: (TYPE_LIST, _encode_list),
+    Hash: (TYPE_HASH, _encode_hash),
+    Set: (TYPE_SET, _encode_set),
+    SortedSet: (TYPE_ZSET, _encode_sorted_set),
+}
+
+
+class _Writer:
+    """Buffers small writes into large ones and keeps a running checksum."""
+
+    def __init__(self, file):
+        self.file = file
+        self.buffer = bytearray()
+        self.crc = 0
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= WRITE_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.crc = zlib.crc32(self.buffer, self.crc)
+        self.file.write(self.buffer)
+        self.buffer.clear()
+
+
+def dump(items, file):
+    """Write (key, value, deadline) items to the binary file object `file`."""
+    writer = _Writer(file)
+    writer.write(HEADER)
+    for key, value, deadline in items:
+        tag, encode = ENCODERS[type(value)]
+        if deadline is not None:
+            writer.write(bytes((OPCODE_EXPIRETIME_MS,)) + struct.pack("<Q", deadline))
+        writer.write(bytes((tag,)) + _encode_string(key) + encode(value))
+    writer.write(bytes((OPCODE_EOF,)))
+    writer.flush()
+    file.write(struct.pack("<I", writer.crc))
+
+def dump_value(value):
+    """
+        Serialize one value, for DUMP and MIGRATE: its type tag and encoding as in a snapshot, then
+        the format version and a crc32 of everything before it.
+    """
+    tag, encode = ENCODERS[type(value)]
+    payload = bytes((tag,)) + encode(value) + VERSION
+    return payload + struct.pack("<I", zlib.crc32(payload))
+
+
+class _Reader:
+    """Reads a snapshot in large chunks and checksums the bytes as they are consumed."""
+
+    def __init__(self, file, initial=b""):
+        self.file = file
+        self.buffer = initial
+        self.pos = 0
+        self.crc_start = 0 # Start of the bytes in `buffer` not yet included in `crc`
+        self.crc = 0
+        self.consumed = 0 # Bytes consumed from the stream before `buffer`
+
+    def read(self, size):
+        end = self.pos + size
+        if end > len(self.buffer):
+            self._refill(size)
+            end = self.pos + size
+        data = self.buffer[self.pos:end]
+        self.pos = end
+        return data
+
+    def read_byte(self):
+        if self.pos >= len(self.buffer):
+            self._refill(1)
+        byte = self.buffer[self.pos]
+        self.pos += 1
+        return byte
+
+    def read_length(self):
+        first = self.read_byte()
+        kind = first >> 6
+        if kind == 0:
+            return first
+        if kind == 1:
+            return ((first & 0x3F) << 8) | self.read_byte()
+        if first == 0x80:
+            return struct.unpack(">I", self.read(4))[0]
+        raise RDBError(f"Unknown length encoding {first:#x}")
+
+    def read_string(self):
+        # Fast path for short strings that are already buffered
+        buffer, pos = self.buffer, self.pos
+        if pos < len(buffer) and buffer[pos] < 0x40:
+            end = pos + 1 + buffer[pos]
+            if end <= len(buffer):
+                self.pos = end
+                return buffer[pos + 1:end]
+        return self.read(self.read_length())
+
+    def update_crc(self):
+        self.crc = zlib.crc32(self.buffer[self.crc_start:self.pos], self.crc)
+        self.crc_start = self.pos
+
+    @property
+    def offset(self):
+        return self.consumed + self.pos
+
+    def _refill(self, size):
+        self.update_crc()
+        self.consumed += self.pos
+        chunk = self.file.read(max(size, READ_CHUNK_SIZE))
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = self.crc_start = 0
+        if len(self.buffer) < size:
+            raise RDBError("Unexpected end of snapshot")
+
+
+def _read_string_value(reader):
+    first = reader.read_byte()
+    integer_format = _INT_FORMATS.get(first)
+    if integer_format is not None:
+        return shared_integer(struct.unpack(integer_format, reader.read(struct.calcsize(integer_format)))[0])
+    reader.pos -= 1
+    return encode_string(reader.read_string())
+
+def _read_list(reader):
+    return QuickList(reader.read_string() for _ in range(reader.read_length()))
+
+def _read_hash(reader):
+    read_string = reader.read_string
+    return Hash((read_string(), read_string()) for _ in range(reader.read_length()))
+
+def _read_set(reader):
+    return Set.from_values([_read_string_value(reader) for _ in range(reader.read_length())])
+
+def _read_sorted_set(reader):
+    members = []
+    for _ in range(reader.read_length()):
+        member = reader.read_string()
+        members.append((member, struct.unpack("<d", reader.read(8))[0]))
+    return SortedSet(members)
+
+# Type tag -> decoder
+DECODERS = {
+    TYPE_STRING: _read_string_value,
+    TYPE_LIST: _read_list,
+    TYPE_HASH: _read_hash,
+    TYPE_ZSET: _read_sorted_set,
+    TYPE_SET: _read_set,
+}
+
+def load(file, db, initial=b""):
+    """
+        Load a snapshot from the binary file object `file` into `db` in a single streaming pass.
+        `initial` holds bytes already read from the start of the stream. Keys whose deadline has
+        passed are skipped. Returns the number of keys loaded and the number of bytes the snapshot
+        took up in the stream, so a caller can carry on reading what follows it.
+    """
+    reader = _Reader(file, initial)
+    try:
+        return _load_records(reader, db)
+    except struct.error as e:
+        raise RDBError(f"Corrupt snapshot: {e}") from None
+
+def load_value(payload):
+    """Decode a value serialized by `dump_value`, raising RDBError if it is corrupt or of an unknown version."""
+    trailer = len(VERSION) + 4
+    if (len(payload) <= trailer or payload[-trailer:-4] not in READABLE_VERSIONS
+            or struct.unpack("<I", payload[-4:])[0] != zlib.crc32(payload[:-4])):
+        raise RDBError("DUMP payload version or checksum are wrong")
+    decode = DECODERS.get(payload[0])
+    if decode is None:
+        raise RDBError(f"Unknown value type {payload[0]}")
+    reader = _Reader(io.BytesIO(), payload[1:-trailer])
+    try:
+        value = decode(reader)
+    except struct.error as e:
+        raise RDBError(f"Corrupt payload: {e}") from None
+    if reader.pos != len(reader.buffer):
+        raise RDBError("Corrupt payload: trailing bytes")
+    return value
+
+def _load_records(reader, db):
+    header = reader.read(len(HEADER))
+    if header[:len(MAGIC)] != MAGIC or header[len(MAGIC):] not in READABLE_VERSIONS:
+        raise RDBError("Not a pyredis snapshot or unsupported version")
+
+    now = now_ms()
+    loaded = 0
+    while True:
+        opcode = reader.read_byte()
+        if opcode == OPCODE_EOF:
+            break
+        deadline = None
+        if opcode == OPCODE_EXPIRETIME_MS:
+            deadline = struct.unpack("<Q", reader.read(8))[0]
+            opcode = reader.read_byte()
+        decode = DECODERS.get(opcode)
+        if decode is None:
+            raise RDBError(f"Unknown value type {opcode}")
+        key = reader.read_string()
+        value = decode(reader)
+        if deadline is not None and deadline < now:
+            continue
+        db.restore(key, value, deadline)
+        loaded += 1
+
+    reader.update_crc()
+    expected = struct.unpack("<I", reader.read(4))[0]
+    if expected != reader.crc:
+        raise RDBError("Snapshot checksum mismatch")
+    return loaded, reader.offset
+
+
+class RDB:
+    """
+        Snapshot persistence for a Database: SAVE writes the file on the calling thread, BGSAVE
+        writes it from a copy-on-write snapshot on a background thread while clients keep being
+        served. Both write to a temporary file that atomically replaces `filename`.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.last_save = int(time.time())
+        self.last_bgsave_ok = True
+        self.dirty_at_last_save = 0
+        self._bgsave_thread = None
+
+    @property
+    def bgsave_in_progress(self):
+        return self._bgsave_thread is not None and self._bgsave_thread.is_alive()
+
+    def save(self, db):
+        snapshot = db.snapshot()
+        try:
+            self._write(snapshot, db.dirty)
+        finally:
+            snapshot.release()
+
+    def bgsave(self, db):
+        """Start a background save. Returns False if one is already running."""
+        if self.bgsave_in_progress:
+            return False
+        snapshot = db.snapshot()
+        self._bgsave_thread = threading.Thread(target=self._background_save, args=(snapshot, db.dirty),
+                                               name="rdb-bgsave", daemon=True)
+        self._bgsave_thread.start()
+        return True
+
+    def load(self, db):
+        """Load the snapshot file into `db`, returning the number of keys loaded."""
+        with open(self.filename, "rb") as file:
+            loaded, _ = load(file, db)
+        return loaded
+
+    def _background_save(self, snapshot, dirty):
+        try:
+            self._write(snapshot, dirty)
+            self.last_bgsave_ok = True
+        except Exception:
+            logger.exception("Background save failed")
+            self.last_bgsave_ok = False
+        finally:
+            snapshot.release()
+
+    def _write(self, snapshot, dirty):
+        temp_filename = os.path.join(os.path.dirname(self.filename), f"temp-{os.getpid()}-{threading.get_ident()}.rdb")
+        try:
+            with open(temp_filename, "wb") as file:
+                dump(snapshot.items(), file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_filename, self.filename)
+        except BaseException:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
+        self.last_save = int(time.time())
+        self.dirty_at_last_save = dirty
+        logger.info("DB saved on disk: %d keys", len(snapshot))
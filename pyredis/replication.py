@@ -0,0 +1,307 @@
+"""
+    Primary-replica replication, for the asyncio server.
+
+    A replica connects to its primary like a client and sends PSYNC with the id of the replication
+    stream it follows and how many bytes of it it has applied. The primary answers either
+
+        +CONTINUE <replid>                  the rest of the stream is still in its backlog, or
+        +FULLRESYNC <replid> <offset>       followed by $<length> and a snapshot in the rdb format,
+
+    and from then on writes every command it propagates to the replica as well: the write commands
+    that reach the AOF, encoded once for all the replicas. The last REPL_BACKLOG_SIZE bytes of the
+    stream are kept in a circular buffer, so a replica that lost its connection for a moment
+    catches up with what it missed instead of loading a whole snapshot again.
+
+    Replicas apply the stream with a client of their own, refuse writes from everybody else, and
+    acknowledge the offset they reached every REPL_ACK_INTERVAL seconds, which INFO replication
+    reports on the primary along with the lag since each replica's last acknowledgment. Replicas
+    don't keep a backlog of their own: a replica promoted with REPLICAOF NO ONE starts a new
+    stream, and its own replicas resynchronise fully.
+"""
+import asyncio, io, logging, os, time
+from pyredis.protocol import Error, RespParser, encode_command
+from pyredis.client import Client
+from pyredis import rdb
+
+REPL_BACKLOG_SIZE = 1024 * 1024 # Bytes of the stream kept for partial resynchronisation
+REPL_ACK_INTERVAL = 1.0 # Seconds between a replica's acknowledgments
+REPL_RETRY_INTERVAL = 1.0 # Seconds before a replica reconnects to its primary
+READ_CHUNK_SIZE = 64 * 1024
+
+READONLY_ERROR = Error("READONLY You can't write against a read only replica.").encode()
+
+logger = logging.getLogger(__name__)
+
+
+def _new_replid():
+    return os.urandom(20).hex().encode()
+
+
+class Backlog:
+    """
+        The last `size` bytes of the replication stream, in a circular buffer. `offset` is the
+        stream position after its last byte, `length` how many bytes before it are kept.
+    """
+
+    def __init__(self, offset, size=None):
+        self.size = REPL_BACKLOG_SIZE if size is None else size
+        self._buffer = bytearray(self.size)
+        self.offset = offset
+        self.length = 0
+
+    @property
+    def first_offset(self):
+        """Stream position of the oldest byte kept."""
+        return self.offset - self.length
+
+    def feed(self, data):
+        size = self.size
+        if len(data) > size:
+            self.offset += len(data) - size
+            data = memoryview(data)[-size:]
+        start = self.offset % size
+        first = min(len(data), size - start)
+        self._buffer[start:start + first] = data[:first]
+        self._buffer[:len(data) - first] = data[first:]
+        self.offset += len(data)
+        self.length = min(size, self.length + len(data))
+
+    def read_from(self, offset):
+        """Return the bytes of the stream from `offset` on, or None if they are not all kept."""
+        if not self.first_offset <= offset <= self.offset:
+            return None
+        size = self.size
+        start = offset % size
+        count = self.offset - offset
+        if start + count <= size:
+            return bytes(self._buffer[start:start + count])
+        return bytes(self._buffer[start:]) + bytes(self._buffer[:start + count - size])
+
+
+class ReplicaState:
+    """What a primary knows of one of its replicas."""
+
+    __slots__ = ("transport", "addr", "port", "state", "pending", "ack_offset", "ack_time")
+
+    def __init__(self, transport, addr):
+        self.transport = transport
+        self.addr = addr
+        self.port = 0 # The port the replica serves clients on, from REPLCONF listening-port
+        self.state = "handshake" # Then "wait_bgsave" while its snapshot is made, then "online"
+        self.pending = None # The stream fed while the snapshot is made, sent right after it
+        self.ack_offset = 0
+        self.ack_time = time.monotonic()
+
+
+class Replication:
+    """
+        The replication state of a Database: as a primary, the stream id and offset, the backlog
+        (created when the first replica connects, as in Redis) and the replicas; as a replica,
+        the `primary` link it follows.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.replid = _new_replid()
+        self.offset = 0 # Bytes of the stream produced, or applied on a replica
+        self.backlog = None
+        self.replicas = {} # Client -> ReplicaState
+        self.primary = None # PrimaryLink while this server is a replica
+        self.port = 0 # Port this server listens on, told to the primary
+
+    def feed(self, data):
+        """Send encoded commands to the replicas and keep them in the backlog."""
+        if self.primary is not None:
+            return # Replicas apply their primary's stream, they don't produce one
+        self.offset += len(data)
+        self.backlog.feed(data)
+        for replica in self.replicas.values():
+            if replica.pending is not None:
+                replica.pending += data
+            elif replica.state == "online":
+                replica.transport.write(data)
+
+    def replica(self, client):
+        """The state of the replica connected as `client`, created on its first REPLCONF or PSYNC."""
+        replica = self.replicas.get(client)
+        if replica is None:
+            replica = self.replicas[client] = ReplicaState(client.transport, client.addr)
+        return replica
+
+    def drop(self, client):
+        """Forget a replica whose connection closed."""
+        self.replicas.pop(client, None)
+
+    def sync(self, client, replid, offset):
+        """
+            Serve PSYNC: write the answer and the stream (or the snapshot) to the replica's
+            transport, then keep it up to date with `feed`.
+        """
+        replica = self.replica(client)
+        transport = client.transport
+        if self.backlog is None:
+            self.backlog = Backlog(self.offset)
+        if replid == self.replid:
+            missed = self.backlog.read_from(offset)
+            if missed is not None:
+                transport.write(b"+CONTINUE %s\r\n" % self.replid + missed)
+                replica.state = "online"
+                replica.ack_offset = offset
+                return
+
+        transport.write(b"+FULLRESYNC %s %d\r\n" % (self.replid, self.offset))
+        replica.state = "wait_bgsave"
+        replica.pending = bytearray()
+        replica.ack_offset = self.offset
+        snapshot = self.db.snapshot()
+        dumped = asyncio.get_running_loop().run_in_executor(None, _dump, snapshot)
+        dumped.add_done_callback(lambda done: self._send_snapshot(client, replica, done))
+
+    def _send_snapshot(self, client, replica, dumped):
+        if self.replicas.get(client) is not replica:
+            return # Disconnected meanwhile
+        if dumped.exception() is not None:
+            logger.error("Snapshot for replica %s failed: %s", replica.addr, dumped.exception())
+            replica.transport.abort()
+            return
+        payload = dumped.result()
+        replica.transport.write(b"$%d\r\n" % len(payload) + payload + replica.pending)
+        replica.pending = None
+        replica.state = "online"
+
+    def acknowledge(self, client, offset):
+        """Record that the replica connected as `client` has applied the stream up to `offset`."""
+        replica = self.replicas.get(client)
+        if replica is not None:
+            replica.ack_offset = offset
+            replica.ack_time = time.monotonic()
+
+    def replicate(self, host, port):
+        """
+            Follow the primary at `host`:`port`, dropping the current one if any. Our own replicas
+            are disconnected: they reconnect and resynchronise fully.
+        """
+        if self.primary is not None:
+            self.primary.stop()
+        for replica in self.replicas.values():
+            replica.transport.abort()
+        self.replicas.clear()
+        self.backlog = None
+        self.primary = PrimaryLink(self, host, port)
+        self.primary.start()
+
+    def stop_replicating(self):
+        """Stop following the primary and start a stream of our own, from the offset reached."""
+        if self.primary is not None:
+            self.primary.stop()
+            self.primary = None
+            self.replid = _new_replid()
+
+
+def _dump(snapshot):
+    # Runs on an executor thread, the snapshot is copy-on-write
+    try:
+        file = io.BytesIO()
+        rdb.dump(snapshot.items(), file)
+        return file.getvalue()
+    finally:
+        snapshot.release()
+
+
+class PrimaryLink:
+    """
+        A replica's connection to its primary: the handshake, then applying the stream and
+        acknowledging it, reconnecting after REPL_RETRY_INTERVAL whenever the link breaks.
+    """
+
+    def __init__(self, replication, host, port):
+        self.replication = replication
+        self.host = host
+        self.port = port
+        self.client = Client(replication.db, (host, port)) # The only client allowed to write
+        self.up = False
+        self.syncing = False
+        self.last_io = time.monotonic()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        self.up = False
+
+    async def _run(self):
+        while True:
+            writer = None
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+                await self._handshake(reader, writer)
+                self.up = True
+                acks = asyncio.ensure_future(self._acknowledge(writer))
+                try:
+                    await self._stream(reader)
+                finally:
+                    acks.cancel()
+            except (OSError, EOFError, ValueError, rdb.RDBError, asyncio.IncompleteReadError) as e:
+                logger.warning("Link with primary %s:%d broken: %s", self.host, self.port, e)
+            finally:
+                self.up = self.syncing = False
+                if writer is not None:
+                    writer.close()
+            await asyncio.sleep(REPL_RETRY_INTERVAL)
+
+    async def _handshake(self, reader, writer):
+        replication = self.replication
+        for args in ([b"PING"], [b"REPLCONF", b"listening-port", b"%d" % replication.port]):
+            writer.write(encode_command(args))
+            line = await reader.readline()
+            if line[:1] != b"+":
+                raise ValueError(f"unexpected reply to {args[0].decode()}: {line!r}")
+
+        writer.write(encode_command([b"PSYNC", replication.replid, b"%d" % replication.offset]))
+        line = (await reader.readline()).rstrip(b"\r\n")
+        if line.startswith(b"+CONTINUE"):
+            logger.info("Partial resynchronisation with %s:%d from offset %d",
+                        self.host, self.port, replication.offset)
+            return
+        if not line.startswith(b"+FULLRESYNC"):
+            raise ValueError(f"unexpected reply to PSYNC: {line!r}")
+        _, replid, offset = line.split()
+        self.syncing = True
+        header = await reader.readline()
+        if header[:1] != b"$":
+            raise ValueError(f"expected a snapshot, got {header!r}")
+        payload = await reader.readexactly(int(header[1:]))
+        db = replication.db
+        db.flush()
+        loaded, _ = rdb.load(io.BytesIO(payload), db)
+        replication.replid, replication.offset = replid, int(offset)
+        self.syncing = False
+        if db.aof is not None:
+            db.aof.start_rewrite(db) # Loaded keys bypass the AOF
+        logger.info("Full resynchronisation with %s:%d: %d keys", self.host, self.port, loaded)
+
+    async def _stream(self, reader):
+        from pyredis.commands import execute # The command modules import the database, which imports us
+        replication = self.replication
+        parser = RespParser()
+        start = replication.offset
+        received = 0
+        while True:
+            data = await reader.read(READ_CHUNK_SIZE)
+            if not data:
+                raise EOFError("connection closed by primary")
+            self.last_io = time.monotonic()
+            parser.feed(data)
+            received += len(data)
+            for args in parser:
+                execute(self.client, args)
+            replication.offset = start + received - parser.pending
+
+    async def _acknowledge(self, writer):
+        while True:
+            writer.write(encode_command([b"REPLCONF", b"ACK", b"%d" % self.replication.offset]))
+            await asyncio.sleep(REPL_ACK_INTERVAL)
+
@@ -0,0 +1,103 @@
+"""
+    Cursors for HSCAN, SSCAN and ZSCAN over hashes, sets and sorted sets in their large encodings.
+
+    Like the keyspace dict (see keyindex), a Python dict or set can't be walked while it changes
+    and doesn't expose its buckets, so the only cursor it offers is a position in iteration order,
+    which shifts when an element before it is removed, and reaching it walks every element before.
+    A `ScanIndex` files the elements of a container under hash buckets instead, the way Redis's dict
+    does, and the cursor names the next bucket to visit. The table has a power of two buckets and
+    doubles or halves with the number of elements; the cursor counts up with its bits reversed
+    (Redis's reverse binary iteration), so the buckets already visited before a resize are exactly
+    the ones that split from or merged into buckets visited after it. An element present during the
+    whole iteration is therefore returned at least once, and a call costs O(count).
+
+    An index is built the first time a container is scanned and kept up to date from then on, so a
+    container that is never scanned doesn't pay for it.
+"""
+
+SCAN_INDEX_MIN_BUCKETS = 16
+SCAN_EMPTY_VISITS = 10 # Most empty buckets one call visits per element asked for, as in Redis
+
+
+class ScanIndex:
+    """The elements of a container, filed by hash into a power of two buckets."""
+
+    __slots__ = ("_buckets", "_size")
+
+    def __init__(self, elements):
+        elements = list(elements)
+        buckets = SCAN_INDEX_MIN_BUCKETS
+        while buckets < len(elements):
+            buckets *= 2
+        self._buckets = None # Bucket -> list of its elements, None while empty
+        self._size = len(elements)
+        self._fill(elements, buckets)
+
+    def __len__(self):
+        return self._size
+
+    def add(self, element):
+        """File `element`, which must not be in the index yet."""
+        buckets = self._buckets
+        position = hash(element) & (len(buckets) - 1)
+        bucket = buckets[position]
+        if bucket is None:
+            buckets[position] = [element]
+        else:
+            bucket.append(element)
+        self._size += 1
+        if self._size > len(buckets):
+            self._resize(len(buckets) * 2)
+
+    def remove(self, element):
+        """Remove `element`, which must be in the index."""
+        buckets = self._buckets
+        position = hash(element) & (len(buckets) - 1)
+        bucket = buckets[position]
+        bucket.remove(element)
+        if not bucket:
+            buckets[position] = None
+        self._size -= 1
+        if len(buckets) > SCAN_INDEX_MIN_BUCKETS and self._size < len(buckets) // 8:
+            self._resize(len(buckets) // 2)
+
+    def scan(self, cursor, count):
+        """
+            Return the elements of the buckets from `cursor` on, stopping once there are at least
+            `count` of them, and the cursor to continue from: 0 once every bucket has been visited.
+        """
+        buckets = self._buckets
+        top = len(buckets) >> 1
+        cursor &= len(buckets) - 1
+        found = []
+        empty_visits = count * SCAN_EMPTY_VISITS
+        while True:
+            bucket = buckets[cursor]
+            if bucket is None:
+                empty_visits -= 1
+            else:
+                found += bucket
+            # Add one to the cursor read from its top bit down: clear the leading ones, set the next bit
+            bit = top
+            while cursor & bit:
+                cursor ^= bit
+                bit >>= 1
+            if not bit:
+                return 0, found # Every bucket visited
+            cursor |= bit
+            if len(found) >= count or empty_visits <= 0:
+                return cursor, found
+
+    def _resize(self, size):
+        self._fill([element for bucket in self._buckets if bucket is not None for element in bucket], size)
+
+    def _fill(self, elements, size):
+        self._buckets = buckets = [None] * size
+        mask = size - 1
+        for element in elements:
+            position = hash(element) & mask
+            bucket = buckets[position]
+            if bucket is None:
+                buckets[position] = [element]
+            else:
+                bucket.append(element)
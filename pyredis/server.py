@@ -1,396 +1,299 @@
-import asyncio, time, random
+import argparse, asyncio, logging, os
 from functools import partial
-from pyredis.protocol import parse_frame, Array, Error, SimpleString, BulkString, Integer
-from pyredis.utils import log_to_aof
+from pyredis.protocol import RespParser, ProtocolError, Error
+from pyredis.aof import AOFWriter, load_aof, APPENDFSYNC_ALWAYS, APPENDFSYNC_EVERYSEC
+from pyredis.rdb import RDB
+from pyredis.eviction import Evictor, MAXMEMORY_POLICIES, NOEVICTION, parse_memory
+from pyredis.keyindex import PrefixIndex
+from pyredis import hashes, sets, sortedsets, pubsub
+from pyredis.blocking import TIMEOUT_REPLY
+from pyredis.transactions import unwatch
+from pyredis.cluster import Cluster
+from pyredis.commands import execute
+from pyredis.client import Client
+from pyredis.db import Database
 
 HOST = "0.0.0.0"
 PORT = 7
 CONCURRENCY_METHOD = "ASYNCIO"
+READ_CHUNK_SIZE = 64 * 1024
+OUTPUT_BUFFER_HIGH_WATER = 64 * 1024 # Drain the writer once this many reply bytes are queued
+ACTIVE_EXPIRE_INTERVAL = 0.1 # Seconds between active expiry ticks
+ACTIVE_EXPIRE_TIME_BUDGET = 0.025 # Longest a single tick may hold the event loop, in seconds
+
+logger = logging.getLogger(__name__)
 
 # Setup server to listen for connections
-async def start_server_using_asyncio(STORE, STORE_LOCK, AOF_FILE):
+async def start_server_using_asyncio(db, port=None, reuse_port=False):
     """
-        Start the asyncio server
+        Start the asyncio server. With `reuse_port` several processes can listen on the same port
+        and the kernel spreads connections over them (see pyredis.shards).
     """
-    server = await asyncio.start_server(partial(handle_client_using_asyncio, STORE, STORE_LOCK, AOF_FILE), HOST, PORT)
+    if db.aof is not None:
+        db.aof.bind_loop(asyncio.get_running_loop()) # Group commit: one AOF write per loop iteration
+    server = await asyncio.start_server(partial(handle_client_using_asyncio, db), HOST,
+                                        PORT if port is None else port, reuse_port=reuse_port)
     addr = server.sockets[0].getsockname()
+    db.replication.port = addr[1] # Told to the primary when this server is a replica
+    if db.cluster is not None:
+        db.cluster.myself.port = addr[1]
     print(f"Server listening on {addr}")
     
     async with server:
         await server.serve_forever()
 
 # Handle client connections
-async def handle_client_using_asyncio(STORE, STORE_LOCK, AOF_FILE, reader, writer):
-    """Handle a single client connection."""
+async def handle_client_using_asyncio(db, reader, writer):
+    """
+        Handle a single client connection.
+
+        Every complete command in a read is executed before anything is sent, and the replies are
+        written to the transport in one go. The writer is only drained once its buffer grows past
+        OUTPUT_BUFFER_HIGH_WATER, so a pipelined batch costs one write and no extra loop round trip.
+        With appendfsync always, replies to a batch that changed the keyspace are held back until
+        the AOF fsync covering its writes has completed; a batch that only read doesn't wait.
+        Commands forwarded to other shards don't stop the batch: their replies are awaited, in
+        order, just before the write. While a command waits, as a blocked BLPOP does, the
+        connection is still read, so a client that hangs up is noticed and its wait dropped.
+    """
     addr = writer.get_extra_info('peername')
-    buffer = b""
+    client = Client(db, addr)
+    client.transport = writer.transport # Pub/sub messages are written straight to it
+    parser = RespParser()
+    replies = []
+    sync_offset = 0 # AOF position the replies wait for with appendfsync always, 0 if they don't
+
+    async def send_replies():
+        nonlocal sync_offset
+        if any(type(reply) is not bytes for reply in replies):
+            replies[:] = [reply if type(reply) is bytes else await reply for reply in replies]
+        if sync_offset:
+            await db.aof.synced(sync_offset)
+            sync_offset = 0
+        if replies:
+            writer.write(b"".join(replies))
+            replies.clear()
+    client.on_block = send_replies # A blocking command sends the replies before it, then waits
+
+    async def until_done(pending):
+        # Keep reading while a command waits; what arrives meanwhile is parsed after it
+        task = asyncio.ensure_future(pending)
+        read = None
+        try:
+            while True:
+                read = asyncio.ensure_future(reader.read(READ_CHUNK_SIZE))
+                await asyncio.wait((task, read), return_when=asyncio.FIRST_COMPLETED)
+                if not read.done():
+                    return task.result()
+                data = read.result()
+                if not data:
+                    raise ConnectionResetError("client disconnected while waiting")
+                parser.feed(data)
+        finally:
+            task.cancel() # A blocked command's wait drops its waiter when cancelled
+            if read is not None:
+                read.cancel() # Data it hadn't taken yet stays in the reader
+            # Let both finish before the connection is read again
+            await asyncio.gather(task, *(() if read is None else (read,)), return_exceptions=True)
 
     try:
         while True:
             # Read data from the client
-            data = await reader.read(4096)
+            data = await reader.read(READ_CHUNK_SIZE)
             if not data:
-                print(f"Client disconnected")
+                logger.debug("Client %s disconnected", addr)
                 break
-            
-            print(f"Raw data received from {addr}: {data}")
-            buffer += data
 
-            # Process complete frames
-            while buffer:
-                frame, consumed = parse_frame(buffer)
-                print(f"Frame Elements - {frame.elements}")
-                if frame is None:
-                    break  # Wait for more data
-                
-                buffer = buffer[consumed:]  # Remove processed data
+            debug = logger.isEnabledFor(logging.DEBUG)
+            if debug:
+                logger.debug("Raw data received from %s: %r", addr, data)
+            parser.feed(data)
 
-                # Handle the command
-                response = await async_process_command(frame, STORE, STORE_LOCK, AOF_FILE)
-                print(f"Sending response: {response}")
-                writer.write(response)
-                await writer.drain()  # Ensure the response is sent
+            # Process complete commands, the parser keeps any partial one for the next read
+            replies.clear()
+            aof = db.aof if db.aof is not None and db.aof.appendfsync == APPENDFSYNC_ALWAYS else None
+            try:
+                for args in parser:
+                    # Handle the command
+                    fed = aof.offset if aof is not None else 0
+                    response = submit_command(args, client)
+                    if aof is not None and aof.offset != fed: # Only this command ran meanwhile
+                        sync_offset = aof.offset
+                    if asyncio.iscoroutine(response):
+                        response = await until_done(response) # Blocked, the rest of the batch waits
+                    if debug:
+                        logger.debug("Command %r -> %r", args, response)
+                    replies.append(response)
+            except ProtocolError as e:
+                replies.append(Error(f"ERR {e}").encode())
+                break
+            finally:
+                # Send everything produced by this read in a single write
+                await send_replies()
+
+            if writer.transport.get_write_buffer_size() > OUTPUT_BUFFER_HIGH_WATER:
+                await writer.drain()  # Apply backpressure only when the client falls behind
     except Exception as e:
-        # print(f"Error handling client: {e}")
-        pass
+        logger.debug("Error handling client %s: %s", addr, e)
     finally:
-        # print(f"Closing connection")
+        if client.subscriber is not None:
+            db.pubsub.disconnect(client.subscriber)
+        unwatch(client)
+        db.replication.drop(client)
         writer.close()
         await writer.wait_closed()
 
 # Handle the command
-async def async_process_command(frame, STORE, STORE_LOCK, AOF_FILE):
-    if isinstance(frame, Array):
-        if not frame.elements:
-            return Error("Empty command").encode()
-        
-        command = frame.elements[0].data.upper()
-        if command == "COMMAND":
-            # Stub response for COMMAND
-            return BulkString("OK").encode()
-        
-        elif command == "INFO":
-            if len(frame.elements) > 1 and frame.elements[1].data.upper() == "SERVER":
-                return BulkString("# Server\nredis_version:0.1.0\n").encode()
-            return BulkString("").encode()
-        
-        elif command == "ECHO":
-            # Handle ECHO command
-            if len(frame.elements) < 2:
-                return Error("ECHO requires an argument").encode()
-            concatenated = " ".join(element.data for element in frame.elements[1:])
-            return BulkString(concatenated).encode()
-        
-        elif command == "PING":
-            # Handle PING command
-            if len(frame.elements) > 1:
-                return SimpleString(frame.elements[1].data).encode()
-            return SimpleString("PONG").encode()
-        
-        elif command == "SET":
-            # Handle SET command with expiry
-            if len(frame.elements) < 3:
-                return Error("SET requires a key and a value").encode()
-            
-            key = frame.elements[1].data
-            value = frame.elements[2].data
-            expiry_time = None
-            
-            # Check for optional expiry argument (EX or PX)
-            if len(frame.elements) > 4:
-                option = frame.elements[3].data.upper()
-                if option == "EX": # Expiry in seconds
-                    expiry_time = time.time() + int(frame.elements[4].data)
-                elif option == "PX": # Expiry in milliseconds
-                    expiry_time = time.time() + int(frame.elements[4].data) / 1000
-
-            async with STORE_LOCK: # Acquire asyncio Lock
-                STORE[key] = (value, expiry_time) # Store the key-value pair, overwrite value if key already exists
-            
-            # Log the command to the AOF file
-            aof_command = f"*3\r\n$3\r\nSET\r\n${len(key)}\r\n{key}\r\n${len(value)}\r\n{value}\r\n".encode()
-            await log_to_aof(aof_command, AOF_FILE)
-            
-            return SimpleString("OK").encode()
-        
-        elif command == "GET":
-            # Handle GET command with expiry check
-            if len(frame.elements) < 2:
-                return Error("GET requires a key").encode()
-            
-            key = frame.elements[1].data
-            async with STORE_LOCK: # Acquire asyncio Lock
-                entry = STORE.get(key) # Retrieve the value for the key
-
-            if entry is None:
-                return BulkString(None).encode() # RESP null bulk string for missing keys
-
-            value, expiry_time = entry
-            # Check if the key has expired
-            if expiry_time is not None and time.time() > expiry_time:
-                async with STORE_LOCK:
-                    del STORE[key] # Remove expired key
-                return BulkString(None).encode()
-            
-            return BulkString(value).encode()
-        
-        elif command == "LPUSH":
-            # Handle LPUSH command
-            if len(frame.elements) < 3:
-                return Error("LPUSH requires a key and a value").encode()
-
-            key = frame.elements[1].data
-            values = [element.data for element in frame.elements[2:]]
-            
-            async with STORE_LOCK: # Acquire asyncio Lock
-                if key in STORE:
-                    if isinstance(STORE[key], list):
-                        STORE[key] = reversed(values) + STORE[key] # Prepend values to the list
-                    else:
-                        return Error("WRONGTYPE: Operation against a key holding the wrong kind of value").encode()
-                else:
-                    STORE[key] = values # Create a new list
-                
-                # Get the length of the list
-                len_entry = str(len(STORE[key]))
-            
-            # Log the command to the AOF file
-            aof_command = f"*3\r\n$5\r\nLPUSH\r\n${len(key)}\r\n{key}\r\n${len(value)}\r\n{value}\r\n"
-            await log_to_aof(aof_command)
-            
-            return SimpleString(f"(integer) {len_entry}").encode()
-
-        elif command == "RPUSH":
-            # Handle RPUSH command
-            if len(frame.elements) < 3:
-                return Error("RPUSH requires a key and a value").encode()
-
-            key = frame.elements[1].data
-            values = [element.data for element in frame.elements[2:]]
-            
-            async with STORE_LOCK: # Acquire asyncio Lock
-                if key in STORE:
-                    if isinstance(STORE[key], list):
-                        STORE[key] = STORE[key] + values # Append values to the list
-                    else:
-                        return Error("WRONGTYPE: Operation against a key holding the wrong kind of value").encode()
-                else:
-                    STORE[key] = values # Create a new list
-                
-                # Get the length of the list
-                len_entry = str(len(STORE[key]))
-            
-            # Log the command to the AOF file
-            aof_command = f"*3\r\n$5\r\nRPUSH\r\n${len(key)}\r\n{key}\r\n${len(value)}\r\n{value}\r\n"
-            await log_to_aof(aof_command)
-
-            return SimpleString(f"(integer) {len_entry}").encode()
-        
-        elif command == "LRANGE":
-            # Handle LRANGE command
-            if len(frame.elements) < 4:
-                return Error("LRANGE requires 3 arguments - a key, a start index for the range, and an end index for the range").encode()
-
-            key = frame.elements[1].data
-            try:
-                start_index = int(frame.elements[2].data)
-                end_index = int(frame.elements[3].data)
-            except:
-                return Error("Start and end indices must be integers").encode()
-            
-            async with STORE_LOCK: # Acquire asyncio Lock
-                if key in STORE:
-                    if isinstance(STORE[key], list):
-                        values = STORE.get(key) # Retrieve the value for the key
-                    else:
-                        return Error("WRONGTYPE: Operation against a key holding the wrong kind of value").encode()
-                else:
-                    return Error("Key not found").encode()
-
-            if start_index > end_index:
-                return Array([]).encode() # Return an empty array if range is invalid
-
-            # Translate negative indices to positive indices
-            if end_index + len(values) < 0: # Entire range is out-of-bounds
-                return Array([]).encode() 
-            elif end_index < 0: # Partial range is out-of-bounds
-                start_index = max(0, start_index + len(values))
-                end_index = end_index + len(values)
-
-            result = values[start_index:end_index + 1]
-
-            return Array([BulkString(value) for value in result]).encode()
-
-        elif command == "EXISTS":
-            # Handle EXISTS command
-            if len(frame.elements) < 2:
-                return Error("EXISTS requires at least one key").encode()
-            
-            keys = [element.data for element in frame.elements[1:]]
-            exists_count = 0
-            async with STORE_LOCK: # Acquire asyncio lock
-                for key in keys:
-                    if key in STORE:
-                        exists_count += 1
-            
-            return SimpleString(f"(integer) {exists_count}").encode()
-
-        elif command == "INCR":
-            # Handle INCR command
-            if len(frame.elements) != 2:
-                return Error("ERR wrong number of arguments for command").encode()
-            
-            key = frame.elements[1].data
-            async with STORE_LOCK: # Acquire Asyncio lock
-                if key in STORE:
-                    if isinstance(STORE[key], tuple) and STORE.get(key)[0].lstrip('-+').isdigit():
-                        value, expiry_time = STORE.get(key)
-                        STORE[key] = (str(int(value) + 1), expiry_time)
-                        
-                        # Log the command to the AOF file
-                        aof_command = f"*2\r\n$4\r\nINCR\r\n${len(key)}\r\n{key}\r\n"
-                        await log_to_aof(aof_command)
-                        
-                        return SimpleString(f"(integer) {int(value) + 1}").encode()
-                    else:
-                        return Error("Value is not an integer or out of range").encode()
-                else:
-                    STORE[key] = ("1", None)
-                    
-                    # Log the command to the AOF file
-                    aof_command = f"*2\r\n$4\r\nINCR\r\n${len(key)}\r\n{key}\r\n"
-                    await log_to_aof(aof_command)
-                    
-                    return SimpleString(f"(integer) 1").encode()
-
-        elif command == "DECR":
-            # Handle DECR command
-            if len(frame.elements) != 2:
-                return Error("ERR wrong number of arguments for command").encode()
-            
-            key = frame.elements[1].data
-            async with STORE_LOCK: # Acquire Asyncio lock
-                if key in STORE:
-                    if isinstance(STORE[key], tuple) and STORE.get(key)[0].lstrip('-+').isdigit():
-                        value, expiry_time = STORE.get(key)
-                        STORE[key] = (str(int(value) - 1), expiry_time)
-                        
-                        # Log the command to the AOF file
-                        aof_command = f"*2\r\n$4\r\nDECR\r\n${len(key)}\r\n{key}\r\n"
-                        await log_to_aof(aof_command)
-
-                        return SimpleString(f"(integer) {int(value) - 1}").encode()
-                    else:
-                        return Error("Value is not an integer or out of range").encode()
-                else:
-                    STORE[key] = ("-1", None)
-                    
-                    # Log the command to the AOF file
-                    aof_command = f"*2\r\n$4\r\nDECR\r\n${len(key)}\r\n{key}\r\n"
-                    await log_to_aof(aof_command)
-                    
-                    return SimpleString(f"(integer) -1").encode()
-
-        elif command == "DEL":
-            # Handle DEL command
-            if len(frame.elements) < 2:
-                return Error("DEL requires at least one key").encode()
-            
-            keys = [element.data for element in frame.elements[1:]]
-            delete_count = 0
-            async with STORE_LOCK: # Acquire asyncio lock
-                for key in keys:
-                    if key in STORE:
-                        del STORE[key]
-                        delete_count += 1
-                        
-            # Log the command to the AOF file
-            aof_command = f"*2\r\n$3\r\nDEL\r\n${len(key)}\r\n{key}\r\n"
-            await log_to_aof(aof_command)
-            
-            return SimpleString(f"(integer) {delete_count}").encode()
+async def async_process_command(args, client):
+    """
+        Execute a command through the shared registry. Handlers are synchronous, so each command
+        runs atomically on the event loop without taking a lock. Commands that changed the
+        keyspace are queued on the AOF writer, which flushes them once per loop iteration.
+    """
+    reply = submit_command(args, client)
+    if type(reply) is not bytes:
+        reply = await reply
+    return reply
 
-        else:
-            return Error("Invalid command").encode()
+def submit_command(args, client):
+    """
+        Start a command and return its reply, or an awaitable for it: a coroutine if the command
+        blocked, a future if it runs on another shard.
+    """
+    router = client.db.router
+    reply = execute(client, args) if router is None else router.submit(args, client)
+    if reply is None: # A blocking command found nothing to pop
+        return wait_until_served(client)
+    return reply
 
-    return Error("Invalid frame type").encode()
+def wait_until_served(client):
+    """
+        Return a coroutine that waits until a push serves the blocked `client` or its timeout
+        expires. Pushes hand elements to blocked clients themselves, so the wait is a plain future
+        with nothing polling the store. The waiter is taken over right away, before anything else
+        can run and serve it. With appendfsync always, the reply is returned once the pop is on disk.
+    """
+    waiter, client.waiter = client.waiter, None
+    served = asyncio.get_running_loop().create_future()
+    waiter.on_ready = lambda: served.done() or served.set_result(None)
+    return _wait(client, waiter, served)
+
+async def _wait(client, waiter, served):
+    if client.on_block is not None:
+        await client.on_block()
+    try:
+        await asyncio.wait_for(served, waiter.timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        if waiter.reply is None:
+            client.db.blocked.unblock(waiter)
+    if waiter.reply is None:
+        return TIMEOUT_REPLY
+    aof = client.db.aof
+    if aof is not None and aof.appendfsync == APPENDFSYNC_ALWAYS:
+        await aof.synced() # The pop was logged by the push that served it
+    return waiter.reply
+
+async def expiry_scheduler(db, time_budget=ACTIVE_EXPIRE_TIME_BUDGET):
+    """
+        Background task to delete expired keys.
 
-async def expiry_scheduler(STORE, STORE_LOCK):
-    """Background task to delete expired keys"""
+        Each tick pops only the keys that are due from the expiry index, spending at most
+        `time_budget` seconds on the event loop. If keys are still due when the budget runs out,
+        the next tick starts as soon as other tasks have had a turn.
+    """
     # Run indefinitely
     while True:
-        # Step 1: Get keys with expiry
-        async with STORE_LOCK:
-            keys_with_expiry = [
-                key for key, value in STORE.items()
-                if isinstance(value, tuple) and value[1] is not None
-            ]
-
-        # If No keys with expiry, wait for 100ms before checking again
-        if not keys_with_expiry:
-            await asyncio.sleep(0.1)
-            continue
-
-        # Step 2: Sample 20 keys at random
-        sampled_keys = random.sample(keys_with_expiry, min(20, len(keys_with_expiry)))
-        
-        # Step 3: Check for expired keys
-        expired_key_count = 0
-        async with STORE_LOCK:
-            for key in sampled_keys:
-                _, expiry_time = STORE.get(key)
-                if expiry_time is not None and time.time() > expiry_time:
-                    expired_key_count += 1
-                    del STORE[key]
-
-        # Step 4: Restart if more than 25% of sampled keys are 
-        if expired_key_count > 0.25 * len(sampled_keys):
-            continue
-
-        # Step 4: Wait 100ms before next check
-        await asyncio.sleep(0.1)
-
-async def replay_aof(STORE, STORE_LOCK, AOF_FILE):
-    """Replay commands from the AOF file to rebuild the dataset."""
-    try:
-        # Read the entire AOF file as a single string
-        async with asyncio.Lock():
-            with open(AOF_FILE, "rb") as file: # Open in binary mode to handle RESP format
-                content = file.read()
-
-        # Debugging: Print the raw content
-        print(f"Replaying AOF content: {content}")
-        
-        # Process commands in the AOF file
-        buffer = content
-        while buffer:
-            # Parse the RESP command from the file and execute it
-            frame, consumed = parse_frame(buffer)
-            if frame:
-                await async_process_command(frame, STORE, STORE_LOCK, AOF_FILE)
-                buffer = buffer[consumed:] # Remove processed command
-            else:
-                break # Exit if no more commands can be parsed
-    except FileNotFoundError:
-        print(f"AOF file {AOF_FILE} not found. Starting with an empty dataset.")
-
+        _, more_due = db.active_expire(time_budget)
+        await asyncio.sleep(0 if more_due else ACTIVE_EXPIRE_INTERVAL)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="pyredis server (asyncio)")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes, each serving one shard of the keyspace")
+    parser.add_argument("--maxmemory", type=parse_memory, default=0,
+                        help="evict keys past this dataset size, e.g. 100mb (0 for no limit)")
+    parser.add_argument("--maxmemory-policy", choices=MAXMEMORY_POLICIES, default=NOEVICTION)
+    parser.add_argument("--prefix-index", action="store_true",
+                        help="keep the keys sorted so KEYS with a literal prefix skips the rest")
+    parser.add_argument("--client-output-buffer-limit-pubsub", nargs=3, metavar=("HARD", "SOFT", "SECONDS"),
+                        default=(str(pubsub.PUBSUB_OUTPUT_BUFFER_HARD_LIMIT), str(pubsub.PUBSUB_OUTPUT_BUFFER_SOFT_LIMIT),
+                                 str(pubsub.PUBSUB_OUTPUT_BUFFER_SOFT_SECONDS)),
+                        help="disconnect a subscriber whose unsent messages pass HARD bytes, or SOFT bytes "
+                             "for SECONDS, e.g. 32mb 8mb 60")
+    parser.add_argument("--replicaof", nargs=2, metavar=("HOST", "PORT"),
+                        help="start as a read-only replica of the server at HOST PORT")
+    parser.add_argument("--cluster-enabled", action="store_true",
+                        help="serve the hash slots assigned with CLUSTER ADDSLOTS and redirect the others")
+    parser.add_argument("--cluster-announce-ip", default="127.0.0.1",
+                        help="address other nodes and clients are told to reach this node at")
+    parser.add_argument("--hash-max-listpack-entries", type=int, default=hashes.HASH_MAX_LISTPACK_ENTRIES)
+    parser.add_argument("--hash-max-listpack-value", type=int, default=hashes.HASH_MAX_LISTPACK_VALUE)
+    parser.add_argument("--set-max-intset-entries", type=int, default=sets.SET_MAX_INTSET_ENTRIES)
+    parser.add_argument("--zset-max-listpack-entries", type=int, default=sortedsets.ZSET_MAX_LISTPACK_ENTRIES)
+    parser.add_argument("--zset-max-listpack-value", type=int, default=sortedsets.ZSET_MAX_LISTPACK_VALUE)
+    options = parser.parse_args()
+    if options.replicaof and options.workers > 1:
+        parser.error("--replicaof needs a single worker")
+    if options.cluster_enabled and (options.workers > 1 or options.replicaof):
+        parser.error("--cluster-enabled needs a single worker and no --replicaof")
+    hard, soft, seconds = options.client_output_buffer_limit_pubsub
+    pubsub.PUBSUB_OUTPUT_BUFFER_HARD_LIMIT = parse_memory(hard)
+    pubsub.PUBSUB_OUTPUT_BUFFER_SOFT_LIMIT = parse_memory(soft)
+    pubsub.PUBSUB_OUTPUT_BUFFER_SOFT_SECONDS = int(seconds)
+    hashes.HASH_MAX_LISTPACK_ENTRIES = options.hash_max_listpack_entries
+    hashes.HASH_MAX_LISTPACK_VALUE = options.hash_max_listpack_value
+    sets.SET_MAX_INTSET_ENTRIES = options.set_max_intset_entries
+    sortedsets.ZSET_MAX_LISTPACK_ENTRIES = options.zset_max_listpack_entries
+    sortedsets.ZSET_MAX_LISTPACK_VALUE = options.zset_max_listpack_value
+    PORT = options.port
+    db = None
     try:
+        logging.basicConfig(level=logging.INFO) # Use logging.DEBUG to trace every command
         print("Using Asyncio")
-        STORE: dict = {}
-        STORE_LOCK = asyncio.Lock()
         AOF_FILE = "C:/Users/rohan/Documents/Projects/SoftwareProjects/PythonProjects/codingChallenges/redis_server/pyredis/appendonly.aof"
-        
+        APPENDFSYNC = APPENDFSYNC_EVERYSEC
+        RDB_FILE = os.path.join(os.path.dirname(AOF_FILE), "dump.rdb")
+
         async def gather_all_async_tasks():
-            # Replay the AOF file to restore the dataset
-            await replay_aof(STORE, STORE_LOCK, AOF_FILE)
+            # Restore the dataset from the AOF, or from the last snapshot if there is no AOF yet,
+            # then log new writes to the AOF
+            if os.path.exists(AOF_FILE):
+                load_aof(db, AOF_FILE)
+            elif os.path.exists(RDB_FILE):
+                db.rdb.load(db)
+            db.aof = AOFWriter(AOF_FILE, APPENDFSYNC)
+            if options.maxmemory:
+                Evictor(options.maxmemory, options.maxmemory_policy).attach(db)
+            if options.prefix_index:
+                PrefixIndex().attach(db)
+            if options.replicaof:
+                host, port = options.replicaof
+                db.replication.port = PORT
+                db.replication.replicate(host, int(port))
             
             # Start the server and expiry scheduler
             await asyncio.gather(
-            start_server_using_asyncio(STORE, STORE_LOCK, AOF_FILE),
-            expiry_scheduler(STORE, STORE_LOCK)
+            start_server_using_asyncio(db),
+            expiry_scheduler(db)
         )
-        asyncio.run(gather_all_async_tasks())
+
+        if options.workers > 1:
+            # One process per shard, each with its own AOF and snapshot file
+            from pyredis.shards import run_workers
+            run_workers(options.workers, PORT, AOF_FILE, RDB_FILE, APPENDFSYNC,
+                        options.maxmemory, options.maxmemory_policy, options.prefix_index)
+        else:
+            STORE: dict = {}
+            db = Database(STORE)
+            db.rdb = RDB(RDB_FILE)
+            if options.cluster_enabled:
+                db.cluster = Cluster(options.cluster_announce_ip, PORT)
+            asyncio.run(gather_all_async_tasks())
     except KeyboardInterrupt:
-        print("Server shutting down...")
\ No newline at end of file
+        print("Server shutting down...")
+    finally:
+        if db is not None and db.aof is not None:
+            db.aof.close()
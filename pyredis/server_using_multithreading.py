@@ -1,129 +1,500 @@
-import socket
-from threading import Thread, Lock
-from pyredis.protocol import parse_frame, Array, Error, SimpleString, BulkString, Integer
+"""
+    Threaded server mode.
+
+    A few I/O threads drive non-blocking sockets through `selectors`: they read, parse and write,
+    and hand the parsed commands of each connection to a fixed pool of worker threads, so idle
+    connections cost a buffer rather than a thread. A connection has at most one batch of commands
+    in a worker at a time, which keeps its replies in order.
+
+    Instead of one store-wide mutex the keyspace is guarded by lock striping: a command takes the
+    locks of its keys' stripes only, so commands on unrelated keys run in parallel on builds of
+    CPython without the GIL. Commands that see the whole keyspace (keyless administration commands,
+    EXEC, blocking commands, pushes that may serve blocked clients, commands that have to evict keys,
+    active expiry, AOF rewrites) take every stripe.
+"""
+import argparse, heapq, logging, os, selectors, socket, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import count
+from threading import Thread, Lock, Event
+from pyredis.protocol import RespParser, ProtocolError, Error
+from pyredis.commands import execute, lookup_command, UNQUEUED_COMMANDS, FAST, BLOCKING
+from pyredis.client import Client
+from pyredis.db import Database
+from pyredis.rdb import RDB
+from pyredis.aof import AOFWriter, load_aof, APPENDFSYNC_EVERYSEC
+from pyredis.blocking import TIMEOUT_REPLY
+from pyredis.transactions import unwatch
+from pyredis.eviction import Evictor, MAXMEMORY_POLICIES, NOEVICTION, parse_memory
+from pyredis.keyindex import PrefixIndex
+from pyredis import hashes, sets, sortedsets
 
 HOST = "0.0.0.0"
 PORT = 7
 CONCURRENCY_METHOD = "MULTITHREADING"
+READ_CHUNK_SIZE = 64 * 1024
+OUTPUT_BUFFER_HIGH_WATER = 64 * 1024 # Stop reading from a client once this many reply bytes are unsent
+IO_THREADS = 2 # Threads running the selectors
+WORKER_THREADS = 8 # Threads running commands
+LOCK_STRIPES = 64 # Locks guarding the keyspace
+ACTIVE_EXPIRE_INTERVAL = 0.1 # Seconds between active expiry ticks
+ACTIVE_EXPIRE_TIME_BUDGET = 0.025 # Longest a single tick may hold the store locks, in seconds
+
+logger = logging.getLogger(__name__)
+
 
-# Setup server to listen for connections
-def start_server_using_multiThreading(STORE, STORE_LOCK):
-    """_summary_
-        The start_server function sets up a basic TCP server using Python’s socket module and 
-        uses threading to handle multiple client connections concurrently
+class StripedLock:
     """
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
-        server_socket.bind((HOST, PORT))
-        server_socket.listen()
-        print(f"Server listening on {HOST}:{PORT}")
-        
+        LOCK_STRIPES locks guarding the keyspace; key `k` is guarded by stripe hash(k) % N.
+
+        Stripes are always acquired in ascending order, so commands locking several keys can't
+        deadlock. `exclusive` takes every stripe, for work that sees the whole keyspace.
+    """
+
+    def __init__(self, stripes=LOCK_STRIPES):
+        self._locks = [Lock() for _ in range(stripes)]
+        self.all = tuple(range(stripes))
+
+    def __len__(self):
+        return len(self._locks)
+
+    def stripes(self, keys):
+        """Return the stripes guarding `keys`, in locking order."""
+        stripes = len(self._locks)
+        if len(keys) == 1:
+            return (hash(keys[0]) % stripes,)
+        return sorted({hash(key) % stripes for key in keys})
+
+    def acquire(self, stripes):
+        locks = self._locks
+        for stripe in stripes:
+            locks[stripe].acquire()
+
+    def release(self, stripes):
+        locks = self._locks
+        for stripe in stripes:
+            locks[stripe].release()
+
+    @contextmanager
+    def exclusive(self):
+        self.acquire(self.all)
+        try:
+            yield
+        finally:
+            self.release(self.all)
+
+    def stripes_for_command(self, args):
+        """Return the stripes a command has to hold while it runs."""
+        command = lookup_command(args[0])
+        if command is None or not command.check_arity(len(args)):
+            return () # Refused without touching the keyspace
+        if BLOCKING in command.flags:
+            return self.all # Blocks or serves other blocked clients
+        keys = command.get_keys(args)
+        if keys:
+            return self.stripes(keys)
+        if FAST in command.flags:
+            return () # PING, ECHO, ...
+        return self.all
+
+
+class IOThread(Thread):
+    """
+        Runs a selector over a share of the connections. Other threads talk to it with `call_soon`
+        and `call_later`, which queue a callback and wake the selector up.
+    """
+
+    def __init__(self, index):
+        super().__init__(name=f"pyredis-io-{index}", daemon=True)
+        self.selector = selectors.DefaultSelector()
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        self.selector.register(self._wakeup_reader, selectors.EVENT_READ)
+        self._calls = deque()
+        self._timers = [] # Heap of (deadline, sequence, callback, args)
+        self._sequence = count()
+
+    def call_soon(self, callback, *args):
+        """Run `callback(*args)` on this thread. Safe to call from any thread."""
+        self._calls.append((callback, args))
+        try:
+            self._wakeup_writer.send(b"\0")
+        except BlockingIOError:
+            pass # The selector has plenty of wake-ups pending already
+
+    def call_later(self, delay, callback, *args):
+        """Run `callback(*args)` on this thread after `delay` seconds. Safe to call from any thread."""
+        self.call_soon(self._add_timer, time.monotonic() + delay, callback, args)
+
+    def _add_timer(self, deadline, callback, args):
+        heapq.heappush(self._timers, (deadline, next(self._sequence), callback, args))
+
+    def run(self):
+        selector = self.selector
+        calls = self._calls
+        timers = self._timers
         while True:
-            client_socket, client_address = server_socket.accept()
-            print(f"New connection from {client_address}")
-            Thread(target=handle_client_using_multiThreading, args=(client_socket, client_address, STORE, STORE_LOCK,)).start()
-
-# Handle client connections
-def handle_client_using_multiThreading(client_socket, client_address, STORE, STORE_LOCK):
-    # Keep handling the client as long as the socket is alive
-    while client_socket:
-        # Initialize buffer
-        buffer = b""
+            timeout = max(0, timers[0][0] - time.monotonic()) if timers else None
+            for key, events in selector.select(timeout):
+                connection = key.data
+                if connection is None:
+                    try:
+                        self._wakeup_reader.recv(4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+                if events & selectors.EVENT_WRITE:
+                    connection.on_writable()
+                if events & selectors.EVENT_READ and not connection.closed:
+                    connection.on_readable()
+            while calls:
+                callback, args = calls.popleft()
+                callback(*args)
+            now = time.monotonic()
+            while timers and timers[0][0] <= now:
+                _, _, callback, args = heapq.heappop(timers)
+                callback(*args)
+
+
+class Connection:
+    """
+        A client connection. Reading, parsing and the selector registration belong to its I/O
+        thread; running commands belongs to whichever worker holds `running`, and replies are sent
+        straight from the worker when the socket can take them.
+    """
+
+    def __init__(self, sock, addr, db, io, pool):
+        self.sock = sock
+        self.addr = addr
+        self.client = Client(db, addr)
+        self.io = io
+        self.pool = pool
+        self.parser = RespParser()
+        self.lock = Lock() # Guards everything below that workers touch
+        self.pending = deque() # Parsed commands not run yet; a ProtocolError ends the stream
+        self.running = False # A worker owns the connection: it is running commands or blocked
+        self.waiter = None # Set while blocked in BLPOP, BRPOP or BLMOVE
+        self.output = bytearray() # Replies the socket could not take yet
+        self.closing = False # Close once the output is sent
+        self.closed = False
+        self.reading = True # Cleared after a protocol error
+        self.events = 0
+
+    # I/O thread side
+
+    def open(self):
+        self.update()
+
+    def update(self):
+        """Register the selector events matching the connection's state."""
+        if self.closed:
+            return
+        with self.lock:
+            unsent = len(self.output)
+            closing = self.closing
+        if closing and not unsent:
+            self.close()
+            return
+        events = selectors.EVENT_WRITE if unsent else 0
+        if self.reading and not closing and unsent < OUTPUT_BUFFER_HIGH_WATER:
+            events |= selectors.EVENT_READ
+        if events != self.events:
+            if not events:
+                self.io.selector.unregister(self.sock)
+            elif not self.events:
+                self.io.selector.register(self.sock, events, self)
+            else:
+                self.io.selector.modify(self.sock, events, self)
+            self.events = events
+
+    def on_readable(self):
+        try:
+            data = self.sock.recv(READ_CHUNK_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            logger.debug("Client %s disconnected", self.addr)
+            self.close()
+            return
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Raw data received from %s: %r", self.addr, data)
+
+        # Parse every complete command, the parser keeps any partial one for the next read
+        self.parser.feed(data)
+        commands = []
         try:
-            while True:
+            commands.extend(self.parser)
+        except ProtocolError as e:
+            commands.append(e) # The stream can't be resynchronised, stop reading
+            self.reading = False
+            self.update()
+        if not commands:
+            return
+        with self.lock:
+            self.pending.extend(commands)
+            if self.running:
+                return # The worker picks them up when it is done
+            self.running = True
+        self.pool.submit(self.run)
+
+    def on_writable(self):
+        with self.lock:
+            if self.output:
                 try:
-                    # Receive data from client
-                    data = client_socket.recv(4096)
-                    if not data:
-                        print("Client disconnected")
-                        client_socket.close()
-                        return # Exit the function
-                    
-                    print(f"Raw data received from {client_address}: {data}")
-                    # Append newly received data to the buffer
-                    buffer += data
-                    while buffer:
-                        frame, consumed = parse_frame(buffer)
-                        if frame is None:
-                            break # Wait for more data
-                        
-                        # Remove processed data
-                        buffer = buffer[consumed:]
-
-                        # Handle the command
-                        response = sync_process_command(frame, STORE, STORE_LOCK)
-                        print(f"Sending response: {response}")
-                        client_socket.sendall(response)
-                except Exception as e:
-                    print(f"Error: {e}")
+                    sent = self.sock.send(self.output)
+                except BlockingIOError:
+                    return
+                except OSError:
+                    sent = len(self.output) # Dropped; the next read notices the broken connection
+                del self.output[:sent]
+        self.update()
+
+    def close(self):
+        if self.closed:
+            return
+        with self.lock:
+            self.closed = True
+            waiter, self.waiter = self.waiter, None
+        if self.events:
+            self.io.selector.unregister(self.sock)
+        self.sock.close()
+        if waiter is not None or self.client.watching:
+            self.pool.submit(self._abandon, waiter)
+
+    # Worker side
+
+    def run(self):
+        """Run the commands received so far, then send their replies in one go."""
+        with self.lock:
+            batch = list(self.pending)
+            self.pending.clear()
+        client = self.client
+        replies = []
+        blocked = False
+        try:
+            for position, args in enumerate(batch):
+                if isinstance(args, ProtocolError):
+                    replies.append(Error(f"ERR {args}").encode())
+                    self.closing = True
                     break
-        except Exception as e:
-            print(f"Error: {e}")
-            client_socket.close()
-            client_socket = None
-            break
+                reply = sync_process_command(args, client, self._park)
+                if reply is None: # Blocked: the rest of the batch waits for it
+                    with self.lock:
+                        self.pending.extendleft(reversed(batch[position + 1:]))
+                    blocked = True
+                    break
+                replies.append(reply)
+            _commit(client.db)
+        except Exception:
+            logger.exception("Error handling client %s", self.addr)
+            self.closing = True
+        self.send(b"".join(replies))
+        if not blocked:
+            self._next()
+
+    def send(self, data):
+        """Send replies right away, buffering what the socket can't take for the I/O thread."""
+        with self.lock:
+            if self.closed:
+                return
+            if data and not self.output:
+                try:
+                    sent = self.sock.send(data)
+                except BlockingIOError:
+                    sent = 0
+                except OSError:
+                    sent = len(data) # Dropped; the I/O thread notices the broken connection
+                data = data[sent:]
+            self.output += data
+            notify = self.closing or self.output
+        if notify:
+            self.io.call_soon(self.update)
+
+    def _next(self):
+        # Run the commands that arrived meanwhile in another task, so busy clients take turns
+        with self.lock:
+            if not self.pending or self.closed or self.closing:
+                self.running = False
+                return
+        self.pool.submit(self.run)
+
+    def _park(self, waiter):
+        # Called while every stripe is held, before anything can serve the waiter
+        self.waiter = waiter
+        waiter.on_ready = lambda: self.pool.submit(self._resume, waiter)
+        if waiter.timeout is not None:
+            self.io.call_later(waiter.timeout, lambda: self.pool.submit(self._time_out, waiter))
+
+    def _resume(self, waiter):
+        with self.lock:
+            if self.waiter is waiter:
+                self.waiter = None
+        _commit(self.client.db)
+        self.send(waiter.reply)
+        self._next()
+
+    def _time_out(self, waiter):
+        db = self.client.db
+        with db.locks.exclusive():
+            if waiter.reply is not None:
+                return # Served in the meantime, `_resume` replies
+            db.blocked.unblock(waiter)
+        with self.lock:
+            self.waiter = None
+        self.send(TIMEOUT_REPLY)
+        self._next()
+
+    def _abandon(self, waiter):
+        # The connection went away while blocked or watching keys
+        db = self.client.db
+        with db.locks.exclusive():
+            if waiter is not None and waiter.reply is None:
+                db.blocked.unblock(waiter)
+            unwatch(self.client)
+
+
+def _commit(db):
+    # Write and, with appendfsync always, fsync the commands run so far, before replying
+    aof = db.aof
+    if aof is None:
+        return
+    aof.commit()
+    if aof.rewrite_due():
+        with db.locks.exclusive(): # The rewrite snapshot must not see commands half done
+            if aof.rewrite_due():
+                aof.start_rewrite(db)
+
+def start_server_using_multiThreading(db, port=None, io_threads=IO_THREADS, workers=WORKER_THREADS):
+    """Start the threaded server and accept connections forever."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_socket.bind((HOST, PORT if port is None else port))
+        server_socket.listen(1024)
+        print(f"Server listening on {server_socket.getsockname()}")
+        serve_using_multiThreading(server_socket, db, io_threads, workers)
+
+def serve_using_multiThreading(server_socket, db, io_threads=IO_THREADS, workers=WORKER_THREADS):
+    """Accept connections on a listening socket and spread them over the I/O threads."""
+    if db.locks is None:
+        db.use_lock_striping(StripedLock())
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pyredis-worker")
+    threads = [IOThread(index) for index in range(io_threads)]
+    for thread in threads:
+        thread.start()
+    Thread(target=expiry_scheduler, args=(db,), daemon=True).start()
+
+    for accepted in count():
+        client_socket, client_address = server_socket.accept()
+        logger.debug("New connection from %s", client_address)
+        client_socket.setblocking(False)
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        io = threads[accepted % io_threads]
+        io.call_soon(Connection(client_socket, client_address, db, io, pool).open)
 
 # Handle the command
-def sync_process_command(frame, STORE, STORE_LOCK):
-    if isinstance(frame, Array):
-        if not frame.elements:
-            return Error("Empty command").encode()
-        
-        command = frame.elements[0].data.upper()
-        if command == "COMMAND":
-            # Stub response for COMMAND
-            return BulkString("OK").encode()
-        
-        elif command == "INFO":
-            if len(frame.elements) > 1 and frame.elements[1].data.upper() == "SERVER":
-                return BulkString("# Server\nredis_version:0.1.0\n").encode()
-            return BulkString("").encode()
-        
-        elif command == "ECHO":
-            # Handle ECHO command
-            if len(frame.elements) < 2:
-                return Error("ECHO requires an argument").encode()
-            concatenated = " ".join(element.data for element in frame.elements[1:])
-            return BulkString(concatenated).encode()
-        
-        elif command == "PING":
-            # Handle PING command
-            if len(frame.elements) > 1:
-                return SimpleString(frame.elements[1].data).encode()
-            return SimpleString("PONG").encode()
-        
-        elif command == "SET":
-            # Handle SET command
-            if len(frame.elements) < 3:
-                return Error("SET requires a key and a value").encode()
-            
-            key = frame.elements[1].data
-            value = frame.elements[2].data
-            with STORE_LOCK: # Acquire Threading Lock
-                STORE[key] = value # Store the key-value pair, overwrite value if key already exists
-            return SimpleString("OK").encode()
-        
-        elif command == "GET":
-            # Handle GET command
-            if len(frame.elements) < 2:
-                return Error("GET requires a key").encode()
-            
-            key = frame.elements[1].data
-            with STORE_LOCK: # Acquire Threading Lock
-                value = STORE.get(key) # Retrieve the value for the key
-            if value is None:
-                return BulkString(None).encode() # RESP null bulk string for missing keys
-            return BulkString(value).encode()
-        
-        else:
-            return Error("Invalid command").encode()
-
-    return Error("Invalid frame type").encode()
+def sync_process_command(args, client, on_blocked=None):
+    """
+        Execute a command through the shared registry while holding the lock stripes of its keys
+        (see `StripedLock.stripes_for_command`).
+
+        When a blocking command has to wait, `on_blocked(waiter)` is called while every stripe is
+        still held, so it can set `waiter.on_ready` before a push can serve the waiter, and None is
+        returned. Without `on_blocked` the calling thread waits for the reply itself.
+    """
+    db = client.db
+    locks = db.locks
+    if client.transaction is not None and _queued(args):
+        stripes = () # Only queued, see transactions
+    else:
+        stripes = locks.stripes_for_command(args)
+    locks.acquire(stripes)
+    try:
+        if len(stripes) < len(locks) and (db.blocked or db.evictor is not None and db.evictor.over_limit(db)):
+            # Clients are blocked: a push may serve them, touching keys of any stripe. Nobody can
+            # block while a stripe is held, so this can't change once the stripes are taken.
+            # Likewise eviction deletes keys of any stripe.
+            locks.release(stripes)
+            stripes = locks.all
+            locks.acquire(stripes)
+        reply = execute(client, args)
+        if reply is not None:
+            return reply
+        waiter, client.waiter = client.waiter, None
+        if on_blocked is not None:
+            on_blocked(waiter)
+            return None
+        served = Event()
+        waiter.on_ready = served.set
+    finally:
+        locks.release(stripes)
+
+    if client.on_block is not None:
+        client.on_block()
+    served.wait(waiter.timeout)
+    with locks.exclusive():
+        if waiter.reply is None:
+            db.blocked.unblock(waiter)
+            return TIMEOUT_REPLY
+        return waiter.reply
+
+def _queued(args):
+    """Whether a command received between MULTI and EXEC is queued rather than run."""
+    command = lookup_command(args[0])
+    return command is None or command.name not in UNQUEUED_COMMANDS
+
+def expiry_scheduler(db, time_budget=ACTIVE_EXPIRE_TIME_BUDGET):
+    """Background thread to delete expired keys, holding the store locks for at most `time_budget` per tick."""
+    while True:
+        with db.locks.exclusive():
+            _, more_due = db.active_expire(time_budget)
+        if not more_due:
+            time.sleep(ACTIVE_EXPIRE_INTERVAL)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="pyredis server (threads)")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--maxmemory", type=parse_memory, default=0,
+                        help="evict keys past this dataset size, e.g. 100mb (0 for no limit)")
+    parser.add_argument("--maxmemory-policy", choices=MAXMEMORY_POLICIES, default=NOEVICTION)
+    parser.add_argument("--prefix-index", action="store_true",
+                        help="keep the keys sorted so KEYS with a literal prefix skips the rest")
+    parser.add_argument("--hash-max-listpack-entries", type=int, default=hashes.HASH_MAX_LISTPACK_ENTRIES)
+    parser.add_argument("--hash-max-listpack-value", type=int, default=hashes.HASH_MAX_LISTPACK_VALUE)
+    parser.add_argument("--set-max-intset-entries", type=int, default=sets.SET_MAX_INTSET_ENTRIES)
+    parser.add_argument("--zset-max-listpack-entries", type=int, default=sortedsets.ZSET_MAX_LISTPACK_ENTRIES)
+    parser.add_argument("--zset-max-listpack-value", type=int, default=sortedsets.ZSET_MAX_LISTPACK_VALUE)
+    options = parser.parse_args()
+    hashes.HASH_MAX_LISTPACK_ENTRIES = options.hash_max_listpack_entries
+    hashes.HASH_MAX_LISTPACK_VALUE = options.hash_max_listpack_value
+    sets.SET_MAX_INTSET_ENTRIES = options.set_max_intset_entries
+    sortedsets.ZSET_MAX_LISTPACK_ENTRIES = options.zset_max_listpack_entries
+    sortedsets.ZSET_MAX_LISTPACK_VALUE = options.zset_max_listpack_value
+    db = None
     try:
-        STORE: dict = {}
-        STORE_LOCK = Lock()
+        logging.basicConfig(level=logging.INFO) # Use logging.DEBUG to trace every command
+        AOF_FILE = "appendonly.aof"
+        APPENDFSYNC = APPENDFSYNC_EVERYSEC
+        RDB_FILE = "dump.rdb"
         print("Using MultiThreading")
-        start_server_using_multiThreading(STORE, STORE_LOCK)
+        db = Database()
+        db.rdb = RDB(RDB_FILE)
+        # Restore the dataset from the AOF, or from the last snapshot if there is no AOF yet
+        if os.path.exists(AOF_FILE):
+            load_aof(db, AOF_FILE)
+        elif os.path.exists(RDB_FILE):
+            db.rdb.load(db)
+        db.aof = AOFWriter(AOF_FILE, APPENDFSYNC)
+        if options.maxmemory:
+            Evictor(options.maxmemory, options.maxmemory_policy).attach(db)
+        if options.prefix_index:
+            PrefixIndex().attach(db)
+        start_server_using_multiThreading(db, options.port)
     except KeyboardInterrupt:
         print("Server shutting down...")
+    finally:
+        if db is not None and db.aof is not None:
+            db.aof.close()
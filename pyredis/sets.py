@@ -0,0 +1,246 @@
+import random, sys
+from array import array
+from bisect import bisect_left
+from itertools import filterfalse
+from pyredis.encoding import encode_string, shared_integer, string_bytes, string_memory
+from pyredis.scanindex import ScanIndex
+
+SET_MAX_INTSET_ENTRIES = 512 # Most members a set of integers keeps in the compact encoding
+
+# Estimated footprint of the parts of a set, see `memory_usage`
+_SET_HEADER = 64 # The Set object
+
+
+class Set:
+    """
+        The set type, in one of two encodings:
+
+        intset    - a sorted array('q') of 64-bit integers, searched with bisect: 8 bytes a member
+                    and no Python object per member. Used while every member is the canonical form
+                    of an integer and there are at most SET_MAX_INTSET_ENTRIES of them.
+        hashtable - a Python set. It has no random access, so once SPOP or SRANDMEMBER first picks
+                    from it, its members are mirrored in a list with a member -> position dict, kept
+                    up to date by swapping the last member into a removed one's place; picking is
+                    then O(1) a member. A set never goes back to the intset encoding, like in Redis.
+
+        Members are received as bytes but stored as strings are (see `encoding.encode_string`): an
+        int when they spell one, so converting an intset keeps its members as ints, and a member is
+        normalised once and then probed against any encoding as is. The "value" methods take and
+        return normalised members, `string_bytes` turns them back into bytes. The memory taken by
+        the members of a hashtable is kept up to date, so `memory_usage` is O(1). `accounted` is the
+        footprint the keyspace last counted for the set (see `Database.modified`). SSCAN walks a
+        hashtable through a ScanIndex, built on the first scan.
+    """
+
+    __slots__ = ("_values", "_bytes", "_scan", "_list", "_positions", "accounted")
+
+    def __init__(self, members=()):
+        self._values = array("q")
+        self._bytes = 0 # Memory taken by the members, in the hashtable encoding
+        self._scan = None # ScanIndex of a hashtable, once it has been scanned
+        self._list = None # The members of a hashtable in a list, once one has been picked at random...
+        self._positions = None # ...and the position of each in it
+        self.accounted = 0
+        for member in members:
+            self.add(member)
+
+    @classmethod
+    def from_values(cls, values):
+        """Build a set from distinct normalised members, in the encoding they call for."""
+        values = list(values)
+        clone = cls()
+        if len(values) <= SET_MAX_INTSET_ENTRIES and all(type(value) is int for value in values):
+            values.sort()
+            clone._values = array("q", values)
+        else:
+            clone._values = {shared_integer(value) if type(value) is int else value for value in values}
+            clone._bytes = sum(map(string_memory, clone._values))
+        return clone
+
+    @property
+    def encoding(self):
+        return "intset" if type(self._values) is array else "hashtable"
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, member):
+        return self.has(encode_string(member))
+
+    def __eq__(self, other):
+        if isinstance(other, Set):
+            return len(self) == len(other) and all(map(other.has, self._values))
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Set({set(self.members())!r})"
+
+    def copy(self):
+        clone = Set()
+        values = self._values
+        clone._values = values[:] if type(values) is array else values.copy()
+        clone._bytes = self._bytes
+        clone.accounted = self.accounted
+        return clone
+
+    def memory_usage(self):
+        """Estimated number of bytes the set takes up."""
+        return _SET_HEADER + sys.getsizeof(self._values) + self._bytes
+
+    def add(self, member):
+        """Add `member` (bytes), returning True if it is new."""
+        return self.add_value(encode_string(member))
+
+    def remove(self, member):
+        """Remove `member` (bytes), returning True if it was in the set."""
+        return self.remove_value(encode_string(member))
+
+    def members(self):
+        """Iterate over the members as bytes."""
+        return map(string_bytes, self._values)
+
+    def values(self):
+        """Iterate over the normalised members: ascending ints in an intset, else in no order."""
+        return iter(self._values)
+
+    def has(self, value):
+        """Whether the normalised member `value` is in the set."""
+        values = self._values
+        if type(values) is not array:
+            return value in values
+        if type(value) is not int:
+            return False
+        i = bisect_left(values, value)
+        return i < len(values) and values[i] == value
+
+    def add_value(self, value):
+        """Add the normalised member `value`, returning True if it is new."""
+        values = self._values
+        if type(values) is array:
+            if type(value) is int:
+                i = bisect_left(values, value)
+                if i < len(values) and values[i] == value:
+                    return False
+                if len(values) < SET_MAX_INTSET_ENTRIES:
+                    values.insert(i, value)
+                    return True
+            values = self._convert()
+        if value in values:
+            return False
+        values.add(value)
+        self._bytes += string_memory(value)
+        if self._scan is not None:
+            self._scan.add(value)
+        if self._list is not None:
+            self._positions[value] = len(self._list)
+            self._list.append(value)
+        return True
+
+    def remove_value(self, value):
+        """Remove the normalised member `value`, returning True if it was in the set."""
+        values = self._values
+        if type(values) is array:
+            if type(value) is not int:
+                return False
+            i = bisect_left(values, value)
+            if i == len(values) or values[i] != value:
+                return False
+            del values[i]
+            return True
+        if value not in values:
+            return False
+        values.remove(value)
+        self._bytes -= string_memory(value)
+        if self._scan is not None:
+            self._scan.remove(value)
+        if self._list is not None:
+            # Move the last member into the hole
+            members, positions = self._list, self._positions
+            position = positions.pop(value)
+            last = members.pop()
+            if position < len(members):
+                members[position] = last
+                positions[last] = position
+        return True
+
+    def scan(self, cursor, count):
+        """
+            Return the cursor to continue from (0 once done) and about `count` members as bytes
+            from `cursor` on. An intset is small and returned whole.
+        """
+        values = self._values
+        if type(values) is array:
+            return 0, list(self.members())
+        if self._scan is None:
+            self._scan = ScanIndex(values)
+        cursor, found = self._scan.scan(cursor, count)
+        return cursor, list(map(string_bytes, found))
+
+    def random_value(self):
+        """Return a random normalised member; the set must not be empty."""
+        values = self._values
+        if type(values) is array:
+            return shared_integer(values[random.randrange(len(values))])
+        return random.choice(self._indexed())
+
+    def random_values(self, count):
+        """
+            Return `count` random normalised members: distinct ones (at most all of the set) if
+            `count` is positive, possibly repeated ones if it is negative.
+        """
+        values = self._values
+        if count >= len(values):
+            return list(values)
+        if type(values) is not array:
+            values = self._indexed()
+        if count < 0:
+            return random.choices(values, k=-count)
+        return random.sample(values, count)
+
+    def _indexed(self):
+        # The members of a hashtable as a list, for random access
+        if self._list is None:
+            self._list = list(self._values)
+            self._positions = {value: position for position, value in enumerate(self._list)}
+        return self._list
+
+    def _probe(self):
+        # A function telling whether a normalised member is in the set, a C one when possible
+        values = self._values
+        return self.has if type(values) is array else values.__contains__
+
+    def _convert(self):
+        # Switch to the hashtable encoding
+        self._values = set(map(shared_integer, self._values))
+        self._bytes = sum(map(string_memory, self._values))
+        return self._values
+
+
+def intersection(sets):
+    """
+        Iterate over the normalised members found in all of `sets`. The smallest set is scanned
+        and each member looked up in the others, largest last since it is the least selective; no
+        intermediate collection is built, so intersecting a few members with a huge set is cheap.
+    """
+    sets = sorted(sets, key=len)
+    if not sets or not sets[0]:
+        return iter(())
+    result = iter(sets[0]._values)
+    for other in sets[1:]:
+        result = filter(other._probe(), result)
+    return result
+
+def union(sets):
+    """Return a Python set of the normalised members found in any of `sets`."""
+    result = set()
+    for members in sets:
+        result.update(members._values)
+    return result
+
+def difference(first, others):
+    """Iterate over the normalised members of `first` that are in none of `others`."""
+    result = iter(first._values)
+    for other in others:
+        if other:
+            result = filterfalse(other._probe(), result)
+    return result
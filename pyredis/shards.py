@@ -0,0 +1,365 @@
+"""
+    Sharded server mode: `--workers N` runs N processes, each owning one hash partition of the
+    keyspace.
+
+    Every worker listens on the same port with SO_REUSEPORT, so the kernel spreads connections over
+    them, and has its own Database, AOF and snapshot file. A command whose keys all live in the
+    receiving worker's shard runs locally. A command for another shard is forwarded over a local
+    socket pair to the worker that owns it; the forwarded commands of one event loop iteration go
+    out in a single write, and the owner runs them like any other client and sends the replies
+    back. Multi-key commands listed in FANOUT are split by shard and their replies merged; other
+    commands whose keys span shards are refused with CROSSSLOT. DBSIZE and KEYS run on every shard
+    and their replies are merged, and SCAN walks the shards one after the other. PUBLISH reaches
+    the subscribers connected to every worker and counts them all. WATCH and the commands of a
+    transaction may only use keys of the receiving worker, which runs the EXEC by itself.
+
+    The shard count must stay the same across restarts, since keys are assigned to shards (and
+    their files) by hash.
+"""
+import asyncio, logging, multiprocessing, os, resource, signal, socket, sys, zlib
+from itertools import count
+from pyredis.protocol import Error, OK, RespParser, encode_bulk, encode_command, encode_integer, reply_end, split_array
+from pyredis.commands import execute, lookup_command, refuse, UNQUEUED_COMMANDS
+from pyredis.client import Client
+from pyredis.aof import AOFWriter, load_aof, APPENDFSYNC_ALWAYS
+from pyredis.db import Database
+from pyredis.rdb import RDB
+from pyredis.eviction import Evictor, NOEVICTION
+from pyredis.keyindex import PrefixIndex, SLOTS
+from pyredis import server
+
+CROSSSLOT_ERROR = Error("CROSSSLOT Keys in request don't hash to the same shard").encode()
+NOT_LOCAL_ERROR = Error("ERR transactions can only use keys of the shard serving the connection").encode()
+
+logger = logging.getLogger(__name__)
+
+
+def shard_file(filename, index):
+    """Per-shard variant of a persistence file name: appendonly.aof -> appendonly-3.aof."""
+    root, ext = os.path.splitext(filename)
+    return f"{root}-{index}{ext}"
+
+
+def _merge_sum(replies, groups):
+    # DEL, EXISTS: add up the integer replies of every shard
+    total = 0
+    for reply in replies:
+        if reply[:1] != b":":
+            return reply
+        total += int(reply[1:-2])
+    return encode_integer(total)
+
+def _merge_ok(replies, groups):
+    # MSET: OK once every shard has stored its part
+    for reply in replies:
+        if reply != OK:
+            return reply
+    return OK
+
+def _merge_by_key(replies, groups):
+    # MGET: put every shard's elements back at the positions of their keys
+    merged = [None] * sum(len(positions) for positions in groups)
+    for reply, positions in zip(replies, groups):
+        if reply[:1] != b"*":
+            return reply
+        for position, element in zip(positions, split_array(reply)):
+            merged[position] = element
+    return b"*%d\r\n" % len(merged) + b"".join(merged)
+
+def _merge_concat(replies, groups):
+    # KEYS: the elements of every shard, one shard after the other
+    total = 0
+    parts = []
+    for reply in replies:
+        if reply[:1] != b"*":
+            return reply
+        header_end = reply.index(b"\r\n")
+        total += int(reply[1:header_end])
+        parts.append(reply[header_end + 2:])
+    return b"*%d\r\n" % total + b"".join(parts)
+
+# Command name -> merge function for multi-key commands that may span shards
+FANOUT = {
+    "del": _merge_sum,
+    "exists": _merge_sum,
+    "mget": _merge_by_key,
+    "mset": _merge_ok,
+}
+
+# Command name -> merge function for keyless commands that run on every shard
+BROADCAST = {
+    "dbsize": _merge_sum,
+    "keys": _merge_concat,
+    "publish": _merge_sum,
+}
+
+
+class ShardRouter:
+    """Routes each command of a worker's clients to the shard that owns its keys."""
+
+    def __init__(self, index, shards):
+        self.index = index
+        self.shards = shards
+        self.links = {} # Shard index -> ShardLink
+
+    def shard_of(self, key):
+        """Return the index of the shard that owns `key`."""
+        return zlib.crc32(key) % self.shards
+
+    def submit(self, args, client):
+        """
+            Start a command. Local commands run straight away and return their reply (or None if
+            they block, as `execute` does); commands for other shards are queued on their links
+            right now, so they keep the client's order, and return a future for the reply.
+        """
+        command = lookup_command(args[0])
+        if command is None or not command.check_arity(len(args)):
+            return execute(client, args) # Errors are handled locally
+        if not command.first_key:
+            if command.name not in BROADCAST and command.name != "scan":
+                return execute(client, args) # Other keyless commands are handled locally
+            if client.transaction is not None:
+                return refuse(client, NOT_LOCAL_ERROR)
+            if command.name == "scan":
+                return self._scan(args, client)
+            return self._broadcast(args, client, BROADCAST[command.name])
+        keys = command.get_keys(args)
+        if not keys:
+            return execute(client, args)
+
+        owner = self.shard_of(keys[0])
+        if command.name == "watch" or client.transaction is not None and command.name not in UNQUEUED_COMMANDS:
+            # EXEC runs the queue locally, in one go
+            if owner != self.index or any(self.shard_of(key) != owner for key in keys[1:]):
+                return refuse(client, NOT_LOCAL_ERROR)
+            return execute(client, args)
+        if all(self.shard_of(key) == owner for key in keys[1:]):
+            if owner == self.index:
+                return execute(client, args)
+            return self.links[owner].request(args)
+
+        merge = FANOUT.get(command.name)
+        if merge is None:
+            return CROSSSLOT_ERROR
+        return self._fan_out(args, client, command, merge)
+
+    def _fan_out(self, args, client, command, merge):
+        # Split the keys (with the arguments that follow each of them) by shard, preserving order
+        step = command.step
+        last = command.last_key if command.last_key >= 0 else len(args) + command.last_key
+        parts = {}
+        for key_index, position in enumerate(range(command.first_key, last + 1, step)):
+            positions, sub_args = parts.setdefault(self.shard_of(args[position]), ([], [args[0]]))
+            positions.append(key_index)
+            sub_args += args[position:position + step]
+
+        pending = []
+        for shard, (_, sub_args) in parts.items():
+            if shard == self.index:
+                pending.append(execute(client, sub_args))
+            else:
+                pending.append(self.links[shard].request(sub_args))
+        groups = [positions for positions, _ in parts.values()]
+        return asyncio.ensure_future(self._merge(pending, groups, merge))
+
+    def _broadcast(self, args, client, merge):
+        # Run the command on every shard, this one included
+        pending = [execute(client, args) if shard == self.index else self.links[shard].request(args)
+                   for shard in range(self.shards)]
+        return asyncio.ensure_future(self._merge(pending, None, merge))
+
+    async def _merge(self, pending, groups, merge):
+        replies = [reply if type(reply) is bytes else await reply for reply in pending]
+        return merge(replies, groups)
+
+    def _scan(self, args, client):
+        # The cursor is shard * SLOTS + the cursor of that shard's own SCAN: the shard is in its
+        # high bits, so a full iteration visits every slot of shard 0, then of shard 1, and so on
+        try:
+            shard, cursor = divmod(int(args[1]), SLOTS)
+        except ValueError:
+            return execute(client, args) # Let SCAN report the bad cursor
+        if shard >= self.shards:
+            return execute(client, [args[0], b"%d" % SLOTS, *args[2:]]) # Past the end: nothing left
+        sub_args = [args[0], b"%d" % cursor, *args[2:]]
+        reply = execute(client, sub_args) if shard == self.index else self.links[shard].request(sub_args)
+        return asyncio.ensure_future(self._scan_reply(reply, shard))
+
+    async def _scan_reply(self, reply, shard):
+        if type(reply) is not bytes:
+            reply = await reply
+        if reply[:1] != b"*":
+            return reply
+        cursor, keys = split_array(reply)
+        cursor = int(cursor.split(b"\r\n")[1])
+        if cursor:
+            cursor += shard * SLOTS
+        elif shard + 1 < self.shards:
+            cursor = (shard + 1) * SLOTS # Done with this shard, go on with the next one
+        return b"*2\r\n" + encode_bulk(b"%d" % cursor) + keys
+
+
+class ShardLink:
+    """
+        One worker's end of the socket pair to another worker. Both workers send requests over it
+        and serve the other's requests.
+
+        A request is the command with a request id prepended as its first argument; a reply is a
+        two element array of the id and the raw reply. Ids let a forwarded blocking command reply
+        after commands sent behind it.
+    """
+
+    def __init__(self, db, peer, sock):
+        self.db = db
+        self.peer = peer
+        self.sock = sock
+        self.client = Client(db, f"shard-{peer}")
+        self.pending = {} # Request id -> future for its reply
+        self._ids = count()
+        self._outgoing = []
+        self._writer = None
+
+    async def start(self):
+        reader, self._writer = await asyncio.open_connection(sock=self.sock)
+        asyncio.ensure_future(self._read_loop(reader))
+
+    def request(self, args):
+        """Forward a command to the peer and return a future for its encoded reply."""
+        request_id = next(self._ids)
+        reply = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = reply
+        self._send(encode_command([b"%d" % request_id, *args]))
+        return reply
+
+    def _send(self, data):
+        # Everything sent during one loop iteration goes out in a single write
+        if not self._outgoing:
+            asyncio.get_running_loop().call_soon(self._flush)
+        self._outgoing.append(data)
+
+    def _flush(self):
+        if self._outgoing:
+            self._writer.write(b"".join(self._outgoing))
+            self._outgoing.clear()
+
+    async def _read_loop(self, reader):
+        buffer = bytearray()
+        try:
+            while True:
+                data = await reader.read(server.READ_CHUNK_SIZE)
+                if not data:
+                    break
+                buffer += data
+                offset = 0
+                replies = []
+                aof = self.db.aof
+                fed = aof.offset if aof is not None else 0
+                while True:
+                    end = reply_end(buffer, offset)
+                    if end == -1:
+                        break
+                    frame = bytes(buffer[offset:end])
+                    offset = end
+                    header_end = frame.index(b"\r\n") + 2
+                    if frame[header_end] == 58: # b":", a reply to one of our requests
+                        id_end = frame.index(b"\r\n", header_end)
+                        self.pending.pop(int(frame[header_end + 1:id_end])).set_result(frame[id_end + 2:])
+                    else:
+                        self._serve(RespParser(frame).get_command(), replies)
+                del buffer[:offset]
+                if aof is not None and aof.offset != fed and aof.appendfsync == APPENDFSYNC_ALWAYS:
+                    await aof.synced(aof.offset)
+                for reply in replies:
+                    self._send(reply)
+        finally:
+            logger.warning("Lost the link to shard %d", self.peer)
+            for reply in self.pending.values():
+                reply.set_result(Error(f"ERR shard {self.peer} is unavailable").encode())
+            self.pending.clear()
+
+    def _serve(self, args, replies):
+        request_id, args = args[0], args[1:]
+        reply = execute(self.client, args)
+        if reply is None: # A forwarded blocking command: reply whenever it is served
+            asyncio.ensure_future(self._reply_later(request_id, server.wait_until_served(self.client)))
+        elif type(reply) is not bytes: # KEYS collecting a large keyspace a batch at a time
+            asyncio.ensure_future(self._reply_later(request_id, reply))
+        else:
+            replies.append(b"*2\r\n:%b\r\n%b" % (request_id, reply))
+
+    async def _reply_later(self, request_id, waiting):
+        self._send(b"*2\r\n:%b\r\n%b" % (request_id, await waiting))
+
+
+async def _run_shard(db, index, shards, sockets, port):
+    router = db.router = ShardRouter(index, shards)
+    for peer, sock in sockets.items():
+        router.links[peer] = link = ShardLink(db, peer, sock)
+        await link.start()
+    await asyncio.gather(
+        server.start_server_using_asyncio(db, port=port, reuse_port=True),
+        server.expiry_scheduler(db),
+    )
+
+def _worker_main(index, shards, sockets, port, aof_file, rdb_file, appendfsync, maxmemory, policy, prefix_index):
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # The parent stops the workers
+    logging.basicConfig(level=logging.INFO, format=f"[shard {index}] %(levelname)s:%(name)s:%(message)s")
+    db = Database()
+    db.rdb = RDB(shard_file(rdb_file, index))
+    aof_file = shard_file(aof_file, index)
+    if os.path.exists(aof_file):
+        load_aof(db, aof_file)
+    elif os.path.exists(db.rdb.filename):
+        db.rdb.load(db)
+    db.aof = AOFWriter(aof_file, appendfsync)
+    if maxmemory:
+        Evictor(maxmemory, policy).attach(db)
+    if prefix_index:
+        PrefixIndex().attach(db)
+    try:
+        asyncio.run(_run_shard(db, index, shards, sockets, port))
+    finally:
+        db.aof.close()
+
+def run_workers(workers, port, aof_file, rdb_file, appendfsync, maxmemory=0, policy=NOEVICTION, prefix_index=False):
+    """
+        Start `workers` shard processes serving `port` and wait for them. Each shard gets an equal
+        part of `maxmemory`.
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise RuntimeError("--workers needs SO_REUSEPORT, which this platform does not support")
+    # One socket pair per pair of workers
+    needed = workers * (workers - 1) + 64
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+    pairs = {(i, j): socket.socketpair() for i in range(workers) for j in range(i + 1, workers)}
+
+    processes = []
+    context = multiprocessing.get_context("fork") # Workers inherit the socket pairs
+    for index in range(workers):
+        sockets = {}
+        for (i, j), (a, b) in pairs.items():
+            if i == index:
+                sockets[j] = a
+            elif j == index:
+                sockets[i] = b
+        process = context.Process(target=_worker_main, name=f"pyredis-shard-{index}",
+                                  args=(index, workers, sockets, port, aof_file, rdb_file, appendfsync,
+                                        maxmemory // workers, policy, prefix_index))
+        process.start()
+        processes.append(process)
+    for a, b in pairs.values():
+        a.close()
+        b.close()
+
+    print(f"Started {workers} shard workers on port {port}")
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0)) # Take the workers down too
+    try:
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+                process.join()
@@ -0,0 +1,392 @@
+import random, sys
+from bisect import bisect_left, bisect_right, insort
+from operator import itemgetter
+from pyredis.scanindex import ScanIndex
+
+ZSET_MAX_LISTPACK_ENTRIES = 128 # Most members a sorted set keeps in the compact encoding...
+ZSET_MAX_LISTPACK_VALUE = 64 # ...as long as no member is longer than this
+
+ZSKIPLIST_MAXLEVEL = 32
+ZSKIPLIST_P = 0.25 # Chance for a node to reach the next level
+
+_score = itemgetter(0)
+
+
+def format_score(score):
+    """Encode a score the way Redis replies with it: 1, 1.5, 1e+20, inf."""
+    text = repr(score)
+    return (text[:-2] if text.endswith(".0") else text).encode()
+
+
+class _Node:
+    __slots__ = ("score", "member", "forward", "span", "backward")
+
+    def __init__(self, level, score, member):
+        self.score = score
+        self.member = member
+        self.forward = [None] * level # Next node on each level
+        self.span = [0] * level # Number of nodes each forward link skips over, for ranks
+        self.backward = None
+
+
+def _precedes(node, score, member, inclusive):
+    # Whether `node` sorts before (score, member), or at it if `inclusive`. With no member, only
+    # the scores are compared.
+    if node.score != score:
+        return node.score < score
+    if member is None:
+        return inclusive
+    return node.member <= member if inclusive else node.member < member
+
+def _random_level():
+    level = 1
+    while level < ZSKIPLIST_MAXLEVEL and random.random() < ZSKIPLIST_P:
+        level += 1
+    return level
+
+
+class SkipList:
+    """
+        Members ordered by (score, member), as in Redis: every node is on level 0 and on each
+        further level with probability ZSKIPLIST_P, and each link records how many nodes it skips,
+        so finding a member's rank or the member at a rank is O(log n) like an insertion.
+    """
+
+    __slots__ = ("_head", "_tail", "_length", "_level")
+
+    def __init__(self):
+        self._head = _Node(ZSKIPLIST_MAXLEVEL, None, None)
+        self._tail = None
+        self._length = 0
+        self._level = 1
+
+    def __len__(self):
+        return self._length
+
+    def insert(self, score, member):
+        """Add a member that is not in the list yet."""
+        level = _random_level()
+        levels = max(level, self._level)
+        update = [self._head] * levels # Last node before the new one on each level
+        rank = [0] * levels # Rank of update[i]
+        node = self._head
+        for i in range(self._level - 1, -1, -1):
+            traversed = rank[i + 1] if i + 1 < self._level else 0
+            following = node.forward[i]
+            # _precedes(following, score, member, False), inlined as in `delete` and `rank`
+            while following is not None and (following.score < score or (
+                    following.score == score and following.member < member)):
+                traversed += node.span[i]
+                node = following
+                following = node.forward[i]
+            rank[i] = traversed
+            update[i] = node
+        for i in range(self._level, level):
+            self._head.span[i] = self._length
+        self._level = levels
+
+        node = _Node(level, score, member)
+        for i in range(level):
+            previous = update[i]
+            node.forward[i] = previous.forward[i]
+            previous.forward[i] = node
+            node.span[i] = previous.span[i] - (rank[0] - rank[i])
+            previous.span[i] = rank[0] - rank[i] + 1
+        for i in range(level, levels):
+            update[i].span[i] += 1
+
+        node.backward = None if update[0] is self._head else update[0]
+        if node.forward[0] is not None:
+            node.forward[0].backward = node
+        else:
+            self._tail = node
+        self._length += 1
+
+    def delete(self, score, member):
+        """Remove a member, returning True if it was there with this score."""
+        update = [None] * self._level
+        node = self._head
+        for i in range(self._level - 1, -1, -1):
+            following = node.forward[i]
+            while following is not None and (following.score < score or (
+                    following.score == score and following.member < member)):
+                node = following
+                following = node.forward[i]
+            update[i] = node
+        node = node.forward[0]
+        if node is None or node.score != score or node.member != member:
+            return False
+
+        for i in range(self._level):
+            previous = update[i]
+            if previous.forward[i] is node:
+                previous.span[i] += node.span[i] - 1
+                previous.forward[i] = node.forward[i]
+            else:
+                previous.span[i] -= 1
+        if node.forward[0] is not None:
+            node.forward[0].backward = node.backward
+        else:
+            self._tail = node.backward
+        while self._level > 1 and self._head.forward[self._level - 1] is None:
+            self._level -= 1
+        self._length -= 1
+        return True
+
+    def count(self, score, member=None, inclusive=False):
+        """Number of members sorting before (score, member), or at it if `inclusive`."""
+        rank = 0
+        node = self._head
+        for i in range(self._level - 1, -1, -1):
+            following = node.forward[i]
+            while following is not None and _precedes(following, score, member, inclusive):
+                rank += node.span[i]
+                node = following
+                following = node.forward[i]
+        return rank
+
+    def rank(self, score, member):
+        """0-based rank of a member that is in the list: `count(score, member)`, inlined."""
+        rank = 0
+        node = self._head
+        for i in range(self._level - 1, -1, -1):
+            following = node.forward[i]
+            while following is not None and (following.score < score or (
+                    following.score == score and following.member < member)):
+                rank += node.span[i]
+                node = following
+                following = node.forward[i]
+        return rank
+
+    def _node_at(self, rank):
+        # The node at 0-based `rank`, which must be in range
+        traversed = 0
+        node = self._head
+        rank += 1
+        for i in range(self._level - 1, -1, -1):
+            following = node.forward[i]
+            while following is not None and traversed + node.span[i] <= rank:
+                traversed += node.span[i]
+                node = following
+                following = node.forward[i]
+            if traversed == rank:
+                return node
+        raise IndexError("skiplist rank out of range")
+
+    def range(self, start, stop, reverse=False):
+        """Yield (score, member) for the ranks from `start` up to `stop`, backwards if `reverse`."""
+        if start >= stop:
+            return
+        if reverse:
+            node = self._node_at(stop - 1)
+            for _ in range(stop - start):
+                yield node.score, node.member
+                node = node.backward
+        else:
+            node = self._node_at(start)
+            for _ in range(stop - start):
+                yield node.score, node.member
+                node = node.forward[0]
+
+    def copy(self):
+        clone = SkipList()
+        clone._length = self._length
+        clone._level = self._level
+        clones = {None: None}
+        node = self._head.forward[0]
+        previous = None
+        while node is not None:
+            twin = clones[node] = _Node(len(node.forward), node.score, node.member)
+            twin.span = node.span.copy()
+            twin.backward = previous
+            previous = twin
+            node = node.forward[0]
+        clone._tail = previous
+        clone._head.span = self._head.span.copy()
+        clone._head.forward = [clones[following] for following in self._head.forward]
+        for node, twin in clones.items():
+            if node is not None:
+                twin.forward = [clones[following] for following in node.forward]
+        return clone
+
+
+# Estimated footprint of the parts of a sorted set, see `memory_usage`
+_ZSET_HEADER = 64 # The SortedSet object
+_MEMBER_HEADER = sys.getsizeof(b"") + sys.getsizeof(0.0) # A member's bytes object and its score
+_LISTPACK_ENTRY = sys.getsizeof((0.0, b"")) # The (score, member) tuple
+_SKIPLIST_ENTRY = ( # A node with its two link lists at the average level, and its dict entry
+    sys.getsizeof(_Node(0, 0.0, b"")) + 2 * sys.getsizeof([]) + int(2 * 8 / (1 - ZSKIPLIST_P)) + 8)
+
+
+class SortedSet:
+    """
+        The sorted set type: members (bytes) ordered by score (a float), then by member. Two
+        encodings, like in Redis:
+
+        listpack - a sorted Python list of (score, member) tuples, searched with bisect. Finding a
+                   member's score is a linear scan, which beats a dict for a few dozen members.
+        skiplist - a SkipList for the order plus a dict from member to score, once the set has
+                   more than ZSET_MAX_LISTPACK_ENTRIES members or a member longer than
+                   ZSET_MAX_LISTPACK_VALUE bytes. Updates and rank queries are O(log n).
+
+        Ranges are expressed as ranks: `count` turns a score or lex bound into one, `range` yields
+        the members between two ranks. The total length of the members is kept up to date, so
+        `memory_usage` is O(1). `accounted` is the footprint the keyspace last counted for the set
+        (see `Database.modified`). ZSCAN walks a skiplist's members through a ScanIndex, built on
+        the first scan, rather than by rank: a rank shifts when a member before it goes away.
+    """
+
+    __slots__ = ("_scores", "_order", "_bytes", "_scan", "accounted")
+
+    def __init__(self, items=()):
+        self._scores = None # Member -> score, in the skiplist encoding
+        self._order = []
+        self._bytes = 0
+        self._scan = None # ScanIndex of a skiplist's members, once it has been scanned
+        self.accounted = 0
+        for member, score in items:
+            self.add(member, score)
+
+    @property
+    def encoding(self):
+        return "listpack" if self._scores is None else "skiplist"
+
+    def __len__(self):
+        return len(self._order)
+
+    def __eq__(self, other):
+        if isinstance(other, SortedSet):
+            return len(self) == len(other) and list(self.items()) == list(other.items())
+        return NotImplemented
+
+    def __repr__(self):
+        return f"SortedSet({list(self.items())!r})"
+
+    def copy(self):
+        clone = SortedSet()
+        clone._order = self._order.copy()
+        if self._scores is not None:
+            clone._scores = self._scores.copy()
+        clone._bytes = self._bytes
+        clone.accounted = self.accounted
+        return clone
+
+    def memory_usage(self):
+        """Estimated number of bytes the sorted set takes up."""
+        members = len(self._order)
+        if self._scores is None:
+            container, entry = sys.getsizeof(self._order), _LISTPACK_ENTRY
+        else:
+            container, entry = sys.getsizeof(self._scores), _SKIPLIST_ENTRY
+        return _ZSET_HEADER + container + members * (entry + _MEMBER_HEADER) + self._bytes
+
+    def score(self, member):
+        """Return the score of `member`, or None if it is not in the set."""
+        if self._scores is not None:
+            return self._scores.get(member)
+        for score, other in self._order:
+            if other == member:
+                return score
+        return None
+
+    def add(self, member, score):
+        """Add `member` or move it to `score`, returning its previous score (None if it is new)."""
+        old = self.score(member)
+        if old is not None:
+            if old != score:
+                self._unlink(member, old)
+                self._link(member, score)
+            return old
+        if self._scores is None and (len(self._order) >= ZSET_MAX_LISTPACK_ENTRIES
+                                     or len(member) > ZSET_MAX_LISTPACK_VALUE):
+            self._convert()
+        self._link(member, score)
+        self._bytes += len(member)
+        if self._scan is not None:
+            self._scan.add(member)
+        return None
+
+    def remove(self, member):
+        """Remove `member`, returning True if it was in the set."""
+        score = self.score(member)
+        if score is None:
+            return False
+        self._unlink(member, score)
+        self._bytes -= len(member)
+        if self._scan is not None:
+            self._scan.remove(member)
+        return True
+
+    def rank(self, member):
+        """Return the 0-based rank of `member` in ascending order, or None if it is not in the set."""
+        score = self.score(member)
+        if score is None:
+            return None
+        if self._scores is not None:
+            return self._order.rank(score, member)
+        return bisect_left(self._order, (score, member))
+
+    def count(self, score, member=None, inclusive=False):
+        """
+            Number of members sorting before (score, member), or at it if `inclusive`. With no
+            member only scores count: members with a lower score, or a score no higher if inclusive.
+        """
+        order = self._order
+        if self._scores is not None:
+            return order.count(score, member, inclusive)
+        if member is None:
+            return (bisect_right if inclusive else bisect_left)(order, score, key=_score)
+        return (bisect_right if inclusive else bisect_left)(order, (score, member))
+
+    def range(self, start, stop, reverse=False):
+        """Yield (member, score) for the ranks from `start` up to `stop`, backwards if `reverse`."""
+        order = self._order
+        if self._scores is not None:
+            pairs = order.range(start, stop, reverse)
+        elif reverse:
+            pairs = reversed(order[start:stop])
+        else:
+            pairs = order[start:stop]
+        for score, member in pairs:
+            yield member, score
+
+    def items(self):
+        """Yield (member, score) in ascending order."""
+        return self.range(0, len(self._order))
+
+    def scan(self, cursor, count):
+        """
+            Return the cursor to continue from (0 once done) and about `count` (member, score)
+            pairs from `cursor` on. A listpack is small and returned whole.
+        """
+        if self._scores is None:
+            return 0, list(self.items())
+        if self._scan is None:
+            self._scan = ScanIndex(self._scores)
+        cursor, found = self._scan.scan(cursor, count)
+        scores = self._scores
+        return cursor, [(member, scores[member]) for member in found]
+
+    def _link(self, member, score):
+        if self._scores is None:
+            insort(self._order, (score, member))
+        else:
+            self._order.insert(score, member)
+            self._scores[member] = score
+
+    def _unlink(self, member, score):
+        order = self._order
+        if self._scores is None:
+            del order[bisect_left(order, (score, member))]
+        else:
+            order.delete(score, member)
+            del self._scores[member]
+
+    def _convert(self):
+        # Switch to the skiplist encoding
+        entries = self._order
+        self._order = SkipList()
+        self._scores = {}
+        for score, member in entries:
+            self._order.insert(score, member)
+            self._scores[member] = score
@@ -0,0 +1,50 @@
+"""
+    MULTI/EXEC transactions with WATCH.
+
+    Between MULTI and EXEC a client's commands are checked (name, arity, memory) and queued rather
+    than run (see commands.execute). EXEC runs the queue in one go: the asyncio server runs it
+    within one event loop iteration, the threaded server while holding every lock stripe, and the
+    writes reach the AOF as a single MULTI ... EXEC entry.
+
+    WATCH is optimistic: the keyspace keeps a version for every watched key, bumped by any change
+    to it (see `Database.watch`), and EXEC gives up if a version moved since the WATCH. A key that
+    expired in the meantime counts as changed too.
+"""
+
+
+class Transaction:
+    """The commands queued since MULTI, and whether one of them was refused."""
+
+    __slots__ = ("commands", "failed")
+
+    def __init__(self):
+        self.commands = [] # (Command, args) in the order received
+        self.failed = False
+
+
+def watch(client, key):
+    watching = client.watching
+    if watching is None:
+        watching = client.watching = {}
+    if key not in watching:
+        db = client.db
+        watching[key] = (db.watch(key), db.peek(key) is not None)
+
+def unwatch(client):
+    """Forget every key `client` watches; on EXEC, DISCARD, UNWATCH and disconnection."""
+    watching, client.watching = client.watching, None
+    if watching:
+        db = client.db
+        for key in watching:
+            db.unwatch(key)
+
+def watched_keys_changed(client):
+    """Whether a key watched by `client` changed, or expired, since it was watched."""
+    watching = client.watching
+    if not watching:
+        return False
+    db = client.db
+    for key, (version, existed) in watching.items():
+        if db.version(key) != version or existed and db.peek(key) is None:
+            return True
+    return False
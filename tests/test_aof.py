@@ -0,0 +1,283 @@
+import asyncio, os, threading, time
+from functools import partial
+import pytest
+from pyredis.aof import AOFWriter, AOFLoadError, load_aof, APPENDFSYNC_ALWAYS, APPENDFSYNC_NO
+from pyredis.client import Client
+from pyredis.commands import execute
+from pyredis.db import Database
+from pyredis.protocol import encode_command
+from pyredis.quicklist import QuickList
+from pyredis.server import handle_client_using_asyncio
+
+
+def test_commit_writes_queued_commands(tmp_path):
+    path = tmp_path / "appendonly.aof"
+    aof = AOFWriter(str(path), APPENDFSYNC_ALWAYS)
+    aof.feed(["SET", "key", "value"])
+    aof.feed(["INCR", "counter"])
+    assert path.read_bytes() == b""
+    aof.commit()
+    expected = b"*3\r\n$3\r\nSET\r\n$3\r\nkey\r\n$5\r\nvalue\r\n*2\r\n$4\r\nINCR\r\n$7\r\ncounter\r\n"
+    assert path.read_bytes() == expected
+    assert aof.size == len(expected)
+    aof.close()
+
+def test_appends_to_existing_file(tmp_path):
+    path = tmp_path / "appendonly.aof"
+    path.write_bytes(b"*1\r\n$4\r\nPING\r\n")
+    aof = AOFWriter(str(path), APPENDFSYNC_NO)
+    aof.feed(["DEL", "key"])
+    aof.close()
+    assert path.read_bytes() == b"*1\r\n$4\r\nPING\r\n*2\r\n$3\r\nDEL\r\n$3\r\nkey\r\n"
+
+def test_invalid_policy(tmp_path):
+    with pytest.raises(ValueError):
+        AOFWriter(str(tmp_path / "appendonly.aof"), "sometimes")
+
+def test_group_commit_on_event_loop(tmp_path, monkeypatch):
+    path = tmp_path / "appendonly.aof"
+    aof = AOFWriter(str(path), APPENDFSYNC_ALWAYS)
+    writes = []
+    real_flush = aof.flush
+    monkeypatch.setattr(aof, "flush", lambda: writes.append(path.stat().st_size) or real_flush())
+
+    async def main():
+        aof.bind_loop(asyncio.get_running_loop())
+        # Three clients write during the same loop iteration and share one write and fsync
+        for i in range(3):
+            aof.feed(["INCR", f"counter{i}"])
+        await asyncio.gather(aof.synced(), aof.synced())
+
+    asyncio.run(main())
+    assert len(writes) == 1
+    assert path.read_bytes().count(b"INCR") == 3
+    aof.close()
+
+def test_synced_waits_only_for_what_is_not_on_disk(tmp_path):
+    aof = AOFWriter(str(tmp_path / "appendonly.aof"), APPENDFSYNC_ALWAYS)
+
+    async def main():
+        aof.bind_loop(asyncio.get_running_loop())
+        aof.feed(["INCR", "counter"])
+        written = aof.offset
+        await aof.synced()
+        assert aof.synced().done() # Nothing new: no fsync to wait for
+        aof.feed(["INCR", "counter"])
+        assert aof.synced(written).done()
+        later = aof.synced()
+        assert not later.done()
+        await later
+
+    asyncio.run(main())
+    aof.close()
+
+def test_blocked_client_served_by_a_synced_push(tmp_path):
+    db = Database()
+    db.aof = aof = AOFWriter(str(tmp_path / "appendonly.aof"), APPENDFSYNC_ALWAYS)
+
+    async def main():
+        aof.bind_loop(asyncio.get_running_loop())
+        server = await asyncio.start_server(partial(handle_client_using_asyncio, db), "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        blocked_reader, blocked_writer = await asyncio.open_connection("127.0.0.1", port)
+        pusher_reader, pusher_writer = await asyncio.open_connection("127.0.0.1", port)
+        blocked_writer.write(encode_command([b"BLPOP", b"queue", b"0"]))
+        while not len(db.blocked):
+            await asyncio.sleep(0.001)
+        # The push's fsync may complete before the blocked client gets its turn
+        pusher_writer.write(encode_command([b"RPUSH", b"queue", b"job"]))
+        assert await asyncio.wait_for(pusher_reader.readexactly(4), 5) == b":1\r\n"
+        expected = b"*2\r\n$5\r\nqueue\r\n$3\r\njob\r\n"
+        assert await asyncio.wait_for(blocked_reader.readexactly(len(expected)), 5) == expected
+        for writer in (blocked_writer, pusher_writer):
+            writer.close()
+        server.close()
+
+    asyncio.run(main())
+    aof.close()
+
+def load(path):
+    db = Database()
+    load_aof(db, str(path))
+    return db
+
+def wait_for_rewrite(aof):
+    for _ in range(500):
+        if not aof.rewrite_in_progress:
+            return
+        time.sleep(0.01)
+    raise AssertionError("rewrite did not finish")
+
+def test_rewrite_compacts_file(tmp_path):
+    path = tmp_path / "appendonly.aof"
+    db = Database()
+    db.aof = aof = AOFWriter(str(path), APPENDFSYNC_NO)
+    client = Client(db)
+    for _ in range(1000):
+        execute(client, [b"INCR", b"counter"])
+    execute(client, [b"SET", b"temp", b"value", b"PX", b"100000"])
+    execute(client, [b"RPUSH", b"list", *[str(i).encode() for i in range(150)]])
+    aof.flush()
+    before = path.stat().st_size
+
+    assert execute(client, [b"BGREWRITEAOF"]) == b"+Background append only file rewriting started\r\n"
+    # Writes made during the rewrite land in the new file too
+    execute(client, [b"INCR", b"counter"])
+    execute(client, [b"RPUSH", b"list", b"last"])
+    wait_for_rewrite(aof)
+    execute(client, [b"DEL", b"temp"])
+    aof.close()
+
+    assert path.stat().st_size < before
+    assert aof.rewrites == 1
+    restored = load(path)
+    assert restored.store == {b"counter": 1001, b"list": QuickList([*(b"%d" % i for i in range(150)), b"last"])}
+
+def test_rewrite_waits_for_fsync_on_old_file(tmp_path, monkeypatch):
+    db = Database()
+    db.aof = aof = AOFWriter(str(tmp_path / "appendonly.aof"), APPENDFSYNC_NO)
+    client = Client(db)
+    execute(client, [b"SET", b"key", b"value"])
+    aof.flush()
+    old_fd, real_fsync, errors = aof._fd, os.fsync, []
+
+    def slow_fsync(fd):
+        if fd == old_fd:
+            time.sleep(0.2)
+            os.fstat(fd) # Fails if the rewrite closed the descriptor meanwhile
+        real_fsync(fd)
+
+    def fsync():
+        try:
+            aof.fsync()
+        except OSError as error:
+            errors.append(error)
+
+    monkeypatch.setattr(os, "fsync", slow_fsync)
+    thread = threading.Thread(target=fsync)
+    thread.start()
+    time.sleep(0.05)
+    execute(client, [b"BGREWRITEAOF"])
+    wait_for_rewrite(aof)
+    thread.join()
+    aof.close()
+    assert errors == []
+    assert aof.rewrites == 1
+
+def test_rewrite_containers(tmp_path):
+    path = tmp_path / "appendonly.aof"
+    db = Database()
+    db.aof = aof = AOFWriter(str(path), APPENDFSYNC_NO)
+    client = Client(db)
+    execute(client, [b"HSET", b"small", b"f", b"v"])
+    for i in range(200):
+        execute(client, [b"HINCRBY", b"big", b"field:%d" % (i % 150), b"1"])
+        execute(client, [b"ZINCRBY", b"zset", b"%r" % (i / 3), b"member:%d" % (i % 150)])
+        execute(client, [b"SADD", b"set", b"%d" % i, b"member:%d" % (i % 150)])
+    aof.start_rewrite(db)
+    wait_for_rewrite(aof)
+    aof.close()
+
+    restored = load(path)
+    assert restored.store == db.store
+    assert restored.store[b"big"].encoding == "hashtable" and restored.store[b"small"].encoding == "listpack"
+
+def test_rewrite_keeps_absolute_deadlines(tmp_path):
+    path = tmp_path / "appendonly.aof"
+    db = Database()
+    db.aof = aof = AOFWriter(str(path), APPENDFSYNC_NO)
+    client = Client(db)
+    execute(client, [b"SET", b"key", b"value", b"EX", b"100"])
+    execute(client, [b"RPUSH", b"list", b"a"])
+    execute(client, [b"EXPIRE", b"list", b"200"])
+    deadlines = dict(db.expires.deadlines)
+    aof.start_rewrite(db)
+    wait_for_rewrite(aof)
+    aof.close()
+    assert load(path).expires.deadlines == deadlines
+
+def test_auto_rewrite_on_growth(tmp_path):
+    path = tmp_path / "appendonly.aof"
+    db = Database()
+    db.aof = aof = AOFWriter(str(path), APPENDFSYNC_NO, auto_rewrite_percentage=100, auto_rewrite_min_size=1024)
+    client = Client(db)
+    for _ in range(100):
+        execute(client, [b"SET", b"key", b"value"])
+        aof.flush()
+    wait_for_rewrite(aof)
+    assert aof.rewrites >= 1
+    aof.close()
+    assert load(path).store == {b"key": b"value"}
+
+def test_snapshot_is_copy_on_write():
+    db = Database()
+    client = Client(db)
+    execute(client, [b"RPUSH", b"list", b"a"])
+    snapshot = db.snapshot()
+    execute(client, [b"RPUSH", b"list", b"b"])
+    execute(client, [b"SET", b"key", b"value"])
+    assert dict((key, value) for key, value, _ in snapshot.items()) == {b"list": QuickList([b"a"])}
+    snapshot.release()
+    assert db._snapshots == ()
+
+def test_load_aof_applies_commands(tmp_path):
+    path = tmp_path / "appendonly.aof"
+    path.write_bytes(b"*3\r\n$3\r\nSET\r\n$3\r\nkey\r\n$5\r\nvalue\r\n"
+                     b"*3\r\n$5\r\nRPUSH\r\n$4\r\nlist\r\n$1\r\na\r\n"
+                     b"*2\r\n$4\r\nINCR\r\n$1\r\nn\r\n" * 2)
+    db = Database()
+    result = load_aof(db, str(path))
+    assert result.commands == 6 and result.truncated == 0
+    assert db.store == {b"key": b"value", b"list": QuickList([b"a", b"a"]), b"n": 2}
+
+def test_binary_values_survive_rewrite(tmp_path):
+    path = tmp_path / "appendonly.aof"
+    db = Database()
+    db.aof = aof = AOFWriter(str(path), APPENDFSYNC_NO)
+    client = Client(db)
+    execute(client, [b"SET", b"\x00key", b"\xff\r\n\xfe"])
+    execute(client, [b"RPUSH", b"\x80", b"\x81"])
+    aof.start_rewrite(db)
+    wait_for_rewrite(aof)
+    aof.close()
+    assert load(path).store == {b"\x00key": b"\xff\r\n\xfe", b"\x80": QuickList([b"\x81"])}
+
+def test_load_aof_truncates_torn_command(tmp_path):
+    path = tmp_path / "appendonly.aof"
+    complete = b"*3\r\n$3\r\nSET\r\n$3\r\nkey\r\n$5\r\nvalue\r\n"
+    path.write_bytes(complete + b"*3\r\n$3\r\nSET\r\n$3\r\nkey\r\n$5\r\nva")
+    db = Database()
+    result = load_aof(db, str(path))
+    assert result.commands == 1 and result.truncated == 28
+    assert path.read_bytes() == complete
+    assert db.store == {b"key": b"value"}
+
+def test_load_aof_transactions(tmp_path):
+    path = tmp_path / "appendonly.aof"
+    db = Database()
+    db.aof = aof = AOFWriter(str(path), APPENDFSYNC_NO)
+    client = Client(db)
+    for args in ([b"MULTI"], [b"INCR", b"n"], [b"RPUSH", b"list", b"a"], [b"EXEC"]):
+        execute(client, args)
+    aof.close()
+    complete = path.read_bytes()
+    assert complete.startswith(b"*1\r\n$5\r\nMULTI\r\n") and complete.endswith(b"*1\r\n$4\r\nEXEC\r\n")
+    path.write_bytes(complete + complete[:-len(b"*1\r\n$4\r\nEXEC\r\n")]) # Torn after the last write
+    db = Database()
+    result = load_aof(db, str(path))
+    assert result.commands == 2 and result.truncated == len(complete) - 14
+    assert db.store == {b"n": 1, b"list": QuickList([b"a"])} # The unfinished transaction was dropped
+    assert path.read_bytes() == complete
+
+def test_load_aof_rejects_garbage(tmp_path):
+    path = tmp_path / "appendonly.aof"
+    path.write_bytes(b"*1\r\n$4\r\nPING\r\n*2\r\n+GET\r\n")
+    with pytest.raises(AOFLoadError):
+        load_aof(Database(), str(path))
+
+def test_load_aof_empty_or_missing(tmp_path):
+    path = tmp_path / "appendonly.aof"
+    path.write_bytes(b"")
+    assert load_aof(Database(), str(path)).commands == 0
+    with pytest.raises(FileNotFoundError):
+        load_aof(Database(), str(tmp_path / "missing.aof"))
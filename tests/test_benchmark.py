@@ -0,0 +1,49 @@
+import asyncio, json
+from functools import partial
+from pyredis import benchmark
+from pyredis.benchmark import Config, COMMANDS, histogram, percentile, run_test, spawn_server
+from pyredis.db import Database
+from pyredis.server import handle_client_using_asyncio
+
+
+def test_percentiles_and_histogram():
+    latencies = [i / 10 for i in range(1, 1001)] # 0.1 .. 100 ms
+    assert percentile(latencies, 0.5) == 50.0
+    assert percentile(latencies, 0.99) == 99.0
+    assert percentile(latencies, 0.999) == 99.9
+    assert percentile([], 0.5) == 0.0
+    buckets = histogram(latencies)
+    assert buckets[:3] == [[0.1, 1], [0.2, 1], [0.5, 3]]
+    assert buckets[-1] == [100.0, 500]
+    assert sum(count for _, count in buckets) == len(latencies)
+
+def test_benchmark_against_asyncio_server():
+    async def main():
+        db = Database()
+        server = await asyncio.start_server(partial(handle_client_using_asyncio, db), "127.0.0.1", 0)
+        config = Config(port=server.sockets[0].getsockname()[1], clients=4, requests=500, pipeline=8,
+                        keyspace=50, data_size=16, seed=1)
+        result = await run_test(config, dict.fromkeys(COMMANDS, 1))
+        server.close()
+        return db, result
+    db, result = asyncio.run(main())
+    assert result["test"] == "set=1,get=1,incr=1,lpush=1,lrange=1,mget=1"
+    assert result["requests"] == 500 and result["errors"] == 0
+    latency = result["latency_ms"]
+    assert 0 < latency["min"] <= latency["p50"] <= latency["p99"] <= latency["p99.9"] <= latency["max"]
+    assert sum(count for _, count in result["histogram_ms"]) == 500
+    assert all(len(key) == len(b"key:") + 12 for key in db.store if key.startswith(b"key:"))
+    assert len([key for key in db.store if key.startswith(b"key:")]) <= 50
+    json.dumps(result)
+
+def test_benchmark_against_threaded_server(tmp_path, capsys):
+    process, port = spawn_server("threads")
+    try:
+        output = tmp_path / "results.json"
+        benchmark.main(["-p", str(port), "-c", "2", "-n", "100", "-t", "set,get", "--json", str(output)])
+    finally:
+        process.terminate()
+    assert "====== SET ======" in capsys.readouterr().out
+    results = json.loads(output.read_text())["results"]
+    assert [result["test"] for result in results] == ["set", "get"]
+    assert all(result["requests"] == 100 and result["errors"] == 0 for result in results)
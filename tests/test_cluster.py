@@ -0,0 +1,128 @@
+import asyncio
+from functools import partial
+from pyredis.client import Client
+from pyredis.cluster import Cluster, CROSSSLOT_ERROR, CLUSTERDOWN_ERROR, TRYAGAIN_ERROR
+from pyredis.commands import execute
+from pyredis.commands.cluster import CLUSTER_DISABLED_ERROR
+from pyredis.db import Database
+from pyredis.expiry import now_ms
+from pyredis.keyindex import key_slot
+from pyredis.protocol import split_array
+from pyredis.server import handle_client_using_asyncio
+
+
+def run(client, *args):
+    return execute(client, [arg if type(arg) is bytes else str(arg).encode() for arg in args])
+
+def node(port=0):
+    db = Database()
+    db.cluster = Cluster("127.0.0.1", port)
+    return db
+
+async def serve(db):
+    server = await asyncio.start_server(partial(handle_client_using_asyncio, db), "127.0.0.1", 0)
+    db.cluster.myself.port = server.sockets[0].getsockname()[1]
+    return server
+
+def test_keyslot_and_redirects():
+    db = node(7000)
+    client = Client(db)
+    assert run(client, "CLUSTER", "KEYSLOT", "foo") == b":12182\r\n"
+    assert run(client, "CLUSTER", "KEYSLOT", "{user1000}.following") == b":3443\r\n"
+    assert run(client, "SET", "bar", "1") == CLUSTERDOWN_ERROR # No slot assigned yet
+    assert run(client, "CLUSTER", "ADDSLOTSRANGE", "0", "8191") == b"+OK\r\n"
+    assert run(client, "CLUSTER", "ADDSLOTS", "100") == b"-ERR Slot 100 is already busy\r\n"
+    other = "b" * 40
+    db.cluster.add_node(other, "127.0.0.1", 7001)
+    for slot in range(8192, 16384):
+        assert run(client, "CLUSTER", "SETSLOT", slot, "NODE", other) == b"+OK\r\n"
+
+    assert run(client, "SET", "bar", "1") == b"+OK\r\n" # Slot 5061
+    assert run(client, "GET", "foo") == b"-MOVED 12182 127.0.0.1:7001\r\n"
+    assert run(client, "MSET", "bar", "1", "b", "2") == CROSSSLOT_ERROR
+    assert run(client, "MSET", "{bar}1", "1", "{bar}2", "2") == b"+OK\r\n"
+    assert run(client, "PING") == b"+PONG\r\n" # Keyless commands run anywhere
+    run(client, "MULTI")
+    assert run(client, "GET", "foo").startswith(b"-MOVED")
+    assert run(client, "EXEC").startswith(b"-EXECABORT")
+
+    assert run(client, "CLUSTER", "COUNTKEYSINSLOT", "5061") == b":3\r\n"
+    assert sorted(split_array(run(client, "CLUSTER", "GETKEYSINSLOT", "5061", "10"))) == [
+        b"$3\r\nbar\r\n", b"$6\r\n{bar}1\r\n", b"$6\r\n{bar}2\r\n"]
+    assert run(client, "CLUSTER", "SETSLOT", "5061", "NODE", other).startswith(b"-ERR Can't assign hashslot")
+    myself = db.cluster.myself.id.encode()
+    assert run(client, "CLUSTER", "SLOTS") == (
+        b"*2\r\n*3\r\n:0\r\n:8191\r\n*3\r\n$9\r\n127.0.0.1\r\n:7000\r\n$40\r\n" + myself + b"\r\n"
+        b"*3\r\n:8192\r\n:16383\r\n*3\r\n$9\r\n127.0.0.1\r\n:7001\r\n$40\r\n" + other.encode() + b"\r\n")
+    nodes = run(client, "CLUSTER", "NODES").decode().split("\r\n")[1].splitlines()
+    assert nodes == [f"{myself.decode()} 127.0.0.1:7000@17000 myself,master - 0 0 0 connected 0-8191",
+                     f"{other} 127.0.0.1:7001@17001 master - 0 0 0 connected 8192-16383"]
+    assert "cluster_state:ok" in run(client, "CLUSTER", "INFO").decode()
+    assert run(Client(Database()), "CLUSTER", "INFO") == CLUSTER_DISABLED_ERROR
+
+def test_dump_and_restore():
+    db = Database()
+    client = Client(db)
+    run(client, "RPUSH", "list", "a", "b")
+    run(client, "PEXPIRE", "list", "100000")
+    payload = run(client, "DUMP", "list").split(b"\r\n", 1)[1][:-2]
+    assert run(client, "RESTORE", "list", "0", payload) == b"-BUSYKEY Target key name already exists.\r\n"
+    assert run(client, "RESTORE", "copy", "5000", payload) == b"+OK\r\n"
+    assert run(client, "LRANGE", "copy", "0", "-1") == b"*2\r\n$1\r\na\r\n$1\r\nb\r\n"
+    assert 0 < db.get_expire(b"copy") - now_ms() <= 5000
+    assert run(client, "RESTORE", "bad", "0", payload[:-1] + b"?").startswith(b"-ERR DUMP payload")
+    assert run(client, "DUMP", "missing") == b"$-1\r\n"
+
+def test_live_slot_migration():
+    async def main():
+        source, target = node(), node()
+        servers = [await serve(source), await serve(target)]
+        source_client, target_client = Client(source), Client(target)
+        assert await run(source_client, "CLUSTER", "MEET", "127.0.0.1", target.cluster.myself.port) == b"+OK\r\n"
+        assert await run(target_client, "CLUSTER", "MEET", "127.0.0.1", source.cluster.myself.port) == b"+OK\r\n"
+        run(source_client, "CLUSTER", "ADDSLOTSRANGE", "0", "16383")
+        for slot in range(16384):
+            run(target_client, "CLUSTER", "SETSLOT", slot, "NODE", source.cluster.myself.id)
+
+        keys = [b"{moving}%d" % i for i in range(250)]
+        slot = key_slot(keys[0])
+        for i, key in enumerate(keys):
+            run(source_client, "SET", key, i)
+        run(source_client, "EXPIRE", keys[0], "1000")
+        run(source_client, "SET", "staying", "here")
+        assert run(target_client, "GET", keys[0]) == b"-MOVED %d 127.0.0.1:%d\r\n" % (slot, source.cluster.myself.port)
+
+        run(target_client, "CLUSTER", "SETSLOT", slot, "IMPORTING", source.cluster.myself.id)
+        run(source_client, "CLUSTER", "SETSLOT", slot, "MIGRATING", target.cluster.myself.id)
+        batches = 0
+        while True:
+            batch = split_array(run(source_client, "CLUSTER", "GETKEYSINSLOT", slot, "100"))
+            if not batch:
+                break
+            batch = [element.split(b"\r\n")[1] for element in batch]
+            migrating = run(source_client, "MIGRATE", "127.0.0.1", target.cluster.myself.port, "", "0", "5000",
+                            "KEYS", *batch)
+            assert run(source_client, "SET", batch[0], "lost?") == TRYAGAIN_ERROR # On its way
+            assert await migrating == b"+OK\r\n"
+            batches += 1
+            # Moved keys are asked for on the target, the others are still served here
+            moved = batch[0]
+            assert run(source_client, "GET", moved) == b"-ASK %d 127.0.0.1:%d\r\n" % (slot, target.cluster.myself.port)
+            assert run(target_client, "GET", moved).startswith(b"-MOVED") # Without ASKING
+            run(target_client, "ASKING")
+            assert run(target_client, "GET", moved) == b"$%d\r\n%s\r\n" % (len(str(keys.index(moved))),
+                                                                           str(keys.index(moved)).encode())
+        assert batches == 3
+        assert run(source_client, "CLUSTER", "COUNTKEYSINSLOT", slot) == b":0\r\n"
+
+        for db in (source, target):
+            run(Client(db), "CLUSTER", "SETSLOT", slot, "NODE", target.cluster.myself.id)
+        assert run(source_client, "GET", keys[1]) == b"-MOVED %d 127.0.0.1:%d\r\n" % (slot, target.cluster.myself.port)
+        assert run(target_client, "GET", keys[1]) == b"$1\r\n1\r\n"
+        assert run(target_client, "CLUSTER", "COUNTKEYSINSLOT", slot) == b":250\r\n"
+        assert target.get_expire(keys[0]) is not None
+        assert run(source_client, "GET", "staying") == b"$4\r\nhere\r\n"
+        assert run(source_client, "MIGRATE", "127.0.0.1", target.cluster.myself.port, "gone", "0", "100") == b"+NOKEY\r\n"
+        for server in servers:
+            server.close()
+    asyncio.run(main())
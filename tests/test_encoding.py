@@ -0,0 +1,61 @@
+import pytest
+from pyredis.client import Client
+from pyredis.commands import execute
+from pyredis.db import Database
+from pyredis.encoding import encode_string, shared_integer, EMBSTR_SIZE_LIMIT
+
+
+@pytest.fixture
+def client():
+    return Client(Database())
+
+def run(client, *args):
+    return execute(client, [arg if type(arg) is bytes else arg.encode() for arg in args])
+
+def test_encode_string():
+    assert encode_string(b"42") == 42 and encode_string(b"42") is shared_integer(42)
+    assert encode_string(b"-9223372036854775808") == -(1 << 63)
+    for value in (b"", b"-", b"-0", b"042", b"+1", b" 1", b"1.5", b"9223372036854775808", b"\xd9\xa1"):
+        assert encode_string(value) == value
+
+def test_object_encoding(client):
+    run(client, "SET", "int", "12345")
+    run(client, "SET", "embstr", "x" * EMBSTR_SIZE_LIMIT)
+    run(client, "SET", "raw", "x" * (EMBSTR_SIZE_LIMIT + 1))
+    run(client, "RPUSH", "list", "a")
+    assert run(client, "OBJECT", "ENCODING", "int") == b"$3\r\nint\r\n"
+    assert run(client, "OBJECT", "ENCODING", "embstr") == b"$6\r\nembstr\r\n"
+    assert run(client, "OBJECT", "ENCODING", "raw") == b"$3\r\nraw\r\n"
+    assert run(client, "OBJECT", "ENCODING", "list") == b"$9\r\nquicklist\r\n"
+    assert run(client, "OBJECT", "ENCODING", "missing") == b"$-1\r\n"
+    assert run(client, "OBJECT", "FREQ", "int").startswith(b"-ERR")
+
+def test_integers_stay_integers(client):
+    run(client, "SET", "counter", "10")
+    assert run(client, "DECR", "counter") == b":9\r\n"
+    assert client.db.store[b"counter"] == 9
+    assert run(client, "GET", "counter") == b"$1\r\n9\r\n"
+    run(client, "SET", "big", "9223372036854775807")
+    assert run(client, "INCR", "big").startswith(b"-ERR increment or decrement would overflow")
+    run(client, "SET", "text", "abc")
+    assert run(client, "INCR", "text").startswith(b"-ERR value is not an integer")
+
+def test_memory_usage_and_info(client):
+    db = client.db
+    run(client, "SET", "small", "7")
+    run(client, "SET", "text", "x" * 1000)
+    run(client, "RPUSH", "list", *["element"] * 100)
+    small = int(run(client, "MEMORY", "USAGE", "small")[1:-2])
+    text = int(run(client, "MEMORY", "USAGE", "text", "SAMPLES", "5")[1:-2])
+    listed = int(run(client, "MEMORY", "USAGE", "list")[1:-2])
+    assert small < text and 1000 < text < 1200 and listed > 700
+    assert small + text + listed == db.used_memory
+    assert run(client, "MEMORY", "USAGE", "missing") == b"$-1\r\n"
+
+    info = run(client, "INFO", "memory").decode()
+    assert f"used_memory:{db.used_memory}\n" in info
+    assert f"used_memory_string:{small + text}\n" in info
+    assert f"used_memory_list:{listed}\n" in info
+
+    run(client, "DEL", "small", "text", "list")
+    assert db.used_memory == 0
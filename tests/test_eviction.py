@@ -0,0 +1,135 @@
+import time
+import pytest
+from pyredis.client import Client
+from pyredis.commands import execute
+from pyredis.db import Database, memory_usage
+from pyredis.eviction import (Evictor, parse_memory, OOM_ERROR, ALLKEYS_LRU, ALLKEYS_LFU, VOLATILE_LRU,
+                              VOLATILE_TTL, NOEVICTION)
+
+
+@pytest.fixture
+def client():
+    return Client(Database())
+
+def run(client, *args):
+    return execute(client, [arg.encode() for arg in args])
+
+def fill(client, count, prefix="key"):
+    for i in range(count):
+        run(client, "SET", f"{prefix}{i}", "x" * 20)
+
+def limit(client, policy, fraction, samples=1000):
+    # Many samples make the approximated policies pick the exact best candidate in these tests
+    db = client.db
+    Evictor(int(db.used_memory * fraction), policy, samples).attach(db)
+
+def test_used_memory_tracks_the_dataset(client):
+    db = client.db
+    run(client, "SET", "string", "value")
+    run(client, "RPUSH", "list", *["element"] * 300)
+    run(client, "LPOP", "list", "10")
+    run(client, "LSET", "list", "0", "a much longer element")
+    run(client, "LTRIM", "list", "0", "200")
+    run(client, "LMOVE", "list", "other", "LEFT", "RIGHT")
+    run(client, "SET", "string", "a longer value")
+    run(client, "INCR", "counter")
+    run(client, "SET", "gone", "soon", "PX", "1")
+    run(client, "DEL", "missing", "other")
+    time.sleep(0.002)
+    db.active_expire(1)
+    assert db.used_memory == sum(memory_usage(key, value) for key, value in db.store.items())
+    for key in list(db.store):
+        db.delete(key)
+    assert db.used_memory == 0
+
+def test_parse_memory():
+    assert parse_memory("1024") == 1024
+    assert parse_memory("100mb") == 100 * 1024 * 1024
+    assert parse_memory("1G") == 1000 ** 3
+    with pytest.raises(ValueError):
+        parse_memory("lots")
+
+def test_noeviction_refuses_commands_that_grow_memory(client):
+    fill(client, 10)
+    limit(client, NOEVICTION, 0.5)
+    assert run(client, "SET", "new", "value") == OOM_ERROR
+    assert run(client, "RPUSH", "list", "value") == OOM_ERROR
+    assert run(client, "GET", "key1") == b"$20\r\n" + b"x" * 20 + b"\r\n"
+    assert run(client, "DEL", "key1") == b":1\r\n"
+
+def test_allkeys_lru_keeps_recently_used_keys(client):
+    fill(client, 100)
+    limit(client, ALLKEYS_LRU, 1)
+    time.sleep(0.01)
+    for i in range(10):
+        run(client, "GET", f"key{i}")
+    client.db.evictor.maxmemory = client.db.used_memory // 2
+    assert run(client, "SET", "new", "value") == b"+OK\r\n"
+    db = client.db
+    assert db.used_memory <= db.evictor.maxmemory + memory_usage(b"new", b"value")
+    assert all(b"key%d" % i in db.store for i in range(10))
+    assert db.stats["evicted_keys"] == 100 - len(db) + 1
+
+def test_allkeys_lfu_keeps_frequently_used_keys(client):
+    fill(client, 50)
+    limit(client, ALLKEYS_LFU, 1)
+    for _ in range(20):
+        for i in range(5):
+            run(client, "GET", f"key{i}")
+    client.db.evictor.maxmemory = client.db.used_memory // 4
+    run(client, "SET", "new", "value")
+    assert all(b"key%d" % i in client.db.store for i in range(5))
+
+def test_volatile_policies_only_evict_keys_with_a_ttl(client):
+    fill(client, 20, "persistent")
+    for i in range(20):
+        run(client, "SET", f"volatile{i}", "x" * 20, "EX", str(100 + i))
+    limit(client, VOLATILE_TTL, 0.9)
+    assert run(client, "SET", "new", "value") == b"+OK\r\n"
+    store = client.db.store
+    assert all(b"persistent%d" % i in store for i in range(20))
+    assert b"volatile0" not in store and b"volatile19" in store # Earliest deadlines go first
+
+    client.db.evictor.maxmemory = 0
+    assert run(client, "SET", "other", "value") == OOM_ERROR # Nothing with a TTL is left
+    assert all(b"persistent%d" % i in store for i in range(20))
+
+def test_volatile_lru(client):
+    fill(client, 20, "persistent")
+    for i in range(20):
+        run(client, "SET", f"volatile{i}", "x" * 20, "EX", "100")
+    limit(client, VOLATILE_LRU, 0.9)
+    assert run(client, "SET", "new", "value") == b"+OK\r\n"
+    assert len([key for key in client.db.store if key.startswith(b"volatile")]) < 20
+    assert all(b"persistent%d" % i in client.db.store for i in range(20))
+
+def test_volatile_lru_finds_the_few_keys_with_a_ttl(client):
+    for i in range(20000):
+        client.db.set_value(b"persistent%d" % i, b"x")
+    for i in range(20):
+        run(client, "SET", f"volatile{i}", "x" * 20, "EX", "100")
+    limit(client, VOLATILE_LRU, 0.999, samples=5)
+    assert run(client, "SET", "new", "value") == b"+OK\r\n"
+    assert len([key for key in client.db.store if key.startswith(b"volatile")]) < 20
+    assert len(client.db.store) > 20000
+
+def test_evictions_are_propagated_and_reported(client):
+    recorded = []
+
+    class RecordingAOF:
+        def feed(self, args):
+            recorded.append(args)
+
+        def rewrite_due(self):
+            return False
+
+    fill(client, 10)
+    client.db.aof = RecordingAOF()
+    limit(client, ALLKEYS_LRU, 0.8)
+    run(client, "SET", "new", "value")
+    evicted = [args[1] for args in recorded if args[0] == b"DEL"]
+    assert evicted and all(key not in client.db.store for key in evicted)
+    assert recorded[-1] == [b"SET", b"new", b"value"]
+    info = run(client, "INFO", "stats", "memory")
+    assert b"evicted_keys:%d\n" % len(evicted) in info
+    assert b"eviction_usec:" in info and b"maxmemory_policy:allkeys-lru\n" in info
@@ -0,0 +1,52 @@
+import random
+from binascii import crc_hqx
+from pyredis import keyindex
+from pyredis.keyindex import SlotIndex, PrefixIndex, key_slot, SLOTS
+
+
+def test_key_slot_matches_redis_cluster():
+    assert key_slot(b"foo") == 12182 and key_slot(b"somekey") == 11058
+    assert key_slot(b"{user1000}.following") == key_slot(b"{user1000}.followers") == key_slot(b"user1000")
+    assert key_slot(b"foo{}{bar}") == crc_hqx(b"foo{}{bar}", 0) % SLOTS # An empty tag doesn't count
+    assert key_slot(b"foo{{bar}}") == key_slot(b"{bar")
+    assert all(0 <= key_slot(b"key%d" % i) < SLOTS for i in range(1000))
+
+def test_slot_scan_survives_changes():
+    index = SlotIndex()
+    kept = {b"kept:%d" % i for i in range(500)}
+    for key in kept:
+        index.add(key)
+    for i in range(200):
+        index.add(b"gone:%d" % i)
+    seen, cursor, step = [], 0, 0
+    while True:
+        cursor, keys = index.scan(cursor, 20)
+        seen += keys
+        # Meanwhile keys come and go
+        index.add(b"new:%d" % step)
+        index.remove(b"gone:%d" % step)
+        step += 1
+        if not cursor:
+            break
+    assert step > 1
+    kept_seen = [key for key in seen if key.startswith(b"kept:")]
+    assert len(kept_seen) == len(kept) and set(kept_seen) == kept # Each exactly once
+    assert index.count(key_slot(b"kept:1")) == len(index.keys(key_slot(b"kept:1"))) >= 1
+
+def test_prefix_index_ranges(monkeypatch):
+    monkeypatch.setattr(keyindex, "PREFIX_INDEX_CHUNK", 4)
+    index = PrefixIndex()
+    keys = [b"%s:%03d" % (prefix, i) for prefix in (b"a", b"b", b"c") for i in range(50)]
+    random.shuffle(keys)
+    for key in keys:
+        index.add(key)
+    assert len(index) == 150
+    assert index.range(b"b:") == sorted(key for key in keys if key.startswith(b"b:"))
+    assert index.range(b"b:01", count=3) == [b"b:010", b"b:011", b"b:012"]
+    assert index.range(b"b:", after=b"b:047") == [b"b:048", b"b:049"]
+    index.remove(b"b:048")
+    index.remove(b"b:048")
+    assert index.range(b"b:", after=b"b:047") == [b"b:049"]
+    for key in keys:
+        index.remove(key)
+    assert len(index) == 0 and index.range(b"") == []
@@ -0,0 +1,31 @@
+import pytest
+from pyredis.pattern import compile_pattern, literal_prefix
+
+
+@pytest.mark.parametrize("pattern, matches, misses", [
+    (b"*", [b"", b"anything"], []),
+    (b"key", [b"key"], [b"keys", b"Key"]),
+    (b"h?llo", [b"hello", b"hallo"], [b"hllo", b"heello"]),
+    (b"h*llo", [b"hllo", b"heeeello"], [b"hellox"]),
+    (b"h[ae]llo", [b"hello", b"hallo"], [b"hillo"]),
+    (b"h[^e]llo", [b"hallo"], [b"hello"]),
+    (b"h[a-c]llo", [b"hbllo"], [b"hdllo"]),
+    (b"h\\*llo", [b"h*llo"], [b"hello"]),
+    (b"a.b+(c)", [b"a.b+(c)"], [b"aab+(c)"]),
+    (b"user:*:name", [b"user:1:name", b"user::name"], [b"user:1:age"]),
+])
+def test_compile_pattern(pattern, matches, misses):
+    match = compile_pattern(pattern)
+    assert all(match(string) for string in matches)
+    assert not any(match(string) for string in misses)
+
+@pytest.mark.parametrize("pattern, prefix", [
+    (b"user:*", b"user:"),
+    (b"user:?:name", b"user:"),
+    (b"a\\*b*", b"a*b"),
+    (b"*", b""),
+    (b"[ab]c", b""),
+    (b"key", b"key"),
+])
+def test_literal_prefix(pattern, prefix):
+    assert literal_prefix(pattern) == prefix
@@ -14,7 +14,7 @@
 # 2. A whole message.
 # 3. A whole message, followed by either 1 or 2.
 # We will need to remove parsed bytes from the stream.
-from pyredis.protocol import BulkString, Error, parse_frame, SimpleString, Integer, Array
+from pyredis.protocol import BulkString, Error, parse_frame, SimpleString, Integer, Array, RespParser, ProtocolError
 
 import pytest
 
@@ -31,8 +31,8 @@ import pytest
     (b"-Error\r\n-Part Error", (Error("Error"), 8)),
     # BulkString
     (b"$5\r\nPart", (None, 0)),
-    (b"$11\r\nBulk String\r\n", (BulkString("Bulk String"), 18)),
-    (b"$8\r\nBulk Str\r\n$+OK", (BulkString("Bulk Str"), 14)),
+    (b"$11\r\nBulk String\r\n", (BulkString(b"Bulk String"), 18)),
+    (b"$8\r\nBulk Str\r\n$+OK", (BulkString(b"Bulk Str"), 14)),
     # Integer
     (b":1000\r\n", (Integer(1000), 7)),
     #Array
@@ -42,7 +42,7 @@ import pytest
         Array([
             SimpleString("Simple"),
             Integer(42),
-            BulkString("String")
+            BulkString(b"String")
         ]), 30
     ))
 ])
@@ -115,4 +115,51 @@ def test_serialize_Array():
             BulkString("String")
         ])
     expected = b"*3\r\n-Error\r\n-\r\n$6\r\nString\r\n"
-    assert val.encode() == expected
\ No newline at end of file
+    assert val.encode() == expected
+
+def test_parser_pipelined_commands():
+    parser = RespParser()
+    parser.feed(b"*1\r\n$4\r\nPING\r\n*3\r\n$3\r\nSET\r\n$3\r\nkey\r\n$5\r\nvalue\r\n")
+    assert list(parser) == [[b"PING"], [b"SET", b"key", b"value"]]
+    assert parser.pending == 0
+
+@pytest.mark.parametrize("split", range(1, 36))
+def test_parser_resumes_partial_command(split):
+    data = b"*3\r\n$3\r\nSET\r\n$3\r\nkey\r\n$10\r\nva\r\nlue\r\n1\r\n"
+    parser = RespParser()
+    parser.feed(data[:split])
+    first = list(parser)
+    parser.feed(data[split:])
+    assert first + list(parser) == [[b"SET", b"key", b"va\r\nlue\r\n1"]]
+
+def test_parser_byte_at_a_time():
+    data = b"*2\r\n$3\r\nGET\r\n$1\r\nk\r\n" * 3
+    parser = RespParser()
+    commands = []
+    for i in range(len(data)):
+        parser.feed(data[i:i + 1])
+        commands.extend(parser)
+    assert commands == [[b"GET", b"k"]] * 3
+
+def test_parser_inline_commands():
+    parser = RespParser()
+    parser.feed(b"PING\r\n\r\nECHO hello world\r\nGET")
+    assert list(parser) == [[b"PING"], [b"ECHO", b"hello", b"world"]]
+    parser.feed(b" k\n")
+    assert list(parser) == [[b"GET", b"k"]]
+
+def test_parser_skips_empty_multibulk():
+    parser = RespParser()
+    parser.feed(b"*0\r\n*-1\r\n*1\r\n$4\r\nPING\r\n")
+    assert list(parser) == [[b"PING"]]
+
+@pytest.mark.parametrize("data", [
+    b"*x\r\n",
+    b"*1\r\n+PING\r\n",
+    b"*1\r\n$-5\r\n",
+])
+def test_parser_protocol_errors(data):
+    parser = RespParser()
+    parser.feed(data)
+    with pytest.raises(ProtocolError):
+        list(parser)
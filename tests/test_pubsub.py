@@ -0,0 +1,134 @@
+import asyncio
+from functools import partial
+from pyredis import pubsub
+from pyredis.client import Client
+from pyredis.commands import execute
+from pyredis.commands.pubsub import PUBSUB_UNSUPPORTED_ERROR
+from pyredis.db import Database
+from pyredis.server import handle_client_using_asyncio
+
+
+class FakeTransport:
+    """Collects what is written to it, and holds on to it like a client that doesn't read."""
+
+    def __init__(self):
+        self.written = []
+        self.aborted = False
+
+    def write(self, data):
+        self.written.append(data)
+
+    def get_write_buffer_size(self):
+        return sum(map(len, self.written))
+
+    def abort(self):
+        self.aborted = True
+
+
+def subscriber(db):
+    client = Client(db)
+    client.transport = FakeTransport()
+    return client
+
+def run(client, *args):
+    return execute(client, [arg.encode() for arg in args])
+
+def test_subscribe_and_publish():
+    db = Database()
+    first, second, publisher = subscriber(db), subscriber(db), Client(db)
+    assert run(first, "SUBSCRIBE", "news", "sport") == (
+        b"*3\r\n$9\r\nsubscribe\r\n$4\r\nnews\r\n:1\r\n*3\r\n$9\r\nsubscribe\r\n$5\r\nsport\r\n:2\r\n")
+    run(second, "SUBSCRIBE", "news")
+    assert run(publisher, "PUBLISH", "news", "hello") == b":2\r\n"
+    assert run(publisher, "PUBLISH", "weather", "rain") == b":0\r\n"
+    message = b"*3\r\n$7\r\nmessage\r\n$4\r\nnews\r\n$5\r\nhello\r\n"
+    assert first.transport.written == second.transport.written == [message]
+    assert first.transport.written[0] is second.transport.written[0] # Encoded once
+
+def test_psubscribe():
+    db = Database()
+    client, publisher = subscriber(db), Client(db)
+    assert run(client, "PSUBSCRIBE", "news.*") == b"*3\r\n$10\r\npsubscribe\r\n$6\r\nnews.*\r\n:1\r\n"
+    run(client, "SUBSCRIBE", "news.art")
+    assert run(publisher, "PUBLISH", "news.art", "x") == b":2\r\n"
+    assert run(publisher, "PUBLISH", "other", "x") == b":0\r\n"
+    assert client.transport.written == [
+        b"*3\r\n$7\r\nmessage\r\n$8\r\nnews.art\r\n$1\r\nx\r\n",
+        b"*4\r\n$8\r\npmessage\r\n$6\r\nnews.*\r\n$8\r\nnews.art\r\n$1\r\nx\r\n"]
+    assert run(client, "PUNSUBSCRIBE") == b"*3\r\n$12\r\npunsubscribe\r\n$6\r\nnews.*\r\n:1\r\n"
+    assert run(publisher, "PUBLISH", "news.art", "x") == b":1\r\n" # The match cache was dropped
+
+def test_subscribed_mode():
+    db = Database()
+    client = subscriber(db)
+    run(client, "SUBSCRIBE", "news")
+    assert run(client, "GET", "x").startswith(b"-ERR Can't execute 'get'")
+    assert run(client, "PING") == b"*2\r\n$4\r\npong\r\n$0\r\n\r\n"
+    assert run(client, "UNSUBSCRIBE") == b"*3\r\n$11\r\nunsubscribe\r\n$4\r\nnews\r\n:0\r\n"
+    assert client.subscriber is None
+    assert run(client, "GET", "x") == b"$-1\r\n"
+    assert run(client, "UNSUBSCRIBE") == b"*3\r\n$11\r\nunsubscribe\r\n$-1\r\n:0\r\n"
+    assert run(Client(db), "SUBSCRIBE", "news") == PUBSUB_UNSUPPORTED_ERROR # No transport to write to
+
+def test_pubsub_introspection():
+    db = Database()
+    first, second = subscriber(db), subscriber(db)
+    run(first, "SUBSCRIBE", "news", "sport")
+    run(second, "SUBSCRIBE", "news")
+    run(second, "PSUBSCRIBE", "n*", "s*")
+    publisher = Client(db)
+    assert sorted(run(publisher, "PUBSUB", "CHANNELS").split(b"\r\n")[2::2]) == [b"news", b"sport"]
+    assert run(publisher, "PUBSUB", "CHANNELS", "s*") == b"*1\r\n$5\r\nsport\r\n"
+    assert run(publisher, "PUBSUB", "NUMSUB", "news", "none") == b"*4\r\n$4\r\nnews\r\n:2\r\n$4\r\nnone\r\n:0\r\n"
+    assert run(publisher, "PUBSUB", "NUMPAT") == b":2\r\n"
+    db.pubsub.disconnect(second.subscriber)
+    assert run(publisher, "PUBSUB", "NUMPAT") == b":0\r\n"
+    assert run(publisher, "PUBSUB", "NUMSUB", "news") == b"*2\r\n$4\r\nnews\r\n:1\r\n"
+
+def test_output_buffer_limits(monkeypatch):
+    monkeypatch.setattr(pubsub, "PUBSUB_OUTPUT_BUFFER_HARD_LIMIT", 1000)
+    monkeypatch.setattr(pubsub, "PUBSUB_OUTPUT_BUFFER_SOFT_LIMIT", 100)
+    monkeypatch.setattr(pubsub, "PUBSUB_OUTPUT_BUFFER_SOFT_SECONDS", 60)
+    db = Database()
+    slow, fast, publisher = subscriber(db), subscriber(db), Client(db)
+    run(slow, "SUBSCRIBE", "news")
+    run(fast, "PSUBSCRIBE", "*")
+    run(publisher, "PUBLISH", "news", "x" * 200) # Past the soft limit, for less than 60 seconds
+    assert not slow.transport.aborted and slow.subscriber.soft_limit_since is not None
+    fast.transport.written.clear()
+    monkeypatch.setattr(pubsub, "PUBSUB_OUTPUT_BUFFER_SOFT_SECONDS", 0)
+    assert run(publisher, "PUBLISH", "news", "x") == b":2\r\n"
+    assert slow.transport.aborted and not fast.transport.aborted
+    assert run(publisher, "PUBSUB", "NUMSUB", "news") == b"*2\r\n$4\r\nnews\r\n:0\r\n"
+    fast.transport.written.clear()
+    monkeypatch.setattr(pubsub, "PUBSUB_OUTPUT_BUFFER_SOFT_SECONDS", 60)
+    run(publisher, "PUBLISH", "other", "x" * 2000) # Past the hard limit
+    assert fast.transport.aborted
+    assert db.pubsub.disconnections == 2
+
+def test_pubsub_over_asyncio():
+    async def main():
+        db = Database()
+        server = await asyncio.start_server(partial(handle_client_using_asyncio, db), "127.0.0.1", 0)
+        address = server.sockets[0].getsockname()
+        readers = []
+        for _ in range(20):
+            reader, writer = await asyncio.open_connection(*address)
+            writer.write(b"*2\r\n$9\r\nSUBSCRIBE\r\n$4\r\nnews\r\n")
+            await reader.readexactly(len(b"*3\r\n$9\r\nsubscribe\r\n$4\r\nnews\r\n:1\r\n"))
+            readers.append((reader, writer))
+        _, publisher = await asyncio.open_connection(*address)
+        publisher.write(b"*3\r\n$7\r\nPUBLISH\r\n$4\r\nnews\r\n$5\r\nhello\r\n")
+        message = b"*3\r\n$7\r\nmessage\r\n$4\r\nnews\r\n$5\r\nhello\r\n"
+        for reader, _ in readers:
+            assert await reader.readexactly(len(message)) == message
+        for _, writer in readers:
+            writer.close()
+        publisher.close()
+        for _ in range(100):
+            if not db.pubsub.channels:
+                break
+            await asyncio.sleep(0.01)
+        assert not db.pubsub.channels # Subscriptions are dropped with the connection
+        server.close()
+    asyncio.run(main())
@@ -0,0 +1,139 @@
+import io, time
+import pytest
+from pyredis import rdb
+from pyredis.aof import AOFWriter, load_aof, APPENDFSYNC_NO
+from pyredis.client import Client
+from pyredis.commands import execute
+from pyredis.db import Database
+from pyredis.expiry import now_ms
+
+
+def make_db():
+    db = Database()
+    client = Client(db)
+    execute(client, [b"SET", b"short", b"value"])
+    execute(client, [b"SET", b"medium", b"m" * 1000])
+    execute(client, [b"SET", b"long", b"l" * 20000])
+    execute(client, [b"SET", b"temp", b"value", b"EX", b"100"])
+    execute(client, [b"RPUSH", b"list", *[str(i).encode() for i in range(20000)]])
+    return db
+
+def roundtrip(db):
+    file = io.BytesIO()
+    snapshot = db.snapshot()
+    rdb.dump(snapshot.items(), file)
+    snapshot.release()
+    restored = Database()
+    loaded, size = rdb.load(io.BytesIO(file.getvalue()), restored)
+    assert size == len(file.getvalue())
+    return restored, loaded, file.getvalue()
+
+def test_roundtrip():
+    db = make_db()
+    restored, loaded, _ = roundtrip(db)
+    assert loaded == 5
+    assert restored.store == db.store
+    assert restored.expires.deadlines == db.expires.deadlines
+
+def test_binary_roundtrip():
+    db = Database()
+    execute(Client(db), [b"SET", b"\xff\x00", bytes(range(256))])
+    restored, loaded, _ = roundtrip(db)
+    assert loaded == 1 and restored.store == {b"\xff\x00": bytes(range(256))}
+
+def test_expired_keys_are_skipped():
+    db = make_db()
+    db.set_expire(b"short", now_ms() + 50)
+    snapshot = db.snapshot()
+    file = io.BytesIO()
+    rdb.dump(snapshot.items(), file)
+    time.sleep(0.1)
+    restored = Database()
+    loaded, _ = rdb.load(io.BytesIO(file.getvalue()), restored)
+    assert loaded == 4 and b"short" not in restored.store
+
+def test_checksum_mismatch():
+    _, _, data = roundtrip(make_db())
+    corrupt = bytearray(data)
+    corrupt[len(rdb.HEADER) + 5] ^= 0xFF
+    with pytest.raises(rdb.RDBError):
+        rdb.load(io.BytesIO(bytes(corrupt)), Database())
+
+def test_truncated_file():
+    _, _, data = roundtrip(make_db())
+    with pytest.raises(rdb.RDBError):
+        rdb.load(io.BytesIO(data[:len(data) // 2]), Database())
+
+def test_save_and_bgsave(tmp_path):
+    db = make_db()
+    db.rdb = rdb.RDB(str(tmp_path / "dump.rdb"))
+    client = Client(db)
+    assert execute(client, [b"SAVE"]) == b"+OK\r\n"
+    restored = Database()
+    assert rdb.RDB(str(tmp_path / "dump.rdb")).load(restored) == 5
+
+    execute(client, [b"DEL", b"list"])
+    assert execute(client, [b"BGSAVE"]) == b"+Background saving started\r\n"
+    execute(client, [b"SET", b"after", b"bgsave"]) # Not part of the snapshot
+    db.rdb._bgsave_thread.join()
+    restored = Database()
+    db.rdb.load(restored)
+    assert set(restored.store) == {b"short", b"medium", b"long", b"temp"}
+    assert b"rdb_changes_since_last_save:1" in execute(client, [b"INFO", b"persistence"])
+
+def test_aof_with_rdb_preamble(tmp_path):
+    path = tmp_path / "appendonly.aof"
+    db = make_db()
+    db.aof = aof = AOFWriter(str(path), APPENDFSYNC_NO, use_rdb_preamble=True)
+    client = Client(db)
+    aof.start_rewrite(db)
+    execute(client, [b"INCR", b"counter"])
+    while aof.rewrite_in_progress:
+        time.sleep(0.01)
+    execute(client, [b"RPUSH", b"list", b"tail"])
+    aof.close()
+
+    assert path.read_bytes().startswith(rdb.HEADER)
+    restored = Database()
+    assert load_aof(restored, str(path)).preamble_keys == 5
+    assert restored.store == db.store
+
+def test_integer_encodings_roundtrip():
+    db = Database()
+    client = Client(db)
+    values = [b"0", b"-1", b"127", b"-129", b"40000", b"-2147483648", b"2147483648", b"9223372036854775807", b"007"]
+    for i, value in enumerate(values):
+        execute(client, [b"SET", b"key%d" % i, value])
+    restored, loaded, data = roundtrip(db)
+    assert loaded == len(values)
+    assert restored.store == db.store
+    assert restored.store[b"key8"] == b"007" # Not a canonical integer, kept as a string
+    assert bytes((rdb.ENCODING_INT8,)) + b"\x7f" in data
+    assert restored.used_memory == db.used_memory
+
+def test_hash_roundtrip():
+    db = Database()
+    client = Client(db)
+    execute(client, [b"HSET", b"small", b"a", b"1", b"b", b""])
+    execute(client, [b"HSET", b"big", *(item for i in range(1000) for item in (b"f%d" % i, b"v" * i))])
+    restored, loaded, _ = roundtrip(db)
+    assert loaded == 2 and restored.store == db.store
+    assert restored.store[b"big"].encoding == "hashtable" and restored.store[b"small"].encoding == "listpack"
+
+def test_set_roundtrip():
+    db = Database()
+    client = Client(db)
+    execute(client, [b"SADD", b"ints", b"1", b"-70000", b"9223372036854775807"])
+    execute(client, [b"SADD", b"mixed", *(b"%d" % i for i in range(1000)), b"m", b"007"])
+    restored, loaded, _ = roundtrip(db)
+    assert loaded == 2 and restored.store == db.store
+    assert restored.store[b"ints"].encoding == "intset" and restored.store[b"mixed"].encoding == "hashtable"
+
+def test_sorted_set_roundtrip():
+    db = Database()
+    client = Client(db)
+    execute(client, [b"ZADD", b"small", b"1.5", b"a", b"-inf", b"b"])
+    execute(client, [b"ZADD", b"big", *(item for i in range(1000) for item in (b"%r" % (i / 7), b"m%d" % i))])
+    restored, loaded, _ = roundtrip(db)
+    assert loaded == 2 and restored.store == db.store
+    assert restored.store[b"big"].encoding == "skiplist" and restored.store[b"small"].encoding == "listpack"
@@ -0,0 +1,141 @@
+import asyncio
+from functools import partial
+from pyredis import replication
+from pyredis.client import Client
+from pyredis.commands import execute
+from pyredis.db import Database
+from pyredis.replication import Backlog, READONLY_ERROR
+from pyredis.server import handle_client_using_asyncio
+
+
+def run(client, *args):
+    return execute(client, [arg.encode() for arg in args])
+
+async def serve(db):
+    server = await asyncio.start_server(partial(handle_client_using_asyncio, db), "127.0.0.1", 0)
+    db.replication.port = server.sockets[0].getsockname()[1]
+    return server
+
+async def wait_for(condition):
+    for _ in range(500):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    assert condition()
+
+def test_backlog():
+    backlog = Backlog(100, size=8)
+    backlog.feed(b"abcde")
+    assert (backlog.first_offset, backlog.offset) == (100, 105)
+    assert backlog.read_from(102) == b"cde"
+    backlog.feed(b"fghij") # Wraps around, "ab" is gone
+    assert backlog.first_offset == 102 and backlog.read_from(102) == b"cdefghij"
+    assert backlog.read_from(101) is None and backlog.read_from(111) is None
+    assert backlog.read_from(110) == b""
+    backlog.feed(b"0123456789xyz") # Larger than the buffer
+    assert backlog.offset == 123 and backlog.read_from(115) == b"56789xyz"
+    assert backlog.read_from(114) is None
+
+def test_full_sync_then_stream(monkeypatch):
+    monkeypatch.setattr(replication, "REPL_ACK_INTERVAL", 0.01)
+    async def main():
+        primary_db, replica_db = Database(), Database()
+        writer = Client(primary_db)
+        run(writer, "SET", "name", "pyredis")
+        run(writer, "RPUSH", "list", "a", "b", "c")
+        run(writer, "HSET", "hash", "field", "value")
+        run(writer, "SET", "temporary", "x", "EX", "1000")
+        primary, replica = await serve(primary_db), await serve(replica_db)
+        run(Client(replica_db), "SET", "stale", "gone after the sync")
+
+        replica_db.replication.replicate("127.0.0.1", primary_db.replication.port)
+        await wait_for(lambda: b"name" in replica_db.store)
+        assert b"stale" not in replica_db.store
+        reader = Client(replica_db)
+        assert run(reader, "LRANGE", "list", "0", "-1") == b"*3\r\n$1\r\na\r\n$1\r\nb\r\n$1\r\nc\r\n"
+        assert run(reader, "HGET", "hash", "field") == b"$5\r\nvalue\r\n"
+        assert replica_db.get_expire(b"temporary") == primary_db.get_expire(b"temporary")
+
+        run(writer, "INCR", "counter")
+        run(writer, "MULTI")
+        run(writer, "INCR", "counter")
+        run(writer, "DEL", "name")
+        run(writer, "EXEC")
+        await wait_for(lambda: replica_db.replication.offset == primary_db.replication.offset)
+        assert run(reader, "GET", "counter") == b"$1\r\n2\r\n"
+        assert run(reader, "EXISTS", "name") == b":0\r\n"
+        assert replica_db.replication.replid == primary_db.replication.replid
+
+        # The primary hears back from its replica
+        await wait_for(lambda: next(iter(primary_db.replication.replicas.values())).ack_offset
+                       == primary_db.replication.offset)
+        info = run(writer, "INFO", "replication").decode()
+        assert "role:master" in info and "connected_slaves:1" in info
+        assert (f"port={replica_db.replication.port},state=online,"
+                f"offset={primary_db.replication.offset},lag=0") in info
+        info = run(reader, "INFO", "replication").decode()
+        assert "role:slave" in info and "master_link_status:up" in info
+        assert f"slave_repl_offset:{primary_db.replication.offset}" in info
+
+        replica_db.replication.stop_replicating()
+        primary.close()
+        replica.close()
+    asyncio.run(main())
+
+def test_partial_resync(monkeypatch):
+    monkeypatch.setattr(replication, "REPL_RETRY_INTERVAL", 0.01)
+    async def main():
+        primary_db, replica_db = Database(), Database()
+        writer = Client(primary_db)
+        run(writer, "SET", "before", "1")
+        primary = await serve(primary_db)
+        replica_db.replication.replicate("127.0.0.1", primary_db.replication.port)
+        await wait_for(lambda: b"before" in replica_db.store)
+
+        # Break the link and write while the replica is away
+        for state in list(primary_db.replication.replicas.values()):
+            state.transport.abort()
+        await wait_for(lambda: not replica_db.replication.primary.up)
+        replica_db.set_value(b"local", b"kept unless the replica resyncs fully")
+        run(writer, "SET", "during", "2")
+        await wait_for(lambda: b"during" in replica_db.store)
+        assert b"local" in replica_db.store # Caught up from the backlog, not from a snapshot
+
+        # Past the backlog, the replica has to load a snapshot
+        replica_db.replication.stop_replicating()
+        primary_db.replication.backlog = Backlog(primary_db.replication.offset, size=16)
+        run(writer, "SET", "much", "x" * 100)
+        replica_db.replication.replid = primary_db.replication.replid
+        replica_db.replication.replicate("127.0.0.1", primary_db.replication.port)
+        await wait_for(lambda: b"much" in replica_db.store)
+        assert b"local" not in replica_db.store
+
+        replica_db.replication.stop_replicating()
+        primary.close()
+    asyncio.run(main())
+
+def test_read_only_replica():
+    async def main():
+        primary_db, replica_db = Database(), Database()
+        primary = await serve(primary_db)
+        replica_db.replication.replicate("127.0.0.1", primary_db.replication.port)
+        client = Client(replica_db)
+        assert run(client, "SET", "key", "value") == READONLY_ERROR
+        assert run(client, "GET", "key") == b"$-1\r\n"
+        run(client, "MULTI")
+        assert run(client, "SET", "key", "value") == READONLY_ERROR
+        assert run(client, "EXEC").startswith(b"-EXECABORT")
+        assert run(client, "REPLICAOF", "NO", "ONE") == b"+OK\r\n"
+        assert run(client, "SET", "key", "value") == b"+OK\r\n"
+        assert "role:master" in run(client, "INFO", "replication").decode()
+        primary.close()
+    asyncio.run(main())
+
+def test_replication_commands_need_a_transport():
+    db = Database()
+    client = Client(db)
+    assert run(client, "PSYNC", "?", "-1").startswith(b"-ERR replication is only supported")
+    assert run(client, "REPLICAOF", "127.0.0.1", "6379").startswith(b"-ERR replication is only supported")
+    assert run(client, "REPLICAOF", "127.0.0.1", "port") == b"-ERR value is not an integer or out of range\r\n"
+    assert run(client, "REPLCONF", "capa", "psync2") == b"+OK\r\n"
+    assert run(client, "REPLCONF", "ACK", "10") == b"" # Unknown replica, and no reply either way
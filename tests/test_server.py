@@ -1,71 +1,858 @@
+import asyncio, socket, threading, time
+from functools import partial
 import pytest
-from pyredis.protocol import Array, BulkString, SimpleString, Error
-from pyredis.server import process_command
+from pyredis.aof import AOFWriter, APPENDFSYNC_ALWAYS
+from pyredis.cluster import read_replies
+from pyredis.commands import execute
+from pyredis.client import Client
+from pyredis.db import Database
+from pyredis.expiry import ExpiryIndex, now_ms
+from pyredis.keyindex import PrefixIndex
+from pyredis.protocol import encode_command
+from pyredis.commands import keys as keys_module
+from pyredis.server import async_process_command, handle_client_using_asyncio
+from pyredis.server_using_multithreading import StripedLock, serve_using_multiThreading, sync_process_command
 
-STORE: dict = {}
 
-def test_command():
-    frame = Array([BulkString("COMMAND")])
-    response = process_command(frame)
-    assert response == b"$2\r\nOK\r\n"
+@pytest.fixture
+def client():
+    return Client(Database())
 
-def test_info_server():
-    frame = Array([BulkString("INFO"), BulkString("SERVER")])
-    response = process_command(frame)
+def run(client, *args):
+    return execute(client, [arg.encode() for arg in args])
+
+class RecordingAOF:
+    def __init__(self):
+        self.commands = []
+
+    def feed(self, args):
+        self.commands.append(args)
+
+    def feed_all(self, commands):
+        self.commands.append(commands) # Kept together, to tell them apart
+
+    def rewrite_due(self):
+        return False
+
+def test_command_count(client):
+    response = run(client, "COMMAND", "COUNT")
+    assert response.startswith(b":") and int(response[1:]) > 10
+
+def test_command_info(client):
+    response = run(client, "COMMAND", "INFO", "get", "nosuchcommand")
+    assert response == (b"*2\r\n*6\r\n$3\r\nget\r\n:2\r\n*2\r\n+readonly\r\n+fast\r\n:1\r\n:1\r\n:1\r\n"
+                        b"*-1\r\n")
+
+def test_command_getkeys(client):
+    response = run(client, "COMMAND", "GETKEYS", "DEL", "a", "b")
+    assert response == b"*2\r\n$1\r\na\r\n$1\r\nb\r\n"
+
+def test_info_server(client):
+    response = run(client, "INFO", "SERVER")
     assert response == b"$29\r\n# Server\nredis_version:0.1.0\n\r\n"
 
-def test_info_other():
-    frame = Array([BulkString("INFO")])
-    response = process_command(frame)
+def test_info_other(client):
+    response = run(client, "INFO")
     assert response == b"$0\r\n\r\n"
 
-def test_echo_single_word():
-    frame = Array([BulkString("ECHO"), BulkString("Hello")])
-    response = process_command(frame)
+def test_echo_single_word(client):
+    response = run(client, "ECHO", "Hello")
     assert response == b"$5\r\nHello\r\n"
 
-def test_echo_multiple_words():
-    frame = Array([BulkString("ECHO"), BulkString("Hello"), BulkString("Redis"), BulkString("World!")])
-    response = process_command(frame)
+def test_echo_multiple_words(client):
+    response = run(client, "ECHO", "Hello", "Redis", "World!")
     assert response == b"$18\r\nHello Redis World!\r\n"
 
-def test_echo_missing_argument():
-    frame = Array([BulkString("ECHO")])
-    response = process_command(frame)
-    assert response == b"-ECHO requires an argument\r\n"
+def test_echo_missing_argument(client):
+    response = run(client, "ECHO")
+    assert response == b"-ERR wrong number of arguments for 'echo' command\r\n"
 
-def test_ping_no_arguments():
-    frame = Array([BulkString("PING")])
-    response = process_command(frame)
+def test_ping_no_arguments(client):
+    response = run(client, "PING")
     assert response == b"+PONG\r\n"
 
-def test_ping_with_argument():
-    frame = Array([BulkString("PING"), BulkString("Hello")])
-    response = process_command(frame)
+def test_ping_with_argument(client):
+    response = run(client, "PING", "Hello")
     assert response == b"+Hello\r\n"
 
-def test_invalid_command():
-    frame = Array([BulkString("INVALID")])
-    response = process_command(frame)
-    assert response == b"-Invalid command\r\n"
-
-def test_empty_array():
-    frame = Array([])
-    response = process_command(frame)
-    assert response == b"-Empty command\r\n"
+def test_command_is_case_insensitive(client):
+    response = run(client, "pInG")
+    assert response == b"+PONG\r\n"
 
-def test_invalid_frame_type():
-    frame = SimpleString("Invalid")
-    response = process_command(frame)
-    assert response == b"-Invalid frame type\r\n"
+def test_invalid_command(client):
+    response = run(client, "INVALID")
+    assert response == b"-ERR unknown command 'INVALID'\r\n"
 
-def test_set_command():
-    frame = Array([BulkString("SET"), BulkString("key"), BulkString("value")])
-    response = process_command(frame)
+def test_set_command(client):
+    response = run(client, "SET", "key", "value")
     assert response == b"+OK\r\n"
 
-def test_get_command():
-    STORE["key"] = "value"
-    frame = Array([BulkString("GET"), BulkString("key")])
-    response = process_command(frame)
-    assert response == b"$5\r\nvalue\r\n"
\ No newline at end of file
+def test_get_command(client):
+    run(client, "SET", "key", "value")
+    response = run(client, "GET", "key")
+    assert response == b"$5\r\nvalue\r\n"
+
+def test_get_missing_key(client):
+    assert run(client, "GET", "missing") == b"$-1\r\n"
+
+def test_incr_decr(client):
+    assert run(client, "INCR", "counter") == b":1\r\n"
+    assert run(client, "INCR", "counter") == b":2\r\n"
+    assert run(client, "DECR", "counter") == b":1\r\n"
+    run(client, "SET", "text", "abc")
+    assert run(client, "INCR", "text") == b"-ERR value is not an integer or out of range\r\n"
+
+def test_binary_safe_values(client):
+    key, value = b"\xff\x00key", bytes(range(256))
+    assert execute(client, [b"SET", key, value]) == b"+OK\r\n"
+    assert execute(client, [b"GET", key]) == b"$256\r\n" + value + b"\r\n"
+    assert client.db.store[key] is value # Stored as received, no codec pass
+    execute(client, [b"RPUSH", b"list", b"\x80\x81"])
+    assert execute(client, [b"LPOP", b"list"]) == b"$2\r\n\x80\x81\r\n"
+
+def test_del_and_exists(client):
+    run(client, "SET", "a", "1")
+    run(client, "SET", "b", "2")
+    assert run(client, "EXISTS", "a", "b", "c") == b":2\r\n"
+    assert run(client, "DEL", "a", "c") == b":1\r\n"
+    assert run(client, "EXISTS", "a") == b":0\r\n"
+
+def test_list_push_and_range(client):
+    assert run(client, "RPUSH", "list", "b", "c") == b":2\r\n"
+    assert run(client, "LPUSH", "list", "a", "z") == b":4\r\n"
+    assert run(client, "LRANGE", "list", "0", "-1") == b"*4\r\n$1\r\nz\r\n$1\r\na\r\n$1\r\nb\r\n$1\r\nc\r\n"
+    assert run(client, "LRANGE", "list", "-2", "10") == b"*2\r\n$1\r\nb\r\n$1\r\nc\r\n"
+    assert run(client, "LRANGE", "missing", "0", "-1") == b"*0\r\n"
+
+def test_list_pop(client):
+    run(client, "RPUSH", "list", "a", "b", "c", "d")
+    assert run(client, "LPOP", "list") == b"$1\r\na\r\n"
+    assert run(client, "RPOP", "list", "2") == b"*2\r\n$1\r\nd\r\n$1\r\nc\r\n"
+    assert run(client, "LLEN", "list") == b":1\r\n"
+    assert run(client, "RPOP", "list", "5") == b"*1\r\n$1\r\nb\r\n"
+    assert run(client, "EXISTS", "list") == b":0\r\n" # Popping the last element removes the key
+    assert run(client, "LPOP", "list") == b"$-1\r\n"
+    assert run(client, "LPOP", "list", "1") == b"*-1\r\n"
+
+def test_list_index_set_and_trim(client):
+    run(client, "RPUSH", "list", *"abcdef")
+    assert run(client, "LINDEX", "list", "-2") == b"$1\r\ne\r\n"
+    assert run(client, "LINDEX", "list", "6") == b"$-1\r\n"
+    assert run(client, "LSET", "list", "1", "B") == b"+OK\r\n"
+    assert run(client, "LSET", "list", "9", "x") == b"-ERR index out of range\r\n"
+    assert run(client, "LSET", "missing", "0", "x") == b"-ERR no such key\r\n"
+    assert run(client, "LTRIM", "list", "1", "-2") == b"+OK\r\n"
+    assert run(client, "LRANGE", "list", "0", "-1") == b"*4\r\n$1\r\nB\r\n$1\r\nc\r\n$1\r\nd\r\n$1\r\ne\r\n"
+    assert run(client, "LTRIM", "list", "5", "10") == b"+OK\r\n"
+    assert run(client, "EXISTS", "list") == b":0\r\n"
+
+def test_lmove(client):
+    run(client, "RPUSH", "src", "a", "b")
+    assert run(client, "LMOVE", "src", "dst", "LEFT", "RIGHT") == b"$1\r\na\r\n"
+    assert run(client, "LMOVE", "src", "dst", "RIGHT", "LEFT") == b"$1\r\nb\r\n"
+    assert run(client, "LRANGE", "dst", "0", "-1") == b"*2\r\n$1\r\nb\r\n$1\r\na\r\n"
+    assert run(client, "EXISTS", "src") == b":0\r\n"
+    assert run(client, "LMOVE", "src", "dst", "LEFT", "LEFT") == b"$-1\r\n"
+    assert run(client, "LMOVE", "dst", "dst", "UP", "LEFT") == b"-ERR syntax error\r\n"
+
+def test_hash_commands(client):
+    assert run(client, "HSET", "h", "a", "1", "b", "2") == b":2\r\n"
+    assert run(client, "HSET", "h", "a", "3", "c", "4") == b":1\r\n"
+    assert run(client, "HSET", "h", "a") == b"-ERR wrong number of arguments for 'hset' command\r\n"
+    assert run(client, "HGET", "h", "a") == b"$1\r\n3\r\n"
+    assert run(client, "HGET", "h", "z") == b"$-1\r\n"
+    assert run(client, "HMGET", "h", "b", "z") == b"*2\r\n$1\r\n2\r\n$-1\r\n"
+    assert run(client, "HLEN", "h") == b":3\r\n"
+    assert run(client, "HGETALL", "h") == b"*6\r\n$1\r\na\r\n$1\r\n3\r\n$1\r\nb\r\n$1\r\n2\r\n$1\r\nc\r\n$1\r\n4\r\n"
+    assert run(client, "HDEL", "h", "a", "z") == b":1\r\n"
+    assert run(client, "HDEL", "h", "b", "c") == b":2\r\n"
+    assert run(client, "EXISTS", "h") == b":0\r\n" # Deleting the last field removes the key
+    assert run(client, "HGETALL", "h") == b"*0\r\n"
+    run(client, "SET", "s", "x")
+    assert run(client, "HGET", "s", "a").startswith(b"-WRONGTYPE")
+    assert run(client, "HSET", "s", "a", "1").startswith(b"-WRONGTYPE")
+
+def test_hincrby(client):
+    assert run(client, "HINCRBY", "h", "n", "5") == b":5\r\n"
+    assert run(client, "HINCRBY", "h", "n", "-7") == b":-2\r\n"
+    run(client, "HSET", "h", "s", "abc", "big", "9223372036854775807")
+    assert run(client, "HINCRBY", "h", "s", "1") == b"-ERR hash value is not an integer\r\n"
+    assert run(client, "HINCRBY", "h", "n", "x") == b"-ERR value is not an integer or out of range\r\n"
+    assert run(client, "HINCRBY", "h", "big", "1") == b"-ERR increment or decrement would overflow\r\n"
+
+def test_hscan(client):
+    run(client, "HSET", "small", "a", "1", "b", "2")
+    assert run(client, "HSCAN", "small", "0", "COUNT", "1") == (
+        b"*2\r\n$1\r\n0\r\n*4\r\n$1\r\na\r\n$1\r\n1\r\n$1\r\nb\r\n$1\r\n2\r\n")
+    fields = [b"field:%d" % i for i in range(300)]
+    execute(client, [b"HSET", b"big", *(item for field in fields for item in (field, b"v"))])
+    seen, cursor = [], b"0"
+    while True:
+        reply = execute(client, [b"HSCAN", b"big", cursor, b"MATCH", b"field:1*", b"COUNT", b"50"])
+        lines = reply.split(b"\r\n")
+        cursor = lines[2]
+        seen += lines[5::4]
+        if cursor == b"0":
+            break
+    assert sorted(seen) == sorted(field for field in fields if field.startswith(b"field:1"))
+    assert run(client, "HSCAN", "big", "x") == b"-ERR invalid cursor\r\n"
+    assert run(client, "HSCAN", "missing", "0") == b"*2\r\n$1\r\n0\r\n*0\r\n"
+
+def test_hscan_survives_changes(client):
+    fields = [b"f%d" % i for i in range(300)]
+    execute(client, [b"HSET", b"h", *(item for field in fields for item in (field, b"v"))])
+    seen, cursor = set(), b"0"
+    while True:
+        lines = execute(client, [b"HSCAN", b"h", cursor, b"COUNT", b"100"]).split(b"\r\n")
+        cursor = lines[2]
+        seen.update(lines[5::4])
+        if cursor == b"0":
+            break
+        execute(client, [b"HDEL", b"h", fields.pop(0)])
+    assert seen >= set(fields)
+
+def test_zadd_and_scores(client):
+    assert run(client, "ZADD", "z", "1", "a", "2", "b", "2", "c") == b":3\r\n"
+    assert run(client, "ZADD", "z", "CH", "5", "a", "2", "b", "0", "d") == b":2\r\n"
+    assert run(client, "ZADD", "z", "XX", "9", "missing") == b":0\r\n"
+    assert run(client, "ZADD", "z", "NX", "9", "a") == b":0\r\n"
+    assert run(client, "ZADD", "z", "GT", "CH", "1", "a", "7", "b") == b":1\r\n"
+    assert run(client, "ZADD", "z", "INCR", "1.5", "a") == b"$3\r\n6.5\r\n"
+    assert run(client, "ZADD", "z", "LT", "INCR", "1", "a") == b"$-1\r\n"
+    assert run(client, "ZADD", "z", "NX", "XX", "1", "a").startswith(b"-ERR XX and NX")
+    assert run(client, "ZADD", "z", "1", "a", "2") == b"-ERR syntax error\r\n"
+    assert run(client, "ZADD", "z", "nan", "a") == b"-ERR value is not a valid float\r\n"
+    assert run(client, "ZINCRBY", "z", "-0.5", "a") == b"$1\r\n6\r\n"
+    assert run(client, "ZSCORE", "z", "b") == b"$1\r\n7\r\n"
+    assert run(client, "ZSCORE", "z", "missing") == b"$-1\r\n"
+    assert run(client, "ZCARD", "z") == b":4\r\n"
+    assert run(client, "ZRANK", "z", "d") == b":0\r\n" and run(client, "ZRANK", "z", "b") == b":3\r\n"
+    assert run(client, "ZREVRANK", "z", "b") == b":0\r\n"
+    assert run(client, "ZREM", "z", "a", "missing") == b":1\r\n"
+    run(client, "SET", "s", "x")
+    assert run(client, "ZADD", "s", "1", "a").startswith(b"-WRONGTYPE")
+
+def test_zrange(client):
+    run(client, "ZADD", "z", "1", "a", "2", "b", "3", "c", "4", "d", "inf", "e")
+    assert run(client, "ZRANGE", "z", "0", "1") == b"*2\r\n$1\r\na\r\n$1\r\nb\r\n"
+    assert run(client, "ZRANGE", "z", "-2", "-1", "WITHSCORES") == b"*4\r\n$1\r\nd\r\n$1\r\n4\r\n$1\r\ne\r\n$3\r\ninf\r\n"
+    assert run(client, "ZRANGE", "z", "0", "1", "REV") == b"*2\r\n$1\r\ne\r\n$1\r\nd\r\n"
+    assert run(client, "ZRANGE", "z", "(1", "3", "BYSCORE") == b"*2\r\n$1\r\nb\r\n$1\r\nc\r\n"
+    assert run(client, "ZRANGE", "z", "+inf", "2", "BYSCORE", "REV", "LIMIT", "1", "2") == b"*2\r\n$1\r\nd\r\n$1\r\nc\r\n"
+    assert run(client, "ZRANGEBYSCORE", "z", "-inf", "(3", "WITHSCORES", "LIMIT", "1", "-1") == b"*2\r\n$1\r\nb\r\n$1\r\n2\r\n"
+    assert run(client, "ZRANGEBYSCORE", "z", "5", "1") == b"*0\r\n"
+    assert run(client, "ZRANGEBYSCORE", "z", "x", "1") == b"-ERR min or max is not a float\r\n"
+    assert run(client, "ZRANGE", "z", "0", "1", "LIMIT", "0", "1").startswith(b"-ERR syntax error, LIMIT")
+    run(client, "ZADD", "lex", "0", "apple", "0", "banana", "0", "cherry", "0", "date")
+    assert run(client, "ZRANGE", "lex", "[b", "(d", "BYLEX") == b"*2\r\n$6\r\nbanana\r\n$6\r\ncherry\r\n"
+    assert run(client, "ZRANGE", "lex", "(banana", "+", "BYLEX") == b"*2\r\n$6\r\ncherry\r\n$4\r\ndate\r\n"
+    assert run(client, "ZRANGE", "lex", "[cherry", "-", "BYLEX", "REV") == b"*3\r\n$6\r\ncherry\r\n$6\r\nbanana\r\n$5\r\napple\r\n"
+    assert run(client, "ZRANGE", "lex", "b", "+", "BYLEX") == b"-ERR min or max not valid string range item\r\n"
+
+def test_zpopmin_and_bzpopmin(client):
+    db = client.db
+    db.aof = aof = RecordingAOF()
+    run(client, "ZADD", "z", "1", "a", "2", "b", "3", "c")
+    assert run(client, "ZPOPMIN", "z") == b"*2\r\n$1\r\na\r\n$1\r\n1\r\n"
+    assert run(client, "ZPOPMAX", "z", "5") == b"*4\r\n$1\r\nc\r\n$1\r\n3\r\n$1\r\nb\r\n$1\r\n2\r\n"
+    assert run(client, "EXISTS", "z") == b":0\r\n"
+    assert run(client, "ZPOPMIN", "z") == b"*0\r\n"
+
+    blocked = Client(db)
+    assert run(blocked, "BZPOPMIN", "z", "other", "0") is None
+    woken = []
+    blocked.waiter.on_ready = lambda: woken.append(blocked)
+    run(client, "ZADD", "other", "5", "x", "4", "y")
+    assert woken == [blocked]
+    assert blocked.waiter.reply == b"*3\r\n$5\r\nother\r\n$1\r\ny\r\n$1\r\n4\r\n"
+    assert aof.commands[-1] == [b"ZPOPMIN", b"other"]
+    assert run(client, "BZPOPMIN", "other", "0") == b"*3\r\n$5\r\nother\r\n$1\r\nx\r\n$1\r\n5\r\n"
+
+def test_set_commands(client):
+    assert run(client, "SADD", "s", "3", "1", "2", "1") == b":3\r\n"
+    assert run(client, "SMEMBERS", "s") == b"*3\r\n$1\r\n1\r\n$1\r\n2\r\n$1\r\n3\r\n"
+    assert run(client, "SISMEMBER", "s", "2") == b":1\r\n"
+    assert run(client, "SISMEMBER", "s", "x") == b":0\r\n"
+    assert run(client, "OBJECT", "ENCODING", "s") == b"$6\r\nintset\r\n"
+    assert run(client, "SADD", "s", "x") == b":1\r\n"
+    assert run(client, "OBJECT", "ENCODING", "s") == b"$9\r\nhashtable\r\n"
+    assert run(client, "SCARD", "s") == b":4\r\n"
+    assert run(client, "SREM", "s", "1", "x", "missing") == b":2\r\n"
+    assert run(client, "SREM", "s", "2", "3") == b":2\r\n"
+    assert run(client, "EXISTS", "s") == b":0\r\n" # Removing the last member removes the key
+    assert run(client, "SCARD", "s") == b":0\r\n"
+    run(client, "SET", "str", "x")
+    assert run(client, "SADD", "str", "a").startswith(b"-WRONGTYPE")
+    assert run(client, "SINTER", "str").startswith(b"-WRONGTYPE")
+
+def test_set_algebra_commands(client):
+    run(client, "SADD", "a", "1", "2", "3", "x")
+    run(client, "SADD", "b", "2", "3", "4")
+    run(client, "SADD", "c", "3", "x")
+    assert run(client, "SINTER", "a", "b", "c") == b"*1\r\n$1\r\n3\r\n"
+    assert run(client, "SINTER", "a", "missing") == b"*0\r\n"
+    assert sorted(run(client, "SUNION", "b", "c", "missing").split(b"\r\n")[2::2]) == [b"2", b"3", b"4", b"x"]
+    assert sorted(run(client, "SDIFF", "a", "b", "missing").split(b"\r\n")[2::2]) == [b"1", b"x"]
+    assert run(client, "SDIFF", "missing", "a") == b"*0\r\n"
+    assert run(client, "SINTERSTORE", "dst", "a", "b") == b":2\r\n"
+    assert run(client, "OBJECT", "ENCODING", "dst") == b"$6\r\nintset\r\n"
+    assert run(client, "SINTERSTORE", "dst", "a", "missing") == b":0\r\n"
+    assert run(client, "EXISTS", "dst") == b":0\r\n"
+
+def test_spop_and_srandmember(client):
+    client.db.aof = aof = RecordingAOF()
+    run(client, "SADD", "s", "a", "b", "c", "d")
+    assert run(client, "SRANDMEMBER", "s", "10").startswith(b"*4\r\n")
+    assert run(client, "SRANDMEMBER", "s", "-6").startswith(b"*6\r\n")
+    assert run(client, "SRANDMEMBER", "missing") == b"$-1\r\n"
+    member = run(client, "SPOP", "s").split(b"\r\n")[1]
+    assert aof.commands[-1] == [b"SREM", b"s", member]
+    assert execute(client, [b"SISMEMBER", b"s", member]) == b":0\r\n"
+    reply = run(client, "SPOP", "s", "2").split(b"\r\n")
+    assert reply[0] == b"*2" and aof.commands[-1] == [b"SREM", b"s", reply[2], reply[4]]
+    assert run(client, "SPOP", "s", "5").startswith(b"*1\r\n")
+    assert run(client, "EXISTS", "s") == b":0\r\n"
+    assert run(client, "SPOP", "s", "-1") == b"-ERR value is out of range, must be positive\r\n"
+
+def test_type_and_dbsize(client):
+    run(client, "SET", "string", "x")
+    run(client, "RPUSH", "list", "x")
+    run(client, "SADD", "set", "x")
+    assert [run(client, "TYPE", key) for key in ("string", "list", "set", "missing")] == [
+        b"+string\r\n", b"+list\r\n", b"+set\r\n", b"+none\r\n"]
+    assert run(client, "DBSIZE") == b":3\r\n"
+
+def _scan_all(client, *options):
+    # Every key returned by a full SCAN iteration, and the number of calls it took
+    keys, cursor, calls = [], b"0", 0
+    while True:
+        reply = execute(client, [b"SCAN", cursor, *options]).split(b"\r\n")
+        cursor, calls = reply[2], calls + 1
+        keys += reply[5::2]
+        if cursor == b"0":
+            return keys, calls
+
+def test_scan(client):
+    for i in range(100):
+        run(client, "SET", f"string:{i}", "x")
+        run(client, "RPUSH", f"list:{i}", "x")
+    run(client, "SET", "expired", "x", "PX", "1")
+    time.sleep(0.002)
+    keys, calls = _scan_all(client, b"COUNT", b"20")
+    assert len(keys) == len(set(keys)) == 200 and calls > 1
+    keys, _ = _scan_all(client, b"MATCH", b"string:1*", b"TYPE", b"string")
+    assert sorted(keys) == sorted(b"string:%d" % i for i in range(100) if str(i).startswith("1"))
+    assert len(_scan_all(client, b"TYPE", b"list")[0]) == 100
+    assert run(client, "SCAN", "x") == b"-ERR invalid cursor\r\n"
+    assert run(client, "SCAN", "0", "COUNT", "0") == b"-ERR syntax error\r\n"
+    assert run(client, "SCAN", "0", "MATCH") == b"-ERR syntax error\r\n"
+
+def test_scan_survives_inserts_and_deletes(client):
+    for i in range(300):
+        run(client, "SET", f"kept:{i}", "x")
+        run(client, "SET", f"gone:{i}", "x")
+    seen, cursor, step = [], b"0", 0
+    while True:
+        reply = execute(client, [b"SCAN", cursor, b"COUNT", b"10"]).split(b"\r\n")
+        cursor = reply[2]
+        seen += reply[5::2]
+        run(client, "DEL", f"gone:{step}")
+        run(client, "SET", f"new:{step}", "x")
+        step += 1
+        if cursor == b"0":
+            break
+    kept = [key for key in seen if key.startswith(b"kept:")]
+    assert len(kept) == len(set(kept)) == 300
+
+def test_keys(client):
+    for i in range(30):
+        run(client, "SET", f"user:{i}", "x")
+    run(client, "SET", "other", "x")
+    reply = run(client, "KEYS", "user:2*").split(b"\r\n")
+    assert sorted(reply[2::2]) == sorted(b"user:%d" % i for i in range(30) if str(i).startswith("2"))
+    assert run(client, "KEYS", "*").startswith(b"*31\r\n")
+    PrefixIndex().attach(client.db)
+    run(client, "SET", "user:2x", "x")
+    run(client, "DEL", "user:20")
+    reply = run(client, "KEYS", "user:2*").split(b"\r\n")
+    assert reply[2::2] == [b"user:2", b"user:21", b"user:22", b"user:23", b"user:24", b"user:25", b"user:26",
+                           b"user:27", b"user:28", b"user:29", b"user:2x"] # In key order from the index
+
+@pytest.mark.parametrize("prefix_index", [False, True])
+def test_keys_yields_to_event_loop(client, monkeypatch, prefix_index):
+    monkeypatch.setattr(keys_module, "KEYS_BATCH", 10)
+    if prefix_index:
+        PrefixIndex().attach(client.db)
+    for i in range(100):
+        run(client, "SET", f"key:{i}", "x")
+    other = Client(client.db)
+
+    async def main():
+        reply = asyncio.ensure_future(async_process_command([b"KEYS", b"key:*"], client))
+        await asyncio.sleep(0)
+        assert not reply.done() # Other clients are served while KEYS collects
+        await async_process_command([b"SET", b"key:new", b"x"], other)
+        return await reply
+    reply = asyncio.run(main()).split(b"\r\n")
+    assert set(b"key:%d" % i for i in range(100)) <= set(reply[2::2])
+
+def test_read_only_batch_does_not_wait_for_fsync(tmp_path, monkeypatch):
+    monkeypatch.setattr(keys_module, "KEYS_BATCH", 10)
+    db = Database()
+    db.aof = aof = AOFWriter(str(tmp_path / "appendonly.aof"), APPENDFSYNC_ALWAYS)
+    for i in range(1000):
+        execute(Client(db), [b"SET", b"key:%d" % i, b"x"])
+    waits = []
+    real_synced = aof.synced
+    monkeypatch.setattr(aof, "synced", lambda offset=None: waits.append(offset) or real_synced(offset))
+    keys_started = []
+    real_collect = keys_module._collect_keys
+    monkeypatch.setattr(keys_module, "_collect_keys", lambda *args: keys_started.append(1) or real_collect(*args))
+
+    async def main():
+        aof.bind_loop(asyncio.get_running_loop())
+        server = await asyncio.start_server(partial(handle_client_using_asyncio, db), "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        other_reader, other_writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(encode_command([b"PING"]) + encode_command([b"KEYS", b"*"]))
+        while not keys_started:
+            await asyncio.sleep(0)
+        other_writer.write(encode_command([b"SET", b"x", b"y"])) # While KEYS collects
+        assert await asyncio.wait_for(read_replies(other_reader, 1), 5) == [b"+OK\r\n"]
+        pong, keys = await asyncio.wait_for(read_replies(reader, 2), 5)
+        assert pong == b"+PONG\r\n" and keys.startswith(b"*100")
+        for stream in (writer, other_writer):
+            stream.close()
+        server.close()
+
+    asyncio.run(main())
+    assert len(waits) == 1 # Only the SET's batch waited for its fsync
+    aof.close()
+
+def test_sscan_and_zscan(client):
+    run(client, "SADD", "ints", "1", "2", "3")
+    assert run(client, "SSCAN", "ints", "0", "COUNT", "1") == b"*2\r\n$1\r\n0\r\n*3\r\n$1\r\n1\r\n$1\r\n2\r\n$1\r\n3\r\n"
+    execute(client, [b"SADD", b"big", *(b"m%d" % i for i in range(300))])
+    execute(client, [b"ZADD", b"zbig", *(item for i in range(300) for item in (b"%d" % i, b"m%d" % i))])
+    for command, key, width in ((b"SSCAN", b"big", 1), (b"ZSCAN", b"zbig", 2)):
+        seen, cursor = [], b"0"
+        while True:
+            reply = execute(client, [command, key, cursor, b"MATCH", b"m1*", b"COUNT", b"50"]).split(b"\r\n")
+            cursor = reply[2]
+            seen += reply[5::2 * width]
+            if cursor == b"0":
+                break
+        assert sorted(seen) == sorted(b"m%d" % i for i in range(300) if str(i).startswith("1"))
+    found, cursor = [], b"0"
+    while True:
+        reply = execute(client, [b"ZSCAN", b"zbig", cursor, b"MATCH", b"m5", b"COUNT", b"10"]).split(b"\r\n")
+        cursor = reply[2]
+        found += reply[5:-1:2]
+        if cursor == b"0":
+            break
+    assert found == [b"m5", b"5"] # Members come with their scores
+    assert run(client, "SSCAN", "missing", "0") == b"*2\r\n$1\r\n0\r\n*0\r\n"
+
+@pytest.mark.parametrize("add, remove, scan, width", [
+    (b"SADD", b"SREM", b"SSCAN", 1),
+    (b"ZADD", b"ZREM", b"ZSCAN", 2),
+])
+def test_member_scan_survives_changes(client, add, remove, scan, width):
+    members = [b"m%d" % i for i in range(300)]
+    execute(client, [add, b"big", *(item for i, member in enumerate(members)
+                                     for item in ((b"%d" % i, member) if width == 2 else (member,)))])
+    seen, cursor, calls = [], b"0", 0
+    while True:
+        reply = execute(client, [scan, b"big", cursor, b"COUNT", b"20"]).split(b"\r\n")
+        cursor = reply[2]
+        seen += reply[5::2 * width]
+        calls += 1
+        if calls == 2: # Shrink the set to a tenth mid-scan, and grow it again
+            execute(client, [remove, b"big", *members[30:]])
+            execute(client, [add, b"big", *((b"0", b"new") if width == 2 else (b"new",))])
+        if cursor == b"0":
+            break
+    assert set(members[:30]) <= set(seen) # Everything present throughout
+
+def test_blpop_pops_without_blocking(client):
+    client.db.aof = aof = RecordingAOF()
+    run(client, "RPUSH", "second", "x")
+    assert run(client, "BLPOP", "first", "second", "0") == b"*2\r\n$6\r\nsecond\r\n$1\r\nx\r\n"
+    assert aof.commands[-1] == [b"LPOP", b"second"]
+    assert run(client, "BLPOP", "first", "-1") == b"-ERR timeout is negative\r\n"
+    assert run(client, "BLPOP", "first", "soon") == b"-ERR timeout is not a float or out of range\r\n"
+
+def test_push_serves_oldest_blocked_client(client):
+    db = client.db
+    db.aof = aof = RecordingAOF()
+    first, second = Client(db), Client(db)
+    woken = []
+    for blocked in (first, second):
+        assert run(blocked, "BRPOP", "queue", "0") is None
+        blocked.waiter.on_ready = lambda blocked=blocked: woken.append(blocked)
+    assert len(db.blocked) == 2
+
+    assert run(client, "RPUSH", "queue", "a") == b":1\r\n"
+    assert woken == [first]
+    assert first.waiter.reply == b"*2\r\n$5\r\nqueue\r\n$1\r\na\r\n"
+    assert aof.commands == [[b"RPUSH", b"queue", b"a"], [b"RPOP", b"queue"]]
+    assert run(client, "EXISTS", "queue") == b":0\r\n" # The element went straight to the waiter
+    assert len(db.blocked) == 1
+
+def test_blmove_is_served_and_wakes_destination(client):
+    db = client.db
+    mover, popper = Client(db), Client(db)
+    assert run(mover, "BLMOVE", "jobs", "working", "LEFT", "RIGHT", "0") is None
+    mover.waiter.on_ready = lambda: None
+    assert run(popper, "BLPOP", "working", "0") is None
+    popper.waiter.on_ready = lambda: None
+
+    run(client, "RPUSH", "jobs", "job1")
+    assert mover.waiter.reply == b"$4\r\njob1\r\n"
+    assert popper.waiter.reply == b"*2\r\n$7\r\nworking\r\n$4\r\njob1\r\n"
+    assert len(db) == 0 and len(db.blocked) == 0
+
+def test_blocking_pop_on_asyncio(client):
+    async def main():
+        blocked = Client(client.db)
+        assert await async_process_command([b"BLPOP", b"queue", b"0.01"], blocked) == b"*-1\r\n"
+        pending = asyncio.ensure_future(async_process_command([b"BLPOP", b"queue", b"0"], blocked))
+        await asyncio.sleep(0)
+        await async_process_command([b"LPUSH", b"queue", b"job"], client)
+        assert await pending == b"*2\r\n$5\r\nqueue\r\n$3\r\njob\r\n"
+        assert len(client.db.blocked) == 0
+    asyncio.run(main())
+
+@pytest.mark.parametrize("block, push, expected", [
+    ([b"BLPOP", b"queue", b"0"], [b"RPUSH", b"queue", b"job"], b"*2\r\n$5\r\nqueue\r\n$3\r\njob\r\n"),
+    ([b"BZPOPMIN", b"queue", b"0"], [b"ZADD", b"queue", b"1", b"job"],
+     b"*3\r\n$5\r\nqueue\r\n$3\r\njob\r\n$1\r\n1\r\n"),
+])
+def test_blocking_pop_with_appendfsync_always(tmp_path, block, push, expected):
+    db = Database()
+    db.aof = aof = AOFWriter(str(tmp_path / "appendonly.aof"), APPENDFSYNC_ALWAYS)
+
+    async def main():
+        aof.bind_loop(asyncio.get_running_loop())
+        server = await asyncio.start_server(partial(handle_client_using_asyncio, db), "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        pusher_reader, pusher_writer = await asyncio.open_connection("127.0.0.1", port)
+        # The write before the blocking command is answered once synced, before the block
+        writer.write(encode_command([b"SET", b"before", b"x"]) + encode_command(block))
+        assert await asyncio.wait_for(read_replies(reader, 1), 5) == [b"+OK\r\n"]
+        while not len(db.blocked):
+            await asyncio.sleep(0.001)
+        pusher_writer.write(encode_command(push))
+        assert await asyncio.wait_for(read_replies(pusher_reader, 1), 5) == [b":1\r\n"]
+        assert await asyncio.wait_for(read_replies(reader, 1), 5) == [expected]
+        # A timeout is answered without waiting on anything
+        writer.write(encode_command([*block[:-1], b"0.01"]))
+        assert await asyncio.wait_for(read_replies(reader, 1), 5) == [b"*-1\r\n"]
+        for stream in (writer, pusher_writer):
+            stream.close()
+        server.close()
+
+    asyncio.run(main())
+    aof.close()
+    assert (tmp_path / "appendonly.aof").read_bytes().count(b"\r\nqueue\r\n") == 2 # The push and the pop
+
+def test_blocked_client_that_hangs_up_is_not_served(client):
+    db = client.db
+
+    async def main():
+        server = await asyncio.start_server(partial(handle_client_using_asyncio, db), "127.0.0.1", 0)
+        _, writer = await asyncio.open_connection(*server.sockets[0].getsockname())
+        writer.write(encode_command([b"BLPOP", b"queue", b"0"]))
+        while not len(db.blocked):
+            await asyncio.sleep(0.001)
+        writer.close()
+        for _ in range(500):
+            if not len(db.blocked):
+                break
+            await asyncio.sleep(0.01)
+        assert await async_process_command([b"RPUSH", b"queue", b"job1"], client) == b":1\r\n"
+        assert await async_process_command([b"LLEN", b"queue"], client) == b":1\r\n" # Not lost
+        server.close()
+    asyncio.run(main())
+
+def test_blocking_pop_on_threads(client):
+    client.db.use_lock_striping(StripedLock())
+    blocked = Client(client.db)
+    assert sync_process_command([b"BLPOP", b"queue", b"0.01"], blocked) == b"*-1\r\n"
+    replies = []
+    waiter = threading.Thread(target=lambda: replies.append(sync_process_command([b"BLPOP", b"queue", b"5"], blocked)))
+    waiter.start()
+    while not len(client.db.blocked):
+        time.sleep(0.001)
+    sync_process_command([b"RPUSH", b"queue", b"job"], client)
+    waiter.join()
+    assert replies == [b"*2\r\n$5\r\nqueue\r\n$3\r\njob\r\n"]
+
+def test_multi_exec(client):
+    client.db.aof = aof = RecordingAOF()
+    assert run(client, "MULTI") == b"+OK\r\n"
+    assert run(client, "INCR", "counter") == b"+QUEUED\r\n"
+    assert run(client, "RPUSH", "log", "a") == b"+QUEUED\r\n"
+    assert run(client, "GET", "counter") == b"+QUEUED\r\n"
+    assert client.db.store == {} # Nothing runs before EXEC
+    assert run(client, "EXEC") == b"*3\r\n:1\r\n:1\r\n$1\r\n1\r\n"
+    assert aof.commands == [[[b"MULTI"], [b"INCR", b"counter"], [b"RPUSH", b"log", b"a"], [b"EXEC"]]]
+    run(client, "MULTI")
+    run(client, "SET", "key", "value", "EX", "100")
+    run(client, "GET", "missing")
+    assert run(client, "EXEC") == b"*2\r\n+OK\r\n$-1\r\n"
+    assert aof.commands[-1][:3] == [b"SET", b"key", b"value"] # A single write needs no MULTI
+    run(client, "MULTI")
+    assert run(client, "EXEC") == b"*0\r\n"
+    assert run(client, "EXEC") == b"-ERR EXEC without MULTI\r\n"
+    assert run(client, "DISCARD") == b"-ERR DISCARD without MULTI\r\n"
+
+def test_multi_errors(client):
+    run(client, "MULTI")
+    assert run(client, "SET", "key").startswith(b"-ERR wrong number of arguments")
+    assert run(client, "INCR", "counter") == b"+QUEUED\r\n"
+    assert run(client, "EXEC").startswith(b"-EXECABORT")
+    assert b"counter" not in client.db.store
+    run(client, "MULTI")
+    assert run(client, "MULTI") == b"-ERR MULTI calls can not be nested\r\n"
+    assert run(client, "EXEC").startswith(b"-EXECABORT")
+    run(client, "MULTI")
+    run(client, "SET", "key", "value")
+    assert run(client, "DISCARD") == b"+OK\r\n"
+    assert client.transaction is None and b"key" not in client.db.store
+    run(client, "SET", "key", "value")
+    run(client, "MULTI")
+    run(client, "LPUSH", "key", "x") # Fails when run, the rest still runs
+    run(client, "SET", "other", "1")
+    assert run(client, "EXEC") == b"*2\r\n" + run(Client(client.db), "LPUSH", "key", "x") + b"+OK\r\n"
+
+def test_blocking_command_in_multi_does_not_block(client):
+    run(client, "MULTI")
+    run(client, "BLPOP", "queue", "0")
+    run(client, "RPUSH", "queue", "job")
+    assert run(client, "EXEC") == b"*2\r\n*-1\r\n:1\r\n"
+    assert len(client.db.blocked) == 0
+
+def test_watch(client):
+    other = Client(client.db)
+    run(client, "SET", "key", "1")
+    assert run(client, "WATCH", "key", "missing") == b"+OK\r\n"
+    run(other, "SET", "key", "2") # Overwrites a string in place
+    run(client, "MULTI")
+    run(client, "SET", "key", "3")
+    assert run(client, "EXEC") == b"*-1\r\n"
+    assert run(client, "GET", "key") == b"$1\r\n2\r\n"
+    assert client.watching is None and client.db.watched == {}
+
+    run(client, "WATCH", "key")
+    run(other, "GET", "key") # Reads don't count
+    run(client, "MULTI")
+    assert run(client, "WATCH", "key") == b"-ERR WATCH inside MULTI is not allowed\r\n"
+    run(client, "DISCARD")
+    run(client, "WATCH", "key")
+    run(client, "MULTI")
+    run(client, "INCR", "key")
+    assert run(client, "EXEC") == b"*1\r\n:3\r\n"
+
+    run(client, "WATCH", "missing")
+    run(other, "RPUSH", "missing", "x")
+    run(client, "MULTI")
+    assert run(client, "EXEC") == b"*-1\r\n"
+    run(client, "WATCH", "key")
+    assert run(client, "UNWATCH") == b"+OK\r\n"
+    run(other, "DEL", "key")
+    run(client, "MULTI")
+    assert run(client, "EXEC") == b"*0\r\n"
+
+def test_watched_key_expiring_aborts_exec(client):
+    run(client, "SET", "key", "1", "PX", "1")
+    run(client, "WATCH", "key")
+    time.sleep(0.002) # Expired, but not removed yet
+    run(client, "MULTI")
+    assert run(client, "EXEC") == b"*-1\r\n"
+
+def test_exec_takes_every_stripe(client):
+    locks = StripedLock(8)
+    client.db.use_lock_striping(locks)
+    assert locks.stripes_for_command([b"EXEC"]) == locks.all
+    assert sync_process_command([b"MULTI"], client) == b"+OK\r\n"
+    locks.acquire(locks.all)
+    try: # Queueing takes no stripe
+        assert sync_process_command([b"INCR", b"counter"], client) == b"+QUEUED\r\n"
+    finally:
+        locks.release(locks.all)
+    assert sync_process_command([b"EXEC"], client) == b"*1\r\n:1\r\n"
+
+def test_striped_lock_orders_stripes():
+    locks = StripedLock(8)
+    keys = [b"key%d" % i for i in range(20)]
+    stripes = locks.stripes(keys)
+    assert stripes == sorted(set(stripes)) and all(0 <= stripe < 8 for stripe in stripes)
+    assert locks.stripes_for_command([b"GET", b"key1"]) == locks.stripes([b"key1"])
+    assert locks.stripes_for_command([b"PING"]) == ()
+    batch = [b"MSET", *(item for key in keys for item in (key, b"v"))]
+    assert locks.stripes_for_command(batch) == stripes # Values are not keys
+    assert locks.stripes_for_command([b"BLPOP", b"key1", b"0"]) == locks.all
+    assert locks.stripes_for_command([b"BGSAVE"]) == locks.all
+
+def _threaded_server(db):
+    server_socket = socket.create_server(("127.0.0.1", 0))
+    threading.Thread(target=serve_using_multiThreading, args=(server_socket, db, 2, 4), daemon=True).start()
+    return server_socket.getsockname()
+
+def _read_reply(connection, expected):
+    data = b""
+    while len(data) < len(expected):
+        chunk = connection.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+def test_threaded_server_pipelines_in_order(client):
+    address = _threaded_server(client.db)
+    with socket.create_connection(address) as connection:
+        connection.sendall(b"*3\r\n$3\r\nSET\r\n$1\r\na\r\n$1\r\n1\r\n" + b"INCR a\r\n" * 100 + b"GET a\r\n")
+        expected = b"+OK\r\n" + b"".join(b":%d\r\n" % i for i in range(2, 102)) + b"$3\r\n101\r\n"
+        assert _read_reply(connection, expected) == expected
+
+def test_threaded_server_blocking_pop(client):
+    address = _threaded_server(client.db)
+    with socket.create_connection(address) as blocked, socket.create_connection(address) as pusher:
+        blocked.sendall(b"BLPOP queue 0.01\r\nBLPOP queue 5\r\nPING\r\n")
+        assert _read_reply(blocked, b"*-1\r\n") == b"*-1\r\n"
+        while not len(client.db.blocked):
+            time.sleep(0.001)
+        pusher.sendall(b"RPUSH queue job\r\n")
+        assert _read_reply(pusher, b":1\r\n") == b":1\r\n"
+        expected = b"*2\r\n$5\r\nqueue\r\n$3\r\njob\r\n+PONG\r\n"
+        assert _read_reply(blocked, expected) == expected
+
+def test_threaded_server_closes_after_protocol_error(client):
+    address = _threaded_server(client.db)
+    with socket.create_connection(address) as connection:
+        connection.sendall(b"PING\r\n*1\r\n:oops\r\n")
+        data = _read_reply(connection, b"+PONG\r\n-ERR Protocol error: expected '$', got ':'\r\n")
+        assert data == b"+PONG\r\n-ERR Protocol error: expected '$', got ':'\r\n"
+        assert connection.recv(1) == b""
+
+def test_wrongtype(client):
+    run(client, "SET", "key", "value")
+    assert run(client, "LPUSH", "key", "a").startswith(b"-WRONGTYPE")
+    run(client, "RPUSH", "list", "a")
+    assert run(client, "GET", "list").startswith(b"-WRONGTYPE")
+
+def test_only_effective_writes_are_propagated(client):
+    client.db.aof = aof = RecordingAOF()
+    run(client, "SET", "key", "value")
+    run(client, "DEL", "missing")
+    run(client, "GET", "key")
+    assert aof.commands == [[b"SET", b"key", b"value"]]
+
+def test_set_with_expiry(client):
+    assert run(client, "SET", "key", "value", "EX", "100") == b"+OK\r\n"
+    assert run(client, "TTL", "key") == b":100\r\n"
+    assert run(client, "SET", "key", "value") == b"+OK\r\n"
+    assert run(client, "TTL", "key") == b":-1\r\n"
+    assert run(client, "SET", "key", "value", "PX", "0").startswith(b"-ERR invalid expire time")
+    assert run(client, "SET", "key", "value", "EX") == b"-ERR syntax error\r\n"
+
+def test_set_expiry_is_logged_as_absolute_deadline(client):
+    client.db.aof = aof = RecordingAOF()
+    run(client, "SET", "key", "value", "EX", "10")
+    propagate = aof.commands[0]
+    assert propagate[:4] == [b"SET", b"key", b"value", b"PXAT"]
+    assert 9000 < int(propagate[4]) - now_ms() <= 10000
+
+def test_set_options(client):
+    client.db.aof = aof = RecordingAOF()
+    assert run(client, "SET", "key", "a", "XX") == b"$-1\r\n"
+    assert run(client, "SET", "key", "a", "NX", "GET") == b"$-1\r\n"
+    assert run(client, "SET", "key", "b", "NX") == b"$-1\r\n"
+    assert run(client, "SET", "key", "b", "XX", "GET", "EX", "100") == b"$1\r\na\r\n"
+    assert run(client, "SET", "key", "c", "KEEPTTL") == b"+OK\r\n"
+    assert run(client, "TTL", "key") == b":100\r\n"
+    assert aof.commands[0] == [b"SET", b"key", b"a"] and aof.commands[-1] == [b"SET", b"key", b"c", b"KEEPTTL"]
+    assert len(aof.commands) == 3 # Refused sets are not logged
+    assert run(client, "SET", "key", "d", "PXAT", "%d" % (now_ms() + 5000)) == b"+OK\r\n"
+    assert 4000 < int(run(client, "PTTL", "key")[1:-2]) <= 5000
+    assert run(client, "SET", "key", "v", "NX", "XX") == b"-ERR syntax error\r\n"
+    assert run(client, "SET", "key", "v", "KEEPTTL", "EX", "1") == b"-ERR syntax error\r\n"
+    run(client, "RPUSH", "list", "x")
+    assert run(client, "SET", "list", "v", "GET").startswith(b"-WRONGTYPE")
+    assert run(client, "LLEN", "list") == b":1\r\n"
+
+def test_getset_and_setnx(client):
+    assert run(client, "GETSET", "key", "1") == b"$-1\r\n"
+    run(client, "EXPIRE", "key", "100")
+    assert run(client, "GETSET", "key", "2") == b"$1\r\n1\r\n"
+    assert run(client, "TTL", "key") == b":-1\r\n"
+    assert run(client, "SETNX", "key", "3") == b":0\r\n"
+    assert run(client, "SETNX", "other", "3") == b":1\r\n"
+    assert run(client, "GET", "key") == b"$1\r\n2\r\n"
+
+def test_mget_mset_msetnx(client):
+    client.db.aof = aof = RecordingAOF()
+    assert run(client, "MSET", "a", "1", "b", "two") == b"+OK\r\n"
+    assert aof.commands == [[b"MSET", b"a", b"1", b"b", b"two"]] # One entry for the batch
+    run(client, "RPUSH", "list", "x")
+    assert run(client, "MGET", "a", "missing", "b", "list") == b"*4\r\n$1\r\n1\r\n$-1\r\n$3\r\ntwo\r\n$-1\r\n"
+    assert run(client, "MSET", "a", "1", "b") == b"-ERR wrong number of arguments for 'mset' command\r\n"
+    assert run(client, "MSETNX", "c", "3", "a", "x") == b":0\r\n"
+    assert run(client, "EXISTS", "c") == b":0\r\n"
+    assert run(client, "MSETNX", "c", "3", "d", "4") == b":1\r\n"
+    assert run(client, "MGET", "c", "d") == b"*2\r\n$1\r\n3\r\n$1\r\n4\r\n"
+
+def test_expire_ttl_persist(client):
+    assert run(client, "EXPIRE", "missing", "10") == b":0\r\n"
+    assert run(client, "TTL", "missing") == b":-2\r\n"
+    run(client, "SET", "key", "value")
+    assert run(client, "EXPIRE", "key", "10", "XX") == b":0\r\n"
+    assert run(client, "EXPIRE", "key", "10", "NX") == b":1\r\n"
+    assert run(client, "EXPIRE", "key", "5", "GT") == b":0\r\n"
+    assert run(client, "PEXPIRE", "key", "20000", "GT") == b":1\r\n"
+    assert 19000 < int(run(client, "PTTL", "key")[1:-2]) <= 20000
+    assert run(client, "PERSIST", "key") == b":1\r\n"
+    assert run(client, "PERSIST", "key") == b":0\r\n"
+    assert run(client, "TTL", "key") == b":-1\r\n"
+
+def test_expireat_in_the_past_deletes(client):
+    run(client, "SET", "key", "value")
+    client.db.aof = aof = RecordingAOF()
+    run(client, "EXPIREAT", "key", "1")
+    assert aof.commands == [[b"DEL", b"key"]]
+    assert run(client, "EXISTS", "key") == b":0\r\n"
+
+def test_expired_key_is_removed_on_access(client):
+    run(client, "SET", "key", "value")
+    client.db.set_expire(b"key", now_ms() - 1)
+    assert run(client, "GET", "key") == b"$-1\r\n"
+    assert b"key" not in client.db.store and len(client.db.expires) == 0
+
+def test_incr_keeps_ttl(client):
+    run(client, "SET", "counter", "1", "EX", "100")
+    run(client, "INCR", "counter")
+    assert run(client, "TTL", "counter") == b":100\r\n"
+
+def test_active_expire_only_pops_due_keys(client):
+    db = client.db
+    for i in range(100):
+        run(client, "SET", f"key{i}", "value", "EX", "100")
+    for i in range(10):
+        db.set_expire(b"key%d" % i, now_ms() - 1)
+    run(client, "EXPIRE", "key50", "200") # Leaves a stale heap entry behind
+    assert db.active_expire(1.0) == (10, False)
+    assert len(db) == 90 and len(db.expires) == 90
+    assert db.active_expire(1.0) == (0, False)
+
+def test_expiry_index_discards_stale_entries():
+    index = ExpiryIndex()
+    for when in range(1000):
+        index.set("key", when)
+    assert len(index._heap) < 200
+    index.set("other", 5)
+    index.remove("other")
+    assert list(index.pop_due(10_000)) == ["key"]
+    assert len(index) == 0
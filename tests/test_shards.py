@@ -0,0 +1,161 @@
+import asyncio, socket
+from functools import partial
+from pyredis.client import Client
+from pyredis.db import Database
+from pyredis.protocol import encode_command
+from pyredis.server import async_process_command, handle_client_using_asyncio, submit_command
+from pyredis.protocol import split_array
+from pyredis.shards import ShardRouter, ShardLink, NOT_LOCAL_ERROR, shard_file
+from pyredis.commands import keys as keys_module
+
+
+async def make_shards(count):
+    dbs = [Database() for _ in range(count)]
+    for index, db in enumerate(dbs):
+        db.router = ShardRouter(index, count)
+    for i in range(count):
+        for j in range(i + 1, count):
+            a, b = socket.socketpair()
+            dbs[i].router.links[j] = ShardLink(dbs[i], j, a)
+            dbs[j].router.links[i] = ShardLink(dbs[j], i, b)
+    for db in dbs:
+        for link in db.router.links.values():
+            await link.start()
+    return dbs
+
+def keys_by_shard(router, count):
+    keys = {}
+    i = 0
+    while len(keys) < count:
+        key = b"key%d" % i
+        keys.setdefault(router.shard_of(key), key)
+        i += 1
+    return [keys[shard] for shard in range(count)]
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def test_shard_file():
+    assert shard_file("/data/appendonly.aof", 3) == "/data/appendonly-3.aof"
+
+def test_commands_are_forwarded_to_the_owner():
+    async def main():
+        dbs = await make_shards(2)
+        local, remote = keys_by_shard(dbs[0].router, 2)
+        client = Client(dbs[0])
+        assert await async_process_command([b"SET", remote, b"value"], client) == b"+OK\r\n"
+        assert await async_process_command([b"SET", local, b"other"], client) == b"+OK\r\n"
+        assert dbs[1].store == {remote: b"value"} and dbs[0].store == {local: b"other"}
+        assert await async_process_command([b"GET", remote], client) == b"$5\r\nvalue\r\n"
+    run(main())
+
+def test_multi_key_commands_fan_out():
+    async def main():
+        dbs = await make_shards(3)
+        keys = keys_by_shard(dbs[0].router, 3)
+        client = Client(dbs[1])
+        for key in keys:
+            await async_process_command([b"SET", key, b"1"], client)
+        assert await async_process_command([b"EXISTS", *keys, b"missing"], client) == b":3\r\n"
+        assert await async_process_command([b"DEL", keys[0], keys[2]], client) == b":2\r\n"
+        assert sum(len(db) for db in dbs) == 1
+        reply = await async_process_command([b"LMOVE", keys[0], keys[1], b"LEFT", b"LEFT"], client)
+        assert reply.startswith(b"-CROSSSLOT")
+    run(main())
+
+def test_dbsize_and_keys_cover_every_shard(monkeypatch):
+    monkeypatch.setattr(keys_module, "KEYS_BATCH", 2)
+    async def main():
+        dbs = await make_shards(2)
+        keys = keys_by_shard(dbs[0].router, 2)
+        client = Client(dbs[0])
+        for key in keys:
+            await async_process_command([b"SET", key, b"1"], client)
+        assert await async_process_command([b"DBSIZE"], client) == b":2\r\n"
+        reply = await async_process_command([b"KEYS", b"*"], client)
+        assert sorted(element.split(b"\r\n")[1] for element in split_array(reply)) == sorted(keys)
+        for i in range(10): # Enough for the other shard to collect its keys a batch at a time
+            await async_process_command([b"SET", b"more%d" % i, b"1"], client)
+        assert await async_process_command([b"DBSIZE"], Client(dbs[1])) == b":12\r\n"
+        assert len(split_array(await async_process_command([b"KEYS", b"*"], client))) == 12
+        await async_process_command([b"MULTI"], client)
+        assert await async_process_command([b"DBSIZE"], client) == NOT_LOCAL_ERROR
+    run(main())
+
+def test_scan_walks_every_shard():
+    async def main():
+        dbs = await make_shards(3)
+        client = Client(dbs[1])
+        keys = [b"key%d" % i for i in range(50)]
+        for key in keys:
+            await async_process_command([b"SET", key, b"1"], client)
+        seen, cursor = [], b"0"
+        while True:
+            reply = await async_process_command([b"SCAN", cursor, b"COUNT", b"5"], client)
+            cursor, found = split_array(reply)
+            cursor = cursor.split(b"\r\n")[1]
+            seen += [element.split(b"\r\n")[1] for element in split_array(found)]
+            if cursor == b"0":
+                break
+        assert sorted(seen) == sorted(keys)
+        assert await async_process_command([b"SCAN", b"%d" % (3 * 16384)], client) == b"*2\r\n$1\r\n0\r\n*0\r\n"
+        assert (await async_process_command([b"SCAN", b"x"], client)).startswith(b"-ERR invalid cursor")
+    run(main())
+
+def test_publish_reaches_subscribers_of_every_shard():
+    async def main():
+        dbs = await make_shards(2)
+        servers = [await asyncio.start_server(partial(handle_client_using_asyncio, db), "127.0.0.1", 0) for db in dbs]
+        subscribers = []
+        for server in servers:
+            reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname())
+            writer.write(encode_command([b"SUBSCRIBE", b"news"]))
+            await reader.readexactly(len(b"*3\r\n$9\r\nsubscribe\r\n$4\r\nnews\r\n:1\r\n"))
+            subscribers.append((reader, writer))
+        assert await async_process_command([b"PUBLISH", b"news", b"hi"], Client(dbs[0])) == b":2\r\n"
+        message = encode_command([b"message", b"news", b"hi"])
+        for reader, writer in subscribers:
+            assert await asyncio.wait_for(reader.readexactly(len(message)), 5) == message
+            writer.close()
+        for server in servers:
+            server.close()
+    run(main())
+
+def test_pipelined_batch_keeps_order():
+    async def main():
+        dbs = await make_shards(2)
+        _, remote = keys_by_shard(dbs[0].router, 2)
+        client = Client(dbs[0])
+        pending = [submit_command(args, client) for args in (
+            [b"RPUSH", remote, b"a"], [b"RPUSH", remote, b"b"], [b"LPOP", remote], [b"PING"])]
+        replies = [reply if type(reply) is bytes else await reply for reply in pending]
+        assert replies == [b":1\r\n", b":2\r\n", b"$1\r\na\r\n", b"+PONG\r\n"]
+    run(main())
+
+def test_forwarded_blocking_pop():
+    async def main():
+        dbs = await make_shards(2)
+        _, remote = keys_by_shard(dbs[0].router, 2)
+        blocked = asyncio.ensure_future(async_process_command([b"BLPOP", remote, b"0"], Client(dbs[0])))
+        await asyncio.sleep(0.01)
+        # A request queued behind the blocked one on the same link is not held up
+        assert await async_process_command([b"EXISTS", remote], Client(dbs[0])) == b":0\r\n"
+        await async_process_command([b"RPUSH", remote, b"job"], Client(dbs[1]))
+        assert await blocked == encode_command([remote, b"job"])
+    run(main())
+
+def test_transactions_stay_on_the_local_shard():
+    async def main():
+        dbs = await make_shards(2)
+        local, remote = keys_by_shard(dbs[0].router, 2)
+        client = Client(dbs[0])
+        assert await async_process_command([b"WATCH", remote], client) == NOT_LOCAL_ERROR
+        assert await async_process_command([b"WATCH", local], client) == b"+OK\r\n"
+        assert await async_process_command([b"MULTI"], client) == b"+OK\r\n"
+        assert await async_process_command([b"SET", local, b"1"], client) == b"+QUEUED\r\n"
+        assert await async_process_command([b"EXEC"], client) == b"*1\r\n+OK\r\n"
+        await async_process_command([b"MULTI"], client)
+        assert await async_process_command([b"SET", remote, b"1"], client) == NOT_LOCAL_ERROR
+        assert (await async_process_command([b"EXEC"], client)).startswith(b"-EXECABORT")
+        assert dbs[1].store == {}
+    run(main())
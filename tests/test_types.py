@@ -0,0 +1,178 @@
+import pytest
+from pyredis import quicklist, hashes, sets, sortedsets
+from pyredis.quicklist import QuickList
+from pyredis.hashes import Hash
+from pyredis.sets import Set, intersection, union, difference
+from pyredis.sortedsets import SortedSet, format_score
+
+
+@pytest.fixture
+def small_nodes(monkeypatch):
+    monkeypatch.setattr(quicklist, "QUICKLIST_NODE_SIZE", 4)
+
+def elements(*bounds):
+    return [b"%d" % i for i in range(*bounds)]
+
+def test_quicklist_push_and_pop(small_nodes):
+    values = QuickList()
+    values.extend(elements(10))
+    values.extendleft([b"a", b"b"])
+    assert list(values) == [b"b", b"a", *elements(10)]
+    assert values.popleft() == b"b"
+    assert values.pop() == b"9"
+    assert len(values) == 10
+    while values:
+        values.pop()
+    assert list(values) == []
+
+def test_quicklist_index(small_nodes):
+    values = QuickList(elements(10))
+    assert values[0] == b"0" and values[5] == b"5" and values[-1] == b"9"
+    values[-3] = b"x"
+    assert values[7] == b"x"
+    with pytest.raises(IndexError):
+        values[10]
+
+def test_quicklist_range_and_trim(small_nodes):
+    values = QuickList(elements(10))
+    assert list(values.range(3, 9)) == elements(3, 9)
+    assert list(values.range(8, 20)) == elements(8, 10)
+    assert list(values.range(5, 5)) == []
+    values.trim(2, 7)
+    assert list(values) == elements(2, 7) and len(values) == 5
+    values.trim(3, 3)
+    assert list(values) == []
+
+def test_quicklist_copy_is_independent(small_nodes):
+    values = QuickList(elements(6))
+    clone = values.copy()
+    values[0] = b"x"
+    values.append(b"6")
+    assert list(clone) == elements(6)
+
+def test_quicklist_memory_usage_follows_elements(small_nodes):
+    values = QuickList(elements(10))
+    empty = QuickList().memory_usage()
+    values.append(b"x" * 100)
+    values[0] = b"y" * 50
+    values.trim(0, 5)
+    assert values.memory_usage() == QuickList([b"y" * 50, *elements(1, 5)]).memory_usage() > empty
+
+def test_hash_set_get_delete():
+    fields = Hash()
+    assert fields.set(b"a", b"b") and fields.set(b"b", b"a") # A value equal to another field
+    assert not fields.set(b"a", b"c")
+    assert fields.get(b"b") == b"a" and fields.get(b"a") == b"c" and fields.get(b"c") is None
+    assert fields.delete(b"a") and not fields.delete(b"a")
+    assert list(fields.items()) == [(b"b", b"a")] and len(fields) == 1
+    assert fields.encoding == "listpack"
+
+def test_hash_converts_past_thresholds(monkeypatch):
+    monkeypatch.setattr(hashes, "HASH_MAX_LISTPACK_ENTRIES", 4)
+    fields = Hash((b"%d" % i, b"v") for i in range(4))
+    assert fields.encoding == "listpack"
+    fields.set(b"4", b"v")
+    assert fields.encoding == "hashtable" and len(fields) == 5
+    assert Hash([(b"f", b"x" * (hashes.HASH_MAX_LISTPACK_VALUE + 1))]).encoding == "hashtable"
+    small = Hash([(b"f", b"v")])
+    small.set(b"f", b"x" * (hashes.HASH_MAX_LISTPACK_VALUE + 1))
+    assert small.encoding == "hashtable" and small.get(b"f") == b"x" * (hashes.HASH_MAX_LISTPACK_VALUE + 1)
+    assert fields == Hash((b"%d" % i, b"v") for i in range(5))
+
+def test_hash_memory_usage_follows_fields(monkeypatch):
+    monkeypatch.setattr(hashes, "HASH_MAX_LISTPACK_ENTRIES", 4)
+    fields = Hash()
+    empty = fields.memory_usage()
+    fields.set(b"field", b"x" * 100)
+    assert fields.memory_usage() >= empty + 105
+    for i in range(10):
+        fields.set(b"%d" % i, b"v")
+    peak = fields.memory_usage()
+    for i in range(10):
+        fields.delete(b"%d" % i)
+    fields.set(b"field", b"y")
+    assert fields.encoding == "hashtable" and fields.memory_usage() < peak - 20 * 33
+
+def test_set_intset_converts_to_hashtable(monkeypatch):
+    monkeypatch.setattr(sets, "SET_MAX_INTSET_ENTRIES", 4)
+    members = Set([b"3", b"-1", b"2", b"3"])
+    assert members.encoding == "intset" and list(members.members()) == [b"-1", b"2", b"3"]
+    assert b"2" in members and b"02" not in members and b"x" not in members
+    assert members.add(b"10") and members.encoding == "intset" and len(members) == 4
+    assert members.add(b"11") and members.encoding == "hashtable"
+    assert Set([b"1", b"007"]).encoding == "hashtable" # Not the canonical form of 7
+    assert members.remove(b"2") and not members.remove(b"2") and b"11" in members
+    assert members == Set([b"-1", b"3", b"10", b"11"]) and members != Set([b"-1", b"3", b"10"])
+    clone = members.copy()
+    clone.add(b"new")
+    assert len(clone) == len(members) + 1 and b"new" not in members
+
+def test_set_random_members_and_memory():
+    members = Set(b"m%d" % i for i in range(100))
+    empty = Set().memory_usage()
+    assert members.memory_usage() > empty + 100 * 35
+    assert len(set(members.random_values(10))) == 10 and len(members.random_values(200)) == 100
+    assert len(members.random_values(-200)) == 200
+    assert members.random_value() in members.random_values(100)
+    for value in members.random_values(100):
+        assert members.remove_value(value)
+    assert not members
+    assert Set(b"%d" % i for i in range(100)).memory_usage() < 100 * 10 + empty
+
+def test_set_random_members_follow_changes():
+    members = Set(b"m%d" % i for i in range(100))
+    members.random_value() # Starts mirroring the members for random access
+    for i in range(0, 100, 2):
+        members.remove(b"m%d" % i)
+    members.add(b"new")
+    expected = {b"m%d" % i for i in range(1, 100, 2)} | {b"new"}
+    assert {members.random_value() for _ in range(2000)} == expected
+    assert set(members.random_values(len(expected) - 1)) < expected
+    clone = members.copy()
+    clone.remove(b"new")
+    assert b"new" not in clone.random_values(-200) and b"new" in members
+
+@pytest.mark.parametrize("max_entries", [0, 512]) # hashtable and intset encodings
+def test_set_algebra(monkeypatch, max_entries):
+    monkeypatch.setattr(sets, "SET_MAX_INTSET_ENTRIES", max_entries)
+    evens = Set(b"%d" % i for i in range(0, 100, 2))
+    threes = Set(b"%d" % i for i in range(0, 100, 3))
+    words = Set([b"6", b"12", b"word"])
+    assert sorted(intersection([evens, threes])) == list(range(0, 100, 6))
+    assert sorted(intersection([evens, threes, words]), key=str) == [12, 6]
+    assert list(intersection([evens, Set()])) == []
+    assert union([evens, words]) == set(range(0, 100, 2)) | {b"word"}
+    assert sorted(difference(evens, [threes, Set()])) == [i for i in range(0, 100, 2) if i % 3]
+    stored = Set.from_values(intersection([evens, threes]))
+    assert stored.encoding == ("hashtable" if max_entries == 0 else "intset")
+    assert stored == Set(b"%d" % i for i in range(0, 100, 6))
+
+@pytest.mark.parametrize("max_entries", [0, 128]) # skiplist and listpack encodings
+def test_sorted_set_order_ranks_and_counts(monkeypatch, max_entries):
+    monkeypatch.setattr(sortedsets, "ZSET_MAX_LISTPACK_ENTRIES", max_entries)
+    zset = SortedSet((b"m%02d" % i, float(i % 10)) for i in range(100))
+    assert zset.encoding == ("skiplist" if max_entries == 0 else "listpack")
+    expected = sorted(((b"m%02d" % i, float(i % 10)) for i in range(100)), key=lambda pair: (pair[1], pair[0]))
+    assert list(zset.items()) == expected
+    assert list(zset.range(10, 15, reverse=True)) == expected[10:15][::-1]
+    assert zset.rank(b"m13") == expected.index((b"m13", 3.0))
+    assert zset.count(3.0) == 30 and zset.count(3.0, inclusive=True) == 40
+    assert zset.count(3.0, b"m13") == 31 and zset.count(3.0, b"m13", inclusive=True) == 32
+    assert zset.add(b"m13", -1.0) == 3.0 and zset.rank(b"m13") == 0
+    assert zset.remove(b"m13") and not zset.remove(b"m13") and zset.score(b"m13") is None
+    clone = zset.copy()
+    clone.add(b"new", 100.0)
+    assert len(clone) == len(zset) + 1 and list(clone.items())[:-1] == list(zset.items())
+
+def test_sorted_set_converts_past_thresholds(monkeypatch):
+    monkeypatch.setattr(sortedsets, "ZSET_MAX_LISTPACK_ENTRIES", 4)
+    zset = SortedSet((b"%d" % i, float(i)) for i in range(4))
+    empty = SortedSet().memory_usage()
+    assert zset.encoding == "listpack" and zset.memory_usage() > empty
+    zset.add(b"4", 4.0)
+    assert zset.encoding == "skiplist" and zset == SortedSet((b"%d" % i, float(i)) for i in range(5))
+    assert SortedSet([(b"x" * 65, 1.0)]).encoding == "skiplist"
+
+def test_format_score():
+    assert [format_score(score) for score in (1.0, -2.0, 1.5, 1e20, float("inf"), float("-inf"))] == [
+        b"1", b"-2", b"1.5", b"1e+20", b"inf", b"-inf"]